@@ -1346,6 +1346,20 @@ class Global(APIBase):
         return {'status': doneCode,
                 'statsList': logutils.Suppressed(statsList)}
 
+    @api.logged(on="api.host")
+    def getAllVmStatsDelta(self, generation=0):
+        """
+        Get the statistics of all running VMs changed since generation.
+        """
+        hooks.before_get_all_vm_stats()
+        statsList = self._cif.getAllVmStats()
+        statsList = hooks.after_get_all_vm_stats(statsList)
+        delta = self._cif.vmStatsTracker.update(statsList, generation)
+        throttledlog.info('getAllVmStats', "Current getAllVmStats: %s",
+                          logutils.AllVmStatsValue(statsList))
+        return {'status': doneCode,
+                'delta': logutils.Suppressed(delta)}
+
     @api.logged(on="api.host")
     def getAllVmIoTunePolicies(self):
         """
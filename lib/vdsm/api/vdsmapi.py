@@ -19,9 +19,12 @@
 #
 from __future__ import absolute_import
 
+import itertools
 import json
 import logging
 import os
+import threading
+
 import six
 import yaml
 
@@ -114,16 +117,36 @@ class Schema(object):
 
     log = logging.getLogger("SchemaCache")
 
-    def __init__(self, paths, strict_mode):
+    def __init__(self, paths, strict_mode, verify_ratio=1):
         """
         Constructs schema object based on yaml files provided as
         list of paths and a mode which determines request/response
         validation behavior. Usually it is based on api_strict_mode
         property from config.py
+
+        When strict_mode is disabled, only one of every verify_ratio
+        requests, responses and events is verified. If verify_ratio is 0,
+        nothing is verified. Usually it is based on api_verify_ratio
+        property from config.py.
         """
         self._strict_mode = strict_mode
+        self._verify_ratio = verify_ratio
+        self._args_calls = itertools.count()
+        self._retval_calls = itertools.count()
+        self._event_calls = itertools.count()
         self._methods = {}
         self._types = {}
+        # Per method caches, keyed by method id.
+        self._arg_names = {}
+        self._default_arg_names = {}
+        self._default_arg_values = {}
+        self._args_validators = {}
+        # Validators of schema types, keyed by the id of the type.
+        self._validators = {}
+        # Validators being compiled, may contain unfinished validators of
+        # recursive types.
+        self._compiled = {}
+        self._compile_lock = threading.Lock()
         try:
             for path in paths:
                 with open(path) as f:
@@ -144,17 +167,32 @@ class Schema(object):
         return method.get('params', [])
 
     def get_arg_names(self, rep):
-        return [arg.get('name') for arg in self.get_args(rep)]
+        try:
+            return self._arg_names[rep.id]
+        except KeyError:
+            names = tuple(arg.get('name') for arg in self.get_args(rep))
+            self._arg_names[rep.id] = names
+            return names
 
     def get_default_arg_names(self, rep):
-        return frozenset([arg.get('name') for arg in self.get_args(rep)
-                          if 'defaultvalue' in arg])
+        try:
+            return self._default_arg_names[rep.id]
+        except KeyError:
+            names = frozenset([arg.get('name') for arg in self.get_args(rep)
+                               if 'defaultvalue' in arg])
+            self._default_arg_names[rep.id] = names
+            return names
 
     def get_default_arg_values(self, rep):
-        return [DEFAULT_VALUES.get(arg.get('defaultvalue'),
-                                   arg.get('defaultvalue'))
-                for arg in self.get_args(rep)
-                if 'defaultvalue' in arg]
+        try:
+            return self._default_arg_values[rep.id]
+        except KeyError:
+            values = tuple(DEFAULT_VALUES.get(arg.get('defaultvalue'),
+                                              arg.get('defaultvalue'))
+                           for arg in self.get_args(rep)
+                           if 'defaultvalue' in arg)
+            self._default_arg_values[rep.id] = values
+            return values
 
     def get_ret_param(self, rep):
         retval = self.get_method(rep)
@@ -170,6 +208,15 @@ class Schema(object):
     def get_methods(self):
         return utils.picklecopy(self._methods)
 
+    def get_method_costs(self):
+        """
+        Return dict of method id -> cost class, for the methods specifying
+        a cost class.
+        """
+        return {name: method['cost']
+                for name, method in six.iteritems(self._methods)
+                if 'cost' in method}
+
     def get_method_description(self, rep):
         method = self.get_method(rep)
         return method.get('description', '')
@@ -184,180 +231,300 @@ class Schema(object):
     def get_types(self):
         return utils.picklecopy(self._types)
 
-    def _check_primitive_type(self, t, value, name):
-        condition = PRIMITIVE_TYPES.get(t)
-        if not condition(value):
-            self._report_inconsistency('Parameter %s is not %s type'
-                                       % (name, t))
-
     def _report_inconsistency(self, message):
         if self._strict_mode:
             raise JsonRpcInvalidParamsError(message)
         else:
             _log_devel.warning('%s', message)
 
+    def _should_verify(self, calls):
+        if self._strict_mode or self._verify_ratio == 1:
+            return True
+        if self._verify_ratio == 0:
+            return False
+        return next(calls) % self._verify_ratio == 0
+
     def verify_args(self, rep, args):
+        if not self._should_verify(self._args_calls):
+            return
         try:
+            self._args_validator(rep)(args)
+        except JsonRpcInvalidParamsError:
+            raise
+        except Exception:
+            self._report_inconsistency('Unexpected issue with request type'
+                                       ' verification for %s' % rep.id)
+
+    def verify_retval(self, rep, ret):
+        if not self._should_verify(self._retval_calls):
+            return
+        try:
+            ret_args = self.get_ret_param(rep)
+
+            if ret_args:
+                if isinstance(ret, Suppressed):
+                    ret = ret.value
+                self._verify_type(ret_args.get('type'), ret, rep.id)
+        except JsonRpcInvalidParamsError:
+            raise
+        except Exception:
+            self._report_inconsistency('Unexpected issue with response type'
+                                       ' verification for %s' % rep.id)
+
+    def _verify_type(self, param, value, identifier):
+        try:
+            validator = self._validators[id(param)]
+        except KeyError:
+            with self._compile_lock:
+                validator = self._compile_type(param)
+                self._validators[id(param)] = validator
+        validator(value, identifier)
+
+    def _args_validator(self, rep):
+        try:
+            return self._args_validators[rep.id]
+        except KeyError:
+            pass
+
+        method_id = rep.id
+        arg_names = frozenset(self.get_arg_names(rep))
+        with self._compile_lock:
+            params = [(param.get('name'), 'defaultvalue' in param,
+                       self._compile_type(param))
+                      for param in self.get_args(rep)]
+        report = self._report_inconsistency
+
+        def verify_args(args):
             # check whether there are extra parameters
-            unknown_args = [key for key in args if key not in
-                            self.get_arg_names(rep)]
+            unknown_args = [key for key in args if key not in arg_names]
             if unknown_args:
-                self._report_inconsistency('Following parameters %s were not'
-                                           ' recognized' % (unknown_args))
+                report('Following parameters %s were not'
+                       ' recognized' % (unknown_args))
 
             # verify types of provided parameters
-            for param in self.get_args(rep):
-                name = param.get('name')
+            for name, optional, verify in params:
                 arg = args.get(name)
                 if arg is None:
                     # check if missing paramter was defined as optional
-                    if 'defaultvalue' not in param:
-                        self._report_inconsistency(
-                            'Required parameter %s is not '
-                            'provided when calling %s' % (name, rep.id))
+                    if not optional:
+                        report('Required parameter %s is not '
+                               'provided when calling %s' % (name, method_id))
                     continue
-                self._verify_type(param, arg, rep.id)
-        except JsonRpcInvalidParamsError:
-            raise
-        except Exception:
-            self._report_inconsistency('Unexpected issue with request type'
-                                       ' verification for %s' % rep.id)
+                verify(arg, method_id)
+
+        self._args_validators[rep.id] = verify_args
+        return verify_args
+
+    # Compiling schema types into validators. Validators are closures
+    # accepting a value and an identifier used in error messages, walking
+    # only the value. Must be called with self._compile_lock held.
+
+    def _compiled_validator(self, key, obj, build):
+        try:
+            return self._compiled[key][1]
+        except KeyError:
+            pass
+
+        # Recursive types refer to the validator we are compiling.
+        slot = []
+
+        def forward(value, identifier):
+            return slot[0](value, identifier)
+
+        # Keeping a reference to obj, so its id is not reused.
+        self._compiled[key] = (obj, forward)
+        try:
+            validator = build()
+        except Exception as e:
+            # Report broken schema types only when verifying a value.
+            def validator(value, identifier, error=e):
+                raise error
+        slot.append(validator)
+        self._compiled[key] = (obj, validator)
+        return validator
+
+    def _compile_type(self, param):
+        return self._compiled_validator(
+            ('type', id(param)), param, lambda: self._build_type(param))
+
+    def _compile_complex_type(self, t_type, t, name):
+        return self._compiled_validator(
+            ('complex', id(t), t_type, name), t,
+            lambda: self._build_complex_type(t_type, t, name))
+
+    def _compile_object_type(self, t):
+        return self._compiled_validator(
+            ('object', id(t)), t, lambda: self._build_object_type(t))
+
+    def _build_primitive_type(self, t, name):
+        condition = PRIMITIVE_TYPES.get(t)
+        report = self._report_inconsistency
+
+        def verify_primitive(value, identifier):
+            if not condition(value):
+                report('Parameter %s is not %s type' % (name, t))
+
+        return verify_primitive
+
+    def _build_type(self, param):
+        report = self._report_inconsistency
 
-    def _verify_type(self, param, value, identifier):
         # check whether a parameter is in a list
         if isinstance(param, list):
-            if not isinstance(value, list):
-                self._report_inconsistency('Parameter %s is not a list'
-                                           % (value))
-            for a in value:
-                self._verify_type(param[0], a, identifier)
-            return
+            verify_item = self._compile_type(param[0])
+
+            def verify_list(value, identifier):
+                if not isinstance(value, list):
+                    report('Parameter %s is not a list' % (value,))
+                for a in value:
+                    verify_item(a, identifier)
+
+            return verify_list
+
         # check whether a parameter is defined as primitive type
         elif param in TYPE_KEYS:
-            self._check_primitive_type(param, value, param)
-            return
+            return self._build_primitive_type(param, param)
 
         # get type and name
         name = param.get('name')
         t = param.get('type')
         if t == 'dict':
             # it seems that there is no other way to have it fixed
-            self._report_inconsistency(
-                'Unsupported type %s in %s please fix' % (t, identifier))
+            def verify_dict(value, identifier):
+                report('Unsupported type %s in %s please fix' %
+                       (t, identifier))
+
+            return verify_dict
 
         # check whether it is a primitive type
         elif t in TYPE_KEYS:
-            self._check_primitive_type(t, value, name)
+            return self._build_primitive_type(t, name)
 
-        else:
-            # if type is a string call type verification method
-            if isinstance(t, six.string_types):
-                self._verify_complex_type(t, param, value, name, identifier)
+        # if type is a string verify complex type
+        elif isinstance(t, six.string_types):
+            return self._compile_complex_type(t, param, name)
+
+        # if type is in a list we need to verify the type of each item
+        elif isinstance(t, list):
+            verify_item = self._compile_type(t[0])
 
-            # if type is in a list we need to get the type and call
-            # type verification method
-            elif isinstance(t, list):
+            def verify_sequence(value, identifier):
                 if not isinstance(value, (list, tuple)):
-                    self._report_inconsistency('Parameter %s is not a sequence'
-                                               % (value))
+                    report('Parameter %s is not a sequence' % (value,))
                 for a in value:
-                    self._verify_type(t[0], a, identifier)
-            else:
-                # call complex type verification
-                self._verify_complex_type(t.get('type'), t, value, name,
-                                          identifier)
+                    verify_item(a, identifier)
 
-    def _verify_complex_type(self, t_type, t, arg, name, identifier):
+            return verify_sequence
+
+        else:
+            return self._compile_complex_type(t.get('type'), t, name)
+
+    def _build_complex_type(self, t_type, t, name):
         """
-        This method verify whether argument value align with different
-        types we support such as: alias, map, union, enum and object.
+        Build validator verifying whether argument value align with
+        different types we support such as: alias, map, union, enum and
+        object.
         """
+        report = self._report_inconsistency
+
         if t_type == 'alias':
             # if alias we need to check sourcetype
-            self._check_primitive_type(t.get('sourcetype'), arg, name)
+            return self._build_primitive_type(t.get('sourcetype'), name)
+
         elif t_type == 'map':
             # if map we need to check key and value types
-            for key, value in six.iteritems(arg):
-                self._verify_type(t.get('key-type'), key, identifier)
-                self._verify_type(t.get('value-type'), value, identifier)
+            verify_key = self._compile_type(t.get('key-type'))
+            verify_value = self._compile_type(t.get('value-type'))
+
+            def verify_map(arg, identifier):
+                for key, value in six.iteritems(arg):
+                    verify_key(key, identifier)
+                    verify_value(value, identifier)
+
+            return verify_map
+
         elif t_type == 'union':
             # if union we need to check whether parameter matches on of the
             # values defined
+            members = []
             for value in t.get('values'):
                 props = value.get('properties')
-                prop_names = [prop.get('name') for prop in props]
-                if not [key for key in arg if key not in prop_names]:
-                    self._verify_complex_type(value.get('type'), value, arg,
-                                              name, identifier)
-                    return
-            self._report_inconsistency('Provided parameters %s do not match'
-                                       ' any of union %s values'
-                                       % (arg, t.get('name')))
+                prop_names = frozenset(prop.get('name') for prop in props)
+                members.append((prop_names, self._compile_complex_type(
+                    value.get('type'), value, name)))
+            union_name = t.get('name')
+
+            def verify_union(arg, identifier):
+                for prop_names, verify_member in members:
+                    if all(key in prop_names for key in arg):
+                        verify_member(arg, identifier)
+                        return
+                report('Provided parameters %s do not match'
+                       ' any of union %s values' % (arg, union_name))
+
+            return verify_union
+
         elif t_type == 'enum':
             # if enum we need to check whether provided parameter is in values
-            if arg not in t.get('values'):
-                self._report_inconsistency('Provided value "%s" not'
-                                           ' defined in %s enum for'
-                                           ' %s' % (arg,
-                                                    t.get('name'),
-                                                    identifier))
+            values = t.get('values')
+            enum_name = t.get('name')
+
+            def verify_enum(arg, identifier):
+                if arg not in values:
+                    report('Provided value "%s" not defined in %s enum for'
+                           ' %s' % (arg, enum_name, identifier))
+
+            return verify_enum
+
         else:
             # if custom time (object) we need to check whether all the
             # properties match values provided
-            self._verify_object_type(t, arg, identifier)
+            return self._compile_object_type(t)
 
-    def _verify_object_type(self, t, arg, identifier):
+    def _build_object_type(self, t):
+        report = self._report_inconsistency
         props = t.get('properties')
-        prop_names = [prop.get('name') for prop in props]
-        # check if there are any extra prarameters
-        unknown_props = [key for key in arg
-                         if key not in prop_names]
-        if unknown_props:
-            if 'any_string' in prop_names:
-                return
-            self._report_inconsistency('Following parameters %s were not'
-                                       ' recognized' % (unknown_props))
-        # iterate over properties
-        for prop in props:
-            p_name = prop.get('name')
-            a = arg.get(p_name)
-
-            # check whether parameter is defined as optional and
-            # check default type
-            if 'defaultvalue' in prop:
-                value = prop.get('defaultvalue')
-                if value == 'needs updating':
-                    self._report_inconsistency(
-                        'No default value specified for %s parameter in'
-                        ' %s' % (p_name, identifier))
-                if value == 'no-default':
-                    continue
-                if a is None or a == value:
-                    continue
-            else:
-                if a is None:
-                    self._report_inconsistency(
-                        'Required property %s is not provided when calling'
-                        ' %s' % (p_name, identifier))
-                    continue
-            # call type verification
-            self._verify_type(prop, a, identifier)
-
-    def verify_retval(self, rep, ret):
-        try:
-            ret_args = self.get_ret_param(rep)
+        prop_names = frozenset(prop.get('name') for prop in props)
+        any_string = 'any_string' in prop_names
+        checks = [(prop.get('name'), 'defaultvalue' in prop,
+                   prop.get('defaultvalue'), self._compile_type(prop))
+                  for prop in props]
+
+        def verify_object(arg, identifier):
+            # check if there are any extra prarameters
+            unknown_props = [key for key in arg if key not in prop_names]
+            if unknown_props:
+                if any_string:
+                    return
+                report('Following parameters %s were not'
+                       ' recognized' % (unknown_props))
+            # iterate over properties
+            for p_name, has_default, value, verify_prop in checks:
+                a = arg.get(p_name)
+
+                # check whether parameter is defined as optional and
+                # check default type
+                if has_default:
+                    if value == 'needs updating':
+                        report('No default value specified for %s parameter'
+                               ' in %s' % (p_name, identifier))
+                    if value == 'no-default':
+                        continue
+                    if a is None or a == value:
+                        continue
+                else:
+                    if a is None:
+                        report('Required property %s is not provided when'
+                               ' calling %s' % (p_name, identifier))
+                        continue
+                # call type verification
+                verify_prop(a, identifier)
 
-            if ret_args:
-                if isinstance(ret, Suppressed):
-                    ret = ret.value
-                self._verify_type(ret_args.get('type'), ret, rep.id)
-        except JsonRpcInvalidParamsError:
-            raise
-        except Exception:
-            self._report_inconsistency('Unexpected issue with response type'
-                                       ' verification for %s' % rep.id)
+        return verify_object
 
     def verify_event_params(self, sub_id, args):
+        if not self._should_verify(self._event_calls):
+            return
         rep = EventRep(sub_id)
         try:
             # due to issue with vm status changes key names (vm_ids)
@@ -43,6 +43,7 @@ from vdsm.virt import events
 from vdsm.virt import migration
 from vdsm.virt import recovery
 from vdsm.virt import secret
+from vdsm.virt import vmstatsdelta
 from vdsm.virt import vmstatus
 from vdsm.virt.vmchannels import Listener
 from vdsm.virt.vmdevices.storage import DISK_TYPE
@@ -107,6 +108,7 @@ class clientIF(object):
         self._subscriptions = defaultdict(list)
         self._scheduler = scheduler
         self._unknown_vm_ids = set()
+        self.vmStatsTracker = vmstatsdelta.Tracker()
         if _glusterEnabled:
             self.gluster = gapi.GlusterApi()
         else:
@@ -550,10 +552,12 @@ class clientIF(object):
                       numa.cpu_topology().cores)
             migration.SourceThread.ongoingMigrations.bound = mog
 
-            recovery.all_domains(self)
+            timings = recovery.Timings()
+            recovery.all_domains(self, timings)
 
             # recover stage 3: waiting for domains to go up
-            self._waitForDomainsUp()
+            with timings.phase('wait_up'):
+                self._waitForDomainsUp()
 
             self._recovery = False
 
@@ -561,12 +565,15 @@ class clientIF(object):
             # and then prepare all volumes.
             # Actually, we need it just to get the resources for future
             # volumes manipulations
-            self._waitForStoragePool()
+            with timings.phase('wait_pool'):
+                self._waitForStoragePool()
 
-            self._preparePathsForRecoveredVMs()
+            with timings.phase('prepare_paths'):
+                self._preparePathsForRecoveredVMs()
 
-            self.log.info('recovery: completed in %is',
-                          vdsm.common.time.monotonic_time() - start_time)
+            self.log.info('recovery: completed in %is (%s)',
+                          vdsm.common.time.monotonic_time() - start_time,
+                          timings)
 
         except:
             self.log.exception("recovery: failed")
@@ -651,21 +658,8 @@ class clientIF(object):
             time.sleep(5)
 
     def _preparePathsForRecoveredVMs(self):
-        vm_objects = self.vmContainer.values()
-        num_vm_objects = len(vm_objects)
-        for idx, vm_obj in enumerate(vm_objects):
-            # Let's recover as much VMs as possible
-            try:
-                # Do not prepare volumes when system goes down
-                if self._enabled:
-                    self.log.info(
-                        'recovery [%d/%d]: preparing paths for'
-                        ' domain %s', idx + 1, num_vm_objects, vm_obj.id)
-                    vm_obj.preparePaths()
-            except:
-                self.log.exception(
-                    "recovery [%d/%d]: failed for vm %s",
-                    idx + 1, num_vm_objects, vm_obj.id)
+        recovery.prepare_paths(self, list(self.vmContainer.values()),
+                               enabled=lambda: self._enabled)
 
     def _prepare_network_drive(self, drive, res):
         """
@@ -139,19 +139,37 @@ class Barrier(object):
 Result = namedtuple("Result", ["succeeded", "value"])
 
 
-def tmap(func, iterable):
+def tmap(func, iterable, workers=None):
+    """
+    Run func with every item of iterable in other threads, and return a list
+    of Result objects, in the same order as iterable.
+
+    By default, every item is handled by a new thread. If workers is
+    specified, at most workers threads are used.
+    """
     args = list(iterable)
     results = [None] * len(args)
-
-    def worker(i, f, arg):
-        try:
-            results[i] = Result(True, f(arg))
-        except Exception as e:
-            results[i] = Result(False, e)
+    if workers is None:
+        workers = len(args)
+
+    lock = threading.Lock()
+    items = iter(enumerate(args))
+
+    def worker():
+        while True:
+            with lock:
+                try:
+                    i, arg = next(items)
+                except StopIteration:
+                    return
+            try:
+                results[i] = Result(True, func(arg))
+            except Exception as e:
+                results[i] = Result(False, e)
 
     threads = []
-    for i, arg in enumerate(args):
-        t = thread(worker, args=(i, func, arg), name="tmap/%d" % i)
+    for i in range(min(workers, len(args))):
+        t = thread(worker, name="tmap/%d" % i)
         t.start()
         threads.append(t)
 
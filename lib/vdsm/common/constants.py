@@ -0,0 +1,120 @@
+#
+# Copyright 2009-2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+import os
+
+GLUSTER_MGMT_ENABLED = False
+
+# SMBIOS manufacturer
+SMBIOS_MANUFACTURER = 'root'
+SMBIOS_OSNAME = 'root'
+
+#
+# file ownership definitions
+#
+VDSM_USER = 'root'
+VDSM_GROUP = 'root'
+DISKIMAGE_USER = 'root'
+DISKIMAGE_GROUP = 'root'
+METADATA_USER = 'root'
+METADATA_GROUP = 'root'
+QEMU_PROCESS_USER = 'root'
+QEMU_PROCESS_GROUP = 'root'
+OVIRT_VMCONSOLE_USER = 'root'
+OVIRT_VMCONSOLE_GROUP = 'root'
+
+
+# Sanlock definitions
+SANLOCK_ENABLED = 'False' == 'yes'
+SANLOCK_USER = 'root'
+
+# Libvirt selinux
+LIBVIRT_SELINUX = 'False' == 'yes'
+
+MEGAB = 2 ** 20  # = 1024 ** 2 = 1 MiB
+GIB = 1024 * MEGAB
+
+#
+# Path definitions
+#
+P_LIBVIRT_VMCHANNELS = '/var/lib/libvirt/qemu/channels/'
+P_OVIRT_VMCONSOLES = '/var/run/ovirt-vmconsole-console/'
+P_VDSM = '/tmp/vdsmgen/'  # NOQA: E501 (potentially long line)
+P_VDSM_HOOKS = '/tmp/vdsmgen/'  # NOQA: E501 (potentially long line)
+P_VDSM_LIB = '/tmp/vdsmgen/'  # NOQA: E501 (potentially long line)
+P_VDSM_RUN = '/tmp/vdsmgen/'  # NOQA: E501 (potentially long line)
+P_VDSM_CONF = '/tmp/vdsmgen/'  # NOQA: E501 (potentially long line)
+
+P_VDSM_LOG = 'root'  # NOQA: E501 (potentially long line)
+
+P_VDSM_EXEC = 'root'  # NOQA: E501 (potentially long line)
+
+#
+# Configuration file definitions
+#
+SYSCONF_PATH = 'root'
+
+#
+# External programs (sorted, please keep in order).
+#
+EXT_CHOWN = '/usr/bin/chown'
+
+EXT_DD = '/usr/bin/dd'
+EXT_DMIDECODE = '/usr/bin/dmidecode'
+EXT_DMSETUP = '/usr/sbin/dmsetup'
+
+EXT_FENCE_PREFIX = os.path.dirname('/usr/bin/true') + '/fence_'
+EXT_FSCK = '/usr/sbin/fsck'
+EXT_FUSER = '/usr/bin/fuser'
+
+EXT_GREP = '/usr/bin/grep'
+
+EXT_IONICE = '/usr/bin/ionice'
+EXT_ISCSIADM = '/usr/bin/iscsiadm'
+
+EXT_KILL = '/usr/bin/kill'
+
+EXT_LVM = '/usr/bin/lvm'
+
+EXT_MKFS = '/usr/sbin/mkfs'
+EXT_MKFS_MSDOS = '/usr/bin/mkfs-msdos'
+EXT_MKISOFS = '/usr/bin/mkisofs'
+EXT_MOUNT = '/usr/bin/mount'
+EXT_MULTIPATH = '/usr/bin/multipath'
+
+EXT_NICE = '/usr/bin/nice'
+
+EXT_SETSID = '/usr/bin/setsid'
+EXT_SH = '/bin/sh'  # The shell path is invariable
+EXT_SU = '/usr/bin/su'
+EXT_SUDO = '/usr/bin/sudo'
+
+EXT_TAR = '/usr/bin/tar'
+EXT_TASKSET = '/usr/bin/taskset'
+EXT_TUNE2FS = '@TUNE2FS_PATH@'
+
+EXT_UMOUNT = '/usr/bin/umount'
+
+EXT_SAFELEASE = '/usr/bin/safelease'
+
+EXT_CURL_IMG_WRAP = '/tmp/vdsmgen/curl-img-wrap'  # NOQA: E501 (potentially long line)
+EXT_FC_SCAN = '/tmp/vdsmgen/fc-scan'  # NOQA: E501 (potentially long line)
+EXT_KVM_2_OVIRT = '/tmp/vdsmgen/kvm2ovirt'  # NOQA: E501 (potentially long line)
@@ -23,11 +23,15 @@ from __future__ import absolute_import
 Blocked tasks may be discarded, and the worker pool is automatically
 replenished."""
 
+import bisect
 import collections
 import functools
+import itertools
 import logging
 import threading
 
+import six
+
 from vdsm.common import concurrent
 from vdsm.common import exception
 from vdsm.common import time
@@ -68,11 +72,20 @@ class Executor(object):
       the stuck task finishes.  This prevents creating an excessive number
       of threads when many tasks are stuck.
 
+    - In work stealing mode, every worker has a local task queue, and
+      dispatched tasks are distributed between the local queues.  A worker
+      with an empty queue takes tasks from the other queues.  Blocked tasks
+      are detected using a timing wheel, advanced by a single periodic
+      scheduler call, instead of scheduling a call for every task.
+
+    The executor keeps histograms of the time tasks waited in the queue and
+    the time they ran, per task type (see `stats()`).
+
     """
     _log = logging.getLogger('Executor')
 
     def __init__(self, name, workers_count, max_tasks, scheduler,
-                 max_workers=None, log=None):
+                 max_workers=None, log=None, work_stealing=False):
         """
         :param name: Name of the executor; no special purpose, just for
           logging and debugging.
@@ -97,22 +110,32 @@ class Executor(object):
         :param log: logger instance to override the default logger. This is
           useful for testing
         :type log: logger as returned by logging.getLogger()
+        :param work_stealing: Use local queue per worker with work stealing,
+          and check blocked tasks using a timing wheel.
+        :type work_stealing: bool
 
         """
         self._name = name
         self._workers_count = workers_count
         self._max_workers = max_workers
         self._worker_id = 0
-        self._tasks = TaskQueue(name, max_tasks)
+        if work_stealing:
+            self._tasks = StealingTaskQueue(name, max_tasks, workers_count)
+            self._timer = TimingWheel(scheduler, log=log)
+        else:
+            self._tasks = TaskQueue(name, max_tasks)
+            self._timer = scheduler
         self._scheduler = scheduler
         if log is not None:
             self._log = log
         self._workers = set()
+        # Statistics of stopped workers.
+        self._stats = TaskStats()
         self._lock = threading.Lock()
         self._running = False
 
     def __repr__(self):
-        return "<Executor %s workers=%i max_workers=%i %s at 0x%x>" % (
+        return "<Executor %s workers=%i max_workers=%s %s at 0x%x>" % (
             self._name,
             self._workers_count,
             self._max_workers,
@@ -130,6 +153,8 @@ class Executor(object):
             if self._running:
                 raise AlreadyStarted()
             self._running = True
+            if isinstance(self._timer, TimingWheel):
+                self._timer.start()
             for _ in range(self._workers_count):
                 self._add_worker()
 
@@ -137,6 +162,8 @@ class Executor(object):
         self._log.debug('Stopping executor')
         with self._lock:
             self._running = False
+            if isinstance(self._timer, TimingWheel):
+                self._timer.stop()
             self._tasks.clear()
             for _ in range(self._workers_count):
                 self._tasks.put(_STOP)
@@ -170,6 +197,22 @@ class Executor(object):
             raise NotRunning()
         self._tasks.put(Task(callable, timeout, discard))
 
+    def stats(self):
+        """
+        Return statistics of the tasks run by the executor, as dict
+        task type -> (wait histogram, run histogram).
+
+        The task type is the name of the callable, or the name of its class
+        for callable objects.
+        """
+        stats = TaskStats()
+        with self._lock:
+            stats.merge(self._stats)
+            workers = tuple(self._workers)
+        for worker in workers:
+            stats.merge(worker.stats)
+        return stats.histograms()
+
     # Serving workers
 
     @property
@@ -225,6 +268,7 @@ class Executor(object):
 
         with self._lock:
             self._workers.remove(worker)
+            self._stats.merge(worker.stats)
             if not self._running:
                 return
             if self._may_add_workers():
@@ -235,12 +279,12 @@ class Executor(object):
             self._log.info("New worker added (%s active, %s total workers)",
                            self._active_workers, self._total_workers)
 
-    def _next_task(self):
+    def _next_task(self, slot=0):
         """
         Called from the worker thread to get the next task from the task queue.
         Raises NotRunning exception if executor was stopped.
         """
-        task = self._tasks.get()
+        task = self._tasks.get(slot)
         if task is _STOP:
             raise NotRunning()
         return task
@@ -249,8 +293,9 @@ class Executor(object):
 
     def _add_worker(self):
         name = "%s/%d" % (self.name, self._worker_id)
+        slot = self._worker_id % self._workers_count
         self._worker_id += 1
-        worker = _Worker(self, self._scheduler, name, self._log)
+        worker = _Worker(self, self._timer, name, self._log, slot=slot)
         worker.start()
         self._workers.add(worker)
 
@@ -266,11 +311,14 @@ class _Worker(object):
 
     _log = logging.getLogger('Executor')
 
-    def __init__(self, executor, scheduler, name, log=None):
+    def __init__(self, executor, scheduler, name, log=None, slot=0):
         self._executor = executor
         self._scheduler = scheduler
+        self._slot = slot
         self._discarded = False
         self._task_counter = 0
+        # Modified only by the worker thread.
+        self.stats = TaskStats()
         self._lock = threading.Lock()
         if log is not None:
             self._log = log
@@ -307,15 +355,18 @@ class _Worker(object):
             self._executor._worker_stopped(self)
 
     def _execute_task(self):
-        task = self._executor._next_task()
+        task = self._executor._next_task(self._slot)
         with self._lock:
             self._scheduled_check = self._check_after(task.timeout)
         self._task = task
+        start = time.precise_monotonic_time()
         try:
             task()
         except Exception:
             self._log.exception("Unhandled exception in %s", task)
         finally:
+            self.stats.add(task.type, start - task.queued,
+                           time.precise_monotonic_time() - start)
             self._task = None
             # We want to discard workers that were too slow to disarm
             # the timer. It does not matter if the thread was still
@@ -378,8 +429,19 @@ class Task(object):
         self._callable = callable
         self.timeout = timeout
         self.discard = discard
+        self.queued = time.precise_monotonic_time()
         self._start = None
 
+    @property
+    def type(self):
+        func = self._callable
+        if isinstance(func, functools.partial):
+            func = func.func
+        try:
+            return func.__name__
+        except AttributeError:
+            return type(func).__name__
+
     @property
     def duration(self):
         if self._start is None:
@@ -451,9 +513,10 @@ class TaskQueue(object):
             self._tasks.append(task)
             self._cond.notify()
 
-    def get(self):
+    def get(self, slot=0):
         """
-        Get a new task. Blocks if empty.
+        Get a new task. Blocks if empty. slot is ignored, all workers share
+        the same queue.
         """
         while True:
             try:
@@ -466,3 +529,279 @@ class TaskQueue(object):
     def clear(self):
         with self._cond:
             self._tasks.clear()
+
+
+class StealingTaskQueue(object):
+    """
+    Task queue with a local queue per worker slot.
+
+    Tasks are distributed between the local queues in round robin. Every
+    worker takes tasks from its local queue, and when it is empty, from the
+    other queues. The lock is used only for waking up idle workers.
+
+    Under concurrent put() calls, the number of queued tasks may exceed
+    max_tasks by the number of concurrent callers.
+    """
+
+    def __init__(self, name, max_tasks, slots):
+        """
+        :param name: Name of the executor; no special purpose, just for
+          logging and debugging.
+        :type name: basestring
+        :param max_tasks: Maximum number of tasks waiting for execution in the
+          executor's task queue.
+        :type max_tasks: int
+        :param slots: Number of local queues.
+        :type slots: int
+        """
+        self._name = name
+        self._max_tasks = max_tasks
+        # Deques support thread-safe append and pop from both ends.
+        self._queues = tuple(collections.deque() for _ in range(slots))
+        self._next = itertools.count()
+        self._idle = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def __len__(self):
+        return sum(map(len, self._queues))
+
+    def __repr__(self):
+        return "<StealingTaskQueue %s max_tasks=%i tasks=%s at 0x%x>" % (
+            self._name,
+            self._max_tasks,
+            [len(q) for q in self._queues],
+            id(self)
+        )
+
+    def put(self, task):
+        """
+        Put a new task in the queue.
+        Do not block when full, raises ResourceExhausted instead.
+        """
+        if len(self) >= self._max_tasks:
+            raise exception.ResourceExhausted(
+                "Too many tasks",
+                resource=self._name,
+                current_tasks=self._max_tasks)
+        queues = self._queues
+        queues[next(self._next) % len(queues)].append(task)
+        # The task must be appended before checking for idle workers. A
+        # worker becoming idle now will find the task when checking the
+        # queues again.
+        if self._idle:
+            with self._cond:
+                self._cond.notify()
+
+    def get(self, slot=0):
+        """
+        Get a new task, preferring the local queue of slot. Blocks if empty.
+        """
+        while True:
+            task = self._take(slot)
+            if task is not None:
+                return task
+            with self._cond:
+                self._idle += 1
+                try:
+                    task = self._take(slot)
+                    if task is not None:
+                        return task
+                    self._cond.wait()
+                finally:
+                    self._idle -= 1
+
+    def clear(self):
+        for q in self._queues:
+            q.clear()
+
+    def _take(self, slot):
+        queues = self._queues
+        local = queues[slot]
+        if local:
+            try:
+                return local.popleft()
+            except IndexError:
+                pass  # Stolen by another worker.
+        for q in queues:
+            if q:
+                try:
+                    return q.popleft()
+                except IndexError:
+                    pass
+        return None
+
+
+class TimingWheel(object):
+    """
+    Timer for checking blocked tasks.
+
+    Calls are kept in a ring of buckets, one bucket per tick. A single
+    periodic scheduler call advances the wheel, and runs the expired calls
+    in the scheduler thread. Scheduling and cancelling a call are O(1) and
+    do not take a lock.
+
+    Calls which are more than one wheel revolution in the future stay in
+    their bucket until their deadline.
+    """
+
+    _log = logging.getLogger('Executor')
+
+    def __init__(self, scheduler, tick=0.1, size=512,
+                 clock=time.monotonic_time, log=None):
+        self._scheduler = scheduler
+        self._tick = tick
+        self._buckets = tuple(set() for _ in range(size))
+        self._clock = clock
+        if log is not None:
+            self._log = log
+        self._lock = threading.Lock()
+        self._current = None
+        self._call = None
+
+    def start(self):
+        with self._lock:
+            self._current = int(self._clock() / self._tick)
+            self._call = self._scheduler.schedule(self._tick, self._advance)
+
+    def stop(self):
+        with self._lock:
+            if self._call is not None:
+                self._call.cancel()
+                self._call = None
+
+    def schedule(self, delay, callable):
+        """
+        Schedule callable to be called after delay seconds, with a
+        resolution of tick seconds. Returns a call object with a cancel()
+        method.
+        """
+        deadline = self._clock() + delay
+        # The first tick at or after the deadline.
+        tick = -int(-deadline // self._tick)
+        bucket = self._buckets[tick % len(self._buckets)]
+        call = _WheelCall(deadline, callable, bucket)
+        # Adding to and removing from a set are atomic.
+        bucket.add(call)
+        return call
+
+    def _advance(self):
+        now = self._clock()
+        expired = []
+        with self._lock:
+            if self._call is None:
+                return
+            current = int(now / self._tick)
+            first = self._current + 1
+            last = min(current, self._current + len(self._buckets))
+            for tick in range(first, last + 1):
+                bucket = self._buckets[tick % len(self._buckets)]
+                # Copying the set is atomic, iterating over it is not.
+                for call in list(bucket):
+                    if call.deadline <= now:
+                        bucket.discard(call)
+                        expired.append(call)
+            self._current = current
+            self._call = self._scheduler.schedule(self._tick, self._advance)
+        for call in expired:
+            # A call cancelled now may still run, like a call of the
+            # scheduler cancelled while it is running.
+            if call.cancelled:
+                continue
+            try:
+                call.func()
+            except Exception:
+                self._log.exception("Unhandled exception in %s", call.func)
+
+
+class _WheelCall(object):
+
+    __slots__ = ("deadline", "func", "bucket", "cancelled")
+
+    def __init__(self, deadline, func, bucket):
+        self.deadline = deadline
+        self.func = func
+        self.bucket = bucket
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        self.bucket.discard(self)
+
+
+class Histogram(object):
+    """
+    Histogram of durations, with exponential buckets.
+    """
+
+    # Bucket upper bounds, from 100 microseconds to 104 seconds. Longer
+    # durations are counted in the last bucket.
+    BOUNDS = tuple(0.0001 * 2 ** i for i in range(21))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, p):
+        """
+        Return the upper bound of the bucket containing the p percentile, or
+        None if the histogram is empty.
+        """
+        if self.count == 0:
+            return None
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else \
+                    float("inf")
+
+    def __repr__(self):
+        return "<Histogram count=%d p50=%s p99=%s at 0x%x>" % (
+            self.count, self.percentile(50), self.percentile(99), id(self))
+
+
+class TaskStats(object):
+    """
+    Wait and run time histograms per task type.
+    """
+
+    def __init__(self):
+        # task type -> (wait Histogram, run Histogram)
+        self._histograms = {}
+
+    def add(self, task_type, wait, run):
+        try:
+            histograms = self._histograms[task_type]
+        except KeyError:
+            histograms = self._histograms[task_type] = (Histogram(),
+                                                        Histogram())
+        histograms[0].add(wait)
+        histograms[1].add(run)
+
+    def merge(self, other):
+        # The other stats may be modified by a worker thread while we merge
+        # them, so we may miss the last few tasks.
+        for task_type, (wait, run) in list(other._histograms.items()):
+            try:
+                histograms = self._histograms[task_type]
+            except KeyError:
+                histograms = self._histograms[task_type] = (Histogram(),
+                                                            Histogram())
+            histograms[0].merge(wait)
+            histograms[1].merge(run)
+
+    def histograms(self):
+        return dict(six.iteritems(self._histograms))
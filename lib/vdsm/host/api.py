@@ -83,18 +83,29 @@ def get_stats(cif, sample):
     return ret
 
 
-def send_metrics(hoststats):
-    prefix = "hosts"
-    data = {}
+# storage domain -> (delay gauge, last check gauge)
+_storage_gauges = {}
 
-    try:
-        for dom in hoststats['storageDomains']:
-            storage_prefix = prefix + '.storage.' + dom
-            dom_info = hoststats['storageDomains'][dom]
-            data[storage_prefix + '.delay'] = dom_info['delay']
-            data[storage_prefix + '.last_check'] = dom_info['lastCheck']
 
-        metrics.send(data)
+def send_metrics(hoststats):
+    try:
+        domains = hoststats['storageDomains']
+        for dom in domains:
+            dom_info = domains[dom]
+            gauges = _storage_gauges.get(dom)
+            if gauges is None:
+                gauges = _storage_gauges[dom] = (
+                    metrics.gauge('hosts.storage.{domain}.delay', domain=dom),
+                    metrics.gauge('hosts.storage.{domain}.last_check',
+                                  domain=dom))
+            gauges[0].set(dom_info['delay'])
+            gauges[1].set(dom_info['lastCheck'])
+
+        for dom in set(_storage_gauges) - set(domains):
+            for gauge in _storage_gauges.pop(dom):
+                gauge.remove()
+
+        metrics.flush()
     except KeyError:
         logging.exception('Host metrics collection failed')
 
@@ -103,6 +103,14 @@ class Job(object):
     def progress(self):
         return None
 
+    @property
+    def queued(self):
+        """
+        Return True if a running job is waiting for resources shared with
+        other jobs, e.g. a copy waiting for admission.
+        """
+        return False
+
     @property
     def job_type(self):
         return self._JOB_TYPE
@@ -120,6 +128,9 @@ class Job(object):
         if self.progress is not None:
             ret['progress'] = self.progress
 
+        if self.queued:
+            ret['queued'] = True
+
         if self.error:
             ret['error'] = self.error.info()
 
@@ -66,6 +66,7 @@ _COMMAND_CONVERTER = {
     'getAllTasksInfo': 'Host.getAllTasksInfo',
     'getAllTasksStatuses': 'Host.getAllTasksStatuses',
     'getAllVmStats': 'Host.getAllVmStats',
+    'getAllVmStatsDelta': 'Host.getAllVmStatsDelta',
     'getAllVmIoTunePolicies': 'Host.getAllVmIoTunePolicies',
     'getConnectedStoragePoolsList': 'Host.getConnectedStoragePools',
     'getDeviceList': 'Host.getDeviceList',
@@ -21,27 +21,106 @@
 from __future__ import absolute_import
 
 import importlib
+import logging
+import threading
+
+import six
+
+from vdsm.common import concurrent
 from ..config import config
+from . import registry as _registry_module
 
+_log = logging.getLogger("metrics")
+
+_registry = _registry_module.Registry()
 _reporter = None
+_flusher = None
 
 
 def start():
-    global _reporter
+    global _reporter, _flusher
     if config.getboolean('metrics', 'enabled'):
         _reporter = importlib.import_module(
             'vdsm.metrics.' + config.get('metrics', 'collector_type')
         )
         _reporter.start(config.get('metrics', 'collector_address'))
+        _flusher = _Flusher(_registry, _reporter)
+        _flusher.start()
 
 
 def stop():
-    global _reporter
+    global _reporter, _flusher
+    if _flusher:
+        _flusher.stop()
+        _flusher = None
     if _reporter:
         _reporter.stop()
         _reporter = None
 
 
+def gauge(template, **labels):
+    """
+    Return a gauge handle. See vdsm.metrics.registry for details.
+    """
+    return _registry.gauge(template, **labels)
+
+
+def flush():
+    """
+    Wake up the flusher thread to publish the updated gauges.
+    """
+    if _flusher:
+        _flusher.wakeup()
+
+
 def send(report):
     if _reporter:
-        _reporter.send(report)
+        for name, value in six.iteritems(report):
+            # Names are not templates.
+            template = name.replace("{", "{{").replace("}", "}}")
+            _registry.gauge(template).set(value)
+        flush()
+
+
+class _Flusher(object):
+    """
+    Publish the gauges updated since the previous flush to the collector,
+    in a background thread.
+    """
+
+    def __init__(self, registry, reporter):
+        self._registry = registry
+        self._reporter = reporter
+        self._cond = threading.Condition(threading.Lock())
+        self._wakeup = False
+        self._running = False
+        self._thread = concurrent.thread(self._run, name="metrics",
+                                         log=_log)
+
+    def start(self):
+        self._running = True
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+
+    def wakeup(self):
+        with self._cond:
+            self._wakeup = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._wakeup:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                self._wakeup = False
+            try:
+                self._reporter.publish(self._registry.pending())
+            except Exception:
+                _log.exception("Error publishing metrics")
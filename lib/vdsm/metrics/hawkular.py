@@ -66,6 +66,10 @@ def send(report):
         _cond.notify()
 
 
+def publish(gauges):
+    send({g.name: g.value for g in gauges if not g.removed})
+
+
 def _get_gauge_metric(name, value):
     return metrics.create_metric(metrics.MetricType.Gauge, name,
                                  metrics.create_datapoint(float(value)))
@@ -0,0 +1,132 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Collector serving the latest value of every metric in the Prometheus text
+exposition format, at http://collector_address:prometheus_port/metrics.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import threading
+
+import six
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from vdsm.common import concurrent
+from vdsm.config import config
+
+PREFIX = "vdsm_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_log = logging.getLogger("metrics.prometheus")
+_lock = threading.Lock()
+_gauges = set()
+_server = None
+
+
+def start(address, port=None):
+    global _server
+    if port is None:
+        port = config.getint('metrics', 'prometheus_port')
+    _log.info("Starting prometheus collector on %s:%s", address, port)
+    _server = _Server((address, port), _Handler)
+    concurrent.thread(_server.serve_forever, name="prometheus",
+                      log=_log).start()
+
+
+def stop():
+    global _server
+    if _server is not None:
+        _log.info("Stopping prometheus collector")
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+    with _lock:
+        _gauges.clear()
+
+
+def publish(gauges):
+    with _lock:
+        for gauge in gauges:
+            if gauge.removed:
+                _gauges.discard(gauge)
+            else:
+                _gauges.add(gauge)
+
+
+def render():
+    """
+    Return the current metrics in the text exposition format, as bytes.
+    """
+    with _lock:
+        gauges = list(_gauges)
+    gauges.sort(key=lambda g: (g.family, g.labels))
+    lines = []
+    family = None
+    for gauge in gauges:
+        try:
+            value = float(gauge.value)
+        except (TypeError, ValueError):
+            continue
+        if gauge.family != family:
+            family = gauge.family
+            lines.append(u"# TYPE %s%s gauge" % (PREFIX, family))
+        if gauge.labels:
+            labels = u",".join(u'%s="%s"' % (name, _escape(value))
+                               for name, value in gauge.labels)
+            lines.append(u"%s%s{%s} %r" % (PREFIX, family, labels, value))
+        else:
+            lines.append(u"%s%s %r" % (PREFIX, family, value))
+    lines.append(u"")
+    return u"\n".join(lines).encode("utf-8")
+
+
+def _escape(value):
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    elif not isinstance(value, six.text_type):
+        value = six.text_type(value)
+    return (value.replace(u"\\", u"\\\\")
+            .replace(u'"', u'\\"')
+            .replace(u"\n", u"\\n"))
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _log.debug(format, *args)
@@ -0,0 +1,140 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Registry of metric handles.
+
+A gauge is created once, and updated on every sample:
+
+    gauge = registry.gauge("vms.{vm}.cpu.user", vm="vm-1")
+    ...
+    gauge.set(12.5)
+
+The name of the gauge is built from the template and the labels when the
+gauge is created. Collectors use the name ("vms.vm-1.cpu.user") or the
+family and labels (vms_cpu_user{vm="vm-1"}), and never rebuild them.
+
+Collectors get the gauges updated or removed since the last time using
+Registry.pending().
+"""
+
+from __future__ import absolute_import
+
+import re
+import threading
+
+import six
+
+_PLACEHOLDER = re.compile(r"\.?\{\w+\}")
+_INVALID_CHARS = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+class Gauge(object):
+
+    __slots__ = ("name", "family", "labels", "value", "removed", "_registry",
+                 "_key")
+
+    def __init__(self, registry, key, template, labels):
+        self.name = _format(template, labels)
+        self.family = _INVALID_CHARS.sub("_", _PLACEHOLDER.sub("", template))
+        self.labels = key[1]
+        self.value = None
+        self.removed = False
+        self._registry = registry
+        self._key = key
+
+    def set(self, value):
+        self.value = value
+        self._registry._updated(self)
+
+    def remove(self):
+        self._registry._remove(self)
+
+    def __repr__(self):
+        return "<Gauge %s=%r>" % (self.name, self.value)
+
+
+def _format(template, labels):
+    try:
+        return template.format(**labels)
+    except UnicodeError:
+        # Python 2, mixing unicode and utf-8 encoded names.
+        return _text(template).format(
+            **{k: _text(v) for k, v in six.iteritems(labels)})
+
+
+def _text(s):
+    if isinstance(s, bytes):
+        return s.decode("utf-8")
+    return s
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (template, labels) -> Gauge
+        self._gauges = {}
+        self._pending = set()
+
+    def gauge(self, template, **labels):
+        """
+        Return the gauge for template and labels, creating it if needed.
+
+        Arguments:
+            template (str): metric name, may include labels in
+                str.format() syntax, e.g. "vms.{vm}.cpu.user"
+            labels (dict): label name -> value
+        """
+        key = (template, tuple(sorted(six.iteritems(labels))))
+        gauge = self._gauges.get(key)
+        if gauge is None:
+            with self._lock:
+                gauge = self._gauges.get(key)
+                if gauge is None:
+                    gauge = Gauge(self, key, template, labels)
+                    self._gauges[key] = gauge
+        return gauge
+
+    def gauges(self):
+        """
+        Return a list of all the gauges.
+        """
+        with self._lock:
+            return list(self._gauges.values())
+
+    def pending(self):
+        """
+        Return the gauges updated or removed since the previous call.
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = set()
+        return list(pending)
+
+    def _updated(self, gauge):
+        with self._lock:
+            self._pending.add(gauge)
+
+    def _remove(self, gauge):
+        with self._lock:
+            if self._gauges.get(gauge._key) is gauge:
+                del self._gauges[gauge._key]
+            gauge.removed = True
+            self._pending.add(gauge)
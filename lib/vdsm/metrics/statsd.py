@@ -22,13 +22,17 @@ from __future__ import absolute_import
 import six
 import socket
 
+from vdsm.config import config
+
 _client = None
 
 
 def start(address, port=8125):
     global _client
     if _client is None:
-        _client = _StatsClient(address, port=port)
+        _client = _StatsClient(
+            address, port=port,
+            maxudpsize=config.getint('metrics', 'statsd_packet_size'))
 
 
 def stop():
@@ -38,8 +42,11 @@ def stop():
 
 
 def send(report):
-    for name, value in six.iteritems(report):
-        _client.gauge(name, value)
+    _client.send_gauges(six.iteritems(report))
+
+
+def publish(gauges):
+    _client.send_gauges((g.name, g.value) for g in gauges if not g.removed)
 
 
 class _StatsClient(object):
@@ -47,9 +54,13 @@ class _StatsClient(object):
     Simple client that sends udp messages to stastd port in metrics format
     standard (based on http://metrics20.org/spec).
 
+    Metrics are sent one per line, packing as many lines as possible in one
+    datagram of up to maxudpsize bytes. The default size fits in a standard
+    ethernet frame.
+
     Currently supports only gauge reports which is used in VDSM.
     """
-    def __init__(self, host, port=8125, maxudpsize=512, ipv6=False):
+    def __init__(self, host, port=8125, maxudpsize=1432, ipv6=False):
         fam = socket.AF_INET6 if ipv6 else socket.AF_INET
         family, _, _, _, addr = socket.getaddrinfo(
             host, port, fam, socket.SOCK_DGRAM)[0]
@@ -77,4 +88,30 @@ class _StatsClient(object):
             stat (string): metric name decoded to utf-8
             value (int): numeric value for stat
         """
-        self._send('%s:%s|g' % (stat, value))
+        self._send(_gauge_line(stat, value))
+
+    def send_gauges(self, items):
+        """
+        Send gauge reports for (stat, value) items, packed in datagrams.
+        A line longer than maxudpsize is sent in its own datagram.
+        """
+        lines = []
+        size = 0
+        for stat, value in items:
+            line = _gauge_line(stat, value)
+            # Lines are separated by a newline.
+            if lines and size + 1 + len(line) > self._maxudpsize:
+                self._send(b"\n".join(lines))
+                lines = []
+                size = 0
+            size += len(line) + (1 if lines else 0)
+            lines.append(line)
+        if lines:
+            self._send(b"\n".join(lines))
+
+
+def _gauge_line(stat, value):
+    line = '%s:%s|g' % (stat, value)
+    if not isinstance(line, bytes):
+        line = line.encode('utf-8')
+    return line
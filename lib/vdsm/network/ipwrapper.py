@@ -22,7 +22,6 @@ from __future__ import absolute_import
 from fnmatch import fnmatch
 from glob import iglob
 import errno
-import itertools
 import os
 
 import six
@@ -262,14 +261,23 @@ def _bondExists(bondName):
 
 def getLinks():
     """Return an iterator of Link objects, each per a link in the system."""
-    dpdk_links = (dpdk.link_info(dev_name, dev_info['pci_addr'])
-                  for dev_name, dev_info
-                  in six.viewitems(dpdk.get_dpdk_devices()))
-    for data in itertools.chain(link.iter_links(), dpdk_links):
+    for data in link.iter_links():
         try:
             yield Link.fromDict(data)
         except IOError:  # If a link goes missing we just don't report it
             continue
+    for dpdk_link in getDpdkLinks():
+        yield dpdk_link
+
+
+def getDpdkLinks():
+    """Return an iterator of Link objects, each per a DPDK device in the
+    system."""
+    for dev_name, dev_info in six.viewitems(dpdk.get_dpdk_devices()):
+        try:
+            yield Link.fromDict(dpdk.link_info(dev_name, dev_info['pci_addr']))
+        except IOError:  # If a link goes missing we just don't report it
+            continue
 
 
 def getLink(dev):
@@ -34,6 +34,7 @@ from __future__ import absolute_import
 
 from ctypes import CDLL, CFUNCTYPE, sizeof, get_errno, byref
 from ctypes import c_char, c_char_p, c_int, c_void_p, c_size_t, py_object
+from ctypes import c_uint64
 
 from vdsm.common.cache import memoized
 from vdsm.network import py2to3
@@ -158,6 +159,18 @@ class NlCbKind(object):
     NL_CB_CUSTOM = 3  # Customized handler specified by user
 
 
+# libnl/include/netlink/route/link.h
+class RtnlLinkStat(object):
+    RX_PACKETS = 0   # Packets received
+    TX_PACKETS = 1   # Packets sent
+    RX_BYTES = 2     # Bytes received
+    TX_BYTES = 3     # Bytes sent
+    RX_ERRORS = 4    # Receive errors
+    TX_ERRORS = 5    # Send errors
+    RX_DROPPED = 6   # Received packets dropped
+    TX_DROPPED = 7   # Packets dropped during transmit
+
+
 class RtnlObjectType(object):
     BASE = 'route'
     ADDR = BASE + '/addr'  # libnl/lib/route/addr.c
@@ -764,6 +777,19 @@ def rtnl_link_get_qdisc(link):
     return py2to3.to_str(qdisc) if qdisc else None
 
 
+def rtnl_link_get_stat(link, stat_id):
+    """Return statistical counter of link object.
+
+    @arg link            Link object
+    @arg stat_id         Identifier of statistical counter (RtnlLinkStat)
+
+    @return Value of counter or 0 if not specified.
+    """
+    _rtnl_link_get_stat = _libnl_route(
+        'rtnl_link_get_stat', c_uint64, c_void_p, c_int)
+    return _rtnl_link_get_stat(link, stat_id)
+
+
 def rtnl_link_get_by_name(cache, name):
     """Lookup link in cache by link name
 
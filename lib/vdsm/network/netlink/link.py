@@ -49,6 +49,21 @@ def iter_links():
                 link = libnl.nl_cache_get_next(link)
 
 
+def iter_links_stats():
+    """Generator that yields an information dictionary for each link of the
+    system, including the link statistics under the 'stats' key.
+
+    All the links and their statistics are fetched using a single dump."""
+    with _pool.socket() as sock:
+        with _nl_link_cache(sock) as cache:
+            link = libnl.nl_cache_get_first(cache)
+            while link:
+                info = _link_info(link, cache=cache)
+                info['stats'] = _link_stats(link)
+                yield info
+                link = libnl.nl_cache_get_next(link)
+
+
 def is_link_up(link_flags, check_oper_status):
     """
     Check link status based on device status flags.
@@ -104,6 +119,23 @@ def _link_info(link, cache=None):
     return info
 
 
+# Statistics names, as reported in /sys/class/net/<link>/statistics/
+_LINK_STATS = (
+    ('rx_bytes', libnl.RtnlLinkStat.RX_BYTES),
+    ('tx_bytes', libnl.RtnlLinkStat.TX_BYTES),
+    ('rx_dropped', libnl.RtnlLinkStat.RX_DROPPED),
+    ('tx_dropped', libnl.RtnlLinkStat.TX_DROPPED),
+    ('rx_errors', libnl.RtnlLinkStat.RX_ERRORS),
+    ('tx_errors', libnl.RtnlLinkStat.TX_ERRORS),
+)
+
+
+def _link_stats(link):
+    """Returns a dictionary with the statistics of the link object."""
+    return {name: libnl.rtnl_link_get_stat(link, stat_id)
+            for name, stat_id in _LINK_STATS}
+
+
 def _link_index_to_name(link_index, cache=None):
     """Returns the textual name of the link with index equal to link_index."""
     if cache is None:
@@ -62,13 +62,19 @@ class DynamicBridge(object):
     def __init__(self):
         paths = [vdsmapi.find_schema()]
         api_strict_mode = config.getboolean('devel', 'api_strict_mode')
+        api_verify_ratio = config.getint('devel', 'api_verify_ratio')
         if _glusterEnabled:
             paths.append(vdsmapi.find_schema('vdsm-api-gluster'))
-        self._schema = vdsmapi.Schema(paths, api_strict_mode)
+        self._schema = vdsmapi.Schema(paths, api_strict_mode,
+                                      verify_ratio=api_verify_ratio)
 
         self._event_schema = vdsmapi.Schema(
             [vdsmapi.find_schema('vdsm-events')],
-            api_strict_mode)
+            api_strict_mode,
+            verify_ratio=api_verify_ratio)
+
+        # Method arguments which are not ctor arguments, keyed by method id.
+        self._method_args = {}
 
         self._threadLocal = threading.local()
         self.log = logging.getLogger('DynamicBridge')
@@ -80,6 +86,10 @@ class DynamicBridge(object):
     def event_schema(self):
         return self._event_schema
 
+    @property
+    def method_costs(self):
+        return self._schema.get_method_costs()
+
     def unregister_server_address(self):
         self._threadLocal.server = None
 
@@ -137,22 +147,23 @@ class DynamicBridge(object):
         them from here.  For any given method, the method_args are obtained by
         chopping off the ctor_args from the beginning of argObj.
         """
-        allArgs = self._schema.get_arg_names(rep)
-
-        class_name = self._convert_class_name(rep.object_name)
-        if _glusterEnabled and class_name.startswith('Gluster'):
-            ctorArgs = getattr(gapi, class_name).ctorArgs
-        else:
-            ctorArgs = getattr(API, class_name).ctorArgs
-
         defaultArgs = self._schema.get_default_arg_names(rep)
         defaultValues = self._schema.get_default_arg_values(rep)
 
-        # Determine the method arguments by subtraction
-        methodArgs = []
-        for arg in allArgs:
-            if arg not in ctorArgs:
-                methodArgs.append(arg)
+        try:
+            methodArgs = self._method_args[rep.id]
+        except KeyError:
+            allArgs = self._schema.get_arg_names(rep)
+
+            class_name = self._convert_class_name(rep.object_name)
+            if _glusterEnabled and class_name.startswith('Gluster'):
+                ctorArgs = getattr(gapi, class_name).ctorArgs
+            else:
+                ctorArgs = getattr(API, class_name).ctorArgs
+
+            # Determine the method arguments by subtraction
+            methodArgs = tuple(arg for arg in allArgs if arg not in ctorArgs)
+            self._method_args[rep.id] = methodArgs
 
         return self._get_args(argObj, methodArgs, defaultArgs, defaultValues)
 
@@ -218,8 +229,7 @@ class DynamicBridge(object):
         else:
             ret = self._get_result(result, retfield)
 
-        self._schema.verify_retval(vdsmapi.MethodRep(className, methodName),
-                                   ret)
+        self._schema.verify_retval(rep, ret)
         return ret
 
 
@@ -351,6 +361,7 @@ command_info = {
     'Host_getVMList': {'call': Host_getVMList_Call, 'ret': 'vmList'},
     'Host_getVMFullList': {'call': Host_getVMFullList_Call, 'ret': 'vmList'},
     'Host_getAllVmStats': {'ret': 'statsList'},
+    'Host_getAllVmStatsDelta': {'ret': 'delta'},
     'Host_getAllVmIoTunePolicies': {'ret': 'io_tune_policies_dict'},
     'Host_setupNetworks': {'ret': 'status'},
     'Host_setKsmTune': {'ret': 'status'},
@@ -19,9 +19,11 @@ import functools
 import logging
 
 from yajsonrpc import JsonRpcServer
+from yajsonrpc import fairqueue
 from yajsonrpc.stompreactor import StompReactor
 
 from vdsm import executor
+from vdsm import metrics
 from vdsm.common import concurrent
 from vdsm.config import config
 
@@ -45,7 +47,9 @@ class BindingJsonRpc(object):
         self._server = JsonRpcServer(
             bridge, timeout, cif,
             functools.partial(self._executor.dispatch,
-                              timeout=_TIMEOUT, discard=False))
+                              timeout=_TIMEOUT, discard=False),
+            fairQueue=_create_fair_queue(bridge),
+            report=metrics.send)
         self._reactor = StompReactor(subs)
         self.startReactor()
 
@@ -80,3 +84,36 @@ class BindingJsonRpc(object):
         self._server.stop()
         self._reactor.stop()
         self._executor.stop()
+
+
+def _create_fair_queue(bridge):
+    if not config.getboolean('rpc', 'fair_queuing'):
+        return None
+    # Bridges without a schema have no cost classes.
+    costs = dict(getattr(bridge, 'method_costs', {}))
+    costs.update(_parse_pairs(config.get('rpc', 'method_costs')))
+    for method, cost in costs.items():
+        if cost not in fairqueue.COSTS:
+            raise ValueError("Invalid cost for method %s: %r" % (method, cost))
+    weights = {cost: int(weight) for cost, weight in
+               _parse_pairs(config.get('rpc', 'cost_weights')).items()}
+    return fairqueue.FairQueue(
+        _THREADS,
+        costs=costs,
+        weights=weights,
+        reserved=config.getint('rpc', 'reserved_workers'),
+        timeout=_TIMEOUT,
+        max_requests=_TASKS)
+
+
+def _parse_pairs(value):
+    """
+    Parse "key:value,key:value" configuration value to a dict.
+    """
+    pairs = {}
+    for item in value.split(','):
+        item = item.strip()
+        if item:
+            key, val = item.split(':', 1)
+            pairs[key.strip()] = val.strip()
+    return pairs
@@ -51,6 +51,17 @@ from Scheduler.schedule(), and cancel the task:
     ...
     scheduled_call.cancel()
 
+WheelScheduler provides the same interface, using a hierarchical timing
+wheel instead of a heap. Scheduling and cancelling a call take constant time,
+cancelled calls are removed immediately, and calls expiring in the same tick
+are executed together:
+
+    scheduler = schedule.WheelScheduler(clock=monotonic_time, tick=0.01)
+
+Both schedulers report their size and the lateness of executed calls:
+
+    scheduler.stats()
+
 Finally, when the scheduler is not needed any more:
 
     scheduler.stop()
@@ -60,6 +71,7 @@ This will cancel any pending calls and terminate the scheduler thread.
 
 import heapq
 import logging
+import math
 import threading
 import time
 
@@ -91,6 +103,8 @@ class Scheduler(object):
         self._cond = threading.Condition(threading.Lock())
         self._running = False
         self._calls = []
+        # count, total, max
+        self._lateness = [0, 0.0, 0.0]
         self._thread = concurrent.thread(self._run, name=self._name,
                                          log=self._log)
 
@@ -114,6 +128,24 @@ class Scheduler(object):
         if wait:
             self._thread.join()
 
+    def stats(self):
+        """
+        Return a dict with the number of calls kept by the scheduler, the
+        number of cancelled calls waiting for removal, and the number and
+        lateness of calls executed since the previous call.
+        """
+        with self._cond:
+            count, total, late_max = self._lateness
+            self._lateness = [0, 0.0, 0.0]
+            size, cancelled = self._size()
+        return {
+            "size": size,
+            "cancelled": cancelled,
+            "executed": count,
+            "lateness_avg": total / count if count else 0.0,
+            "lateness_max": late_max,
+        }
+
     def schedule(self, delay, callable):
         """
         Schedule callable to be called after delay seconds on the scheduler
@@ -173,8 +205,22 @@ class Scheduler(object):
             heapq.heappop(self._calls)
             if call.valid():
                 expired.append(call)
+        self._record_lateness(expired, now)
         return expired
 
+    def _record_lateness(self, calls, now):
+        stats = self._lateness
+        for call in calls:
+            lateness = now - call._deadline
+            stats[0] += 1
+            stats[1] += lateness
+            if lateness > stats[2]:
+                stats[2] = lateness
+
+    def _size(self):
+        cancelled = sum(1 for call in self._calls if not call.valid())
+        return len(self._calls), cancelled
+
     def _cancel_calls(self):
         # Help the garbage collector by breaking reference cycles
         with self._cond:
@@ -182,6 +228,156 @@ class Scheduler(object):
                 call.cancel()
 
 
+class WheelScheduler(Scheduler):
+    """
+    Scheduler keeping calls in a hierarchical timing wheel.
+
+    Time is divided into ticks. The first wheel has one slot per tick, and
+    each of the next wheels has one slot per revolution of the previous
+    wheel. A call is kept in the lowest wheel covering its deadline, and is
+    moved to a lower wheel when the previous wheel completes a revolution.
+
+    Calls are executed in the first tick after their deadline, so they may
+    be up to one tick late. All calls expiring in the same tick are executed
+    together.
+
+    Like Scheduler, this class is thread safe.
+    """
+
+    def __init__(self, name="Scheduler", clock=time.time, tick=0.01,
+                 bits=8, levels=4):
+        """
+        Initialize a scheduler.
+
+        Arguments:
+          name      Used as scheduler thread name
+          clock     Callable returning current time (default time.time)
+          tick      Resolution of the scheduler in seconds
+          bits      Number of slots in every wheel, as a power of 2
+          levels    Number of wheels
+        """
+        super(WheelScheduler, self).__init__(name=name, clock=clock)
+        self._resolution = tick
+        self._bits = bits
+        self._mask = (1 << bits) - 1
+        self._wheels = [[set() for i in range(1 << bits)]
+                        for level in range(levels)]
+        # The next tick to process.
+        self._current = self._tick_of(clock())
+        # The tick the scheduler thread is waiting for.
+        self._wakeup = None
+        self._count = 0
+
+    def schedule(self, delay, callable):
+        deadline = self._clock() + delay
+        call = WheelCall(deadline, callable, self)
+        tick = self._tick_of(deadline)
+        with self._cond:
+            if not self._running:
+                raise AssertionError("Scheduler not running")
+            self._insert(call, tick)
+            self._count += 1
+            if self._wakeup is None or tick < self._wakeup:
+                self._cond.notify()
+        return call
+
+    def _remove(self, call):
+        with self._cond:
+            if call._bucket is not None:
+                call._bucket.discard(call)
+                call._bucket = None
+                self._count -= 1
+
+    def _tick_of(self, deadline):
+        return int(math.ceil(deadline / self._resolution))
+
+    def _insert(self, call, tick):
+        call._tick = tick
+        current = self._current
+        if tick <= current:
+            bucket = self._wheels[0][current & self._mask]
+        else:
+            for level, wheel in enumerate(self._wheels):
+                shift = self._bits * level
+                # A slot is free to use if it will not be processed before
+                # tick.
+                if (tick >> shift) - (current >> shift) <= self._mask:
+                    bucket = wheel[(tick >> shift) & self._mask]
+                    break
+            else:
+                # Beyond the last wheel; keep the call in the last slot and
+                # move it again when this slot is processed.
+                bucket = wheel[((current >> shift) - 1) & self._mask]
+        bucket.add(call)
+        call._bucket = bucket
+
+    def _time_until_deadline(self):
+        if self._count == 0:
+            self._wakeup = None
+            return self.DEFAULT_DELAY
+        self._wakeup = self._next_tick(self._current)
+        return self._wakeup * self._resolution - self._clock()
+
+    def _next_tick(self, tick):
+        """
+        Return the first tick at or after tick with calls to execute, or
+        with calls to move to the first wheel.
+        """
+        wheel = self._wheels[0]
+        while True:
+            if tick & self._mask == 0 or wheel[tick & self._mask]:
+                return tick
+            tick += 1
+
+    def _pop_expired_calls(self):
+        now = self._clock()
+        last = int(now / self._resolution)
+        expired = []
+        while self._current <= last:
+            if self._count == 0:
+                self._current = last + 1
+                break
+            tick = self._current
+            if tick & self._mask == 0:
+                self._cascade(tick)
+            bucket = self._wheels[0][tick & self._mask]
+            if bucket:
+                self._wheels[0][tick & self._mask] = set()
+                for call in bucket:
+                    call._bucket = None
+                    if call.valid():
+                        expired.append(call)
+                self._count -= len(bucket)
+            self._current = min(self._next_tick(tick + 1), last + 1)
+        self._record_lateness(expired, now)
+        return expired
+
+    def _cascade(self, tick):
+        for level in range(1, len(self._wheels)):
+            shift = self._bits * level
+            index = (tick >> shift) & self._mask
+            bucket = self._wheels[level][index]
+            if bucket:
+                self._wheels[level][index] = set()
+                for call in bucket:
+                    self._insert(call, call._tick)
+            if index != 0:
+                break
+
+    def _size(self):
+        return self._count, 0
+
+    def _cancel_calls(self):
+        with self._cond:
+            for wheel in self._wheels:
+                for bucket in wheel:
+                    for call in bucket:
+                        call._bucket = None
+                        ScheduledCall.cancel(call)
+                    bucket.clear()
+            self._count = 0
+
+
 class ScheduledCall(object):
     """
     Returned when a callable is scheduled. The caller may cancel the call if it
@@ -223,6 +419,25 @@ class ScheduledCall(object):
         return self._deadline < other._deadline
 
 
+class WheelCall(ScheduledCall):
+    """
+    ScheduledCall kept by a WheelScheduler. Cancelling the call removes it
+    from the scheduler.
+    """
+
+    __slots__ = ('_tick', '_bucket', '_scheduler')
+
+    def __init__(self, deadline, callable, scheduler):
+        super(WheelCall, self).__init__(deadline, callable)
+        self._tick = None
+        self._bucket = None
+        self._scheduler = scheduler
+
+    def cancel(self):
+        super(WheelCall, self).cancel()
+        self._scheduler._remove(self)
+
+
 # Sentinel for marking calls as invalid. Callable so we can invalidate a call
 # in a thread safe manner without locks.
 def _INVALID():
@@ -28,9 +28,7 @@ import re
 import time
 import functools
 import sys
-from collections import namedtuple
 from contextlib import contextmanager
-from operator import itemgetter
 
 import six
 
@@ -57,10 +55,13 @@ from vdsm.storage import multipath
 from vdsm.storage import resourceFactories
 from vdsm.storage import resourceManager as rm
 from vdsm.storage import sd
+from vdsm.storage import slotcache
+from vdsm.storage import volumeindex
 from vdsm.storage.compat import sanlock
 from vdsm.storage.mailbox import MAILBOX_SIZE
 from vdsm.storage.persistent import PersistentDict, DictValidator
 from vdsm.storage.sdm import volume_artifacts
+from vdsm.storage.volumeindex import BlockSDVol
 
 import vdsm.common.supervdsm as svdsm
 
@@ -77,7 +78,6 @@ SPECIAL_LVS_V0 = sd.SPECIAL_VOLUMES_V0 + (MASTERLV,)
 SPECIAL_LVS_V4 = sd.SPECIAL_VOLUMES_V4 + (MASTERLV,)
 
 MASTERLV_SIZE = "1024"  # In MiB = 2 ** 20 = 1024 ** 2 => 1GiB
-BlockSDVol = namedtuple("BlockSDVol", "name, image, parent")
 
 log = logging.getLogger("storage.BlockSD")
 
@@ -100,6 +100,8 @@ if MAX_PVS > MAX_PVS_LIMIT:
 PVS_METADATA_SIZE = MAX_PVS * 142
 
 SD_METADATA_SIZE = 2048
+
+SLOT_CACHE_MAX_AGE = config.getfloat("irs", "block_metadata_cache_max_age")
 DEFAULT_BLOCKSIZE = 512
 
 DMDK_VGUUID = "VGUUID"
@@ -190,7 +192,10 @@ def getAllVolumes(sdUUID):
     For other volumes, there is just a single imageUUID.
     Template self image is the 1st term in template volume entry images.
     """
-    vols = _getVolsTree(sdUUID)
+    return _getAllVolumes(sdUUID, _getVolsTree(sdUUID))
+
+
+def _getAllVolumes(sdUUID, vols):
     res = {}
     for volName in vols.iterkeys():
         res[volName] = {'imgs': [], 'parent': None}
@@ -343,10 +348,11 @@ class LvMetadataRW(object):
             f.write(data)
 
 LvBasedSDMetadata = lambda vg, lv: DictValidator(
-    PersistentDict(LvMetadataRW(vg, lv, 0, SD_METADATA_SIZE)),
+    PersistentDict(LvMetadataRW(vg, lv, 0, SD_METADATA_SIZE),
+                   readMostly=True),
     BLOCK_SD_MD_FIELDS)
 TagBasedSDMetadata = lambda vg: DictValidator(
-    PersistentDict(VGTagMetadataRW(vg)),
+    PersistentDict(VGTagMetadataRW(vg), readMostly=True),
     BLOCK_SD_MD_FIELDS)
 
 
@@ -392,6 +398,16 @@ class BlockStorageDomainManifest(sd.StorageDomainManifest):
         # BlockStorageDomain. The lock should not be used elsewhere.
         self.metadata_lock = threading.Lock()
 
+        # Volumes, images and metadata slots, updated incrementally when lvs
+        # change.
+        self._volume_index = volumeindex.BlockVolumeIndex(
+            sdUUID, self.special_volumes(self.getVersion()))
+
+        # Volume metadata, loaded in bulk when walking volume chains.
+        self._slot_cache = slotcache.SlotCache(
+            self.metadata_volume_path, self._used_metadata_slots,
+            SLOT_CACHE_MAX_AGE)
+
         try:
             self.logBlkSize = self.getMetaParam(DMDK_LOGBLKSIZE)
             self.phyBlkSize = self.getMetaParam(DMDK_PHYBLKSIZE)
@@ -738,7 +754,7 @@ class BlockStorageDomainManifest(sd.StorageDomainManifest):
         """
         vols = {}  # The "legal" volumes: not half deleted/removed volumes.
         remnants = {}  # Volumes which are part of failed image deletes.
-        allVols = getAllVolumes(self.sdUUID)
+        allVols = _getAllVolumes(self.sdUUID, self._volume_index.volumes())
         for volName, ip in allVols.iteritems():
             if (volName.startswith(sd.REMOVED_IMAGE_PREFIX) or
                     ip.imgs[0].startswith(sd.REMOVED_IMAGE_PREFIX)):
@@ -820,55 +836,33 @@ class BlockStorageDomainManifest(sd.StorageDomainManifest):
                                       (self.sdUUID, dev, ext))
 
     def _getFreeMetadataSlot(self, slotSize):
-        occupiedSlots = self._getOccupiedMetadataSlots()
-
         # It might look weird skipping the sd metadata when it has been moved
         # to tags. But this is here because domain metadata and volume metadata
         # look the same. The domain might get confused and think it has lv
         # metadata if it finds something is written in that area.
-        freeSlot = (SD_METADATA_SIZE + self.logBlkSize - 1) / self.logBlkSize
+        firstSlot = self._first_metadata_slot()
 
-        for offset, size in occupiedSlots:
-            if offset >= freeSlot + slotSize:
-                break
-
-            freeSlot = offset + size
+        freeSlot = self._volume_index.free_slot(firstSlot, slotSize)
 
         self.log.debug("Found freeSlot %s in VG %s", freeSlot, self.sdUUID)
         return freeSlot
 
     def _getOccupiedMetadataSlots(self):
-        stripPrefix = lambda s, pfx: s[len(pfx):]
-        occupiedSlots = []
-        special_lvs = self.special_volumes(self.getVersion())
-        for lv in lvm.getLV(self.sdUUID):
-            if lv.name in special_lvs:
-                # Special LVs have no mapping
-                continue
-
-            offset = None
-            size = sc.VOLUME_MDNUMBLKS
-            for tag in lv.tags:
-                if tag.startswith(sc.TAG_PREFIX_MD):
-                    offset = int(stripPrefix(tag, sc.TAG_PREFIX_MD))
-
-                if tag.startswith(sc.TAG_PREFIX_MDNUMBLKS):
-                    size = int(stripPrefix(tag,
-                                           sc.TAG_PREFIX_MDNUMBLKS))
+        return self._volume_index.occupied_slots()
 
-                if offset is not None and size != sc.VOLUME_MDNUMBLKS:
-                    # I've found everything I need
-                    break
-
-            if offset is None:
-                self.log.warn("Could not find mapping for lv %s/%s",
-                              self.sdUUID, lv.name)
-                continue
+    def _first_metadata_slot(self):
+        return (SD_METADATA_SIZE + self.logBlkSize - 1) // self.logBlkSize
 
-            occupiedSlots.append((offset, size))
-
-        occupiedSlots.sort(key=itemgetter(0))
-        return occupiedSlots
+    def _used_metadata_slots(self):
+        """
+        Return (first, end) of the metadata slots used by volumes.
+        """
+        first = self._first_metadata_slot()
+        slots = self._volume_index.occupied_slots()
+        if not slots:
+            return first, first
+        offset, size = slots[-1]
+        return first, max(first, offset + size)
 
     def validateCreateVolumeParams(self, volFormat, srcVolUUID,
                                    preallocate=None):
@@ -930,6 +924,22 @@ class BlockStorageDomainManifest(sd.StorageDomainManifest):
     def metadata_volume_path(self):
         return lvm.lvPath(self.sdUUID, sd.METADATA)
 
+    def volume_metadata_snapshot(self):
+        return self._slot_cache.snapshot()
+
+    def cached_volume_metadata(self, slot):
+        """
+        Return the VolumeMetadata in slot if the caller is in a
+        volume_metadata_snapshot() scope and the slot is cached, or None.
+        """
+        return self._slot_cache.get(slot)
+
+    def volume_metadata_changed(self, slot):
+        self._slot_cache.invalidate(slot)
+
+    def getSlotCacheStats(self):
+        return self._slot_cache.stats()
+
 
 class BlockStorageDomain(sd.StorageDomain):
     manifestClass = BlockStorageDomainManifest
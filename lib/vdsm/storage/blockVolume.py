@@ -98,6 +98,13 @@ class BlockVolumeManifest(volume.VolumeManifest):
 
         _, offs = metaId
         sd = sdCache.produce_manifest(self.sdUUID)
+
+        # Served from memory when walking a volume chain. If the slot has
+        # metadata of another image, it was reused by another host.
+        md = sd.cached_volume_metadata(offs)
+        if md is not None and md.image == self.imgUUID:
+            return md.legacy_info()
+
         try:
             lines = misc.readblock(sd.metadata_volume_path(),
                                    offs * sc.METADATA_SIZE,
@@ -235,9 +242,12 @@ class BlockVolumeManifest(volume.VolumeManifest):
 
         sd = sdCache.produce_manifest(vgname)
         metavol = sd.metadata_volume_path()
-        with directio.DirectFile(metavol, "r+") as f:
-            f.seek(offs * sc.METADATA_SIZE)
-            f.write(data)
+        try:
+            with directio.DirectFile(metavol, "r+") as f:
+                f.seek(offs * sc.METADATA_SIZE)
+                f.write(data)
+        finally:
+            sd.volume_metadata_changed(offs)
 
     def changeVolumeTag(self, tagPrefix, uuid):
 
@@ -24,14 +24,22 @@ health monitoring:
 
 CheckService     entry point for starting and stopping path checkers.
 
-DirectioChecker  checker using dd process for file or block based
-                 volumes.
+DirectioChecker  checker using direct I/O for file or block based
+                 volumes, reading in a ReaderPool thread or using a dd
+                 process.
 
-CheckResult      result object provided to user callback on each check.
+ReaderPool       threads reading paths using direct I/O.
+
+CheckResult      result object provided to user callback on each dd check.
+
+ReadResult       result object provided to user callback on each
+                 in-process check.
 """
 
 from __future__ import absolute_import
 
+import collections
+import errno
 import logging
 import re
 import threading
@@ -40,12 +48,22 @@ from vdsm.common import constants
 from vdsm.common import cmdutils
 from vdsm.common import concurrent
 from vdsm.common.compat import subprocess
+from vdsm.common.time import monotonic_time
+from vdsm.common.time import precise_monotonic_time
+from vdsm.config import config
 from vdsm.storage import asyncevent
 from vdsm.storage import asyncutils
+from vdsm.storage import directio
 from vdsm.storage import exception
 
 EXEC_ERROR = 127
 
+# Like dd bs=4096 count=1.
+READ_SIZE = 4096
+
+# Idle reader threads exit after this number of seconds.
+READER_IDLE_TIMEOUT = 60
+
 _log = logging.getLogger("storage.check")
 
 
@@ -83,6 +101,10 @@ class CheckService(object):
         self._thread = concurrent.thread(self._loop.run_forever,
                                          name="check/loop")
         self._checkers = {}
+        if config.get("irs", "path_checker") == "inprocess":
+            self._pool = ReaderPool()
+        else:
+            self._pool = None
 
     def start(self):
         """
@@ -109,6 +131,8 @@ class CheckService(object):
             self._loop.call_soon_threadsafe(self._loop.stop)
             self._thread.join()
             self._loop.close()
+            if self._pool is not None:
+                self._pool.stop()
 
     def start_checking(self, path, complete, interval=10.0):
         """
@@ -123,7 +147,7 @@ class CheckService(object):
             if path in self._checkers:
                 raise RuntimeError("Already checking path %r" % path)
             checker = DirectioChecker(self._loop, path, complete,
-                                      interval=interval)
+                                      interval=interval, pool=self._pool)
             self._checkers[path] = checker
         self._loop.call_soon_threadsafe(checker.start)
 
@@ -155,9 +179,14 @@ class DirectioChecker(object):
 
     DirectioChecker is created with a complete callback.  Each time a check
     cycle is completed, the complete callback will be invoked with a
-    CheckResult instance.
+    CheckResult or ReadResult instance.
 
-    CheckResult provides a delay() method returning the read delay in
+    If created with a ReaderPool, the checker reads the path in a pool
+    thread. If the path does not support direct I/O in this process, or the
+    checker was created without a pool, the checker runs a dd process for
+    every check.
+
+    The result provides a delay() method returning the read delay in
     seconds. If the check failed, the delay() method will raise the
     appropriate exception that can be reported to engine.
 
@@ -206,13 +235,15 @@ class DirectioChecker(object):
 
     log = logging.getLogger("storage.directiochecker")
 
-    def __init__(self, loop, path, complete, interval=10.0):
+    def __init__(self, loop, path, complete, interval=10.0, pool=None):
         self._loop = loop
         self._path = path
         self._complete = complete
         self._interval = interval
+        self._pool = pool
         self._looper = asyncutils.LoopingCall(loop, self._check)
         self._check_time = None
+        self._reading = False
         self._proc = None
         self._reader = None
         self._reaper = None
@@ -248,7 +279,7 @@ class DirectioChecker(object):
         _log.debug("Checker %r stopping", self._path)
         self._state = STOPPING
         self._looper.stop()
-        if self._proc is None:
+        if not self._check_in_progress():
             self._stop_completed()
 
     def wait(self, timeout=None):
@@ -273,13 +304,72 @@ class DirectioChecker(object):
         the checker is stopped.
         """
         assert self._state is RUNNING
-        if self._proc:
+        if self._check_in_progress():
             _log.warning("Checker %r is blocked for %.2f seconds",
                          self._path, self._loop.time() - self._check_time)
             return
         self._check_time = self._loop.time()
         _log.debug("START check %r (delay=%.2f)",
                    self._path, self._check_time - self._looper.deadline)
+        if self._pool is not None:
+            self._reading = True
+            self._pool.submit(self._read)
+        else:
+            self._run_dd()
+
+    def _check_in_progress(self):
+        return self._reading or self._proc is not None
+
+    # Reading in-process
+
+    def _read(self):
+        """
+        Called in a pool thread. Reports the result on the event loop thread.
+        """
+        try:
+            delay = read_direct(self._path)
+        except EnvironmentError as e:
+            delay, error = None, e
+        else:
+            error = None
+        try:
+            self._loop.call_soon_threadsafe(self._read_completed_direct,
+                                            delay, error)
+        except RuntimeError:
+            _log.debug("Event loop closed, dropping result for %r",
+                       self._path)
+
+    def _read_completed_direct(self, delay, error):
+        assert self._state is not IDLE
+        self._reading = False
+        if error is not None and error.errno == errno.EINVAL:
+            # The path does not support direct I/O in this process. dd may
+            # still succeed using its own buffers.
+            _log.info("Cannot read %r in-process (%s), using dd",
+                      self._path, error)
+            self._pool = None
+            if self._state is STOPPING:
+                self._stop_completed()
+                return
+            self._run_dd()
+            return
+
+        elapsed = self._loop.time() - self._check_time
+        _log.debug("FINISH check %r (error=%s, elapsed=%.02f)",
+                   self._path, error, elapsed)
+        if self._state is STOPPING:
+            self._stop_completed()
+            return
+        result = ReadResult(self._path, error, self._check_time, elapsed,
+                            delay)
+        try:
+            self._complete(result)
+        except Exception:
+            _log.exception("Unhandled error in complete callback")
+
+    # Reading using dd
+
+    def _run_dd(self):
         try:
             self._start_process()
         except Exception as e:
@@ -347,6 +437,150 @@ class DirectioChecker(object):
         return "<%s at 0x%x>" % (" ".join(info), id(self))
 
 
+def read_direct(path):
+    """
+    Read the first block of path using direct I/O, and return the time the
+    read took in seconds.
+
+    Raises EnvironmentError if the path cannot be opened or read.
+    """
+    buf = _aligned_buffer()
+    with directio.DirectFile(path, "r") as f:
+        start = precise_monotonic_time()
+        f.pread(buf, 0)
+        return precise_monotonic_time() - start
+
+
+_local = threading.local()
+
+
+def _aligned_buffer():
+    """
+    Return the buffer of the current thread.
+    """
+    try:
+        return _local.buffer
+    except AttributeError:
+        _local.buffer = directio.AlignedBuffer(READ_SIZE)
+        return _local.buffer
+
+
+class ReaderPool(object):
+    """
+    Threads running direct I/O reads for checkers.
+
+    A thread is started when a read is submitted and no thread is idle, so a
+    thread blocked on unresponsive storage does not delay reads from other
+    paths. Idle threads exit after idle_timeout seconds.
+
+    If max_threads is set, reads are queued when all threads are busy, and
+    max_threads hung reads delay the reads of all other paths. The check
+    service does not limit the threads; a checker does not start a read
+    before the previous read completed, so the number of threads is bounded
+    by the number of checked paths.
+
+    This class is thread safe.
+    """
+
+    def __init__(self, max_threads=None, idle_timeout=READER_IDLE_TIMEOUT):
+        self._max_threads = max_threads
+        self._idle_timeout = idle_timeout
+        self._cond = threading.Condition(threading.Lock())
+        self._reads = collections.deque()
+        self._threads = 0
+        self._idle = 0
+        self._running = True
+        self._count = 0
+
+    @property
+    def threads(self):
+        return self._threads
+
+    def submit(self, func):
+        """
+        Run func in a pool thread.
+        """
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("Reader pool is stopped")
+            self._reads.append(func)
+            if (len(self._reads) > self._idle and
+                    (self._max_threads is None or
+                     self._threads < self._max_threads)):
+                self._start_thread()
+            self._cond.notify()
+
+    def stop(self):
+        """
+        Stop the idle threads. Threads blocked on storage exit when the read
+        completes.
+        """
+        with self._cond:
+            self._running = False
+            self._reads.clear()
+            self._cond.notify_all()
+
+    def _start_thread(self):
+        name = "check/reader/%d" % self._count
+        self._count += 1
+        t = concurrent.thread(self._run, name=name, log=_log)
+        t.start()
+        self._threads += 1
+
+    def _run(self):
+        try:
+            while True:
+                func = self._next_read()
+                if func is None:
+                    return
+                try:
+                    func()
+                except Exception:
+                    _log.exception("Unhandled error in %s", func)
+        finally:
+            with self._cond:
+                self._threads -= 1
+
+    def _next_read(self):
+        """
+        Return the next read, or None if the thread should exit.
+        """
+        with self._cond:
+            deadline = monotonic_time() + self._idle_timeout
+            while self._running and not self._reads:
+                timeout = deadline - monotonic_time()
+                if timeout <= 0:
+                    return None
+                self._idle += 1
+                try:
+                    self._cond.wait(timeout)
+                finally:
+                    self._idle -= 1
+            if not self._running:
+                return None
+            return self._reads.popleft()
+
+
+class ReadResult(object):
+
+    def __init__(self, path, error, time, elapsed, read_delay):
+        self.path = path
+        self.error = error
+        self.time = time
+        self.elapsed = elapsed
+        self.read_delay = read_delay
+
+    def delay(self):
+        if self.error is not None:
+            raise exception.MiscFileReadException(self.path, self.error)
+        return self.read_delay
+
+    def __repr__(self):
+        return "<%s path=%s error=%s time=%.2f elapsed=%.2f at 0x%x>" % (
+            self.__class__.__name__, self.path, self.error, self.time,
+            self.elapsed, id(self))
+
+
 class CheckResult(object):
 
     _PATTERN = re.compile(br".*, ([\de\-.]+) s,[^,]+")
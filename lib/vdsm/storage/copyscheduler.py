@@ -0,0 +1,265 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+copyscheduler - admission control for qemu-img copies
+=====================================================
+
+Copying disks with qemu-img convert can saturate a storage domain. Many
+concurrent copies to the same domain starve VM I/O and the domain monitor
+checks.
+
+Before running qemu-img convert, copy code requests a slot on both the
+source and the destination domain:
+
+    request = copyscheduler.request(src_sd_id, dst_sd_id, size)
+    with request:
+        operation = qemuimg.convert(..., rate_limit=request.rate_limit)
+        operation.run()
+
+Entering the request blocks until the copy is admitted; request.cancel()
+aborts the wait from another thread.
+
+At most max_per_domain copies run on a domain at a time. Waiting copies are
+admitted in priority order: smaller copies first, so short copies are not
+stuck behind copies of large disks. A copy gains priority while waiting
+(aging_rate bytes per second of waiting), so large copies are not starved
+by a stream of small copies. Domains needed by a waiting copy are reserved
+for it; copies with lower priority cannot take them.
+
+If domain_rate_limit is set, every admitted copy is limited to
+domain_rate_limit / max_per_domain bytes per second, so the copies running on
+a domain never use more than domain_rate_limit bytes per second. The share is
+static; a copy running alone on a domain cannot use the rest of the
+bandwidth. The rate limit requires max_per_domain, and a qemu-img version
+supporting the convert -r option.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import threading
+
+from vdsm.common import exception
+from vdsm.common.time import monotonic_time
+from vdsm.config import config
+
+# Request states.
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+CANCELED = "canceled"
+
+log = logging.getLogger("storage.copyscheduler")
+
+
+class Scheduler(object):
+    """
+    Admit copies between storage domains.
+
+    Arguments:
+        max_per_domain (int): maximum number of copies running on a domain.
+            Use 0 to admit all copies.
+        domain_rate_limit (int): maximum bandwidth in bytes per second used
+            by the copies running on a domain. Use 0 for no limit. Ignored
+            if max_per_domain is 0.
+        aging_rate (int): priority gained by a waiting copy, in bytes per
+            second of waiting.
+        clock (callable): return the current time in seconds.
+    """
+
+    def __init__(self, max_per_domain, domain_rate_limit=0, aging_rate=0,
+                 clock=monotonic_time):
+        if domain_rate_limit and not max_per_domain:
+            log.warning("Ignoring domain rate limit %d, the number of copies "
+                        "per domain is not limited", domain_rate_limit)
+            domain_rate_limit = 0
+        self._max_per_domain = max_per_domain
+        self._domain_rate_limit = domain_rate_limit
+        self._aging_rate = aging_rate
+        self._clock = clock
+        self._cond = threading.Condition(threading.Lock())
+        self._queue = []
+        # domain -> number of running copies
+        self._running = {}
+        self._stats = {
+            "admitted": 0,
+            "queued": 0,
+            "canceled": 0,
+        }
+
+    def request(self, src_sd_id, dst_sd_id, size):
+        """
+        Return a Request for copying size bytes from domain src_sd_id to
+        domain dst_sd_id.
+        """
+        return Request(self, src_sd_id, dst_sd_id, size)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["waiting"] = len(self._queue)
+            stats["running"] = dict(self._running)
+            return stats
+
+    def _wait(self, req):
+        with self._cond:
+            if req.state == CANCELED:
+                raise exception.ActionStopped
+            if req.state != QUEUED:
+                raise RuntimeError("Invalid state: %s" % req)
+            req.queued = self._clock()
+            self._queue.append(req)
+            self._schedule()
+            if req.state == QUEUED:
+                log.info("Queuing %s (running=%s)", req, self._running)
+                self._stats["queued"] += 1
+            while req.state == QUEUED:
+                self._cond.wait()
+            if req.state == CANCELED:
+                raise exception.ActionStopped
+
+    def _cancel(self, req):
+        with self._cond:
+            if req.state != QUEUED:
+                return
+            log.info("Canceling %s", req)
+            req.state = CANCELED
+            self._stats["canceled"] += 1
+            if req in self._queue:
+                self._queue.remove(req)
+                # Domains reserved for this request may be used now.
+                self._schedule()
+            self._cond.notify_all()
+
+    def _release(self, req):
+        with self._cond:
+            if req.state != RUNNING:
+                return
+            req.state = DONE
+            for sd_id in req.domains:
+                self._running[sd_id] -= 1
+                if self._running[sd_id] == 0:
+                    del self._running[sd_id]
+            self._schedule()
+
+    def _schedule(self):
+        """
+        Admit waiting requests in priority order. Must be called when
+        holding the lock.
+        """
+        now = self._clock()
+        self._queue.sort(key=lambda req: self._priority(req, now))
+        reserved = set()
+        admitted = []
+
+        for req in self._queue:
+            if req.domains & reserved:
+                continue
+            if all(self._available(sd_id) for sd_id in req.domains):
+                admitted.append(req)
+                self._admit(req)
+            else:
+                reserved.update(req.domains)
+
+        if admitted:
+            for req in admitted:
+                self._queue.remove(req)
+            self._cond.notify_all()
+
+    def _priority(self, req, now):
+        # Lower value is admitted first.
+        return req.size - (now - req.queued) * self._aging_rate
+
+    def _available(self, sd_id):
+        if self._max_per_domain == 0:
+            return True
+        return self._running.get(sd_id, 0) < self._max_per_domain
+
+    def _admit(self, req):
+        for sd_id in req.domains:
+            self._running[sd_id] = self._running.get(sd_id, 0) + 1
+        if self._domain_rate_limit:
+            # Every domain is shared by up to max_per_domain copies.
+            req.rate_limit = self._domain_rate_limit // self._max_per_domain
+        req.state = RUNNING
+        self._stats["admitted"] += 1
+        log.debug("Admitted %s", req)
+
+
+class Request(object):
+    """
+    A copy waiting for admission, or running.
+    """
+
+    def __init__(self, scheduler, src_sd_id, dst_sd_id, size):
+        self._scheduler = scheduler
+        self.src_sd_id = src_sd_id
+        self.dst_sd_id = dst_sd_id
+        self.domains = frozenset((src_sd_id, dst_sd_id))
+        self.size = size
+        # Maximum bandwidth of this copy in bytes per second, None if the
+        # copy is not limited. Set when the copy is admitted.
+        self.rate_limit = None
+        self.queued = None
+        self.state = QUEUED
+
+    @property
+    def waiting(self):
+        """
+        Return True if the copy is waiting for admission.
+        """
+        return self.state == QUEUED and self.queued is not None
+
+    def cancel(self):
+        """
+        Stop waiting for admission. Entering the request raises
+        exception.ActionStopped if the copy was not admitted.
+
+        May be called from any thread.
+        """
+        self._scheduler._cancel(self)
+
+    def __enter__(self):
+        self._scheduler._wait(self)
+        return self
+
+    def __exit__(self, t, v, tb):
+        self._scheduler._release(self)
+
+    def __repr__(self):
+        return ("<Request src={self.src_sd_id} dst={self.dst_sd_id} "
+                "size={self.size} state={self.state} "
+                "rate_limit={self.rate_limit} at {addr:#x}>").format(
+                    self=self, addr=id(self))
+
+
+_scheduler = Scheduler(
+    config.getint("irs", "copy_max_per_domain"),
+    domain_rate_limit=config.getint("irs", "copy_domain_rate_limit") * 1024**2,
+    aging_rate=config.getint("irs", "copy_priority_aging") * 1024**2)
+
+
+def request(src_sd_id, dst_sd_id, size):
+    return _scheduler.request(src_sd_id, dst_sd_id, size)
+
+
+def stats():
+    return _scheduler.stats()
@@ -22,6 +22,7 @@ from __future__ import absolute_import
 import ctypes
 import io
 import logging
+import mmap
 import os
 
 from contextlib import closing
@@ -35,6 +36,51 @@ CharPointer = ctypes.POINTER(ctypes.c_char)
 _PC_REC_XFER_ALIGN = 17
 _PC_REC_MIN_XFER_SIZE = 16
 
+_pread = libc.pread
+_pread.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t,
+                   ctypes.c_int64]
+_pread.restype = ctypes.c_ssize_t
+
+_pwrite = libc.pwrite
+_pwrite.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t,
+                    ctypes.c_int64]
+_pwrite.restype = ctypes.c_ssize_t
+
+
+class AlignedBuffer(object):
+    """
+    Buffer for direct I/O, allocated once and reused for many reads and
+    writes.
+
+    The buffer is backed by anonymous mmap, so it is page aligned and
+    initialized with zeros. Slicing the buffer returns bytes.
+    """
+
+    def __init__(self, size):
+        self._mmap = mmap.mmap(-1, size)
+        self._address = ctypes.addressof(ctypes.c_char.from_buffer(self._mmap))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._mmap)
+
+    def __getitem__(self, key):
+        return self._mmap[key]
+
+    def __setitem__(self, key, value):
+        self._mmap[key] = value
+
+    def address(self, offset=0):
+        return self._address + offset
+
+    def close(self):
+        self._mmap.close()
+
 
 class DirectFile(object):
 
@@ -163,6 +209,48 @@ class DirectFile(object):
     def seek(self, offset, whence=os.SEEK_SET):
         return os.lseek(self._fd, offset, whence)
 
+    def pread(self, buf, offset, start=0, size=None):
+        """
+        Read size bytes at file offset into AlignedBuffer buf at start,
+        without changing the file position. If size is not specified, fill
+        the buffer from start to the end.
+
+        Returns the number of bytes read, which may be less than size at end
+        of file.
+        """
+        if size is None:
+            size = len(buf) - start
+        self._check_range(buf, offset, start, size)
+        numRead = _pread(self._fd, buf.address(start), size, offset)
+        if numRead < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return numRead
+
+    def pwrite(self, buf, offset, start=0, size=None):
+        """
+        Write size bytes from AlignedBuffer buf at start to file offset,
+        without changing the file position. If size is not specified, write
+        the buffer from start to the end.
+
+        Returns the number of bytes written.
+        """
+        if size is None:
+            size = len(buf) - start
+        self._check_range(buf, offset, start, size)
+        numWritten = _pwrite(self._fd, buf.address(start), size, offset)
+        if numWritten < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return numWritten
+
+    def _check_range(self, buf, offset, start, size):
+        if offset % 512 or start % 512 or size % 512:
+            raise ValueError("You can only access in 512 multiplies")
+        if start + size > len(buf):
+            raise ValueError("Range start=%d size=%d exceeds buffer size %d"
+                             % (start, size, len(buf)))
+
     def close(self):
         if self.closed:
             return
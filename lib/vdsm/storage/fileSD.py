@@ -19,7 +19,6 @@
 #
 from __future__ import absolute_import
 
-import collections
 import os
 import errno
 import logging
@@ -31,6 +30,7 @@ from contextlib import contextmanager
 
 from vdsm import utils
 from vdsm.common import supervdsm
+from vdsm.common.config import config
 from vdsm.common.compat import glob_escape
 from vdsm.storage import clusterlock
 from vdsm.storage import constants as sc
@@ -41,6 +41,7 @@ from vdsm.storage import misc
 from vdsm.storage import mount
 from vdsm.storage import outOfProcess as oop
 from vdsm.storage import sd
+from vdsm.storage import volumeindex
 from vdsm.storage import xlease
 from vdsm.storage.persistent import PersistentDict, DictValidator
 from vdsm.storage.sdm import volume_artifacts
@@ -71,6 +72,8 @@ ST_BYTES_PER_BLOCK = 512
 
 _MOUNTLIST_IGNORE = ('/' + sd.BLOCKSD_DIR, '/' + sd.GLUSTERSD_DIR)
 
+VOLUME_INDEX_MAX_AGE = config.getint("irs", "file_volume_index_max_age")
+
 getProcPool = oop.getGlobalProcPool
 
 
@@ -157,10 +160,16 @@ class FileMetadataRW(object):
 
 
 FileSDMetadata = lambda metafile: DictValidator(
-    PersistentDict(FileMetadataRW(metafile)), FILE_SD_MD_FIELDS)
+    PersistentDict(FileMetadataRW(metafile), readMostly=True),
+    FILE_SD_MD_FIELDS)
 
 
 class FileStorageDomainManifest(sd.StorageDomainManifest):
+
+    # Whether changes in the images directory can be detected using inotify.
+    # Changes done by other hosts on shared file systems are not reported.
+    volumeIndexInotify = False
+
     def __init__(self, domainPath, metadata=None):
         # Using glob might look like the simplest thing to do but it isn't
         # If one of the mounts is stuck it'll cause the entire glob to fail
@@ -212,6 +221,28 @@ class FileStorageDomainManifest(sd.StorageDomainManifest):
     def getImagePath(self, imgUUID):
         return os.path.join(self.domaindir, sd.DOMAIN_IMAGES, imgUUID)
 
+    @property
+    def _volumeIndex(self):
+        imagesDir = os.path.join(self.mountpoint, self.sdUUID,
+                                 sd.DOMAIN_IMAGES)
+        return volumeindex.file_volume_index(
+            self.sdUUID, imagesDir, VOLUME_INDEX_MAX_AGE,
+            inotify=self.volumeIndexInotify)
+
+    def getVolumeIndexStats(self):
+        """
+        Return the volume index counters, see FileVolumeIndex.stats().
+        """
+        return self._volumeIndex.stats()
+
+    def refreshImageVolumes(self, imgUUID):
+        # Volumes added by other hosts to existing images do not change the
+        # images directory, so the index cannot detect them.
+        self._volumeIndex.image_changed(imgUUID)
+
+    def refreshVolumes(self):
+        self._volumeIndex.invalidate()
+
     def getVolumeClass(self):
         """
         Return a type specific volume generator object
@@ -236,12 +267,16 @@ class FileStorageDomainManifest(sd.StorageDomainManifest):
         except OSError as e:
             self.log.error("image: %s can't be moved", currImgDir)
             raise se.ImageDeleteError("%s %s" % (imgUUID, str(e)))
+        finally:
+            volumeindex.image_changed(self.sdUUID, imgUUID)
+            volumeindex.image_changed(self.sdUUID, os.path.basename(toDelDir))
 
     def purgeImage(self, sdUUID, imgUUID, volsImgs, discard):
         self.log.debug("Purging image %s", imgUUID)
         if discard:
             raise se.DiscardIsNotSupported(sdUUID, "file storage domain")
         toDelDir = self.getDeletedImagePath(imgUUID)
+        volumeindex.image_changed(self.sdUUID, os.path.basename(toDelDir))
         for volUUID in volsImgs:
             volPath = os.path.join(toDelDir, volUUID)
             self._deleteVolumeFile(volPath)
@@ -287,17 +322,8 @@ class FileStorageDomainManifest(sd.StorageDomainManifest):
         Template volumes have no parent, and thus we report BLANK_UUID as their
         parentUUID.
         """
-        volMetaPattern = os.path.join(self.mountpoint, self.sdUUID,
-                                      sd.DOMAIN_IMAGES, "*", "*.meta")
-        volMetaPaths = self.oop.glob.glob(volMetaPattern)
-
-        # First create mapping from images to volumes
-        images = collections.defaultdict(list)
-        for metaPath in volMetaPaths:
-            head, tail = os.path.split(metaPath)
-            volUUID, volExt = os.path.splitext(tail)
-            imgUUID = os.path.basename(head)
-            images[imgUUID].append(volUUID)
+        # First get mapping from images to volumes
+        images = self._volumeIndex.images(self.oop)
 
         # Using images to volumes mapping, we can create volumes to images
         # mapping, detecting template volumes and template images, based on
@@ -337,15 +363,8 @@ class FileStorageDomainManifest(sd.StorageDomainManifest):
         """
         Fetch the set of the Image UUIDs in the SD.
         """
-        # Get Volumes of an image
-        pattern = os.path.join(self.mountpoint, self.sdUUID, sd.DOMAIN_IMAGES,
-                               UUID_GLOB_PATTERN)
-        files = self.oop.glob.glob(pattern)
-        images = set()
-        for i in files:
-            if self.oop.os.path.isdir(i):
-                images.add(os.path.basename(i))
-        return images
+        return set(imgUUID for imgUUID in self._volumeIndex.images(self.oop)
+                   if fnmatch.fnmatch(imgUUID, UUID_GLOB_PATTERN))
 
     def getVolumeLease(self, imgUUID, volUUID):
         """
@@ -401,6 +420,9 @@ class FileStorageDomain(sd.StorageDomain):
         """
         return True
 
+    def getVolumeIndexStats(self):
+        return self._manifest.getVolumeIndexStats()
+
     def setMetadataPermissions(self):
         procPool = oop.getProcessPool(self.sdUUID)
         for metaFile in (sd.LEASES, sd.IDS, sd.INBOX, sd.OUTBOX):
@@ -730,7 +752,11 @@ class FileStorageDomain(sd.StorageDomain):
         self.log.debug("Removing remnants of deleted images %s" %
                        removedImages)
         for imageDir in removedImages:
-            self.oop.fileUtils.cleanupdir(imageDir)
+            try:
+                self.oop.fileUtils.cleanupdir(imageDir)
+            finally:
+                volumeindex.image_changed(self.sdUUID,
+                                          os.path.basename(imageDir))
 
     def templateRelink(self, imgUUID, volUUID):
         """
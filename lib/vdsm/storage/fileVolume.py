@@ -34,6 +34,7 @@ from vdsm.storage import outOfProcess as oop
 from vdsm.storage import qemuimg
 from vdsm.storage import task
 from vdsm.storage import volume
+from vdsm.storage import volumeindex
 from vdsm.storage.compat import sanlock
 from vdsm.storage.misc import deprecated
 from vdsm.storage.sdc import sdCache
@@ -54,6 +55,15 @@ def getDomUuidFromVolumePath(volPath):
     return sdUUID
 
 
+def imageChanged(volPath):
+    """
+    Report to the domain volume index that volumes were added or removed in
+    the image containing volPath.
+    """
+    imgUUID = os.path.basename(os.path.dirname(os.path.normpath(volPath)))
+    volumeindex.image_changed(getDomUuidFromVolumePath(volPath), imgUUID)
+
+
 class FileVolumeManifest(volume.VolumeManifest):
 
     # Raw volumes should be aligned to sector size, which is 512 or 4096
@@ -250,6 +260,7 @@ class FileVolumeManifest(volume.VolumeManifest):
 
         sdUUID = getDomUuidFromVolumePath(volPath)
         oop.getProcessPool(sdUUID).os.rename(metaPath + ".new", metaPath)
+        imageChanged(volPath)
 
     def setImage(self, imgUUID):
         """
@@ -265,6 +276,7 @@ class FileVolumeManifest(volume.VolumeManifest):
         if self.oop.os.path.lexists(metaPath):
             self.log.debug("Removing: %s", metaPath)
             self.oop.os.unlink(metaPath)
+            imageChanged(metaPath)
 
     @classmethod
     def leaseVolumePath(cls, vol_path):
@@ -313,6 +325,7 @@ class FileVolumeManifest(volume.VolumeManifest):
         self.log.debug("Share volume metadata of %s to %s", self.volUUID,
                        dstImgPath)
         self.oop.utils.forceLink(self._getMetaVolumePath(), dstMetaPath)
+        imageChanged(dstVolPath)
 
         # Link the lease file if the domain uses sanlock
         if sdCache.produce(self.sdUUID).hasVolumeLeases():
@@ -412,6 +425,7 @@ class FileVolume(volume.Volume):
         sdUUID = getDomUuidFromVolumePath(volPath)
         if oop.getProcessPool(sdUUID).os.path.lexists(metaPath):
             oop.getProcessPool(sdUUID).os.unlink(metaPath)
+            imageChanged(volPath)
 
     @classmethod
     def _create(cls, dom, imgUUID, volUUID, size, volFormat, preallocate,
@@ -538,6 +552,7 @@ class FileVolume(volume.Volume):
         procPool.utils.rmFile(volPath)
         procPool.utils.rmFile(cls.manifestClass.metaVolumePath(volPath))
         procPool.utils.rmFile(cls.manifestClass.leaseVolumePath(volPath))
+        imageChanged(volPath)
 
     def setParentMeta(self, puuid):
         """
@@ -559,6 +574,7 @@ class FileVolume(volume.Volume):
             cls.log.info("oldPath=%s newPath=%s", oldPath, newPath)
             sdUUID = getDomUuidFromVolumePath(oldPath)
             oop.getProcessPool(sdUUID).os.rename(oldPath, newPath)
+            imageChanged(newPath)
         except Exception:
             cls.log.error("Could not rollback "
                           "volume rename (oldPath=%s newPath=%s)",
@@ -593,6 +609,7 @@ class FileVolume(volume.Volume):
                                                  [metaPath, prevMetaPath]))
         self.log.debug("Renaming %s to %s", prevMetaPath, metaPath)
         self.oop.os.rename(prevMetaPath, metaPath)
+        imageChanged(volPath)
         if recovery:
             name = "Rename lease-volume rollback: " + leasePath
             vars.task.pushRecovery(task.Recovery(name, "fileVolume",
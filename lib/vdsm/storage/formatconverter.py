@@ -210,6 +210,7 @@ def v3DomainConverter(repoPath, hostId, domain, isMsd):
                       "host id: %s", domain.sdUUID, hostId)
             newClusterLock.acquire(hostId, domain.getClusterLease())
 
+        domain.refreshVolumes()
         allVolumes = domain.getAllVolumes()
         allImages = {}  # {images: parent_image}
 
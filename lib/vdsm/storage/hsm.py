@@ -1492,11 +1492,10 @@ class HSM(object):
         # hence, we need a unique identifier.
         vars.task.getExclusiveLock(STORAGE, "%s_%s" % (imgUUID, sdUUID))
         vars.task.getSharedLock(STORAGE, sdUUID)
-        allVols = dom.getAllVolumes()
-        volsByImg = sd.getVolsOfImage(allVols, imgUUID)
+        volsByImg = dom.getVolsOfImage(imgUUID)
         if not volsByImg:
-            self.log.error("Empty or not found image %s in SD %s. %s",
-                           imgUUID, sdUUID, allVols)
+            self.log.error("Empty or not found image %s in SD %s",
+                           imgUUID, sdUUID)
             raise se.ImageDoesNotExistInSD(imgUUID, sdUUID)
 
         # on data domains, images should not be deleted if they are templates
@@ -1570,18 +1569,15 @@ class HSM(object):
         Moving a template from a data domain is only allowed if there are no
         images based on it in the source data domain.
         """
-        srcAllVols = srcDom.getAllVolumes()
-        dstAllVols = dstDom.getAllVolumes()
-
-        # Filter volumes related to this image
-        srcVolsImgs = sd.getVolsOfImage(srcAllVols, imgUUID)
+        srcVolsImgs = srcDom.getVolsOfImage(imgUUID)
         # Find the template
         for volName, imgsPar in srcVolsImgs.iteritems():
             if len(imgsPar.imgs) > 1:
                 # This is the template. Should be only one.
                 tName, tImgs = volName, imgsPar.imgs
                 # Template self image is the 1st entry
-                if imgUUID != tImgs[0] and tName not in dstAllVols.keys():
+                if (imgUUID != tImgs[0] and
+                        tName not in dstDom.getVolsOfImage(tImgs[0])):
                     self.log.error(
                         "img %s can't be moved to dom %s because template "
                         "%s is absent on it", imgUUID, dstDom.sdUUID, tName)
@@ -3163,9 +3159,7 @@ class HSM(object):
 
         imgVolumesInfo = []
         dom = sdCache.produce(sdUUID)
-        allVols = dom.getAllVolumes()
-        # Filter volumes related to this image
-        imgVolumes = sd.getVolsOfImage(allVols, imgUUID).keys()
+        imgVolumes = dom.getVolsOfImage(imgUUID).keys()
 
         if leafUUID not in imgVolumes:
             raise se.VolumeDoesNotExist(leafUUID)
@@ -3241,11 +3235,10 @@ class HSM(object):
         """
         vars.task.getSharedLock(STORAGE, sdUUID)
         dom = sdCache.produce(sdUUID=sdUUID)
-        vols = dom.getAllVolumes()
         if imgUUID == sc.BLANK_UUID:
-            volUUIDs = vols.keys()
+            volUUIDs = dom.getAllVolumes().keys()
         else:
-            volUUIDs = [k for k, v in vols.iteritems() if imgUUID in v.imgs]
+            volUUIDs = dom.getVolsOfImage(imgUUID).keys()
         return dict(uuidlist=volUUIDs)
 
     @public
@@ -33,6 +33,7 @@ from vdsm.common import cmdutils
 from vdsm.common import logutils
 from vdsm.common.threadlocal import vars
 from vdsm.storage import constants as sc
+from vdsm.storage import copyscheduler
 from vdsm.storage import exception as se
 from vdsm.storage import imageSharing
 from vdsm.storage import misc
@@ -82,10 +83,9 @@ def _deleteImage(dom, imgUUID, postZero, discard):
 
     Replaces Image.delete() in Image.[copyCollapsed(), move(), multimove()].
     """
-    allVols = dom.getAllVolumes()
-    imgVols = sd.getVolsOfImage(allVols, imgUUID)
+    imgVols = dom.getVolsOfImage(imgUUID)
     if not imgVols:
-        log.warning("No volumes found for image %s. %s", imgUUID, allVols)
+        log.warning("No volumes found for image %s", imgUUID)
         return
     elif postZero:
         dom.zeroImage(dom.sdUUID, imgUUID, imgVols, discard)
@@ -113,6 +113,19 @@ class Image:
             operation.run()
         self.log.debug('qemu-img operation has completed')
 
+    def _run_qemuimg_convert(self, src_sd_id, dst_sd_id, size, src, dst,
+                             **kwargs):
+        """
+        Convert src to dst when the copy scheduler admits copying size bytes
+        from domain src_sd_id to domain dst_sd_id.
+        """
+        request = copyscheduler.request(src_sd_id, dst_sd_id, size)
+        with vars.task.abort_callback(request.cancel), request:
+            operation = qemuimg.convert(src, dst,
+                                        rate_limit=request.rate_limit,
+                                        **kwargs)
+            self._run_qemuimg_operation(operation)
+
     def deletedVolumeName(self, uuid):
         """
         Create REMOVED_IMAGE_PREFIX + <random> + uuid string.
@@ -179,8 +192,14 @@ class Image:
         Return the chain of volumes of image as a sorted list
         (not including a shared base (template) if any)
         """
+        dom = sdCache.produce(sdUUID)
+        # Serve the metadata reads of the walk from a single bulk read.
+        with dom.manifest.volume_metadata_snapshot():
+            return self._getChain(dom, sdUUID, imgUUID, volUUID)
+
+    def _getChain(self, dom, sdUUID, imgUUID, volUUID):
         chain = []
-        volclass = sdCache.produce(sdUUID).getVolumeClass()
+        volclass = dom.getVolumeClass()
 
         # Use volUUID when provided
         if volUUID:
@@ -465,17 +484,19 @@ class Image:
                         backing = None
                         backingFormat = None
 
-                    operation = qemuimg.convert(
-                        srcVol.getVolumePath(),
-                        dstVol.getVolumePath(),
-                        srcFormat=srcFormat,
-                        dstFormat=dstFormat,
-                        dstQcow2Compat=destDom.qcow2_compat(),
-                        backing=backing,
-                        backingFormat=backingFormat)
                     with utils.stopwatch("Copy volume %s"
                                          % srcVol.volUUID):
-                        self._run_qemuimg_operation(operation)
+                        self._run_qemuimg_convert(
+                            srcSdUUID,
+                            destDom.sdUUID,
+                            srcVol.getVolumeTrueSize(bs=1),
+                            srcVol.getVolumePath(),
+                            dstVol.getVolumePath(),
+                            srcFormat=srcFormat,
+                            dstFormat=dstFormat,
+                            dstQcow2Compat=destDom.qcow2_compat(),
+                            backing=backing,
+                            backingFormat=backingFormat)
                 except ActionStopped:
                     raise
                 except se.StorageException:
@@ -799,15 +820,17 @@ class Image:
                 dstVol.prepare(rw=True, setrw=True)
 
                 try:
-                    operation = qemuimg.convert(
-                        volParams['path'],
-                        dstPath,
-                        srcFormat=sc.fmt2str(volParams['volFormat']),
-                        dstFormat=sc.fmt2str(dstVolFormat),
-                        dstQcow2Compat=destDom.qcow2_compat())
                     with utils.stopwatch("Copy volume %s"
                                          % srcVol.volUUID):
-                        self._run_qemuimg_operation(operation)
+                        self._run_qemuimg_convert(
+                            sdUUID,
+                            dstSdUUID,
+                            int(volParams['truesize']) * sc.BLOCK_SIZE,
+                            volParams['path'],
+                            dstPath,
+                            srcFormat=sc.fmt2str(volParams['volFormat']),
+                            dstFormat=sc.fmt2str(dstVolFormat),
+                            dstQcow2Compat=destDom.qcow2_compat())
                 except ActionStopped:
                     raise
                 except cmdutils.Error as e:
@@ -1088,15 +1111,17 @@ class Image:
                 # Step 2: Convert successor to new volume
                 #   qemu-img convert -f qcow2 successor -O raw newUUID
                 try:
-                    operation = qemuimg.convert(
-                        srcVolParams['path'],
-                        newVol.getVolumePath(),
-                        srcFormat=sc.fmt2str(srcVolParams['volFormat']),
-                        dstFormat=sc.fmt2str(volParams['volFormat']),
-                        dstQcow2Compat=sdDom.qcow2_compat())
                     with utils.stopwatch("Copy volume %s"
                                          % srcVol.volUUID):
-                        self._run_qemuimg_operation(operation)
+                        self._run_qemuimg_convert(
+                            sdDom.sdUUID,
+                            sdDom.sdUUID,
+                            int(srcVolParams['truesize']) * sc.BLOCK_SIZE,
+                            srcVolParams['path'],
+                            newVol.getVolumePath(),
+                            srcFormat=sc.fmt2str(srcVolParams['volFormat']),
+                            dstFormat=sc.fmt2str(volParams['volFormat']),
+                            dstQcow2Compat=sdDom.qcow2_compat())
                 except cmdutils.Error:
                     self.log.exception('conversion failure for volume %s',
                                        srcVol.volUUID)
@@ -1193,8 +1218,7 @@ class Image:
         """
         # Prepare volumes
         dom = sdCache.produce(sdUUID)
-        allVols = dom.getAllVolumes()
-        imgVolumes = sd.getVolsOfImage(allVols, imgUUID).keys()
+        imgVolumes = dom.getVolsOfImage(imgUUID).keys()
         dom.activateVolumes(imgUUID, imgVolumes)
 
         # Walk the volume chain using qemu-img.  Not safe for running VMs
@@ -1239,8 +1263,7 @@ class Image:
                       sdUUID, vmUUID, imgUUID, ancestor, successor,
                       str(postZero), discard)
         sdDom = sdCache.produce(sdUUID)
-        allVols = sdDom.getAllVolumes()
-        volsImgs = sd.getVolsOfImage(allVols, imgUUID)
+        volsImgs = sdDom.getVolsOfImage(imgUUID)
         # Since image namespace should be locked is produce all the volumes is
         # safe. Producing the (eventual) template is safe also.
         # TODO: Split for block and file based volumes for efficiency sake.
@@ -39,6 +39,9 @@ class LocalFsStorageDomainManifest(fileSD.FileStorageDomainManifest):
         4: clusterlock.LocalLock,
     }
 
+    # Local file system, only this host can change the images.
+    volumeIndexInotify = True
+
     # External leases support
 
     @classmethod
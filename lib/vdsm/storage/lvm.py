@@ -36,12 +36,16 @@ import logging
 from collections import namedtuple
 import pprint as pp
 import threading
+import time
+import weakref
+from collections import defaultdict
 from itertools import chain
 from subprocess import list2cmdline
 
 from vdsm import constants
 from vdsm.storage import devicemapper
 from vdsm.storage import exception as se
+from vdsm.storage import lvmshell
 from vdsm.storage import misc
 from vdsm.storage import multipath
 from vdsm.storage.constants import VG_EXTENT_SIZE_MB, SUPPORTED_BLOCKSIZE
@@ -243,7 +247,11 @@ class LVMCache(object):
             if not self._filterStale:
                 return self._extraCfg
 
-            self._extraCfg = _buildConfig(multipath.getMPDevNamesIter())
+            extraCfg = _buildConfig(multipath.getMPDevNamesIter())
+            if self._shell is not None and extraCfg != self._extraCfg:
+                # Shells may keep state using the previous filter.
+                self._shell.restart()
+            self._extraCfg = extraCfg
             _updateLvmConf(self._extraCfg)
             self._filterStale = False
 
@@ -270,7 +278,10 @@ class LVMCache(object):
         self.invalidateFilter()
         self.flush()
 
-    def __init__(self):
+    def __init__(self, shell=None):
+        # lvmshell.Pool running the commands, or None to run every command
+        # in a new lvm process.
+        self._shell = shell
         self._filterStale = True
         self._extraCfg = None
         self._filterLock = threading.Lock()
@@ -281,10 +292,25 @@ class LVMCache(object):
         self._pvs = {}
         self._vgs = {}
         self._lvs = {}
+        # Names of VGs whose LVs were loaded by a full reload, and were not
+        # invalidated since. In these VGs only stale LVs need a reload.
+        self._freshlvs = set()
+        # Concurrent reloads of LVs in the same VG are combined using a
+        # barrier per VG, see _refreshlvs.
+        self._lvsBarriers = {}
+        # Objects interested in LV changes, see addLVListener.
+        self._lvListeners = defaultdict(weakref.WeakSet)
+        self._stats = {
+            "lv_hits": 0,
+            "lv_misses": 0,
+            "lv_reloads": 0,
+            "lv_reload_time": 0.0,
+            "lv_reload_max_time": 0.0,
+        }
 
     def cmd(self, cmd, devices=tuple()):
         finalCmd = self._addExtraCfg(cmd, devices)
-        rc, out, err = misc.execCmd(finalCmd, sudo=True)
+        rc, out, err = self._run(finalCmd)
         if rc != 0:
             # Filter might be stale
             self.invalidateFilter()
@@ -294,10 +320,65 @@ class LVMCache(object):
             # the devlist is sorted there is no fear
             # of two identical filters looking differently
             if newCmd != finalCmd:
-                return misc.execCmd(newCmd, sudo=True)
+                return self._run(newCmd)
 
         return rc, out, err
 
+    def _run(self, cmd):
+        if self._shell is not None:
+            try:
+                return self._shell.run(cmd[1:])
+            except lvmshell.Error as e:
+                log.debug("Cannot run %s in lvm shell, starting lvm: %s",
+                          cmd[1], e)
+        return misc.execCmd(cmd, sudo=True)
+
+    def stats(self):
+        """
+        Return a copy of the cache counters:
+
+        lv_hits: getLv calls served from the cache
+        lv_misses: getLv calls requiring a reload
+        lv_reloads: number of lvs commands run
+        lv_reload_time: total time spent in lvs commands, in seconds
+        lv_reload_max_time: longest lvs command time, in seconds
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def addLvListener(self, vgName, listener):
+        with self._lock:
+            self._lvListeners[vgName].add(listener)
+
+    def _notifylvs(self, vgName, lvNames=None, removed=False):
+        """
+        Notify the listeners of vgName that lvNames were invalidated, changed
+        or removed. If vgName is None, notify all listeners. If lvNames is
+        None, all the LVs in the VG were invalidated.
+
+        Must be called without holding self._lock, since listeners may use
+        the cache.
+        """
+        with self._lock:
+            if vgName is None:
+                listeners = [listener
+                             for listeners in self._lvListeners.values()
+                             for listener in listeners]
+            else:
+                listeners = list(self._lvListeners.get(vgName, ()))
+        for listener in listeners:
+            try:
+                if removed:
+                    listener.lvsRemoved(vgName, lvNames)
+                else:
+                    listener.lvsChanged(vgName, lvNames)
+            except Exception:
+                log.exception("Error notifying %s", listener)
+
     def __str__(self):
         return ("PVS:\n%s\n\nVGS:\n%s\n\nLVS:\n%s" %
                 (pp.pformat(self._pvs),
@@ -422,9 +503,27 @@ class LVMCache(object):
         else:
             cmd.append(vgName)
 
+        start = time.time()
         rc, out, err = self.cmd(cmd, self._getVGDevs((vgName,)))
+        elapsed = time.time() - start
+
+        # Parsing thousands of LVs is slow; do it before taking the lock to
+        # avoid blocking other threads using the cache.
+        updatedLVs = {}
+        if rc == 0:
+            for line in out:
+                fields = [field.strip() for field in line.split(SEPARATOR)]
+                lv = makeLV(*fields)
+                # For LV we are only interested in its first extent
+                if lv.seg_start_pe == "0":
+                    updatedLVs[(lv.vg_name, lv.name)] = lv
 
         with self._lock:
+            self._stats["lv_reloads"] += 1
+            self._stats["lv_reload_time"] += elapsed
+            self._stats["lv_reload_max_time"] = max(
+                self._stats["lv_reload_max_time"], elapsed)
+
             if rc != 0:
                 log.warning("lvm lvs failed: %s %s %s", str(rc), str(out),
                             str(err))
@@ -434,33 +533,99 @@ class LVMCache(object):
                         self._lvs[l] = Unreadable(self._lvs[l].name, True)
                 return dict(self._lvs)
 
-            updatedLVs = {}
-            for line in out:
-                fields = [field.strip() for field in line.split(SEPARATOR)]
-                lv = makeLV(*fields)
-                # For LV we are only interested in its first extent
-                if lv.seg_start_pe == "0":
-                    self._lvs[(lv.vg_name, lv.name)] = lv
-                    updatedLVs[(lv.vg_name, lv.name)] = lv
+            changedLVs = []
+            if not lvNames:
+                # LVs added or changed by other hosts are found only when
+                # reloading the entire VG. If the VG was never loaded,
+                # there is nothing to report.
+                loaded = any(v == vgName for v, _ in self._lvs)
+                if loaded:
+                    for key, lv in updatedLVs.items():
+                        old = self._lvs.get(key)
+                        if (old is None or isinstance(old, Stub) or
+                                old.tags != lv.tags):
+                            changedLVs.append(key[1])
+
+            self._lvs.update(updatedLVs)
 
             # Determine if there are stale LVs
             if lvNames:
-                staleLVs = (lvName for lvName in lvNames
-                            if (vgName, lvName) not in updatedLVs.iterkeys())
+                staleLVs = [lvName for lvName in lvNames
+                            if (vgName, lvName) not in updatedLVs]
             else:
                 # All the LVs in the VG
-                staleLVs = (lvName for v, lvName in self._lvs.keys()
+                staleLVs = [lvName for v, lvName in self._lvs
                             if (v == vgName) and
-                            ((vgName, lvName) not in updatedLVs.iterkeys()))
+                            ((vgName, lvName) not in updatedLVs)]
+                self._freshlvs.add(vgName)
 
             for lvName in staleLVs:
                 log.warning("Removing stale lv: %s/%s", vgName, lvName)
                 self._lvs.pop((vgName, lvName), None)
 
-            log.debug("lvs reloaded")
+            log.debug("lvs reloaded (vg=%s, lvs=%d, elapsed=%.2f)",
+                      vgName, len(updatedLVs), elapsed)
+
+        if changedLVs:
+            self._notifylvs(vgName, changedLVs)
+        if staleLVs and not lvNames:
+            self._notifylvs(vgName, staleLVs, removed=True)
 
         return updatedLVs
 
+    def _refreshlvs(self, vgName, lvNames=()):
+        """
+        Reload the stale LVs in vgName, and lvNames if they are not in the
+        cache.
+
+        If the LVs of the VG were never loaded or the entire VG was
+        invalidated, reload all the LVs in the VG. Otherwise reload only the
+        invalidated LVs.
+
+        Concurrent callers share a single lvs command: if another thread is
+        reloading the VG, wait until it finishes, and then let one of the
+        waiting threads reload the LVs invalidated meanwhile on behalf of
+        all of them.
+        """
+        with self._lock:
+            # Missing LVs may have been created by another host, mark them
+            # so the next reload will look them up.
+            for lvName in lvNames:
+                if (vgName, lvName) not in self._lvs:
+                    self._lvs[(vgName, lvName)] = Stub(lvName, True)
+            barrier = self._lvsBarriers.get(vgName)
+            if barrier is None:
+                barrier = self._lvsBarriers[vgName] = misc.DynamicBarrier()
+
+        if not barrier.enter():
+            # Another thread reloaded the VG after we invalidated the LVs.
+            return
+
+        try:
+            with self._lock:
+                fresh = vgName in self._freshlvs
+                staleLVs = [lvName for (v, lvName), lv in self._lvs.items()
+                            if v == vgName and isinstance(lv, Stub)]
+
+            if fresh:
+                if not staleLVs:
+                    return
+                self._reloadlvs(vgName, staleLVs)
+                with self._lock:
+                    failed = any(
+                        isinstance(self._lvs.get((vgName, lvName)), Stub)
+                        for lvName in staleLVs)
+                if not failed:
+                    return
+                # Some LVs could not be reloaded, typically since they were
+                # removed by another host.
+                log.debug("Reloading stale lvs failed, reloading all lvs "
+                          "in vg %s", vgName)
+
+            self._reloadlvs(vgName)
+        finally:
+            barrier.exit()
+
     def _reloadAllLvs(self):
         """
         Used only during bootstrap.
@@ -478,11 +643,14 @@ class LVMCache(object):
                     updatedLVs.add((lv.vg_name, lv.name))
 
             # Remove stales
-            for vgName, lvName in self._lvs.keys():
+            for vgName, lvName in list(self._lvs):
                 if (vgName, lvName) not in updatedLVs:
                     self._lvs.pop((vgName, lvName), None)
                     log.error("Removing stale lv: %s/%s", vgName, lvName)
             self._stalelv = False
+            with self._lock:
+                self._freshlvs.update(vgName for vgName, _ in updatedLVs)
+            self._notifylvs(None)
         return dict(self._lvs)
 
     def _invalidatepvs(self, pvNames):
@@ -517,15 +685,28 @@ class LVMCache(object):
                     self._lvs[(vgName, lvName)] = Stub(lvName, True)
             else:
                 # Invalidate all the LVs in a given VG
-                for lv in self._lvs.values():
+                for lv in list(self._lvs.values()):
                     if not isinstance(lv, Stub):
                         if lv.vg_name == vgName:
                             self._lvs[(vgName, lv.name)] = Stub(lv.name, True)
+                # LVs may have been added to the VG, so we must reload the
+                # entire VG.
+                self._freshlvs.discard(vgName)
+        self._notifylvs(vgName, lvNames or None)
+
+    def _removelvs(self, vgName, lvNames):
+        lvNames = _normalizeargs(lvNames)
+        with self._lock:
+            for lvName in lvNames:
+                self._lvs.pop((vgName, lvName), None)
+        self._notifylvs(vgName, lvNames, removed=True)
 
     def _invalidateAllLvs(self):
         with self._lock:
             self._stalelv = True
             self._lvs.clear()
+            self._freshlvs.clear()
+        self._notifylvs(None)
 
     def flush(self):
         self._invalidateAllPvs()
@@ -605,10 +786,6 @@ class LVMCache(object):
         return vgs.values()
 
     def getLv(self, vgName, lvName=None):
-        # Checking self._stalelv here is suboptimal, because
-        # unnecessary reloads
-        # are done.
-
         # Return vgName/lvName info
         # If both 'vgName' and 'lvName' are None then return everything
         # If only 'lvName' is None then return all the LVs in the given VG
@@ -618,29 +795,31 @@ class LVMCache(object):
             # vgName, lvName
             lv = self._lvs.get((vgName, lvName))
             if not lv or isinstance(lv, Stub):
-                # while we here reload all the LVs in the VG
-                lvs = self._reloadlvs(vgName)
-                lv = lvs.get((vgName, lvName))
+                self._count("lv_misses")
+                # While we are here reload the other stale LVs in the VG.
+                self._refreshlvs(vgName, (lvName,))
+                lv = self._lvs.get((vgName, lvName))
                 if not lv:
                     log.warning("lv: %s not found in lvs vg: %s response",
                                 lvName, vgName)
+            else:
+                self._count("lv_hits")
             res = lv
         else:
             # vgName, None
-            # If there any stale LVs reload the whole VG, since it would
-            # cost us around same efforts anyhow and these stale LVs can
-            # be in the vg.
-            # Will be better when the pvs dict will be part of the vg.
-            # Fix me: should not be more stubs
-            if self._stalelv or any(isinstance(lv, Stub)
-                                    for lv in self._lvs.values()):
-                lvs = self._reloadlvs(vgName)
+            with self._lock:
+                vglvs = [lv for (v, _), lv in self._lvs.items()
+                         if v == vgName]
+                fresh = vgName in self._freshlvs
+            if not fresh or any(isinstance(lv, Stub) for lv in vglvs):
+                self._count("lv_misses")
+                self._refreshlvs(vgName)
+                with self._lock:
+                    vglvs = [lv for (v, _), lv in self._lvs.items()
+                             if v == vgName]
             else:
-                lvs = dict(self._lvs)
-            # lvs = self._reloadlvs()
-            lvs = [lv for lv in lvs.values()
-                   if not isinstance(lv, Stub) and (lv.vg_name == vgName)]
-            res = lvs
+                self._count("lv_hits")
+            res = [lv for lv in vglvs if not isinstance(lv, Stub)]
         return res
 
     def getAllLvs(self):
@@ -652,7 +831,15 @@ class LVMCache(object):
             lvs = dict(self._lvs)
         return lvs.values()
 
-_lvminfo = LVMCache()
+
+def _create_shell():
+    workers = config.getint("irs", "lvm_shell_workers")
+    if workers == 0:
+        return None
+    return lvmshell.Pool([constants.EXT_LVM], workers)
+
+
+_lvminfo = LVMCache(_create_shell())
 
 
 def bootstrap(refreshlvs=()):
@@ -703,6 +890,26 @@ def invalidateCache():
     _lvminfo.invalidateCache()
 
 
+def cacheStats():
+    return _lvminfo.stats()
+
+
+def addLVListener(vgName, listener):
+    """
+    Register listener for changes in the LVs of vgName.
+
+    The cache calls listener.lvsChanged(vgName, lvNames) when LVs are
+    invalidated, or when reloading the VG finds LVs added or modified by
+    another host, and listener.lvsRemoved(vgName, lvNames) when LVs are
+    removed. lvNames is None if all the LVs in the VG were invalidated, and
+    vgName is None if the entire cache was invalidated.
+
+    The cache keeps a weak reference to listener; there is no need to
+    unregister it.
+    """
+    _lvminfo.addLvListener(vgName, listener)
+
+
 def _fqpvname(pv):
     if pv and not pv.startswith(PV_PREFIX):
         pv = os.path.join(PV_PREFIX, pv)
@@ -1198,11 +1405,10 @@ def removeLVs(vgName, lvNames):
         cmd.append("%s/%s" % (vgName, lvName))
     rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vgName, )))
     if rc == 0:
-        for lvName in lvNames:
-            # Remove the LV from the cache
-            _lvminfo._lvs.pop((vgName, lvName), None)
-            # If lvremove succeeded it affected VG as well
-            _lvminfo._invalidatevgs(vgName)
+        # Remove the LVs from the cache
+        _lvminfo._removelvs(vgName, lvNames)
+        # If lvremove succeeded it affected VG as well
+        _lvminfo._invalidatevgs(vgName)
     else:
         # Otherwise LV info needs to be refreshed
         _lvminfo._invalidatelvs(vgName, lvNames)
@@ -1317,7 +1523,8 @@ def renameLV(vg, oldlv, newlv):
     if rc != 0:
         raise se.LogicalVolumeRenameError("%s %s %s" % (vg, oldlv, newlv))
 
-    _lvminfo._lvs.pop((vg, oldlv), None)
+    _lvminfo._removelvs(vg, oldlv)
+    _lvminfo._invalidatelvs(vg, newlv)
     _lvminfo._reloadlvs(vg, newlv)
 
 
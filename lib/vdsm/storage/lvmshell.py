@@ -0,0 +1,392 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+lvmshell - run lvm commands in long lived lvm shell processes
+=============================================================
+
+Running an lvm command starts sudo and lvm, which loads the lvm libraries
+and configuration before doing any work. When running hundreds of commands
+back to back, e.g. when creating or deleting many snapshots, most of the
+time is spent starting processes.
+
+Pool keeps lvm processes running in shell mode ("lvm" without arguments),
+and runs commands by writing them to the shell stdin. Every command is run
+with "--reportformat json" and with the command log enabled, so the output
+of every command is a JSON document including the command status. The
+output is read from stdout until the next shell prompt.
+
+Reports (pvs, vgs, lvs) are converted back to the output of the same
+command run without a shell: one line per row, with the fields in the
+requested order, separated by "|".
+
+Running commands in a shell requires lvm2 2.02.158 or later. If a shell
+cannot be started, or fails before a command was run, the command must be
+run in a new lvm process; Pool.run() raises Error in this case.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import json
+import logging
+import os
+import select
+import threading
+from collections import OrderedDict
+
+from vdsm.common import cmdutils
+from vdsm.common.compat import subprocess
+from vdsm.common.osutils import uninterruptible_poll
+from vdsm.common.time import monotonic_time
+
+PROMPT = b"lvm> "
+
+# Commands that do not modify anything, and can be run again in a new lvm
+# process if the shell failed while running them.
+REPORT_COMMANDS = frozenset(["pvs", "vgs", "lvs"])
+
+# Enable the command log, reporting the command status in the output.
+LOG_CONFIG = "log { report_command_log=1 command_log_selection='all' }"
+
+# Seconds to wait before starting a shell after a shell failed to start.
+START_RETRY_INTERVAL = 60
+
+# lvm return code for successful command (ECMD_PROCESSED).
+_ECMD_PROCESSED = 1
+
+log = logging.getLogger("storage.lvmshell")
+
+
+class Error(Exception):
+    """
+    The command was not run in a shell, or the shell failed while running
+    a command that can be run again.
+    """
+
+    # True if the command was written to the shell.
+    sent = False
+
+
+class Pool(object):
+    """
+    Pool of up to max_shells lvm shells. Shells are started on demand, and
+    kept running until the pool is restarted or closed.
+
+    Arguments:
+        command (list): command starting lvm in shell mode.
+        max_shells (int): maximum number of shells running commands
+            concurrently.
+        sudo (bool): run the shells using sudo.
+    """
+
+    def __init__(self, command, max_shells, sudo=True):
+        self._command = command
+        self._max_shells = max_shells
+        self._sudo = sudo
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []
+        self._busy = 0
+        # Incremented on restart; shells of older generations are closed
+        # when they become idle.
+        self._generation = 0
+        self._retry_start = None
+        self._closed = False
+        self._stats = {
+            "started": 0,
+            "failed": 0,
+            "commands": 0,
+        }
+
+    def run(self, args):
+        """
+        Run lvm command args (e.g. ["lvs", "-o", "name", "vg"]) in a shell.
+
+        Returns (rc, out, err) like misc.execCmd(). Raises Error if the
+        command must be run in a new lvm process.
+        """
+        shell = self._acquire()
+        try:
+            result = shell.run(args)
+        except Error as e:
+            self._discard(shell)
+            if e.sent and args[0] not in REPORT_COMMANDS:
+                # The command may have run; running it again may fail or
+                # change the system twice.
+                log.warning("lvm shell failed running %s: %s", args[0], e)
+                return 1, [], [str(e)]
+            raise
+        else:
+            self._release(shell)
+            return result
+
+    def restart(self):
+        """
+        Start new shells for the next commands, e.g. after the lvm filter
+        was changed.
+        """
+        with self._cond:
+            self._generation += 1
+            self._retry_start = None
+            idle = self._idle
+            self._idle = []
+        log.info("Restarting lvm shells")
+        for shell in idle:
+            shell.close()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._cond.notify_all()
+        for shell in idle:
+            shell.close()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["idle"] = len(self._idle)
+            stats["busy"] = self._busy
+            return stats
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise Error("lvm shell pool is closed")
+                if self._idle:
+                    shell = self._idle.pop()
+                    self._busy += 1
+                    self._stats["commands"] += 1
+                    return shell
+                if self._busy + len(self._idle) < self._max_shells:
+                    if (self._retry_start is not None and
+                            monotonic_time() < self._retry_start):
+                        raise Error("Starting lvm shells is disabled")
+                    self._busy += 1
+                    generation = self._generation
+                    break
+                self._cond.wait()
+
+        try:
+            shell = Shell(self._command, generation, sudo=self._sudo)
+        except Error as e:
+            log.warning("%s, running lvm commands without a shell for %d "
+                        "seconds", e, START_RETRY_INTERVAL)
+            with self._cond:
+                self._busy -= 1
+                self._stats["failed"] += 1
+                self._retry_start = monotonic_time() + START_RETRY_INTERVAL
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._stats["started"] += 1
+            self._stats["commands"] += 1
+        return shell
+
+    def _release(self, shell):
+        with self._cond:
+            self._busy -= 1
+            keep = (shell.generation == self._generation and
+                    not self._closed)
+            if keep:
+                self._idle.append(shell)
+            self._cond.notify()
+        if not keep:
+            shell.close()
+
+    def _discard(self, shell):
+        with self._cond:
+            self._busy -= 1
+            self._cond.notify()
+        shell.close()
+
+
+class Shell(object):
+    """
+    A single lvm process running in shell mode.
+    """
+
+    def __init__(self, command, generation, sudo=True):
+        self.generation = generation
+        cmd = cmdutils.wrap_command(command, with_sudo=sudo)
+        log.debug("Starting lvm shell: %s", cmdutils.command_log_line(cmd))
+        try:
+            self._proc = subprocess.Popen(
+                cmd, close_fds=True, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            raise Error("Cannot start lvm shell: %s" % e)
+        try:
+            # Wait for the first prompt, so we do not report start errors
+            # as command errors.
+            self._read_until_prompt()
+        except Error:
+            self.close()
+            raise
+
+    def run(self, args):
+        line = " ".join(_quote(arg) for arg in _shell_args(args))
+        try:
+            _write_all(self._proc.stdin.fileno(), line.encode("utf-8") + b"\n")
+        except EnvironmentError as e:
+            raise Error("Cannot write command to lvm shell: %s" % e)
+
+        try:
+            out, err = self._read_until_prompt()
+            return _parse_output(out, err)
+        except Error as e:
+            e.sent = True
+            raise
+
+    def close(self):
+        if self._proc.poll() is None:
+            try:
+                self._proc.kill()
+            except EnvironmentError as e:
+                if e.errno != errno.ESRCH:
+                    log.warning("Error terminating lvm shell %s: %s",
+                                self._proc.pid, e)
+            self._proc.wait()
+        self._proc.stdin.close()
+        self._proc.stdout.close()
+        self._proc.stderr.close()
+
+    def _read_until_prompt(self):
+        """
+        Read stdout until the next prompt, and stderr, without blocking
+        lvm on a full stderr pipe.
+        """
+        stdout = self._proc.stdout.fileno()
+        stderr = self._proc.stderr.fileno()
+        out = bytearray()
+        err = bytearray()
+        poller = select.poll()
+        poller.register(stdout, select.POLLIN)
+        poller.register(stderr, select.POLLIN)
+
+        while True:
+            for fd, _ in uninterruptible_poll(poller.poll):
+                data = os.read(fd, 65536)
+                if fd == stderr:
+                    if data:
+                        err += data
+                    else:
+                        poller.unregister(stderr)
+                    continue
+                if not data:
+                    raise Error("lvm shell terminated: %s" %
+                                err.decode("utf-8", "replace"))
+                out += data
+                # The prompt is not terminated by newline, and is written
+                # after the output of the command.
+                if out.endswith(PROMPT):
+                    # Errors were written before the prompt.
+                    for data in _read_available(stderr):
+                        err += data
+                    return bytes(out[:-len(PROMPT)]), bytes(err)
+
+
+def _shell_args(args):
+    """
+    Return args with json output and the command log enabled.
+    """
+    args = list(args)
+    for i, arg in enumerate(args):
+        if arg == "--config":
+            # The shell cannot parse an argument containing both kinds of
+            # quotes, and lvm accepts strings in single quotes.
+            config = "%s %s" % (args[i + 1], LOG_CONFIG)
+            args[i + 1] = config.replace('"', "'")
+            break
+    else:
+        args[1:1] = ["--config", LOG_CONFIG]
+    args[1:1] = ["--reportformat", "json"]
+    return args
+
+
+def _quote(arg):
+    """
+    Quote arg for the lvm shell, which splits the command line on white
+    space, and does not support escaping quotes.
+    """
+    if "\n" in arg:
+        raise Error("Cannot pass argument %r to lvm shell" % arg)
+    if arg and not any(c.isspace() or c in "'\"#" for c in arg):
+        return arg
+    if '"' not in arg:
+        return '"%s"' % arg
+    if "'" not in arg:
+        return "'%s'" % arg
+    raise Error("Cannot pass argument %r to lvm shell" % arg)
+
+
+def _parse_output(out, err):
+    """
+    Parse lvm json output, returning (rc, out, err).
+    """
+    try:
+        doc = json.loads(out.decode("utf-8"), object_pairs_hook=OrderedDict)
+    except ValueError as e:
+        raise Error("Invalid lvm shell output %r: %s" % (out[:200], e))
+
+    entries = doc.get("log", [])
+    status = [e for e in entries if e.get("log_type") == "status"]
+    if not status:
+        raise Error("No command status in lvm shell output")
+    commands = [e for e in status if e.get("log_object_type") == "cmd"]
+    ret_code = int((commands or status)[-1]["log_ret_code"])
+    rc = 0 if ret_code == _ECMD_PROCESSED else ret_code
+
+    lines = []
+    for report in doc.get("report", []):
+        for rows in report.values():
+            for row in rows:
+                lines.append(_encode("  " + "|".join(row.values())))
+
+    errors = err.splitlines()
+    errors.extend(_encode("  " + e["log_message"]) for e in entries
+                  if e.get("log_type") in ("error", "warn"))
+    return rc, lines, errors
+
+
+def _encode(s):
+    """
+    Return text encoded like the output of misc.execCmd().
+    """
+    return s.encode("utf-8")
+
+
+def _read_available(fd):
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    while uninterruptible_poll(poller.poll, 0):
+        data = os.read(fd, 65536)
+        if not data:
+            break
+        yield data
+
+
+def _write_all(fd, data):
+    while data:
+        n = os.write(fd, data)
+        data = data[n:]
@@ -31,12 +31,12 @@ import uuid
 from six.moves import queue
 
 from vdsm.config import config
+from vdsm.storage import directio
 from vdsm.storage import misc
 from vdsm.storage import task
 from vdsm.storage.exception import InvalidParameterException
 from vdsm.storage.threadPool import ThreadPool
 
-from vdsm import constants
 from vdsm.common import concurrent
 
 __author__ = "ayalb"
@@ -50,11 +50,11 @@ VOLUME_MAX_SIZE = 0xFFFFFFFF  # 64 bit unsigned max size
 SIZE_CHARS = 16
 MESSAGE_VERSION = "1"
 MESSAGE_SIZE = 64
-CLEAN_MESSAGE = "\1" * MESSAGE_SIZE
+CLEAN_MESSAGE = b"\1" * MESSAGE_SIZE
 EXTEND_CODE = "xtnd"
 BLOCK_SIZE = 512
 REPLY_OK = 1
-EMPTYMAILBOX = MAILBOX_SIZE * "\0"
+EMPTYMAILBOX = MAILBOX_SIZE * b"\0"
 SLOTS_PER_MAILBOX = int(MAILBOX_SIZE / MESSAGE_SIZE)
 # Last message slot is reserved for metadata (checksum, extendable mailbox,
 # etc)
@@ -80,8 +80,201 @@ def runTask(args):
     ctask.prepare(cmd, *args)
 
 
-def _mboxExecCmd(*args, **kwargs):
-    return misc.execCmd(*args, **kwargs)
+class _MailReader(object):
+    """
+    Read mail from a mailbox file using direct I/O.
+
+    The file is opened on the first read and kept open, and mail is read into
+    preallocated buffers. The content of the previous read is kept, so
+    changed messages can be detected by comparing the current and previous
+    content, instead of comparing byte by byte.
+
+    If reading fails the file is closed, and opened again on the next read.
+    The file is also opened again if the path was changed to another file,
+    e.g. when the master domain was changed.
+    """
+
+    def __init__(self, path, offset, size):
+        self._path = path
+        self._offset = offset
+        self._file = None
+        self._current = directio.AlignedBuffer(size)
+        self._previous = directio.AlignedBuffer(size)
+
+    def __len__(self):
+        return len(self._current)
+
+    def __getitem__(self, key):
+        return self._current[key]
+
+    def read(self):
+        """
+        Read the mailbox file into the current buffer, keeping the previous
+        content. Raises IOError if the mailbox could not be read.
+        """
+        size = len(self._previous)
+        try:
+            self._file = _open_mailbox(self._path, "r", self._file)
+            n = self._file.pread(self._previous, self._offset)
+        except (OSError, IOError) as e:
+            self.close()
+            raise IOError(errno.EIO, "Could not read mailbox %s: %s"
+                          % (self._path, e))
+        if n != size:
+            raise IOError(errno.EIO, "Could not read mailbox %s: read %d "
+                          "bytes instead of %d" % (self._path, n, size))
+        self._current, self._previous = self._previous, self._current
+
+    def changed(self, start, end):
+        """
+        Return True if the content between start and end has changed since
+        the previous read.
+        """
+        return self._current[start:end] != self._previous[start:end]
+
+    def clear(self, start, end):
+        """
+        Clear the current content between start and end, so it will be
+        compared with zeros on the next read.
+        """
+        self._current[start:end] = b"\0" * (end - start)
+
+    def resize(self, size):
+        self._current = _resize_buffer(self._current, size)
+        self._previous = _resize_buffer(self._previous, size)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class _MailWriter(object):
+    """
+    Write mail to a mailbox file using direct I/O.
+
+    Mail is kept in a preallocated buffer, and only the mailboxes modified
+    since the last flush are written to storage. The file is opened on the
+    first write and kept open. If writing fails the file is closed, and the
+    modified mailboxes are written again on the next flush. If the path was
+    changed to another file, e.g. when the master domain was changed, the
+    new file is opened and all mailboxes are written to it.
+    """
+
+    def __init__(self, path, offset, size):
+        self._path = path
+        self._offset = offset
+        self._file = None
+        self._buf = directio.AlignedBuffer(size)
+        self._dirty = set()
+
+    def __len__(self):
+        return len(self._buf)
+
+    def __getitem__(self, key):
+        return self._buf[key]
+
+    def write(self, start, data):
+        """
+        Write data to the buffer at start, marking the modified mailboxes
+        for the next flush.
+        """
+        end = start + len(data)
+        self._buf[start:end] = data
+        self._dirty.update(range(start // MAILBOX_SIZE,
+                                 (end - 1) // MAILBOX_SIZE + 1))
+
+    def clear(self):
+        """
+        Clear the entire buffer, marking all mailboxes for the next flush.
+        """
+        self.write(0, b"\0" * len(self._buf))
+
+    def flush(self):
+        """
+        Write the modified mailboxes to storage, merging adjacent mailboxes
+        to one write. Raises IOError if the mailbox could not be written.
+        """
+        if not self._dirty:
+            return
+        try:
+            f = _open_mailbox(self._path, "r+", self._file)
+            if self._file is not None and f is not self._file:
+                self._dirty.update(range(len(self._buf) // MAILBOX_SIZE))
+            self._file = f
+            for first, count in _ranges(sorted(self._dirty)):
+                start = first * MAILBOX_SIZE
+                size = count * MAILBOX_SIZE
+                n = self._file.pwrite(self._buf, self._offset + start, start,
+                                      size)
+                if n != size:
+                    raise IOError(errno.EIO, "wrote %d bytes instead of %d"
+                                  % (n, size))
+                self._dirty.difference_update(range(first, first + count))
+        except (OSError, IOError) as e:
+            self.close()
+            raise IOError(errno.EIO, "Could not write mailbox %s: %s"
+                          % (self._path, e))
+
+    def resize(self, size):
+        old_size = len(self._buf)
+        self._buf = _resize_buffer(self._buf, size)
+        mailboxes = size // MAILBOX_SIZE
+        self._dirty = set(i for i in self._dirty if i < mailboxes)
+        # New mailboxes must be written on the next flush, like existing
+        # mailboxes.
+        self._dirty.update(range(old_size // MAILBOX_SIZE, mailboxes))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _open_mailbox(path, mode, f):
+    """
+    Return f if it is open on the file at path, or the file at path opened
+    using direct I/O.
+
+    The mailbox paths are under the mastersd link, which points to the new
+    master domain after the master domain was changed. The open file is the
+    mailbox of the old master domain in this case.
+    """
+    if f is not None:
+        st = os.stat(path)
+        fst = os.fstat(f.fileno())
+        if (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino):
+            return f
+        logging.getLogger("storage.MailBox").info(
+            "Mailbox %s was replaced, opening the new mailbox", path)
+        f.close()
+    return directio.DirectFile(path, mode)
+
+
+def _resize_buffer(buf, size):
+    new = directio.AlignedBuffer(size)
+    n = min(size, len(buf))
+    new[0:n] = buf[0:n]
+    buf.close()
+    return new
+
+
+def _ranges(indexes):
+    """
+    Group sorted indexes to (first, count) ranges of adjacent indexes.
+    """
+    first = None
+    count = 0
+    for i in indexes:
+        if first is not None and i == first + count:
+            count += 1
+            continue
+        if first is not None:
+            yield first, count
+        first = i
+        count = 1
+    if first is not None:
+        yield first, count
 
 
 class SPM_Extend_Message:
@@ -242,25 +435,10 @@ class HSM_MailMonitor(object):
         self._monitorInterval = monitorInterval
         self._hostID = int(hostID)
         self._used_slots_array = [0] * MESSAGES_PER_MAILBOX
-        self._outgoingMail = EMPTYMAILBOX
-        self._incomingMail = EMPTYMAILBOX
         # TODO: add support for multiple paths (multiple mailboxes)
-        self._inCmd = [constants.EXT_DD,
-                       'if=' + str(inbox),
-                       'iflag=direct,fullblock',
-                       'bs=' + str(MAILBOX_SIZE),
-                       'count=1',
-                       'skip=' + str(self._hostID)
-                       ]
-        self._outCmd = [constants.EXT_DD,
-                        'of=' + str(outbox),
-                        'iflag=fullblock',
-                        'oflag=direct',
-                        'conv=notrunc',
-                        'bs=' + str(MAILBOX_SIZE),
-                        'count=1',
-                        'seek=' + str(self._hostID)
-                        ]
+        mailboxOffset = self._hostID * MAILBOX_SIZE
+        self._incomingMail = _MailReader(inbox, mailboxOffset, MAILBOX_SIZE)
+        self._outgoingMail = _MailWriter(outbox, mailboxOffset, MAILBOX_SIZE)
         self._init = False
         self._initMailbox()  # Read initial mailbox state
         self._msgCounter = 0
@@ -271,14 +449,14 @@ class HSM_MailMonitor(object):
 
     def _initMailbox(self):
         # Sync initial incoming mail state with storage view
-        (rc, out, err) = _mboxExecCmd(self._inCmd, raw=True)
-        if rc == 0:
-            self._incomingMail = out
-            self._init = True
-        else:
+        try:
+            self._incomingMail.read()
+        except IOError as e:
             self.log.warning("HSM_MailboxMonitor - Could not initialize "
                              "mailbox, will not accept requests until init "
-                             "succeeds")
+                             "succeeds: %s", e)
+        else:
+            self._init = True
 
     def immStop(self):
         self._stop = True
@@ -290,8 +468,9 @@ class HSM_MailMonitor(object):
         self._thread.join(timeout=timeout)
         return not self._thread.is_alive()
 
-    def _handleResponses(self, newMsgs):
+    def _handleResponses(self):
         rc = False
+        newMsgs = self._incomingMail
 
         for i in range(0, MESSAGES_PER_MAILBOX):
             # Skip checking non used slots
@@ -303,16 +482,11 @@ class HSM_MailMonitor(object):
 
             # First byte of message is message version.
             # Check return message version, if 0 then message is empty
-            if newMsgs[start] in ['\0', '0']:
+            if newMsgs[start:start + 1] in (b'\0', b'0'):
                 continue
 
-            for j in range(start, start + MESSAGE_SIZE):
-                if newMsgs[j] != self._incomingMail[j]:
-                    break
-
-            # If search exhausted then message hasn't changed since last read
-            # and can be skipped
-            if j == (start + MESSAGE_SIZE - 1):
+            # If message hasn't changed since last read it can be skipped
+            if not newMsgs.changed(start, start + MESSAGE_SIZE):
                 continue
 
             #
@@ -328,15 +502,12 @@ class HSM_MailMonitor(object):
                 del self._activeMessages[i]
                 self._used_slots_array[i] = 0
                 self._msgCounter -= 1
-                self._outgoingMail = self._outgoingMail[0:start] + \
-                    MESSAGE_SIZE * "\0" + self._outgoingMail[start +
-                                                             MESSAGE_SIZE:]
+                self._outgoingMail.write(start, MESSAGE_SIZE * b"\0")
                 continue
 
             msg = self._activeMessages[i]
             self._activeMessages[i] = CLEAN_MESSAGE
-            self._outgoingMail = self._outgoingMail[0:start] + \
-                CLEAN_MESSAGE + self._outgoingMail[start + MESSAGE_SIZE:]
+            self._outgoingMail.write(start, CLEAN_MESSAGE)
 
             try:
                 self.log.debug("HSM_MailboxMonitor(%s/%s) - Checking reply: "
@@ -364,34 +535,27 @@ class HSM_MailMonitor(object):
                                "checking reply from SPM, request was: %s "
                                "reply: %s", repr(msg.payload), repr(newMsg),
                                exc_info=True)
-        # Finished processing incoming mail, now save mail to compare against
-        # next batch
-        self._incomingMail = newMsgs
+        # Finished processing incoming mail, the current mail will be compared
+        # against the next batch.
         return rc
 
     def _checkForMail(self):
         # self.log.debug("HSM_MailMonitor - checking for mail")
-        # self.log.debug("Running command: " + str(self._inCmd))
-        (rc, in_mail, err) = misc.execCmd(self._inCmd, raw=True)
-        if rc:
-            raise RuntimeError("_handleResponses.Could not read mailbox - rc "
-                               "%s" % rc)
-        if (len(in_mail) != MAILBOX_SIZE):
-            raise RuntimeError("_handleResponses.Could not read mailbox - len "
-                               "%s != %s" % (len(in_mail), MAILBOX_SIZE))
+        self._incomingMail.read()
         # self.log.debug("Parsing inbox content: %s", in_mail)
-        return self._handleResponses(in_mail)
+        return self._handleResponses()
 
     def _sendMail(self):
-        self.log.info("HSM_MailMonitor sending mail to SPM - " +
-                      str(self._outCmd))
+        self.log.info("HSM_MailMonitor sending mail to SPM")
         chk = misc.checksum(
             self._outgoingMail[0:MAILBOX_SIZE - CHECKSUM_BYTES],
             CHECKSUM_BYTES)
         pChk = struct.pack('<l', chk)  # Assumes CHECKSUM_BYTES equals 4!!!
-        self._outgoingMail = \
-            self._outgoingMail[0:MAILBOX_SIZE - CHECKSUM_BYTES] + pChk
-        _mboxExecCmd(self._outCmd, data=self._outgoingMail)
+        self._outgoingMail.write(MAILBOX_SIZE - CHECKSUM_BYTES, pChk)
+        try:
+            self._outgoingMail.flush()
+        except IOError as e:
+            self.log.error("HSM_MailMonitor couldn't send mail: %s", e)
 
     def _handleMessage(self, message):
         # TODO: add support for multiple mailboxes
@@ -401,12 +565,8 @@ class HSM_MailMonitor(object):
                 if not freeSlot:
                     freeSlot = i
                 continue
-            duplicate = True
-            for j in range(0, MESSAGE_SIZE):
-                if message[j] != self._activeMessages[i][j]:
-                    duplicate = False
-                    break
-            if duplicate:
+            if message[0:MESSAGE_SIZE] == \
+                    self._activeMessages[i][0:MESSAGE_SIZE]:
                 self.log.debug("HSM_MailMonitor - ignoring duplicate message "
                                "%s" % (repr(message)))
                 return
@@ -419,8 +579,7 @@ class HSM_MailMonitor(object):
         self._activeMessages[freeSlot] = message
         start = freeSlot * MESSAGE_SIZE
         end = start + MESSAGE_SIZE
-        self._outgoingMail = self._outgoingMail[0:start] + message.payload + \
-            self._outgoingMail[end:]
+        self._outgoingMail.write(start, message.payload)
         self.log.debug("HSM_MailMonitor - start: %s, end: %s, len: %s, "
                        "message(%s/%s): %s" %
                        (start, end, len(self._outgoingMail), self._msgCounter,
@@ -510,8 +669,10 @@ class HSM_MailMonitor(object):
         finally:
             self.log.info("HSM_MailboxMonitor - Incoming mail monitoring "
                           "thread stopped, clearing outgoing mail")
-            self._outgoingMail = EMPTYMAILBOX
+            self._outgoingMail.clear()
             self._sendMail()  # Clear outgoing mailbox
+            self._incomingMail.close()
+            self._outgoingMail.close()
 
 
 class SPM_MailMonitor:
@@ -554,30 +715,18 @@ class SPM_MailMonitor:
         self._outMailLen = MAILBOX_SIZE * self._numHosts
         self._monitorInterval = monitorInterval
         # TODO: add support for multiple paths (multiple mailboxes)
-        self._outgoingMail = self._outMailLen * "\0"
-        self._incomingMail = self._outgoingMail
-        self._inCmd = ['dd',
-                       'if=' + str(self._inbox),
-                       'iflag=direct,fullblock',
-                       'count=1'
-                       ]
-        self._outCmd = ['dd',
-                        'of=' + str(self._outbox),
-                        'oflag=direct',
-                        'iflag=fullblock',
-                        'conv=notrunc',
-                        'count=1'
-                        ]
+        self._outgoingMail = _MailWriter(self._outbox, 0, self._outMailLen)
+        self._incomingMail = _MailReader(self._inbox, 0, self._outMailLen)
         self._outLock = threading.Lock()
         self._inLock = threading.Lock()
         # Clear outgoing mail
-        self.log.debug("SPM_MailMonitor - clearing outgoing mail, command is: "
-                       "%s", self._outCmd)
-        cmd = self._outCmd + ['bs=' + str(self._outMailLen)]
-        (rc, out, err) = _mboxExecCmd(cmd, data=self._outgoingMail)
-        if rc:
-            self.log.warning("SPM_MailMonitor couldn't clear outgoing mail, "
-                             "dd failed")
+        self.log.debug("SPM_MailMonitor - clearing outgoing mail")
+        self._outgoingMail.clear()
+        try:
+            self._outgoingMail.flush()
+        except IOError as e:
+            self.log.warning("SPM_MailMonitor couldn't clear outgoing mail: "
+                             "%s", e)
 
         self._thread = concurrent.thread(
             self._run, name="mailbox-spm", log=self.log)
@@ -600,15 +749,10 @@ class SPM_MailMonitor:
     def setMaxHostID(self, newMaxId):
         with self._inLock:
             with self._outLock:
-                diff = newMaxId - self._numHosts
-                if diff > 0:
-                    delta = MAILBOX_SIZE * diff * "\0"
-                    self._outgoingMail += delta
-                    self._incomingMail += delta
-                elif diff < 0:
-                    delta = MAILBOX_SIZE * diff
-                    self._outgoingMail = self._outgoingMail[:-delta]
-                    self._incomingMail = self._incomingMail[:-delta]
+                if newMaxId != self._numHosts:
+                    size = MAILBOX_SIZE * newMaxId
+                    self._outgoingMail.resize(size)
+                    self._incomingMail.resize(size)
                 self._numHosts = newMaxId
                 self._outMailLen = MAILBOX_SIZE * self._numHosts
 
@@ -633,9 +777,10 @@ class SPM_MailMonitor:
             return False  # Ignore messages of empty mailbox
         return True
 
-    def _handleRequests(self, newMail):
+    def _handleRequests(self):
 
         send = False
+        newMail = self._incomingMail
 
         # run through all messages and check if new messages have arrived
         # (since last read)
@@ -643,6 +788,12 @@ class SPM_MailMonitor:
             # Check mailbox checksum
             mailboxStart = host * MAILBOX_SIZE
 
+            # Most mailboxes do not change between reads. Skipping them using
+            # single comparison is much cheaper than checking every message.
+            if not newMail.changed(mailboxStart,
+                                   mailboxStart + MAILBOX_SIZE):
+                continue
+
             isMailboxValidated = False
 
             for i in range(0, MESSAGES_PER_MAILBOX):
@@ -652,7 +803,7 @@ class SPM_MailMonitor:
 
                 # First byte of message is message version.  Check message
                 # version, if 0 then message is empty and can be skipped
-                if newMail[msgStart] in ['\0', '0']:
+                if newMail[msgStart:msgStart + 1] in (b'\0', b'0'):
                     continue
 
                 # Most mailboxes are probably empty so it costs less to check
@@ -664,8 +815,8 @@ class SPM_MailMonitor:
                             newMail[mailboxStart:mailboxStart + MAILBOX_SIZE],
                             host):
                         # Cleaning invalid mbx in newMail
-                        newMail = newMail[:mailboxStart] + EMPTYMAILBOX + \
-                            newMail[mailboxStart + MAILBOX_SIZE:]
+                        newMail.clear(mailboxStart,
+                                      mailboxStart + MAILBOX_SIZE)
                         break
                     self.log.debug("SPM_MailMonitor: Mailbox %s validated, "
                                    "checking mail", host)
@@ -678,25 +829,15 @@ class SPM_MailMonitor:
                     # take the lock
                     self._outLock.acquire()
                     try:
-                        self._outgoingMail = \
-                            self._outgoingMail[0:msgOffset] + CLEAN_MESSAGE + \
-                            self._outgoingMail[msgOffset + MESSAGE_SIZE:
-                                               self._outMailLen]
+                        self._outgoingMail.write(msgOffset, CLEAN_MESSAGE)
                     finally:
                         self._outLock.release()
                     send = True
                     continue
 
-                # Message isn't empty, check if its new
-                isMessageNew = False
-                for j in range(msgStart, msgStart + MESSAGE_SIZE):
-                    if newMail[j] != self._incomingMail[j]:
-                        isMessageNew = True
-                        break
-
-                # If search exhausted, i.e. message hasn't changed since last
-                # read, it can be skipped
-                if not isMessageNew:
+                # Message isn't empty, if it hasn't changed since last read,
+                # it can be skipped
+                if not newMail.changed(msgStart, msgStart + MESSAGE_SIZE):
                     continue
 
                 # We only get here if there is a novel request
@@ -729,7 +870,6 @@ class SPM_MailMonitor:
                                    newMail[msgStart:msgStart + MESSAGE_SIZE],
                                    exc_info=True)
 
-        self._incomingMail = newMail
         return send
 
     def _checkForMail(self):
@@ -738,33 +878,19 @@ class SPM_MailMonitor:
         self._inLock.acquire()
         try:
             # self.log.debug("SPM_MailMonitor -_checking for mail")
-            cmd = self._inCmd + ['bs=' + str(self._outMailLen)]
-            # self.log.debug("SPM_MailMonitor - reading incoming mail, "
-            #               "command: " + str(cmd))
-            (rc, in_mail, err) = misc.execCmd(cmd, raw=True)
-            if rc:
-                raise IOError(errno.EIO, "_handleRequests._checkForMail - "
-                              "Could not read mailbox: %s" % self._inbox)
-
-            if (len(in_mail) != (self._outMailLen)):
-                self.log.error('SPM_MailMonitor: _checkForMail - dd succeeded '
-                               'but read %d bytes instead of %d, cannot check '
-                               'mail.  Read mail contains: %s', len(in_mail),
-                               self._outMailLen, repr(in_mail[:80]))
-                raise RuntimeError("_handleRequests._checkForMail - Could not "
-                                   "read mailbox")
+            self._incomingMail.read()
             # self.log.debug("Parsing inbox content: %s", in_mail)
-            if self._handleRequests(in_mail):
-                self._outLock.acquire()
-                try:
-                    cmd = self._outCmd + ['bs=' + str(self._outMailLen)]
-                    (rc, out, err) = _mboxExecCmd(cmd,
-                                                  data=self._outgoingMail)
-                    if rc:
-                        self.log.warning("SPM_MailMonitor couldn't write "
-                                         "outgoing mail, dd failed")
-                finally:
-                    self._outLock.release()
+            self._handleRequests()
+            # Write the modified mailboxes, including mailboxes we failed to
+            # write in previous checks.
+            self._outLock.acquire()
+            try:
+                self._outgoingMail.flush()
+            except IOError as e:
+                self.log.warning("SPM_MailMonitor couldn't write outgoing "
+                                 "mail: %s", e)
+            finally:
+                self._outLock.release()
         finally:
             self._inLock.release()
 
@@ -774,20 +900,13 @@ class SPM_MailMonitor:
         self._outLock.acquire()
         try:
             msgOffset = msgID * MESSAGE_SIZE
-            self._outgoingMail = \
-                self._outgoingMail[0:msgOffset] + msg.payload + \
-                self._outgoingMail[msgOffset + MESSAGE_SIZE:self._outMailLen]
-            mailboxOffset = (msgID / SLOTS_PER_MAILBOX) * MAILBOX_SIZE
-            mailbox = self._outgoingMail[mailboxOffset:
-                                         mailboxOffset + MAILBOX_SIZE]
-            cmd = self._outCmd + ['bs=' + str(MAILBOX_SIZE),
-                                  'seek=' + str(mailboxOffset / MAILBOX_SIZE)]
-            # self.log.debug("Running command: %s, for message id: %s",
-            #               str(cmd), str(msgID))
-            (rc, out, err) = _mboxExecCmd(cmd, data=mailbox)
-            if rc:
+            self._outgoingMail.write(msgOffset, msg.payload)
+            # self.log.debug("Sending reply for message id: %s", str(msgID))
+            try:
+                self._outgoingMail.flush()
+            except IOError as e:
                 self.log.error("SPM_MailMonitor: sendReply - couldn't send "
-                               "reply, dd failed")
+                               "reply: %s", e)
         finally:
             self._outLock.release()
 
@@ -802,6 +921,10 @@ class SPM_MailMonitor:
         finally:
             self._stopped = True
             self.tp.joinAll(waitForTasks=False)
+            with self._inLock:
+                self._incomingMail.close()
+            with self._outLock:
+                self._outgoingMail.close()
             self.log.info("SPM_MailMonitor - Incoming mail monitoring thread "
                           "stopped")
 
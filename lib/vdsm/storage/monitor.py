@@ -23,8 +23,13 @@ import logging
 import threading
 import time
 
+import six
+
+from vdsm import executor
+from vdsm import schedule
 from vdsm import utils
-from vdsm.common import concurrent
+from vdsm.common import exception
+from vdsm.common.time import monotonic_time
 from vdsm.config import config
 from vdsm.storage import check
 from vdsm.storage import clusterlock
@@ -33,6 +38,15 @@ from vdsm.storage.sdc import sdCache
 
 log = logging.getLogger('storage.Monitor')
 
+# Monitors are run by the monitor scheduler, dispatching blocking domain
+# operations to a small executor. A worker blocked on storage for more than
+# the monitor interval is replaced. The number of workers is not limited;
+# every monitor has at most one cycle queued or running, so the number of
+# blocked workers is bounded by the number of monitored domains.
+_WORKERS = config.getint('irs', 'sd_health_check_workers')
+# Every monitor has at most one queued task.
+_MAX_TASKS = 1000
+
 
 class Status(object):
 
@@ -147,6 +161,14 @@ class DomainMonitor(object):
             "storage.DomainMonitor.onDomainStateChange", sync=False)
         self._checker = check.CheckService()
         self._checker.start()
+        self._scheduler = schedule.Scheduler(name="monitor/sched",
+                                             clock=monotonic_time)
+        self._scheduler.start()
+        self._executor = executor.Executor(name="monitor",
+                                           workers_count=_WORKERS,
+                                           max_tasks=_MAX_TASKS,
+                                           scheduler=self._scheduler)
+        self._executor.start()
 
     @property
     def domains(self):
@@ -180,8 +202,9 @@ class DomainMonitor(object):
             return
 
         log.info("Start monitoring %s", sdUUID)
-        monitor = MonitorThread(sdUUID, hostId, self._interval,
-                                self.onDomainStateChange, self._checker)
+        monitor = MonitorTask(sdUUID, hostId, self._interval,
+                              self.onDomainStateChange, self._checker,
+                              self._scheduler, self._executor)
         monitor.poolDomain = poolDomain
         monitor.start()
         # The domain should be added only after it succesfully started
@@ -202,7 +225,7 @@ class DomainMonitor(object):
 
     def getHostStatus(self, domains):
         status = {}
-        for sdUUID, hostId in domains.iteritems():
+        for sdUUID, hostId in six.iteritems(domains):
             try:
                 monitor = self._monitors[sdUUID]
             except KeyError:
@@ -220,24 +243,27 @@ class DomainMonitor(object):
         id. To stop monitors and release the host id, use stopMonitoring().
         """
         log.info("Shutting down domain monitors")
-        self._stopMonitors(self._monitors.values(), shutdown=True)
+        self._stopMonitors(list(self._monitors.values()), shutdown=True)
         self._checker.stop()
+        # Workers blocked on storage are not waited for.
+        self._executor.stop(wait=False)
+        self._scheduler.stop()
 
     def _stopMonitors(self, monitors, shutdown=False):
         # The domain monitor issues events that might become raceful if
-        # you don't wait until a monitor thread exit.
+        # you don't wait until a monitor exit.
         # Eg: when a domain is detached the domain monitor is stopped and
         # the host id is released. If the monitor didn't actually exit it
         # might respawn a new acquire host id.
 
-        # First stop monitor threads - this take no time, and make the process
-        # about 7 times faster when stopping 30 monitors.
+        # First stop monitors - this take no time, and make the process about
+        # 7 times faster when stopping 30 monitors.
         for monitor in monitors:
             log.info("Stop monitoring %s (shutdown=%s)",
                      monitor.sdUUID, shutdown)
             monitor.stop(shutdown=shutdown)
 
-        # Now wait for threads to finish - this takes about 10 seconds with 30
+        # Now wait for monitors to finish - this takes about 10 seconds with 30
         # monitors, most of the time spent waiting for sanlock.
         for monitor in monitors:
             log.debug("Waiting for monitor %s", monitor.sdUUID)
@@ -249,11 +275,17 @@ class DomainMonitor(object):
                             monitor.sdUUID)
 
 
-class MonitorThread(object):
+class MonitorTask(object):
+    """
+    Monitor a storage domain.
+
+    The monitor does not have a thread. Every cycle is dispatched to the
+    executor, and the next cycle is scheduled on the scheduler when the
+    cycle completes, so a domain never has more than one cycle running.
+    """
 
-    def __init__(self, sdUUID, hostId, interval, changeEvent, checker):
-        self.thread = concurrent.thread(self._run, log=log,
-                                        name="monitor/" + sdUUID[:7])
+    def __init__(self, sdUUID, hostId, interval, changeEvent, checker,
+                 scheduler, executor):
         self.stopEvent = threading.Event()
         self.domain = None
         self.sdUUID = sdUUID
@@ -261,6 +293,8 @@ class MonitorThread(object):
         self.interval = interval
         self.changeEvent = changeEvent
         self.checker = checker
+        self.scheduler = scheduler
+        self.executor = executor
         self.lock = threading.Lock()
         self.monitoringPath = None
         # For backward compatibility, we must present a fake status before
@@ -277,16 +311,37 @@ class MonitorThread(object):
         self.wasShutdown = False
         # Used for synchronizing during the tests
         self.cycleCallback = _NULL_CALLBACK
+        # Set when the monitor completed setup.
+        self.ready = False
+        # Protects self._call and self._running.
+        self._cycleLock = threading.Lock()
+        # The next cycle scheduled on the scheduler.
+        self._call = None
+        # True while a cycle is queued or running in the executor.
+        self._running = False
+        self._done = threading.Event()
 
     def start(self):
-        self.thread.start()
+        log.debug("Domain monitor for %s started", self.sdUUID)
+        with self._cycleLock:
+            self._running = True
+            self._dispatch(self._cycle)
 
     def stop(self, shutdown=False):
         self.wasShutdown = shutdown
-        self.stopEvent.set()
+        with self._cycleLock:
+            self.stopEvent.set()
+            if self._call is not None:
+                self._call.cancel()
+                self._call = None
+            if self._running:
+                # The running cycle will finish the monitor.
+                return
+            self._running = True
+            self._dispatch(self._finish)
 
     def join(self):
-        self.thread.join()
+        self._done.wait()
 
     def getStatus(self):
         return self.status
@@ -300,39 +355,85 @@ class MonitorThread(object):
         """ Accessed by methods decorated with @util.cancelpoint """
         return self.stopEvent.is_set()
 
-    def _run(self):
-        log.debug("Domain monitor for %s started", self.sdUUID)
+    # Scheduling cycles
+
+    def _dispatch(self, func):
+        """
+        Must be called with self._cycleLock held.
+        """
+        try:
+            # Blocking on storage for more than interval replaces the worker.
+            self.executor.dispatch(func, timeout=self.interval)
+        except (executor.NotRunning, exception.ResourceExhausted) as e:
+            log.error("Cannot dispatch monitor for %s: %s", self.sdUUID, e)
+            self._running = False
+            if func == self._cycle and not self.stopEvent.is_set():
+                self._call = self.scheduler.schedule(self.interval,
+                                                     self._scheduled)
+            else:
+                # Nothing left to run; do not block stopMonitoring().
+                self._done.set()
+
+    def _scheduled(self):
+        """
+        Called from the scheduler thread. Must not block!
+        """
+        with self._cycleLock:
+            self._call = None
+            if self.stopEvent.is_set():
+                return
+            self._running = True
+            self._dispatch(self._cycle)
+
+    def _cycle(self):
+        """
+        Run one cycle in an executor worker, and schedule the next cycle, or
+        finish the monitor if it was stopped.
+        """
         try:
-            self._setupLoop()
-            self._monitorLoop()
+            if not self.ready:
+                self.ready = self._setupStep()
+            if self.ready:
+                self._monitorStep()
         except utils.Canceled:
             log.debug("Domain monitor for %s canceled", self.sdUUID)
-        finally:
+
+        with self._cycleLock:
+            if not self.stopEvent.is_set():
+                self._running = False
+                self._call = self.scheduler.schedule(self.interval,
+                                                     self._scheduled)
+                return
+
+        self._finish()
+
+    def _finish(self):
+        try:
             log.debug("Domain monitor for %s stopped (shutdown=%s)",
                       self.sdUUID, self.wasShutdown)
             self._stopCheckingPath()
             if self._shouldReleaseHostId():
                 self._releaseHostId()
+        finally:
+            self._done.set()
 
     # Setting up
 
-    def _setupLoop(self):
+    def _setupStep(self):
         """
-        Set up the monitor, retrying on failures. Returns when the monitor is
-        ready.
+        Try to set up the monitor. Returns True if the monitor is ready, or
+        False if setup should be retried in the next cycle.
         """
-        while True:
-            try:
-                self._setupMonitor()
-                return
-            except Exception as e:
-                log.exception("Setting up monitor for %s failed", self.sdUUID)
-                domain_status = DomainStatus(error=e)
-                status = Status(self.status._path_status, domain_status)
-                self._updateStatus(status)
-                self.cycleCallback()
-                if self.stopEvent.wait(self.interval):
-                    raise utils.Canceled
+        try:
+            self._setupMonitor()
+            return True
+        except Exception as e:
+            log.exception("Setting up monitor for %s failed", self.sdUUID)
+            domain_status = DomainStatus(error=e)
+            status = Status(self.status._path_status, domain_status)
+            self._updateStatus(status)
+            self.cycleCallback()
+            return False
 
     def _setupMonitor(self):
         # Pick up changes in the domain, for example, domain upgrade.
@@ -340,7 +441,7 @@ class MonitorThread(object):
             self._refreshDomain()
 
         # Producing the domain is deferred because it might take some time and
-        # we don't want to slow down the thread start (and anything else that
+        # we don't want to slow down the monitor start (and anything else that
         # relies on that as for example updateMonitoringThreads). It also might
         # fail and we want keep trying until we succeed or the domain is
         # deactivated.
@@ -375,19 +476,13 @@ class MonitorThread(object):
 
     # Monitoring
 
-    def _monitorLoop(self):
-        """
-        Monitor the domain peroidically until the monitor is stopped.
-        """
-        while True:
-            try:
-                self._monitorDomain()
-            except Exception:
-                log.exception("Domain monitor for %s failed", self.sdUUID)
-            finally:
-                self.cycleCallback()
-            if self.stopEvent.wait(self.interval):
-                raise utils.Canceled
+    def _monitorStep(self):
+        try:
+            self._monitorDomain()
+        except Exception:
+            log.exception("Domain monitor for %s failed", self.sdUUID)
+        finally:
+            self.cycleCallback()
 
     def _monitorDomain(self):
         # Pick up changes in the domain, for example, domain upgrade.
@@ -144,6 +144,14 @@ class PersistentDict(object):
     """
     This class provides interface for a generic set of key=value pairs
     that can be accessed by any consumer
+
+    Metadata is parsed and its checksum verified only when the lines read
+    from storage change. The encoded lines used for computing the checksum
+    are kept between flushes, so only modified lines are encoded again.
+
+    In read-mostly mode, readers get the last refreshed or flushed metadata
+    without taking the lock, unless a transaction is in progress or the
+    metadata was invalidated.
     """
     log = logging.getLogger("storage.PersistentDict")
 
@@ -184,20 +192,43 @@ class PersistentDict(object):
                 finally:
                     self._inTransaction = False
 
-    def __init__(self, metaReaderWriter):
+    def __init__(self, metaReaderWriter, readMostly=False):
         self._syncRoot = threading.RLock()
         self._metadata = {}
         self._metaRW = metaReaderWriter
         self._isValid = False
         self._inTransaction = False
+        self._readMostly = readMostly
+        # Metadata for lockless readers, replaced on refresh and flush.
+        self._published = None
+        # Lines last read or written, and the metadata parsed from them.
+        self._lines = None
+        self._linesMD = None
+        # line -> line encoded for checksum
+        self._encodedLines = {}
         self.log.debug("Created a persistent dict with %s backend",
                        self._metaRW.__class__.__name__)
 
+    def _snapshot(self):
+        """
+        Return metadata that can be read without locking, or None if the
+        caller must use the locked path.
+        """
+        if self._readMostly and not self._inTransaction:
+            return self._published
+        return None
+
     def get(self, key, default=None):
+        md = self._snapshot()
+        if md is not None:
+            return md.get(key, default)
         with self._accessWrapper():
             return self._metadata.get(key, default)
 
     def __getitem__(self, key):
+        md = self._snapshot()
+        if md is not None:
+            return md[key]
         with self._accessWrapper():
             if key not in self._metadata:
                 raise KeyError(key)
@@ -216,14 +247,23 @@ class PersistentDict(object):
             self._metadata.update(metadata)
 
     def keys(self):
+        md = self._snapshot()
+        if md is not None:
+            return md.keys()
         with self._accessWrapper():
             return self._metadata.keys()
 
     def iterkeys(self):
+        md = self._snapshot()
+        if md is not None:
+            return md.iterkeys()
         with self._accessWrapper():
             return self._metadata.iterkeys()
 
     def __iter__(self):
+        md = self._snapshot()
+        if md is not None:
+            return md.__iter__()
         with self._accessWrapper():
             return self._metadata.__iter__()
 
@@ -231,6 +271,12 @@ class PersistentDict(object):
         with self._syncRoot:
             lines = self._metaRW.readlines()
 
+            if lines == self._lines:
+                self.log.debug("read lines (%s) did not change",
+                               self._metaRW.__class__.__name__)
+                self._setMetadata(self._linesMD.copy())
+                return
+
             self.log.debug("read lines (%s)=%s",
                            self._metaRW.__class__.__name__,
                            lines)
@@ -252,8 +298,7 @@ class PersistentDict(object):
 
             if not newMD:
                 self.log.debug("Empty metadata")
-                self._isValid = True
-                self._metadata = newMD
+                self._setMetadata(newMD, lines)
                 return
 
             if declaredChecksum is None:
@@ -263,18 +308,10 @@ class PersistentDict(object):
                 # that empty metadata is always invalid.
                 self.log.warn("data has no embedded checksum - "
                               "trust it as it is")
-                self._isValid = True
-                self._metadata = newMD
+                self._setMetadata(newMD, lines)
                 return
 
-            checksumCalculator = hashlib.sha1()
-            keys = newMD.keys()
-            keys.sort()
-            for key in keys:
-                value = newMD[key]
-                line = "%s=%s" % (key, value)
-                checksumCalculator.update(_preprocessLine(line))
-            computedChecksum = checksumCalculator.hexdigest()
+            computedChecksum, _ = self._checksum(newMD)
 
             if declaredChecksum != computedChecksum:
                 self.log.warning("data seal is broken metadata declares `%s` "
@@ -283,46 +320,81 @@ class PersistentDict(object):
                 raise se.MetaDataSealIsBroken(declaredChecksum,
                                               computedChecksum)
 
-            self._isValid = True
-            self._metadata = newMD
+            self._setMetadata(newMD, lines)
 
     def flush(self, overrideMD):
         with self._syncRoot:
             md = overrideMD
 
-            checksumCalculator = hashlib.sha1()
-            lines = []
-            keys = md.keys()
-            keys.sort()
-            for key in keys:
-                value = md[key]
-                line = "=".join([key, value.strip()])
-                checksumCalculator.update(_preprocessLine(line))
-                lines.append(line)
-
-            computedChecksum = checksumCalculator.hexdigest()
+            computedChecksum, lines = self._checksum(md)
             lines.append("=".join([SHA_CKSUM_TAG, computedChecksum]))
 
             self.log.debug("about to write lines (%s)=%s",
                            self._metaRW.__class__.__name__, lines)
-            self._metaRW.writelines(lines)
+            # The backend may modify the lines, keep our own copy.
+            self._metaRW.writelines(lines[:])
 
-            self._metadata = md
-            self._isValid = True
+            self._setMetadata(md, lines)
 
     def invalidate(self):
         with self._syncRoot:
             self._isValid = False
+            self._published = None
+
+    def _checksum(self, md):
+        """
+        Return the checksum of metadata md and the metadata lines, sorted by
+        key.
+        """
+        checksumCalculator = hashlib.sha1()
+        lines = []
+        encodedLines = {}
+        keys = md.keys()
+        keys.sort()
+        for key in keys:
+            value = md[key]
+            line = "=".join([key, value.strip()])
+            encoded = self._encodedLines.get(line)
+            if encoded is None:
+                encoded = _preprocessLine(line)
+            encodedLines[line] = encoded
+            checksumCalculator.update(encoded)
+            lines.append(line)
+
+        self._encodedLines = encodedLines
+        return checksumCalculator.hexdigest(), lines
+
+    def _setMetadata(self, md, lines=None):
+        """
+        Make md the current valid metadata. If lines are specified, md was
+        read from or written as lines.
+        """
+        if lines is not None:
+            self._lines = lines
+            self._linesMD = md.copy()
+        self._metadata = md
+        self._isValid = True
+        if self._readMostly:
+            self._published = md.copy()
 
     def __len__(self):
+        md = self._snapshot()
+        if md is not None:
+            return len(md)
         with self._accessWrapper():
             return len(self._metadata)
 
     def __contains__(self, item):
+        md = self._snapshot()
+        if md is not None:
+            return item in md
         with self._accessWrapper():
-            return self._metadata.__contains__(self, item)
+            return item in self._metadata
 
     def copy(self):
+        md = self._snapshot()
+        if md is not None:
+            return md.copy()
         with self._accessWrapper():
             return self._metadata.copy()
 
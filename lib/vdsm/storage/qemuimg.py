@@ -151,11 +151,16 @@ def check(image, format=None):
 
 
 def convert(srcImage, dstImage, srcFormat=None, dstFormat=None,
-            dstQcow2Compat=None, backing=None, backingFormat=None):
+            dstQcow2Compat=None, backing=None, backingFormat=None,
+            rate_limit=None):
     cmd = [_qemuimg.cmd, "convert", "-p", "-t", "none", "-T", "none"]
     options = []
     cwdPath = None
 
+    if rate_limit:
+        # Bytes per second.
+        cmd.extend(("-r", str(rate_limit)))
+
     if srcFormat:
         cmd.extend(("-f", srcFormat))
 
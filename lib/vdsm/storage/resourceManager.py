@@ -23,12 +23,13 @@ import threading
 import logging
 import re
 import weakref
+from collections import deque
+from contextlib import contextmanager
 from functools import partial
 from uuid import uuid4
 
 from six.moves import queue
 
-from vdsm import utils
 from vdsm.common import concurrent
 from vdsm.common.logutils import SimpleLogAdapter
 from vdsm.storage import exception as se
@@ -262,8 +263,7 @@ class ResourceRef(object):
                  resRefID=str(uuid4())):
         self._namespace = namespace
         self._name = name
-        self._log = SimpleLogAdapter(self._log, {"ResName": self.fullName,
-                                                 "ResRefID": resRefID})
+        self._resRefID = resRefID
 
         self.__wrappedObject = wrappedObject
         if wrappedObject is not None:
@@ -273,6 +273,13 @@ class ResourceRef(object):
         self._isValid = True
         self._syncRoot = rwlock.RWLock()
 
+    @property
+    def _logger(self):
+        # Created only when needed, since references are created on the
+        # fast path of acquiring a resource.
+        return SimpleLogAdapter(self._log, {"ResName": self.fullName,
+                                            "ResRefID": self._resRefID})
+
     def __wrapObj(self):
         for attr in dir(self.__wrappedObject):
             if hasattr(self, attr) or attr in ('close', 'switchLockType'):
@@ -293,8 +300,8 @@ class ResourceRef(object):
         with self._syncRoot.exclusive:
             self.__wrappedObject = None
             if not self._isValid:
-                self._log.warn("Tried to re-release a resource. Request "
-                               "ignored.")
+                self._logger.warn("Tried to re-release a resource. Request "
+                                  "ignored.")
                 return
 
             releaseResource(self.namespace, self.name)
@@ -324,7 +331,7 @@ class ResourceRef(object):
                 releaseResource(namespace, name)
             t = concurrent.thread(
                 release,
-                args=(self._log, self.namespace, self.name),
+                args=(self._logger, self.namespace, self.name),
                 name="rm/" + self.name[:8])
             t.start()
             self._isValid = False
@@ -339,6 +346,14 @@ class _ResourceManager(object):
     """
     Manages all the resources in the application.
 
+    The resources of every namespace are striped by name; requests for
+    resources in different stripes do not contend on the same lock.
+
+    Acquiring a free resource, or a resource locked as shared with no
+    waiters, is done in one step under the stripe lock, without creating a
+    request or logging. Otherwise the request waits in the resource queue,
+    and is granted in FIFO order when the resource is released.
+
     This class is for internal usage only, clients should use the module
     interface.
     """
@@ -347,7 +362,9 @@ class _ResourceManager(object):
     _resourceNameValidator = re.compile(r"^[^\s.]+$")
 
     def __init__(self):
-        self._syncRoot = rwlock.RWLock()
+        # Serializes namespace registration. Looking up namespaces does not
+        # need the lock.
+        self._syncRoot = threading.Lock()
         self._namespaces = {}
 
     def registerNamespace(self, namespace, factory):
@@ -358,7 +375,7 @@ class _ResourceManager(object):
             raise NamespaceRegistered("Namespace '%s' already registered"
                                       % namespace)
 
-        with self._syncRoot.exclusive:
+        with self._syncRoot:
             if namespace in self._namespaces:
                 raise NamespaceRegistered("Namespace '%s' already registered"
                                           % namespace)
@@ -368,7 +385,7 @@ class _ResourceManager(object):
             self._namespaces[namespace] = Namespace(factory)
 
     def unregisterNamespace(self, namespace):
-        with self._syncRoot.exclusive:
+        with self._syncRoot:
             if namespace not in self._namespaces:
                 raise KeyError("Namespace '%s' doesn't exist" % namespace)
 
@@ -376,39 +393,43 @@ class _ResourceManager(object):
 
     def _unregisterNamespaceLocked(self, namespace):
         """
-        Must be called when holding self._syncRoot.exclusive, and namespace
-        exists in self._namespaces.
+        Must be called when holding self._syncRoot, and namespace exists in
+        self._namespaces.
         """
         self._log.debug("Unregistering namespace '%s'", namespace)
         namespaceObj = self._namespaces[namespace]
-        with namespaceObj.lock:
-            if len(namespaceObj.resources) > 0:
+        with namespaceObj.locked():
+            if any(stripe.resources for stripe in namespaceObj.stripes):
                 raise ResourceManagerError("Cannot unregister Resource "
                                            "Factory '%s'. It has active "
                                            "resources." % (namespace))
 
+            # Requests holding a reference to the namespace will fail.
+            namespaceObj.registered = False
             del self._namespaces[namespace]
 
+    def _getNamespace(self, namespace):
+        try:
+            return self._namespaces[namespace]
+        except KeyError:
+            raise ValueError("Namespace '%s' is not registered with this "
+                             "manager" % namespace)
+
     def getResourceStatus(self, namespace, name):
         if not self._resourceNameValidator.match(name):
             raise ValueError("Invalid resource name '%s'" % name)
 
-        with self._syncRoot.shared:
-            try:
-                namespaceObj = self._namespaces[namespace]
-            except KeyError:
-                raise ValueError("Namespace '%s' is not registered with this "
-                                 "manager" % namespace)
-            resources = namespaceObj.resources
-            with namespaceObj.lock:
-                if not namespaceObj.factory.resourceExists(name):
-                    raise KeyError("No such resource '%s.%s'" % (namespace,
-                                                                 name))
+        namespaceObj = self._getNamespace(namespace)
+        stripe = namespaceObj.stripe(name)
+        with stripe.lock:
+            if not namespaceObj.factory.resourceExists(name):
+                raise KeyError("No such resource '%s.%s'" % (namespace,
+                                                             name))
 
-                if name not in resources:
-                    return LockState.free
+            if name not in stripe.resources:
+                return LockState.free
 
-                return LockState.fromType(resources[name].currentLock)
+            return LockState.fromType(stripe.resources[name].currentLock)
 
     def _switchLockType(self, resourceInfo, newLockType):
         switchLock = (resourceInfo.currentLock != newLockType)
@@ -455,6 +476,10 @@ class _ResourceManager(object):
             except ValueError:
                 raise TypeError("'timeout' must be number")
 
+        resourceInfo = self._tryAcquire(namespace, name, lockType)
+        if resourceInfo is not None:
+            return ResourceRef(namespace, name, resourceInfo.realObj)
+
         resource = queue.Queue()
 
         def callback(req, res):
@@ -482,202 +507,244 @@ class _ResourceManager(object):
 
         :returns: a request object that tracks the current request.
         """
-        fullName = "%s.%s" % (namespace, name)
+        request = Request(namespace, name, lockType, callback)
+        try:
+            resourceInfo = self._tryAcquire(namespace, name, lockType,
+                                            waiter=request)
+        except se.ResourceAcqusitionFailed:
+            request.cancel()
+            return RequestRef(request)
+
+        if resourceInfo is not None:
+            request.grant()
+            request.emit(ResourceRef(namespace, name, resourceInfo.realObj,
+                                     request.reqID))
 
+        return RequestRef(request)
+
+    def _tryAcquire(self, namespace, name, lockType, waiter=None):
+        """
+        Acquire the resource if it is free, or if it is locked as shared,
+        lockType is shared, and nobody is waiting for it.
+
+        If the resource cannot be acquired now and waiter is specified, add
+        waiter to the resource queue.
+
+        :returns: the acquired ResourceInfo, or None if the resource was not
+            acquired.
+        :raises: se.ResourceAcqusitionFailed if the resource factory failed
+            to create the resource.
+        """
         if not self._resourceNameValidator.match(name):
             raise ValueError("Invalid resource name '%s'" % name)
 
         if lockType not in (SHARED, EXCLUSIVE):
             raise ValueError("invalid lock type %r" % lockType)
 
-        request = Request(namespace, name, lockType, callback)
-        self._log.debug("Trying to register resource '%s' for lock type '%s'",
-                        fullName, lockType)
-        with utils.RollbackContext() as contextCleanup, self._syncRoot.shared:
-            try:
-                namespaceObj = self._namespaces[namespace]
-            except KeyError:
+        namespaceObj = self._getNamespace(namespace)
+        stripe = namespaceObj.stripe(name)
+        with stripe.lock:
+            if not namespaceObj.registered:
                 raise ValueError("Namespace '%s' is not registered with this "
                                  "manager" % namespace)
 
-            resources = namespaceObj.resources
-            with namespaceObj.lock:
-                try:
-                    resource = resources[name]
-                except KeyError:
-                    if not namespaceObj.factory.resourceExists(name):
-                        raise KeyError("No such resource '%s'" % (fullName))
-                else:
-                    if len(resource.queue) == 0 and \
-                            resource.currentLock == SHARED and \
-                            request.lockType == SHARED:
-                        resource.activeUsers += 1
-                        self._log.debug("Resource '%s' found in shared state "
-                                        "and queue is empty, Joining current "
-                                        "shared lock (%d active users)",
-                                        fullName, resource.activeUsers)
-                        request.grant()
-                        contextCleanup.defer(request.emit,
-                                             ResourceRef(namespace, name,
-                                                         resource.realObj,
-                                                         request.reqID))
-                        return RequestRef(request)
-
-                    resource.queue.insert(0, request)
+            resource = stripe.resources.get(name)
+            if resource is not None:
+                if (not resource.queue and
+                        resource.currentLock == SHARED and
+                        lockType == SHARED):
+                    resource.activeUsers += 1
+                    return resource
+
+                if waiter is not None:
+                    resource.queue.append(waiter)
                     self._log.debug("Resource '%s' is currently locked, "
                                     "Entering queue (%d in queue)",
-                                    fullName, len(resource.queue))
-                    return RequestRef(request)
-
-                # TODO : Creating the object inside the namespace lock causes
-                #        the entire namespace to lock and might cause
-                #        performance issues. As this is no currently a problem
-                #        I left it as it is to keep the code simple. If there
-                #        is a bottleneck in the resource framework, its
-                #        probably here.
-                try:
-                    obj = namespaceObj.factory.createResource(name, lockType)
-                except:
-                    self._log.warn("Resource factory failed to create resource"
-                                   " '%s'. Canceling request.", fullName,
-                                   exc_info=True)
-                    contextCleanup.defer(request.cancel)
-                    return RequestRef(request)
-
-                resource = resources[name] = ResourceInfo(obj, namespace, name)
-                resource.currentLock = request.lockType
-                resource.activeUsers += 1
+                                    resource.fullName, len(resource.queue))
+                return None
 
-                self._log.debug("Resource '%s' is free. Now locking as '%s' "
-                                "(1 active user)", fullName, request.lockType)
-                request.grant()
-                contextCleanup.defer(request.emit,
-                                     ResourceRef(namespace, name,
-                                                 resource.realObj,
-                                                 request.reqID))
-                return RequestRef(request)
+            if not namespaceObj.factory.resourceExists(name):
+                raise KeyError("No such resource '%s.%s'" % (namespace, name))
+
+            # TODO : Creating the object inside the stripe lock blocks other
+            #        resources in the same stripe. As this is no currently a
+            #        problem I left it as it is to keep the code simple.
+            try:
+                obj = namespaceObj.factory.createResource(name, lockType)
+            except Exception:
+                self._log.warn("Resource factory failed to create resource"
+                               " '%s.%s'. Canceling request.", namespace, name,
+                               exc_info=True)
+                raise se.ResourceAcqusitionFailed()
+
+            resource = ResourceInfo(obj, namespace, name)
+            resource.currentLock = lockType
+            resource.activeUsers = 1
+            stripe.resources[name] = resource
+            return resource
 
     def releaseResource(self, namespace, name):
         # WARN : unlike in resource acquire the user now has the request
         #        object and can CANCEL THE REQUEST at any time. Always use
         #        request.grant between try and except to properly handle such
         #        a case
-        fullName = "%s.%s" % (namespace, name)
-
-        self._log.debug("Trying to release resource '%s'", fullName)
-        with utils.RollbackContext() as contextCleanup, self._syncRoot.shared:
+        namespaceObj = self._getNamespace(namespace)
+        stripe = namespaceObj.stripe(name)
+        with stripe.lock:
             try:
-                namespaceObj = self._namespaces[namespace]
+                resource = stripe.resources[name]
             except KeyError:
-                raise ValueError("Namespace '%s' is not registered with this "
-                                 "manager", namespace)
-            resources = namespaceObj.resources
+                raise ValueError("Resource '%s.%s' is not currently "
+                                 "registered" % (namespace, name))
+
+            resource.activeUsers -= 1
+
+            # Is some one else is using the resource
+            if resource.activeUsers > 0:
+                return
+
+            if resource.queue:
+                granted = self._grantWaiters(resource)
+            else:
+                granted = []
+
+            if resource.activeUsers == 0:
+                self._freeResource(resource)
+                del stripe.resources[name]
+
+        # Notify outside of the lock, callbacks may acquire other resources.
+        for request, ref in granted:
+            request.emit(ref)
+
+    def _grantWaiters(self, resource):
+        """
+        Grant the waiting requests of a free resource. Must be called when
+        holding the resource stripe lock.
+
+        Returns list of (request, ResourceRef) tuples for the granted
+        requests.
+        """
+        granted = []
+        fullName = resource.fullName
+        self._log.debug("Resource '%s' is free, granting the first of %d "
+                        "requests in queue", fullName, len(resource.queue))
+
+        while resource.queue:
+            nextRequest = resource.queue.popleft()
+            # We lock the request to simulate a transaction. We cannot
+            # grant the request before there is a resource switch. And
+            # we can't do a resource switch before we can guarantee
+            # that the request will be granted.
+            with nextRequest.syncRoot:
+                if nextRequest.canceled():
+                    self._log.debug("Request '%s' was canceled, "
+                                    "Ignoring it.", nextRequest)
+                    continue
 
-            with namespaceObj.lock:
                 try:
-                    resource = resources[name]
-                except KeyError:
-                    raise ValueError("Resource '%s.%s' is not currently "
-                                     "registered" % (namespace, name))
+                    self._switchLockType(resource, nextRequest.lockType)
+                except Exception:
+                    self._log.warn("Resource factory failed to create "
+                                   "resource '%s'. Canceling request.",
+                                   fullName, exc_info=True)
+                    nextRequest.cancel()
+                    continue
+
+                nextRequest.grant()
+                granted.append((nextRequest, self._resourceRef(
+                    resource, nextRequest)))
+                resource.activeUsers += 1
 
-                resource.activeUsers -= 1
-                self._log.debug("Released resource '%s' (%d active users)",
-                                fullName, resource.activeUsers)
+                self._log.debug("Request '%s' was granted", nextRequest)
+                break
 
-                # Is some one else is using the resource
-                if resource.activeUsers > 0:
-                    return
-                self._log.debug("Resource '%s' is free, finding out if anyone "
-                                "is waiting for it.", fullName)
-                # Grant a request
-                while True:
-                    # Is there someone waiting for the resource
-                    if len(resource.queue) == 0:
-                        self._freeResource(resources[name])
-                        del resources[name]
-                        self._log.debug("No one is waiting for resource '%s', "
-                                        "Clearing records.", fullName)
-                        return
-
-                    self._log.debug("Resource '%s' has %d requests in queue. "
-                                    "Handling top request.", fullName,
-                                    len(resource.queue))
-                    nextRequest = resource.queue.pop()
-                    # We lock the request to simulate a transaction. We cannot
-                    # grant the request before there is a resource switch. And
-                    # we can't do a resource switch before we can guarantee
-                    # that the request will be granted.
-                    with nextRequest.syncRoot:
-                        if nextRequest.canceled():
-                            self._log.debug("Request '%s' was canceled, "
-                                            "Ignoring it.", nextRequest)
-                            continue
-
-                        try:
-                            self._switchLockType(resource,
-                                                 nextRequest.lockType)
-                        except Exception:
-                            self._log.warn("Resource factory failed to create "
-                                           "resource '%s'. Canceling request.",
-                                           fullName, exc_info=True)
-                            nextRequest.cancel()
-                            continue
-
-                        nextRequest.grant()
-                        contextCleanup.defer(
-                            partial(nextRequest.emit,
-                                    ResourceRef(namespace, name,
-                                                resource.realObj,
-                                                nextRequest.reqID)))
-
-                        resource.activeUsers += 1
-
-                        self._log.debug("Request '%s' was granted",
-                                        nextRequest)
-                        break
-
-                # If the lock is exclusive were done
-                if resource.currentLock == EXCLUSIVE:
-                    return
+        # If the lock is exclusive were done
+        if resource.currentLock == EXCLUSIVE:
+            return granted
 
-                # Keep granting shared locks
-                self._log.debug("This is a shared lock. Granting all shared "
-                                "requests")
-                while len(resource.queue) > 0:
-
-                    nextRequest = resource.queue[-1]
-                    if nextRequest.canceled():
-                        resource.queue.pop()
-                        continue
-
-                    if nextRequest.lockType == EXCLUSIVE:
-                        break
-
-                    nextRequest = resource.queue.pop()
-                    try:
-                        nextRequest.grant()
-                        contextCleanup.defer(
-                            partial(nextRequest.emit,
-                                    ResourceRef(namespace, name,
-                                                resource.realObj,
-                                                nextRequest.reqID)))
-                    except RequestAlreadyProcessedError:
-                        continue
+        # Keep granting shared locks
+        while resource.queue:
+            nextRequest = resource.queue[0]
+            if nextRequest.canceled():
+                resource.queue.popleft()
+                continue
 
-                    resource.activeUsers += 1
-                    self._log.debug("Request '%s' was granted (%d "
-                                    "active users)", nextRequest,
-                                    resource.activeUsers)
+            if nextRequest.lockType == EXCLUSIVE:
+                break
+
+            resource.queue.popleft()
+            try:
+                nextRequest.grant()
+            except RequestAlreadyProcessedError:
+                continue
+
+            granted.append((nextRequest, self._resourceRef(
+                resource, nextRequest)))
+            resource.activeUsers += 1
+            self._log.debug("Request '%s' was granted (%d "
+                            "active users)", nextRequest,
+                            resource.activeUsers)
+
+        return granted
+
+    def _resourceRef(self, resource, request):
+        return ResourceRef(resource.namespace, resource.name,
+                           resource.realObj, request.reqID)
+
+
+# Number of resource stripes per namespace.
+_STRIPES = 16
 
 
 class Namespace(object):
     """
     Namespace struct
     """
-    def __init__(self, factory):
-        self.resources = {}
-        self.lock = threading.Lock()  # rwlock.RWLock()
+    def __init__(self, factory, stripes=_STRIPES):
+        self.stripes = tuple(_Stripe() for i in range(stripes))
         self.factory = factory
+        self.registered = True
+
+    def stripe(self, name):
+        return self.stripes[hash(name) % len(self.stripes)]
+
+    @property
+    def resources(self):
+        """
+        Return a dict of all resources, for debugging.
+        """
+        with self.locked():
+            resources = {}
+            for stripe in self.stripes:
+                resources.update(stripe.resources)
+            return resources
+
+    @contextmanager
+    def locked(self):
+        """
+        Lock all stripes.
+        """
+        locked = []
+        try:
+            for stripe in self.stripes:
+                stripe.lock.acquire()
+                locked.append(stripe.lock)
+            yield
+        finally:
+            for lock in reversed(locked):
+                lock.release()
+
+
+class _Stripe(object):
+    """
+    Resources whose names map to the same stripe, and the lock protecting
+    them.
+    """
+    __slots__ = ("lock", "resources")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resources = {}
 
 
 class ResourceInfo(object):
@@ -685,7 +752,7 @@ class ResourceInfo(object):
     Resource struct
     """
     def __init__(self, realObj, namespace, name):
-        self.queue = []
+        self.queue = deque()
         self.activeUsers = 0
         self.currentLock = None
         self.realObj = realObj
@@ -522,6 +522,37 @@ class StorageDomainManifest(object):
         finally:
             self.releaseHostId(host_id)
 
+    @contextmanager
+    def volume_metadata_snapshot(self):
+        """
+        Scope for reading the metadata of many volumes, e.g. when walking a
+        volume chain. Domains keeping volume metadata in a shared area may
+        serve reads in this scope from memory.
+        """
+        yield
+
+    def refreshImageVolumes(self, imgUUID):
+        """
+        Called before looking up the volumes of image imgUUID, which may
+        have been changed by another host. Domains caching the volumes may
+        read them again from storage.
+        """
+
+    def refreshVolumes(self):
+        """
+        Called before walking all the volumes of the domain. Domains caching
+        the volumes may read them again from storage.
+        """
+
+    def getVolsOfImage(self, imgUUID):
+        """
+        Return the volumes of image imgUUID, see getVolsOfImage(). The image
+        volumes are read from storage, since another host may have changed
+        them.
+        """
+        self.refreshImageVolumes(imgUUID)
+        return getVolsOfImage(self.getAllVolumes(), imgUUID)
+
     def inquireDomainLock(self):
         return self._domainLock.inquire(self.getDomainLease())
 
@@ -715,6 +746,15 @@ class StorageDomain(object):
     def getAllVolumes(self):
         return self._manifest.getAllVolumes()
 
+    def refreshImageVolumes(self, imgUUID):
+        self._manifest.refreshImageVolumes(imgUUID)
+
+    def refreshVolumes(self):
+        self._manifest.refreshVolumes()
+
+    def getVolsOfImage(self, imgUUID):
+        return self._manifest.getVolsOfImage(imgUUID)
+
     def prepareMailbox(self):
         """
         This method has been introduced in order to prepare the mailbox
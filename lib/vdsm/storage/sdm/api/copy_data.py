@@ -25,6 +25,7 @@ import logging
 from vdsm import jobs
 from vdsm.common import properties
 from vdsm.storage import constants as sc
+from vdsm.storage import copyscheduler
 from vdsm.storage import guarded
 from vdsm.storage import qemuimg
 from vdsm.storage import resourceManager as rm
@@ -46,13 +47,20 @@ class Job(base.Job):
         super(Job, self).__init__(job_id, 'copy_data', host_id)
         self._source = _create_endpoint(source, host_id, writable=False)
         self._dest = _create_endpoint(destination, host_id, writable=True)
+        self._request = None
         self._operation = None
 
     @property
     def progress(self):
         return getattr(self._operation, 'progress', None)
 
+    @property
+    def queued(self):
+        return self._request is not None and self._request.waiting
+
     def _abort(self):
+        if self._request:
+            self._request.cancel()
         if self._operation:
             self._operation.abort()
 
@@ -71,7 +79,10 @@ class Job(base.Job):
                     src_format = self._source.qemu_format
                     dst_format = self._dest.qemu_format
 
-                with self._dest.volume_operation():
+                self._request = copyscheduler.request(
+                    self._source.sd_id, self._dest.sd_id, self._source.size)
+
+                with self._request, self._dest.volume_operation():
                     self._operation = qemuimg.convert(
                         self._source.path,
                         self._dest.path,
@@ -79,7 +90,8 @@ class Job(base.Job):
                         dstFormat=dst_format,
                         dstQcow2Compat=self._dest.qcow2_compat,
                         backing=self._dest.backing_path,
-                        backingFormat=self._dest.backing_qemu_format)
+                        backingFormat=self._dest.backing_qemu_format,
+                        rate_limit=self._request.rate_limit)
                     self._operation.run()
 
 
@@ -131,6 +143,13 @@ class CopyDataDivEndpoint(properties.Owner):
     def qemu_format(self):
         return sc.fmt2str(self.volume.getFormat())
 
+    @property
+    def size(self):
+        """
+        Return the allocated size of the volume in bytes.
+        """
+        return self.volume.getVolumeTrueSize(bs=1)
+
     @property
     def backing_path(self):
         parent_vol = self.volume.getParentVolume()
@@ -56,6 +56,7 @@ from vdsm.storage import constants as sc
 from vdsm.storage import exception as se
 from vdsm.storage import lvm
 from vdsm.storage import qemuimg
+from vdsm.storage import volumeindex
 from vdsm.storage.volumemetadata import VolumeMetadata
 
 
@@ -256,10 +257,17 @@ class FileVolumeArtifacts(VolumeArtifacts):
             if e.errno == errno.EEXIST:
                 raise se.VolumeAlreadyExists("Path %r exists", self.meta_path)
             raise
+        finally:
+            volumeindex.image_changed(self.sd_manifest.sdUUID,
+                                      os.path.basename(self.artifacts_dir))
 
         # If we created a new image directory, rename it to the correct name
         if not self.is_image():
-            self._oop.os.rename(self.artifacts_dir, self._image_dir)
+            try:
+                self._oop.os.rename(self.artifacts_dir, self._image_dir)
+            finally:
+                volumeindex.image_changed(self.sd_manifest.sdUUID,
+                                          self.img_id)
 
     def _get_volume_preallocation(self, vol_format):
         # File volumes are always sparse regardless of format
@@ -0,0 +1,203 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+slotcache - cache of block volume metadata slots
+================================================
+
+Block storage domains keep the metadata of every volume in a slot in the
+metadata LV. Walking a volume chain reads the slot of every volume in the
+chain several times, one direct I/O per read.
+
+SlotCache reads the used region of the metadata LV in a few large direct
+reads, and parses all the records at once. Code walking volume chains
+enters a snapshot() scope; inside the scope, metadata reads in the same
+thread are served from memory. Outside of a scope the cache is not used, so
+code modifying metadata (read, modify, write) always reads the slot from
+storage.
+
+Metadata may be changed by other hosts. A snapshot is shared by later
+scopes only while it is younger than max_age seconds. When this host writes
+a slot, the slot is invalidated and read again from storage.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import threading
+from contextlib import contextmanager
+
+from vdsm.common.time import monotonic_time
+from vdsm.storage import constants as sc
+from vdsm.storage import directio
+from vdsm.storage import exception as se
+from vdsm.storage.volumemetadata import VolumeMetadata
+
+# Size of the largest read when loading a snapshot (2048 slots).
+MAX_READ_SIZE = 1024**2
+
+log = logging.getLogger("storage.slotcache")
+
+
+class SlotCache(object):
+    """
+    Metadata slots of a block storage domain.
+
+    Arguments:
+        path (callable): return the path to the metadata LV.
+        region (callable): return (first, end) of the slots in use.
+        max_age (float): maximum age in seconds of a shared snapshot. Use 0
+            to load a new snapshot for every scope.
+    """
+
+    def __init__(self, path, region, max_age, read_size=MAX_READ_SIZE):
+        self._path = path
+        self._region = region
+        self._max_age = max_age
+        self._read_size = read_size
+        # Protects the snapshot and the counters.
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # slot -> VolumeMetadata, None if not loaded.
+        self._records = None
+        self._first = 0
+        self._end = 0
+        self._loaded = None
+        self._loads = 0
+        self._hits = 0
+        self._misses = 0
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Serve metadata reads in this thread from memory, until the scope is
+        exited. Scopes may be nested.
+        """
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            # The snapshot used by this scope, set on the first read.
+            self._local.snapshot = None
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+
+    def get(self, slot):
+        """
+        Return the VolumeMetadata in slot, or None if the caller is not in
+        a snapshot scope, or the slot does not contain valid metadata. The
+        caller must read the slot from storage in this case.
+        """
+        if not getattr(self._local, "depth", 0):
+            return None
+
+        with self._lock:
+            if self._stale(slot):
+                try:
+                    self._load()
+                except (OSError, IOError) as e:
+                    log.warning("Cannot load metadata slots from %s: %s",
+                                self._path(), e)
+                    self._records = None
+                    self._misses += 1
+                    return None
+
+            self._local.snapshot = self._loads
+            md = self._records.get(slot)
+            if md is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return md
+
+    def invalidate(self, slot):
+        """
+        Called after this host wrote slot, or failed to write it.
+        """
+        with self._lock:
+            if self._records is not None:
+                self._records.pop(slot, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "slots": len(self._records or ()),
+                "loads": self._loads,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+    def _stale(self, slot):
+        if self._records is None:
+            return True
+        # The slot may have been allocated after the snapshot was loaded.
+        if not self._first <= slot < self._end:
+            return True
+        # The snapshot used by this scope is fresh enough until the scope
+        # is exited.
+        if self._local.snapshot == self._loads:
+            return False
+        return monotonic_time() - self._loaded >= self._max_age
+
+    def _load(self):
+        first, end = self._region()
+        records = {}
+        offset = first * sc.METADATA_SIZE
+        stop = end * sc.METADATA_SIZE
+
+        if offset < stop:
+            size = min(self._read_size, stop - offset)
+            with directio.DirectFile(self._path(), "r") as f, \
+                    directio.AlignedBuffer(size) as buf:
+                while offset < stop:
+                    count = min(size, stop - offset)
+                    nread = f.pread(buf, offset, size=count)
+                    _parse_slots(buf[:nread], offset // sc.METADATA_SIZE,
+                                 records)
+                    # Slots after the end of the LV are empty.
+                    if nread < count:
+                        break
+                    offset += count
+
+        log.debug("Loaded %d metadata slots (first=%d, end=%d) from %s",
+                  len(records), first, end, self._path())
+        self._records = records
+        self._first = first
+        self._end = end
+        self._loaded = monotonic_time()
+        self._loads += 1
+
+
+def _parse_slots(data, first, records):
+    """
+    Parse the slots in data, starting with slot first, adding the valid
+    records to records.
+    """
+    for i in range(len(data) // sc.METADATA_SIZE):
+        start = i * sc.METADATA_SIZE
+        block = data[start:start + sc.METADATA_SIZE]
+        # Never used, or cleared when a volume was removed.
+        if block.startswith((b"\0", b"NONE=")):
+            continue
+        try:
+            records[first + i] = VolumeMetadata.from_lines(block.splitlines())
+        except (se.MetaDataKeyNotFoundError, ValueError):
+            log.debug("Ignoring invalid metadata in slot %d", first + i)
@@ -0,0 +1,664 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+volumeindex - in-memory index of storage domain volumes
+=======================================================
+
+Block storage domains
+---------------------
+
+Block storage domains keep the image, parent and metadata slot of a volume
+in the volume LV tags. Building the volume tree or finding a free metadata
+slot requires parsing the tags of all the LVs in the domain, which is slow
+on domains with thousands of LVs.
+
+BlockVolumeIndex keeps this information in memory. The index registers
+with the LVM cache, and when LVs are invalidated or removed, only these LVs
+are parsed again on the next access. If the entire VG was invalidated, the
+index is rebuilt.
+
+The index keeps three maps:
+
+- volumes: volume -> (image, parent)
+- images: image -> set of volumes
+- slots: metadata slots occupied by the volumes, kept as a sorted list of
+  intervals and a sorted list of the free gaps between them.
+
+File storage domains
+--------------------
+
+File storage domains keep every volume in the image directory, with a
+metadata file named <volUUID>.meta. Finding the volumes requires globbing
+all the image directories, which is slow on domains with many images.
+
+FileVolumeIndex keeps the volumes of every image directory in memory. When
+an image is changed by this host, image_changed() marks it for scanning on
+the next access. Changes by other processes are detected:
+
+- On local file systems, using inotify watches on the images directory and
+  on every image directory.
+- On shared file systems, by checking the images directory mtime on every
+  access, detecting added and removed images. Changes to existing images
+  by other hosts do not modify this directory, so the index is rebuilt
+  when it is older than max_age seconds, and image lookups scan the image
+  directory first.
+"""
+
+from __future__ import absolute_import
+
+import bisect
+import logging
+import os
+import threading
+from collections import namedtuple
+
+import pyinotify
+
+from vdsm.common.time import monotonic_time
+from vdsm.storage import constants as sc
+from vdsm.storage import exception as se
+from vdsm.storage import lvm
+
+log = logging.getLogger("storage.volumeindex")
+
+BlockSDVol = namedtuple("BlockSDVol", "name, image, parent")
+
+# Parsed LV tags. offset is None if the LV has no metadata slot.
+_Entry = namedtuple("_Entry", "tags, image, parent, temporary, offset, size")
+
+
+def parse_tags(tags):
+    """
+    Parse LV tags, returning an _Entry.
+    """
+    image = ""
+    parent = ""
+    offset = None
+    size = sc.VOLUME_MDNUMBLKS
+    for tag in tags:
+        if tag.startswith(sc.TAG_PREFIX_IMAGE):
+            image = tag[len(sc.TAG_PREFIX_IMAGE):]
+        elif tag.startswith(sc.TAG_PREFIX_PARENT):
+            parent = tag[len(sc.TAG_PREFIX_PARENT):]
+        elif tag.startswith(sc.TAG_PREFIX_MDNUMBLKS):
+            size = int(tag[len(sc.TAG_PREFIX_MDNUMBLKS):])
+        elif tag.startswith(sc.TAG_PREFIX_MD):
+            offset = int(tag[len(sc.TAG_PREFIX_MD):])
+    temporary = sc.TEMP_VOL_LVTAG in tags
+    return _Entry(tags, image, parent, temporary, offset, size)
+
+
+class SlotMap(object):
+    """
+    Metadata slots occupied by volumes.
+
+    Occupied slots are kept in a sorted list of (offset, size) intervals.
+    Free gaps between the intervals, starting at the first usable slot, are
+    kept in sorted lists of gap starts and ends; the last gap has no end.
+
+    When intervals do not overlap, adding an interval into a free gap and
+    removing an interval update the gaps in O(log n). Otherwise the gaps
+    are computed again on the next allocation.
+    """
+
+    def __init__(self):
+        self._intervals = []
+        # Free gaps, valid for self._first.
+        self._first = None
+        self._starts = []
+        self._ends = []
+        # True if the gaps are valid and no intervals overlap.
+        self._disjoint = False
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def occupied(self):
+        return list(self._intervals)
+
+    def add(self, offset, size):
+        bisect.insort(self._intervals, (offset, size))
+        if not self._disjoint:
+            return
+        end = offset + size
+        i = bisect.bisect_right(self._starts, offset) - 1
+        if i < 0 or (self._ends[i] is not None and self._ends[i] < end):
+            # Overlaps other intervals, or the area before the first slot.
+            self._disjoint = False
+            return
+        start, gap_end = self._starts[i], self._ends[i]
+        gaps = []
+        if start < offset:
+            gaps.append((start, offset))
+        if gap_end is None or end < gap_end:
+            gaps.append((end, gap_end))
+        self._starts[i:i + 1] = [s for s, e in gaps]
+        self._ends[i:i + 1] = [e for s, e in gaps]
+
+    def remove(self, offset, size):
+        i = bisect.bisect_left(self._intervals, (offset, size))
+        if i == len(self._intervals) or self._intervals[i] != (offset, size):
+            raise KeyError((offset, size))
+        del self._intervals[i]
+        if not self._disjoint:
+            return
+        if offset < self._first:
+            self._disjoint = False
+            return
+        start = offset
+        end = offset + size
+        # Merge with the gap ending at offset.
+        i = bisect.bisect_left(self._starts, offset) - 1
+        if i >= 0 and self._ends[i] == offset:
+            start = self._starts[i]
+        else:
+            i += 1
+        # Merge with the gap starting at end.
+        j = bisect.bisect_left(self._starts, end)
+        if j < len(self._starts) and self._starts[j] == end:
+            end = self._ends[j]
+            j += 1
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+
+    def find(self, first, size):
+        """
+        Return the first free slot at or after first with room for size
+        slots.
+        """
+        if not self._disjoint or first != self._first:
+            self._compute_gaps(first)
+        # Usually all slots are of the same size, and the first gap fits.
+        for start, end in zip(self._starts, self._ends):
+            if end is None or end - start >= size:
+                return start
+
+    def _compute_gaps(self, first):
+        self._first = first
+        self._starts = []
+        self._ends = []
+        self._disjoint = True
+        cursor = first
+        prev_end = None
+        for offset, size in self._intervals:
+            end = offset + size
+            if prev_end is not None and offset < prev_end:
+                self._disjoint = False
+            prev_end = end if prev_end is None else max(prev_end, end)
+            if offset < first:
+                self._disjoint = False
+            if offset > cursor:
+                self._starts.append(cursor)
+                self._ends.append(offset)
+            cursor = max(cursor, end)
+        self._starts.append(cursor)
+        self._ends.append(None)
+
+
+class BlockVolumeIndex(object):
+    """
+    Index of the volumes in a block storage domain.
+    """
+
+    def __init__(self, sdUUID, special_lvs=()):
+        self._sdUUID = sdUUID
+        self._special_lvs = frozenset(special_lvs)
+        # Protects the index maps.
+        self._lock = threading.Lock()
+        # Protects self._stale, self._dirty and self._removed. Taken by the
+        # LVM cache listener callbacks, which may run while self._lock is
+        # held.
+        self._dirty_lock = threading.Lock()
+        self._stale = True
+        self._dirty = set()
+        self._removed = set()
+        self._entries = {}
+        self._images = {}
+        self._slots = SlotMap()
+        # LVs we warned about, so we warn once, and not on every rebuild.
+        self._warned = set()
+        lvm.addLVListener(sdUUID, self)
+
+    # LVM cache listener interface.
+
+    def lvsChanged(self, vgName, lvNames):
+        with self._dirty_lock:
+            if lvNames is None:
+                self._stale = True
+                self._dirty.clear()
+                self._removed.clear()
+            elif not self._stale:
+                self._dirty.update(lvNames)
+                self._removed.difference_update(lvNames)
+
+    def lvsRemoved(self, vgName, lvNames):
+        # Removed LVs are not in the LVM cache, and looking them up would
+        # reload the entire VG, so we drop them without a lookup.
+        with self._dirty_lock:
+            if not self._stale:
+                self._removed.update(lvNames)
+                self._dirty.difference_update(lvNames)
+
+    # Queries.
+
+    def volumes(self):
+        """
+        Return dict {volUUID: BlockSDVol} of the volumes in the domain,
+        excluding temporary volumes and LVs without image and parent tags.
+        """
+        with self._lock:
+            self._sync()
+            return {name: BlockSDVol(name, e.image, e.parent)
+                    for name, e in self._entries.items()
+                    if e.image and e.parent and not e.temporary}
+
+    def image_volumes(self, imgUUID):
+        """
+        Return the names of the LVs tagged with imgUUID.
+        """
+        with self._lock:
+            self._sync()
+            return sorted(self._images.get(imgUUID, ()))
+
+    def occupied_slots(self):
+        """
+        Return sorted list of (offset, size) metadata slots.
+        """
+        with self._lock:
+            self._sync()
+            return self._slots.occupied()
+
+    def free_slot(self, first, size):
+        """
+        Return the first metadata slot at or after first with room for size
+        slots.
+        """
+        with self._lock:
+            self._sync()
+            return self._slots.find(first, size)
+
+    # Private.
+
+    def _sync(self):
+        with self._dirty_lock:
+            stale = self._stale
+            dirty = self._dirty
+            removed = self._removed
+            self._stale = False
+            self._dirty = set()
+            self._removed = set()
+
+        if stale:
+            self._rebuild()
+            return
+
+        for name in removed:
+            entry = self._entries.get(name)
+            if entry is not None:
+                self._remove(name, entry)
+        if dirty:
+            self._update(dirty)
+
+    def _rebuild(self):
+        log.debug("Rebuilding volume index for domain %s", self._sdUUID)
+        self._entries = {}
+        self._images = {}
+        self._slots = SlotMap()
+        try:
+            lvs = lvm.getLV(self._sdUUID)
+        except se.LogicalVolumeDoesNotExistError:
+            lvs = []
+        for lv in lvs:
+            self._add(lv.name, parse_tags(lv.tags))
+        self._warned.intersection_update(self._entries)
+
+    def _update(self, names):
+        for name in names:
+            entry = self._entries.get(name)
+            try:
+                lv = lvm.getLV(self._sdUUID, name)
+            except se.LogicalVolumeDoesNotExistError:
+                lv = None
+            if lv is not None and entry is not None and lv.tags == entry.tags:
+                continue
+            if entry is not None:
+                self._remove(name, entry)
+            if lv is not None:
+                self._add(name, parse_tags(lv.tags))
+
+    def _add(self, name, entry):
+        self._entries[name] = entry
+        if entry.image:
+            self._images.setdefault(entry.image, set()).add(name)
+        if name in self._special_lvs:
+            # Special LVs have no image, parent, or metadata slot.
+            return
+        warn = name not in self._warned
+        if not (entry.image and entry.parent or entry.temporary):
+            if warn:
+                self._warned.add(name)
+                log.warning("Ignoring Volume %s that lacks minimal tag set "
+                            "tags %s", name, entry.tags)
+        if entry.offset is None:
+            if warn:
+                self._warned.add(name)
+                log.warning("Could not find mapping for lv %s/%s",
+                            self._sdUUID, name)
+            return
+        self._slots.add(entry.offset, entry.size)
+
+    def _remove(self, name, entry):
+        del self._entries[name]
+        self._warned.discard(name)
+        if entry.image:
+            names = self._images[entry.image]
+            names.discard(name)
+            if not names:
+                del self._images[entry.image]
+        if name not in self._special_lvs and entry.offset is not None:
+            self._slots.remove(entry.offset, entry.size)
+
+
+# Changes to the images directory and image directories, detected using
+# inotify.
+_INOTIFY_MASK = (pyinotify.IN_CREATE |
+                 pyinotify.IN_DELETE |
+                 pyinotify.IN_MOVED_FROM |
+                 pyinotify.IN_MOVED_TO |
+                 pyinotify.IN_DELETE_SELF |
+                 pyinotify.IN_MOVE_SELF)
+
+# Volume metadata file extension, see fileVolume.META_FILEEXT.
+_META_FILEEXT = ".meta"
+
+# A change to the images directory may keep the mtime if it is done in
+# the same second as the previous change. The mtime is set using the clock
+# of the server, which may differ from our clock, so we cannot tell if the
+# mtime is recent. Instead, we list the directory on every check until this
+# number of seconds passed since we have seen the mtime. After that, any
+# change modifies the mtime.
+_MTIME_GRANULARITY = 1
+
+_file_indexes = {}
+_file_indexes_lock = threading.Lock()
+
+
+def file_volume_index(sdUUID, images_dir, max_age, inotify=False):
+    """
+    Return the volume index of file storage domain sdUUID, creating it if
+    needed. The index is shared by all the objects of the same domain.
+    """
+    with _file_indexes_lock:
+        index = _file_indexes.get(sdUUID)
+        if index is None or index.images_dir != images_dir:
+            if index is not None:
+                index.close()
+            index = FileVolumeIndex(sdUUID, images_dir, max_age,
+                                    inotify=inotify)
+            _file_indexes[sdUUID] = index
+        return index
+
+
+def image_changed(sdUUID, imgUUID):
+    """
+    Report that this host changed the volumes in image imgUUID, or created,
+    renamed or removed the image directory.
+    """
+    index = _file_indexes.get(sdUUID)
+    if index is not None:
+        index.image_changed(imgUUID)
+
+
+class FileVolumeIndex(object):
+    """
+    Index of the volumes in a file storage domain.
+
+    The domain is scanned using the oop object of the caller. The index
+    does not keep it, so an idle ioprocess can be terminated.
+    """
+
+    def __init__(self, sdUUID, images_dir, max_age, inotify=False,
+                 clock=monotonic_time):
+        self._sdUUID = sdUUID
+        self.images_dir = images_dir
+        self._max_age = max_age
+        self._clock = clock
+        # Protects the index and the counters.
+        self._lock = threading.Lock()
+        # Protects self._stale and self._dirty. Taken by image_changed(),
+        # which may be called while self._lock is held.
+        self._dirty_lock = threading.Lock()
+        self._stale = True
+        self._dirty = set()
+        # image -> frozenset of volumes
+        self._images = {}
+        # Images directory mtime when it was checked, None if unknown.
+        self._mtime = None
+        # When we have seen self._mtime, None if the mtime can be trusted.
+        self._mtime_seen = None
+        # When the index was last rebuilt.
+        self._rebuilt = None
+        self._hits = 0
+        self._misses = 0
+        self._rebuilds = 0
+        self._notifier = None
+        if inotify:
+            self._start_inotify()
+
+    def image_changed(self, imgUUID):
+        with self._dirty_lock:
+            self._dirty.add(imgUUID)
+
+    def invalidate(self):
+        with self._dirty_lock:
+            self._stale = True
+            self._dirty.clear()
+
+    # Queries.
+
+    def images(self, oop):
+        """
+        Return dict {imgUUID: frozenset of volUUIDs} of all the directories
+        in the images directory.
+        """
+        with self._lock:
+            self._sync(oop)
+            return dict(self._images)
+
+    def stats(self):
+        """
+        Return a copy of the index counters:
+
+        age: seconds since the index was rebuilt, None if it was not built
+        hits: accesses served without scanning the domain
+        misses: accesses requiring scanning of some images, or rebuilding
+        rebuilds: number of times the entire domain was scanned
+        hit_rate: hits / (hits + misses), None before the first access
+        inotify: whether changes are detected using inotify
+        """
+        with self._lock:
+            accesses = self._hits + self._misses
+            return {
+                "age": (None if self._rebuilt is None
+                        else self._clock() - self._rebuilt),
+                "hits": self._hits,
+                "misses": self._misses,
+                "rebuilds": self._rebuilds,
+                "hit_rate": (float(self._hits) / accesses if accesses
+                             else None),
+                "inotify": self._notifier is not None,
+            }
+
+    def close(self):
+        with self._lock:
+            self._stop_inotify()
+
+    # Private.
+
+    def _sync(self, oop):
+        if self._notifier is not None:
+            self._read_events()
+        elif (self._rebuilt is None or
+              self._clock() - self._rebuilt >= self._max_age):
+            self.invalidate()
+
+        with self._dirty_lock:
+            stale = self._stale
+            dirty = self._dirty
+            self._stale = False
+            self._dirty = set()
+
+        if stale:
+            self._misses += 1
+            self._rebuild(oop)
+            return
+
+        if self._notifier is None:
+            dirty.update(self._check_images_dir(oop))
+
+        if dirty:
+            self._misses += 1
+            for imgUUID in dirty:
+                self._scan_image(oop, imgUUID)
+        else:
+            self._hits += 1
+
+    def _rebuild(self, oop):
+        log.debug("Rebuilding volume index for domain %s", self._sdUUID)
+        self._rebuilds += 1
+        self._rebuilt = self._clock()
+        # Take the mtime before scanning; changes during the scan will be
+        # detected on the next access.
+        self._mtime = oop.os.stat(self.images_dir).st_mtime
+        self._mtime_seen = self._rebuilt
+
+        images = {}
+        pattern = os.path.join(self.images_dir, "*", "*" + _META_FILEEXT)
+        for path in oop.glob.glob(pattern):
+            head, tail = os.path.split(path)
+            volUUID = os.path.splitext(tail)[0]
+            images.setdefault(os.path.basename(head), []).append(volUUID)
+
+        # Directories without volumes.
+        for path in oop.glob.glob(os.path.join(self.images_dir, "*")):
+            imgUUID = os.path.basename(path)
+            if imgUUID not in images and oop.os.path.isdir(path):
+                images[imgUUID] = ()
+
+        self._images = {imgUUID: frozenset(volUUIDs)
+                        for imgUUID, volUUIDs in images.items()}
+
+    def _check_images_dir(self, oop):
+        """
+        Return the images added or removed since the images directory was
+        checked.
+        """
+        mtime = oop.os.stat(self.images_dir).st_mtime
+        now = self._clock()
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self._mtime_seen = now
+        elif self._mtime_seen is None:
+            return set()
+        elif now - self._mtime_seen >= _MTIME_GRANULARITY:
+            # Changes keeping this mtime were done before now; list the
+            # directory once more, and trust the mtime from now on.
+            self._mtime_seen = None
+
+        paths = oop.glob.glob(os.path.join(self.images_dir, "*"))
+        names = set(os.path.basename(path) for path in paths)
+        return names.symmetric_difference(self._images)
+
+    def _scan_image(self, oop, imgUUID):
+        image_dir = os.path.join(self.images_dir, imgUUID)
+        pattern = os.path.join(image_dir, "*" + _META_FILEEXT)
+        volUUIDs = [os.path.splitext(os.path.basename(path))[0]
+                    for path in oop.glob.glob(pattern)]
+        if volUUIDs or oop.os.path.isdir(image_dir):
+            self._images[imgUUID] = frozenset(volUUIDs)
+        else:
+            self._images.pop(imgUUID, None)
+
+    # inotify.
+
+    def _start_inotify(self):
+        try:
+            wm = pyinotify.WatchManager()
+        except EnvironmentError as e:
+            log.warning("Cannot create inotify instance for %s, checking "
+                        "directory mtime instead: %s", self.images_dir, e)
+            return
+        notifier = pyinotify.Notifier(wm, default_proc_fun=self._process_event)
+        try:
+            # Watching the image directories may exceed the maximum number
+            # of watches (fs.inotify.max_user_watches).
+            wm.add_watch(self.images_dir, _INOTIFY_MASK,
+                         proc_fun=self._process_event, rec=True,
+                         auto_add=True, quiet=False)
+        except pyinotify.WatchManagerError as e:
+            log.warning("Cannot watch %s, checking directory mtime "
+                        "instead: %s", self.images_dir, e)
+            notifier.stop()
+            return
+        self._notifier = notifier
+
+    def _stop_inotify(self):
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
+
+    def _read_events(self):
+        try:
+            while self._notifier.check_events(timeout=0):
+                self._notifier.read_events()
+                self._notifier.process_events()
+        except (pyinotify.NotifierError, EnvironmentError) as e:
+            log.warning("Error reading inotify events for %s, checking "
+                        "directory mtime instead: %s", self.images_dir, e)
+            self._stop_inotify()
+            self.invalidate()
+
+    def _process_event(self, event):
+        if event.mask & pyinotify.IN_Q_OVERFLOW:
+            log.warning("inotify queue overflow, rebuilding volume index "
+                        "for domain %s", self._sdUUID)
+            self.invalidate()
+            return
+
+        if event.mask & pyinotify.IN_IGNORED:
+            return
+
+        if event.path == self.images_dir:
+            if event.mask & (pyinotify.IN_DELETE_SELF |
+                             pyinotify.IN_MOVE_SELF):
+                self.invalidate()
+            else:
+                self.image_changed(event.name)
+            return
+
+        # An event in an image directory.
+        parent, imgUUID = os.path.split(event.path)
+        if parent == self.images_dir:
+            self.image_changed(imgUUID)
+        else:
+            log.debug("Unexpected event %s, rebuilding volume index",
+                      event)
+            self.invalidate()
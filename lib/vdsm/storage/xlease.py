@@ -470,6 +470,14 @@ class Record(object):
 # Record with empty values, mark a free record in the index.
 EMPTY_RECORD = Record("", 0)
 
+_EMPTY_RECORD_BYTES = EMPTY_RECORD.bytes()
+_EMPTY_LOOKUP_BYTES = LOOKUP_STRUCT.pack(b"")
+
+# Number of records in a block, and the free bitmap of an empty block.
+_BLOCK_RECORDS = BLOCK_SIZE // RECORD_SIZE
+_BLOCK_MASK = (1 << _BLOCK_RECORDS) - 1
+_EMPTY_BLOCK_BYTES = _EMPTY_RECORD_BYTES * _BLOCK_RECORDS
+
 
 class LeasesVolume(object):
     """
@@ -669,10 +677,19 @@ class VolumeIndex(object):
     """
     Index maintaining volume metadata and the mapping from lease id to lease
     offset.
+
+    To avoid searching the entire index on every lookup, the index keeps an
+    auxiliary mapping from lease id to record number, and a bitmap of the
+    free records. Both are rebuilt when loading the index from storage, and
+    updated when writing a record.
     """
 
     def __init__(self):
         self._buf = mmap.mmap(-1, INDEX_SIZE, mmap.MAP_SHARED)
+        # LOOKUP_STRUCT packed lease_id -> record number
+        self._records = {}
+        # Bit n is set if record n is free.
+        self._free = 0
 
     def find_record(self, lease_id):
         """
@@ -680,25 +697,15 @@ class VolumeIndex(object):
         otherwise.
         """
         prefix = LOOKUP_STRUCT.pack(lease_id.encode("ascii"))
-
-        # TODO: continue search if offset is not aligned to record size.
-        offset = self._buf.find(prefix, RECORD_BASE)
-        if offset == -1:
-            return -1
-
-        return self._record_number(offset)
+        return self._records.get(prefix, -1)
 
     def find_free_record(self):
         """
         Find the first free record. Returns record number if found, -1
         otherwise.
         """
-        # TODO: continue search if offset is not aligned to record size.
-        offset = self._buf.find(EMPTY_RECORD.bytes(), RECORD_BASE)
-        if offset == -1:
-            return -1
-
-        return self._record_number(offset)
+        # Isolate the lowest set bit; its position is the first free record.
+        return (self._free & -self._free).bit_length() - 1
 
     def read_record(self, recnum):
         """
@@ -718,8 +725,11 @@ class VolumeIndex(object):
         storage.
         """
         offset = self._record_offset(recnum)
+        old_prefix = self._buf[offset:offset + LOOKUP_STRUCT.size]
+        data = record.bytes()
         self._buf.seek(offset)
-        self._buf.write(record.bytes())
+        self._buf.write(data)
+        self._update_record(recnum, old_prefix, data)
 
     def read_metadata(self):
         """
@@ -751,6 +761,7 @@ class VolumeIndex(object):
         nread = file.pread(INDEX_BASE, self._buf)
         if nread < len(self._buf):
             raise TruncatedIndex(len(self._buf), nread)
+        self._rebuild()
 
     def dump(self, file):
         """
@@ -791,6 +802,71 @@ class VolumeIndex(object):
     def close(self):
         self._buf.close()
 
+    def _rebuild(self):
+        """
+        Rebuild the lease id mapping and the free records bitmap from the
+        index buffer.
+        """
+        records = {}
+        free = 0
+        data = self._buf[RECORD_BASE:]
+        for first in range(0, MAX_RECORDS, _BLOCK_RECORDS):
+            start = first * RECORD_SIZE
+            block = data[start:start + BLOCK_SIZE]
+            # Most blocks are empty in a typical index.
+            if block == _EMPTY_BLOCK_BYTES:
+                free |= _BLOCK_MASK << first
+                continue
+            for i in range(_BLOCK_RECORDS):
+                record = block[i * RECORD_SIZE:(i + 1) * RECORD_SIZE]
+                if record == _EMPTY_RECORD_BYTES:
+                    free |= 1 << (first + i)
+                else:
+                    prefix = record[:LOOKUP_STRUCT.size]
+                    if prefix != _EMPTY_LOOKUP_BYTES:
+                        # Like a linear search, the first record wins if the
+                        # index contains duplicate lease ids.
+                        records.setdefault(prefix, first + i)
+        self._records = records
+        self._free = free
+
+    def _update_record(self, recnum, old_prefix, data):
+        """
+        Update the lease id mapping and the free records bitmap after record
+        recnum was changed from old_prefix to data.
+        """
+        if data == _EMPTY_RECORD_BYTES:
+            self._free |= 1 << recnum
+        else:
+            self._free &= ~(1 << recnum)
+
+        prefix = data[:LOOKUP_STRUCT.size]
+        if prefix == old_prefix:
+            return
+
+        if self._records.get(old_prefix) == recnum:
+            del self._records[old_prefix]
+            # Expose a duplicate record shadowed by this record, if any.
+            dup = self._search(old_prefix)
+            if dup != -1:
+                self._records[old_prefix] = dup
+
+        if prefix != _EMPTY_LOOKUP_BYTES:
+            current = self._records.get(prefix, MAX_RECORDS)
+            self._records[prefix] = min(current, recnum)
+
+    def _search(self, prefix):
+        """
+        Search the index buffer for a record starting with prefix. Returns
+        record number if found, -1 otherwise.
+        """
+        offset = self._buf.find(prefix, RECORD_BASE)
+        while offset != -1:
+            if (offset - RECORD_BASE) % RECORD_SIZE == 0:
+                return self._record_number(offset)
+            offset = self._buf.find(prefix, offset + 1)
+        return -1
+
     def _record_offset(self, recnum):
         return RECORD_BASE + recnum * RECORD_SIZE
 
@@ -94,8 +94,12 @@ def serve_clients(log):
             except:
                 panic("Error initializing IRS")
 
-        scheduler = schedule.Scheduler(name="vdsm.Scheduler",
-                                       clock=time.monotonic_time)
+        if config.get('vars', 'scheduler') == 'wheel':
+            scheduler_class = schedule.WheelScheduler
+        else:
+            scheduler_class = schedule.Scheduler
+        scheduler = scheduler_class(name="vdsm.Scheduler",
+                                    clock=time.monotonic_time)
         scheduler.start()
 
         from vdsm.clientIF import clientIF  # must import after config is read
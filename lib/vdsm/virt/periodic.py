@@ -49,10 +49,12 @@ _WORKERS = config.getint('sampling', 'periodic_workers')
 _TASK_PER_WORKER = config.getint('sampling', 'periodic_task_per_worker')
 _TASKS = _WORKERS * _TASK_PER_WORKER
 _MAX_WORKERS = config.getint('sampling', 'max_workers')
+_WORK_STEALING = config.getboolean('sampling', 'periodic_work_stealing')
 _THROTTLING_INTERVAL = 10  # seconds
 
 _operations = []
 _executor = None
+_link_sampler = None
 
 
 def _timeout_from(interval):
@@ -65,12 +67,14 @@ def _timeout_from(interval):
 def start(cif, scheduler):
     global _operations
     global _executor
+    global _link_sampler
 
     _executor = executor.Executor(name="periodic",
                                   workers_count=_WORKERS,
                                   max_tasks=_TASKS,
                                   scheduler=scheduler,
-                                  max_workers=_MAX_WORKERS)
+                                  max_workers=_MAX_WORKERS,
+                                  work_stealing=_WORK_STEALING)
     _executor.start()
 
     def per_vm_operation(func, period):
@@ -111,6 +115,10 @@ def start(cif, scheduler):
     ]
 
     if config.getboolean('sampling', 'enable'):
+        if config.getboolean('sampling', 'netlink_link_stats'):
+            _link_sampler = sampling.LinkSampler()
+            _link_sampler.start()
+
         _operations.extend([
             # libvirt sampling using bulk stats can block, but unresponsive
             # domains are handled inside VMBulkstatsMonitor for performance
@@ -124,7 +132,7 @@ def start(cif, scheduler):
                 scheduler),
 
             Operation(
-                sampling.HostMonitor(cif=cif),
+                sampling.HostMonitor(cif=cif, link_sampler=_link_sampler),
                 config.getint('vars', 'host_sample_stats_interval'),
                 scheduler,
                 timeout=config.getint('vars', 'host_sample_stats_interval'),
@@ -141,6 +149,9 @@ def stop():
     for op in _operations:
         op.stop()
 
+    if _link_sampler is not None:
+        _link_sampler.stop()
+
     _executor.stop(wait=False)
 
 
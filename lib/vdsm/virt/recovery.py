@@ -19,19 +19,25 @@
 #
 from __future__ import absolute_import
 
+from contextlib import contextmanager
 import logging
 import os
 import os.path
+import struct
 import tempfile
 import threading
 import time
 
 import libvirt
+import six
 
+from vdsm.common import concurrent
 from vdsm.common import fileutils
 from vdsm.common import libvirtconnection
 from vdsm.common import response
 from vdsm.common.compat import pickle
+from vdsm.common.time import monotonic_time
+from vdsm.config import config
 from vdsm import constants
 from vdsm import containersconnection
 from vdsm import utils
@@ -41,6 +47,8 @@ from vdsm.virt import vmxml
 from vdsm.virt.domain_descriptor import DomainDescriptor
 from vdsm.virt.utils import isVdsmImage
 
+_WORKERS = config.getint('vars', 'recovery_workers')
+
 
 def _is_external_vm(dom_xml):
     return (not vmxml.has_channel(dom_xml, vmchannels.LEGACY_DEVICE_NAME) and
@@ -69,33 +77,48 @@ def _is_ignored_vm(dom_uuid, dom_obj, dom_xml):
     return False
 
 
-def _list_domains():
+def _list_domains(workers=None):
+    """
+    Return a list of (dom_obj, dom_xml, external) tuples. The domains XML
+    is fetched from libvirt concurrently, using at most workers threads.
+    """
+    if workers is None:
+        workers = _WORKERS
     conn = libvirtconnection.get()
+    results = concurrent.tmap(_domain_info, conn.listAllDomains(),
+                              workers=workers)
     domains = []
-    for dom_obj in conn.listAllDomains():
-        dom_uuid = 'unknown'
-        try:
-            dom_uuid = dom_obj.UUIDString()
-            logging.debug("Found domain %s", dom_uuid)
-            dom_xml = dom_obj.XMLDesc(0)
-        except libvirt.libvirtError as e:
-            if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
-                logging.exception("domain %s is dead", dom_uuid)
-            else:
-                raise
-        else:
-            if _is_ignored_vm(dom_uuid, dom_obj, dom_xml):
-                continue
-            domains.append((dom_obj, dom_xml, _is_external_vm(dom_xml),))
+    for res in results:
+        if not res.succeeded:
+            raise res.value
+        if res.value is not None:
+            domains.append(res.value)
     return domains
 
 
-def _recover_domain(cif, vm_id, dom_xml, external):
+def _domain_info(dom_obj):
+    dom_uuid = 'unknown'
+    try:
+        dom_uuid = dom_obj.UUIDString()
+        logging.debug("Found domain %s", dom_uuid)
+        dom_xml = dom_obj.XMLDesc(0)
+    except libvirt.libvirtError as e:
+        if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+            logging.exception("domain %s is dead", dom_uuid)
+            return None
+        raise
+    if _is_ignored_vm(dom_uuid, dom_obj, dom_xml):
+        return None
+    return dom_obj, dom_xml, _is_external_vm(dom_xml)
+
+
+def _recover_domain(cif, vm_id, dom_xml, external, params=None):
     external_str = " (external)" if external else ""
     cif.log.debug("recovery: trying with VM%s %s", external_str, vm_id)
     try:
-        res = cif.createVm(_recovery_params(vm_id, dom_xml, external),
-                           vmRecover=True)
+        if params is None:
+            params = _recovery_params(vm_id, dom_xml, external)
+        res = cif.createVm(params, vmRecover=True)
     except Exception:
         cif.log.exception("Error recovering VM%s: %s", external_str, vm_id)
         return False
@@ -122,10 +145,43 @@ def _recovery_params(vm_id, dom_xml, external):
 
 class File(object):
     """
-    "pickle" for vm state.
+    Persistent vm state, used for recovering the vm.
+
+    The state is split into sections: the domain XML, the devices, the
+    block jobs, the guest info, and the rest of the vm status. The file
+    starts with MAGIC, followed by a log of records, each holding the
+    latest value of one section:
+
+        name length, value length (RECORD), name, pickled value
+
+    Saving appends records only for the sections modified since the
+    previous save. When the log has more than COMPACT_RECORDS records, the
+    latest value of every section is written to a new file, replacing the
+    log.
+
+    Files written by older versions, holding a pickle of the entire state,
+    can be loaded.
     """
 
     EXTENSION = ".recovery"
+    MAGIC = b"VDSM-RECOVERY-1\n"
+    RECORD = struct.Struct(">HI")
+    COMPACT_RECORDS = 100
+
+    # Section name -> keys of vm state. Other keys are kept in the 'state'
+    # section.
+    SECTIONS = (
+        ('xml', ('xml',)),
+        ('devices', ('devices', 'drives')),
+        ('block_jobs', ('_blockJobs',)),
+        ('guest', ('username', 'guestIPs', 'guestFQDN')),
+    )
+
+    # Protocol 2 is binary, and can be read by both python 2 and 3.
+    _PROTOCOL = 2
+
+    # A section without any of its keys.
+    _EMPTY_SECTION = pickle.dumps({}, _PROTOCOL)
 
     _log = logging.getLogger("virt.recovery.file")
 
@@ -134,6 +190,10 @@ class File(object):
         self._name = '%s%s' % (vmid, self.EXTENSION)
         self._path = os.path.join(constants.P_VDSM_RUN, self._name)
         self._lock = threading.Lock()
+        # Section name -> pickled value, as saved in the file.
+        self._saved = {}
+        # Number of records in the file.
+        self._records = 0
 
     @property
     def vmid(self):
@@ -154,15 +214,13 @@ class File(object):
             if self._path is None:
                 self._log.debug('save after cleanup')
             else:
-                self._dump(data)
+                self._write(data)
 
     def load(self, cif, dom_xml=None):
         self._log.debug("recovery: trying with VM %s", self._vmid)
         try:
-            with open(self._path, 'rb') as src:
-                params = pickle.load(src)
+            params = self._read(dom_xml)
             self._set_elapsed_time(params)
-            self._update_domain_xml(params, dom_xml)
             res = cif.createVm(params, vmRecover=True)
         except Exception:
             self._log.exception("Error recovering VM: %s", self._vmid)
@@ -172,14 +230,96 @@ class File(object):
                 return False
             return True
 
-    def _dump(self, data):
+    def _write(self, data):
+        changed = []
+        for name, value in six.iteritems(self._split(data)):
+            payload = pickle.dumps(value, self._PROTOCOL)
+            if self._saved.get(name) != payload:
+                changed.append((name, payload))
+        if not changed:
+            return
+
+        # The first save rewrites the file, which may have been written
+        # by an older version.
+        compact = (not self._saved or
+                   self._records + len(changed) > self.COMPACT_RECORDS or
+                   not os.path.exists(self._path))
+        self._saved.update(changed)
+        if compact:
+            self._compact()
+        else:
+            with open(self._path, 'ab') as f:
+                f.write(self._format_records(changed))
+            self._records += len(changed)
+
+    def _compact(self):
+        records = sorted(six.iteritems(self._saved))
         with tempfile.NamedTemporaryFile(
             dir=constants.P_VDSM_RUN,
             delete=False
         ) as f:
-            pickle.dump(data, f)
+            f.write(self.MAGIC)
+            f.write(self._format_records(records))
 
         os.rename(f.name, self._path)
+        self._records = len(records)
+
+    def _format_records(self, records):
+        chunks = []
+        for name, payload in records:
+            name = name.encode('ascii')
+            chunks.append(self.RECORD.pack(len(name), len(payload)))
+            chunks.append(name)
+            chunks.append(payload)
+        return b''.join(chunks)
+
+    def _split(self, data):
+        data = data.copy()
+        sections = {}
+        for name, keys in self.SECTIONS:
+            sections[name] = {key: data.pop(key) for key in keys
+                              if key in data}
+        sections['state'] = data
+        return sections
+
+    def _read(self, dom_xml=None):
+        with open(self._path, 'rb') as src:
+            content = src.read()
+
+        if not content.startswith(self.MAGIC):
+            # Written by an older version.
+            params = pickle.loads(content)
+            return self._update_domain_xml(params, dom_xml)
+
+        params = {}
+        for name, payload in six.iteritems(self._parse_records(content)):
+            if name == 'xml' and dom_xml is not None:
+                # Replaced by the libvirt XML, no need to unpickle it.
+                if payload != self._EMPTY_SECTION:
+                    params['xml'] = None
+            else:
+                params.update(pickle.loads(payload))
+        return self._update_domain_xml(params, dom_xml)
+
+    def _parse_records(self, content):
+        """
+        Return dict of section name -> latest pickled value.
+        """
+        sections = {}
+        offset = len(self.MAGIC)
+        while offset + self.RECORD.size <= len(content):
+            name_len, value_len = self.RECORD.unpack_from(content, offset)
+            offset += self.RECORD.size
+            end = offset + name_len + value_len
+            if end > len(content):
+                # Partial record written before a crash.
+                self._log.warning("Ignoring truncated record in %s",
+                                  self._path)
+                break
+            name = content[offset:offset + name_len].decode('ascii')
+            sections[name] = content[offset + name_len:end]
+            offset = end
+        return sections
 
     def _collect(self, vm):
         data = vm.status()
@@ -221,27 +361,125 @@ class File(object):
         return params
 
 
-def all_domains(cif):
-    doms = _list_domains() + containersconnection.recovery()
+class Timings(object):
+    """
+    Duration of the recovery phases, for logging.
+    """
+
+    def __init__(self, clock=monotonic_time):
+        self._clock = clock
+        self._phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self._phases.append((name, self._clock() - start))
+
+    def __str__(self):
+        return ", ".join("%s: %.2fs" % phase for phase in self._phases)
+
+
+def all_domains(cif, timings=None):
+    """
+    Recover all domains running on this host.
+
+    Domains XML is fetched and parsed concurrently. The VMs are created
+    serially, in the order returned by libvirt, since creating a VM is
+    serialized by the clientIF VM container lock anyway.
+    """
+    if timings is None:
+        timings = Timings()
+
+    with timings.phase('list'):
+        doms = _list_domains() + containersconnection.recovery()
+
+    with timings.phase('parse'):
+        results = concurrent.tmap(_domain_params, doms, workers=_WORKERS)
+
     num_doms = len(doms)
-    for idx, (dom_obj, dom_xml, external) in enumerate(doms):
-        vm_id = dom_obj.UUIDString()
-        if _recover_domain(cif, vm_id, dom_xml, external):
-            cif.log.info(
-                'recovery [1:%d/%d]: recovered domain %s',
-                idx + 1, num_doms, vm_id)
-        elif external:
-            cif.log.info("Failed to recover external domain: %s" % (vm_id,))
-        else:
-            cif.log.info(
-                'recovery [1:%d/%d]: loose domain %s found, killing it.',
-                idx + 1, num_doms, vm_id)
+    with timings.phase('create'):
+        for idx, (dom, res) in enumerate(zip(doms, results)):
+            dom_obj, dom_xml, external = dom
+            vm_id = dom_obj.UUIDString()
+            # If parsing failed, _recover_domain parses again and logs
+            # the error.
+            params = res.value if res.succeeded else None
+            if _recover_domain(cif, vm_id, dom_xml, external, params=params):
+                cif.log.info(
+                    'recovery [1:%d/%d]: recovered domain %s',
+                    idx + 1, num_doms, vm_id)
+            elif external:
+                cif.log.info("Failed to recover external domain: %s" %
+                             (vm_id,))
+            else:
+                cif.log.info(
+                    'recovery [1:%d/%d]: loose domain %s found, killing it.',
+                    idx + 1, num_doms, vm_id)
+                try:
+                    dom_obj.destroy()
+                except libvirt.libvirtError:
+                    cif.log.exception(
+                        'recovery [1:%d/%d]: failed to kill loose domain %s',
+                        idx + 1, num_doms, vm_id)
+
+
+def _domain_params(dom):
+    dom_obj, dom_xml, external = dom
+    return _recovery_params(dom_obj.UUIDString(), dom_xml, external)
+
+
+def group_by_storage_domain(vms):
+    """
+    Group vms by the storage domain of their first vdsm image disk.
+
+    Returns a list of lists of vms. Vms without vdsm images are grouped
+    together.
+    """
+    groups = {}
+    for vm_obj in vms:
+        sd_id = None
+        for drive in vm_obj.getDiskDevices():
+            if isVdsmImage(drive):
+                sd_id = drive.domainID
+                break
+        groups.setdefault(sd_id, []).append(vm_obj)
+    return list(groups.values())
+
+
+def prepare_paths(cif, vms, enabled=lambda: True):
+    """
+    Prepare the volume paths of recovered vms.
+
+    Groups of vms using different storage domains are prepared
+    concurrently, so a slow storage domain delays only the vms using it.
+    Vms in the same group are prepared serially.
+    """
+    num_vms = len(vms)
+    counter = iter(range(1, num_vms + 1))
+    lock = threading.Lock()
+
+    def prepare_group(group):
+        for vm_obj in group:
+            with lock:
+                idx = next(counter)
+            # Let's recover as much VMs as possible
             try:
-                dom_obj.destroy()
-            except libvirt.libvirtError:
+                # Do not prepare volumes when system goes down
+                if enabled():
+                    cif.log.info(
+                        'recovery [%d/%d]: preparing paths for'
+                        ' domain %s', idx, num_vms, vm_obj.id)
+                    vm_obj.preparePaths()
+            except Exception:
                 cif.log.exception(
-                    'recovery [1:%d/%d]: failed to kill loose domain %s',
-                    idx + 1, num_doms, vm_id)
+                    "recovery [%d/%d]: failed for vm %s",
+                    idx, num_vms, vm_obj.id)
+
+    concurrent.tmap(prepare_group, group_by_storage_domain(vms),
+                    workers=_WORKERS)
 
 
 def lookup_external_vms(cif):
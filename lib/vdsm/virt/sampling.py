@@ -37,6 +37,7 @@ import time
 from vdsm import hugepages
 from vdsm import numa
 from vdsm import utils
+from vdsm.common import concurrent
 import vdsm.common.time
 from vdsm.config import config
 from vdsm.constants import P_VDSM_RUN
@@ -45,6 +46,9 @@ from vdsm.network import ipwrapper
 from vdsm.network.link import bond
 from vdsm.network.link import nic
 from vdsm.network.link import vlan
+from vdsm.network.netlink import libnl
+from vdsm.network.netlink import link as nllink
+from vdsm.network.netlink import monitor
 from vdsm.virt import vmstats
 from vdsm.virt.utils import ExpiringCache
 
@@ -109,6 +113,24 @@ class InterfaceSample(object):
         self.speed = _getLinkSpeed(link)
         self.duplex = _getDuplex(ifid)
 
+    @classmethod
+    def from_stats(cls, stats, oper_up, speed, duplex):
+        """
+        Create a sample from the statistics reported by netlink, see
+        vdsm.network.netlink.link.iter_links_stats().
+        """
+        sample = cls.__new__(cls)
+        sample.rx = stats['rx_bytes']
+        sample.tx = stats['tx_bytes']
+        sample.rxDropped = stats['rx_dropped']
+        sample.txDropped = stats['tx_dropped']
+        sample.rxErrors = stats['rx_errors']
+        sample.txErrors = stats['tx_errors']
+        sample.operstate = 'up' if oper_up else 'down'
+        sample.speed = speed
+        sample.duplex = duplex
+        return sample
+
 
 class TotalCpuSample(object):
     """
@@ -209,6 +231,122 @@ def _get_interfaces_and_samples():
     return links_and_samples
 
 
+_LinkEntry = namedtuple('_LinkEntry', 'index, link, speed, duplex')
+
+
+class LinkSampler(object):
+    """
+    Sample the statistics of all the host links using a single netlink dump,
+    instead of reading them from sysfs link by link.
+
+    Link type, speed and duplex are cached until a netlink link event
+    invalidates them. If link events cannot be monitored, they are read
+    again on every sample.
+    """
+
+    _log = logging.getLogger("virt.sampling.LinkSampler")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> _LinkEntry
+        self._cache = {}
+        # Incremented when the cache is invalidated, to avoid caching an
+        # entry read before the invalidation.
+        self._generation = 0
+        self._monitor = None
+        self._monitoring = False
+
+    def start(self):
+        try:
+            self._monitor = monitor.Monitor(groups=('link',))
+            self._monitor.start()
+        except Exception:
+            self._log.exception("Cannot monitor link events, reading link "
+                                "speed and duplex on every sample")
+            self._monitor = None
+            return
+        self._monitoring = True
+        concurrent.thread(self._watch, name="sampling/links",
+                          log=self._log).start()
+
+    def stop(self):
+        if self._monitor is not None and not self._monitor.is_stopped():
+            self._monitor.stop()
+
+    def invalidate(self, name):
+        """
+        Drop cached information of link name. The speed of bonds and vlans
+        depends on other links, so their information is dropped as well.
+        """
+        with self._lock:
+            self._generation += 1
+            self._cache.pop(name, None)
+            for cached_name, entry in list(six.iteritems(self._cache)):
+                if entry.link.isBOND() or entry.link.isVLAN():
+                    del self._cache[cached_name]
+
+    def sample(self):
+        """
+        Return a dict of link name -> InterfaceSample.
+        """
+        samples = {}
+        for data in nllink.iter_links_stats():
+            stats = data.pop('stats')
+            try:
+                entry = self._get_entry(data)
+            except IOError as e:
+                # The link was removed after the dump.
+                if e.errno == errno.ENODEV:
+                    continue
+                raise
+            if entry is None:
+                continue
+            oper_up = bool(data['flags'] & libnl.IfaceStatus.IFF_RUNNING)
+            samples[data['name']] = InterfaceSample.from_stats(
+                stats, oper_up, entry.speed, entry.duplex)
+
+        with self._lock:
+            for name in set(self._cache) - set(samples):
+                del self._cache[name]
+
+        for link in ipwrapper.getDpdkLinks():
+            samples[link.name] = InterfaceSample(link)
+
+        return samples
+
+    def _get_entry(self, data):
+        with self._lock:
+            entry = self._cache.get(data['name'])
+            generation = self._generation
+        if entry is not None and entry.index == data['index']:
+            return entry
+
+        try:
+            link = ipwrapper.Link.fromDict(data)
+        except IOError:
+            # If a link goes missing we just don't report it
+            return None
+        entry = _LinkEntry(data['index'], link, _getLinkSpeed(link),
+                           _getDuplex(link.name))
+
+        with self._lock:
+            if self._monitoring and self._generation == generation:
+                self._cache[link.name] = entry
+        return entry
+
+    def _watch(self):
+        try:
+            for event in self._monitor:
+                self.invalidate(event.get('name'))
+        except Exception:
+            self._log.exception("Error monitoring link events, reading link "
+                                "speed and duplex on every sample")
+        finally:
+            with self._lock:
+                self._monitoring = False
+                self._cache.clear()
+
+
 class HostSample(TimedSample):
     """
     A sample of host-related statistics.
@@ -229,15 +367,21 @@ class HostSample(TimedSample):
             d[p] = {'free': str(free)}
         return d
 
-    def __init__(self, pid):
+    def __init__(self, pid, link_sampler=None):
         """
         Initialize a HostSample.
 
         :param pid: The PID of this vdsm host.
         :type pid: int
+        :param link_sampler: Sampler used to sample the host interfaces.
+            If not specified, the interfaces are sampled using sysfs.
+        :type link_sampler: LinkSampler
         """
         super(HostSample, self).__init__()
-        self.interfaces = _get_interfaces_and_samples()
+        if link_sampler is None:
+            self.interfaces = _get_interfaces_and_samples()
+        else:
+            self.interfaces = link_sampler.sample()
         self.pidcpu = PidCpuSample(pid)
         self.ncpus = os.sysconf('SC_NPROCESSORS_ONLN')
         self.totcpu = TotalCpuSample()
@@ -526,18 +670,9 @@ class VMBulkstatsMonitor(object):
         vm_samples = self._stats_cache.get_batch()
         if vm_samples is None:
             return
-        stats = {}
-        for vm_id, vm_sample in six.iteritems(vm_samples):
-            vm_obj = vms.get(vm_id)
-            if vm_obj is None:
-                # unknown VM, such as an external VM
-                continue
-            vm_data = vmstats.produce(vm_obj,
-                                      vm_sample.first_value,
-                                      vm_sample.last_value,
-                                      vm_sample.interval)
-            vm_data["vmName"] = vm_obj.name
-            stats[vm_id] = vm_data
+        stats = vmstats.produce_batch(vms, vm_samples)
+        for vm_id, vm_data in six.iteritems(stats):
+            vm_data["vmName"] = vms[vm_id].name
         vmstats.send_metrics(stats)
 
     def _get_responsive_doms(self):
@@ -565,13 +700,14 @@ host_samples = SampleWindow(size=HOST_STATS_AVERAGING_WINDOW)
 
 class HostMonitor(object):
 
-    def __init__(self, samples=host_samples, cif=None):
+    def __init__(self, samples=host_samples, cif=None, link_sampler=None):
         self._samples = samples
         self._pid = os.getpid()
         self._cif = cif
+        self._link_sampler = link_sampler
 
     def __call__(self):
-        sample = HostSample(self._pid)
+        sample = HostSample(self._pid, self._link_sampler)
         self._samples.append(sample)
 
         if self._cif and _METRICS_ENABLED:
@@ -38,12 +38,63 @@ def produce(vm, first_sample, last_sample, interval):
     """
     Translates vm samples into stats.
     """
+    nics = []
+    drives = []
+    stats = _produce_vm(vm, nics, drives, first_sample, last_sample,
+                        interval)
+    _produce_devices(nics, drives)
+    return stats
+
+
+def produce_batch(vms, vm_samples):
+    """
+    Translates the samples of many vms into stats.
+
+    `vms' maps vm ids to Vm objects, and `vm_samples' maps vm ids to
+    StatsSample, as returned by sampling.StatsCache.get_batch().
+    Return a dict mapping vm ids to the stats produce() returns for each vm.
+    Vms missing in `vms', or failing to produce stats, are not included.
+
+    Instead of walking the samples of each vm separately, first collect the
+    devices of all the vms, and then compute the stats of all disks and
+    all nics in one pass.
+    """
+    result = {}
+    nics = []
+    drives = []
+
+    for vm_id, vm_sample in six.iteritems(vm_samples):
+        vm = vms.get(vm_id)
+        if vm is None:
+            # unknown VM, such as an external VM
+            continue
+
+        try:
+            stats = _produce_vm(vm, nics, drives,
+                                vm_sample.first_value,
+                                vm_sample.last_value,
+                                vm_sample.interval)
+        except Exception:
+            _log.exception("Error producing stats for vm %s", vm_id)
+            continue
+
+        result[vm_id] = stats
+
+    _produce_devices(nics, drives)
+    return result
+
 
+def _produce_vm(vm, nics, drives, first_sample, last_sample, interval):
+    """
+    Translates vm samples into stats, except the stats of the nics and the
+    drives, which are appended to `nics' and `drives', to be computed later
+    by _produce_devices().
+    """
     stats = {}
 
     cpu(stats, first_sample, last_sample, interval)
-    networks(vm, stats, first_sample, last_sample, interval)
-    disks(vm, stats, first_sample, last_sample, interval)
+    _collect_nics(nics, vm, stats, first_sample, last_sample, interval)
+    _collect_drives(drives, vm, stats, first_sample, last_sample, interval)
     balloon(vm, stats, last_sample)
     cpu_count(stats, last_sample)
     tune_io(vm, stats)
@@ -52,6 +103,19 @@ def produce(vm, first_sample, last_sample, interval):
     return stats
 
 
+def _produce_devices(nics, drives):
+    """
+    Compute the stats of the nics and drives collected by _produce_vm(). The
+    bulk stats keys are formatted once per device index, and the sample time
+    is taken once for all the nics.
+    """
+    sample_time = monotonic_time()
+    for item in nics:
+        _nic_stats(item, sample_time)
+    for item in drives:
+        _drive_stats(item)
+
+
 def translate(vm_stats):
     stats = {}
 
@@ -186,68 +250,115 @@ def cpu_count(stats, sample):
             _log.error('Failed to get VM cpu count')
 
 
+# (metric, stats key) pairs.
+_VM_METRICS = (
+    ('cpu.user', 'cpuUser'),
+    ('cpu.sys', 'cpuSys'),
+    ('cpu.usage', 'cpuUsage'),
+)
+
+_BALLOON_METRICS = (
+    ('balloon.max', 'balloon_max'),
+    ('balloon.min', 'balloon_min'),
+    ('balloon.target', 'balloon_target'),
+    ('balloon.cur', 'balloon_cur'),
+)
+
+_DISK_METRICS = (
+    ('read_latency', 'readLatency'),
+    ('read_ops', 'readOps'),
+    ('read_bytes', 'readBytes'),
+    ('read_rate', 'readRate'),
+    ('write_bytes', 'writtenBytes'),
+    ('write_ops', 'writeOps'),
+    ('write_latency', 'writeLatency'),
+    ('write_rate', 'writeRate'),
+    ('apparent_size', 'apparentsize'),
+    ('flush_latency', 'flushLatency'),
+    ('true_size', 'truesize'),
+)
+
+_NIC_METRICS = (
+    ('speed', 'speed'),
+    ('rx_bytes', 'rx'),
+    ('rx_errors', 'rxErrors'),
+    ('rx_dropped', 'rxDropped'),
+    ('tx_bytes', 'tx'),
+    ('tx_errors', 'txErrors'),
+    ('tx_dropped', 'txDropped'),
+)
+
+# vm name -> _VmMetrics
+_vm_metrics = {}
+
+
+class _VmMetrics(object):
+    """
+    The metric handles of one vm, created when first needed.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._gauges = []
+        self.vm = self._create('vms.{vm}.', _VM_METRICS)
+        self.balloon = self._create('vms.{vm}.', _BALLOON_METRICS)
+        self._disks = {}
+        self._nics = {}
+
+    def disk(self, name):
+        handles = self._disks.get(name)
+        if handles is None:
+            handles = self._disks[name] = self._create(
+                'vms.{vm}.disk.{disk}.', _DISK_METRICS, disk=name)
+        return handles
+
+    def nic(self, name):
+        handles = self._nics.get(name)
+        if handles is None:
+            handles = self._nics[name] = self._create(
+                'vms.{vm}.nic.{nic}.', _NIC_METRICS, nic=name)
+        return handles
+
+    def remove(self):
+        for gauge in self._gauges:
+            gauge.remove()
+
+    def _create(self, prefix, names, **labels):
+        handles = [(metrics.gauge(prefix + metric, vm=self._name, **labels),
+                    key)
+                   for metric, key in names]
+        self._gauges.extend(gauge for gauge, key in handles)
+        return handles
+
+
+def _set(handles, stats):
+    for gauge, key in handles:
+        gauge.set(stats[key])
+
+
 def send_metrics(vms_stats):
-    data = {}
     try:
+        names = set()
         for vm_uuid in vms_stats:
             stat = vms_stats[vm_uuid]
-            prefix = "vms." + stat['vmName']
-            data[prefix + '.cpu.user'] = stat['cpuUser']
-            data[prefix + '.cpu.sys'] = stat['cpuSys']
-            data[prefix + '.cpu.usage'] = stat['cpuUsage']
+            name = stat['vmName']
+            names.add(name)
+            vm_metrics = _vm_metrics.get(name)
+            if vm_metrics is None:
+                vm_metrics = _vm_metrics[name] = _VmMetrics(name)
+
+            _set(vm_metrics.vm, stat)
 
             if stat['balloonInfo']:
-                data[prefix + '.balloon.max'] = \
-                    stat['balloonInfo']['balloon_max']
-                data[prefix + '.balloon.min'] = \
-                    stat['balloonInfo']['balloon_min']
-                data[prefix + '.balloon.target'] = \
-                    stat['balloonInfo']['balloon_target']
-                data[prefix + '.balloon.cur'] = \
-                    stat['balloonInfo']['balloon_cur']
+                _set(vm_metrics.balloon, stat['balloonInfo'])
 
             if 'disks' in stat:
-                for disk in stat['disks']:
-                    diskprefix = prefix + '.disk.' + disk
-                    diskinfo = stat['disks'][disk]
-
-                    data[diskprefix + '.read_latency'] = \
-                        diskinfo['readLatency']
-                    data[diskprefix + '.read_ops'] = \
-                        diskinfo['readOps']
-                    data[diskprefix + '.read_bytes'] = \
-                        diskinfo['readBytes']
-                    data[diskprefix + '.read_rate'] = \
-                        diskinfo['readRate']
-
-                    data[diskprefix + '.write_bytes'] = \
-                        diskinfo['writtenBytes']
-                    data[diskprefix + '.write_ops'] = \
-                        diskinfo['writeOps']
-                    data[diskprefix + '.write_latency'] = \
-                        diskinfo['writeLatency']
-                    data[diskprefix + '.write_rate'] = \
-                        diskinfo['writeRate']
-
-                    data[diskprefix + '.apparent_size'] = \
-                        diskinfo['apparentsize']
-                    data[diskprefix + '.flush_latency'] = \
-                        diskinfo['flushLatency']
-                    data[diskprefix + '.true_size'] = \
-                        diskinfo['truesize']
+                for disk, diskinfo in six.iteritems(stat['disks']):
+                    _set(vm_metrics.disk(disk), diskinfo)
 
             if 'network' in stat:
-                for interface in stat['network']:
-                    netprefix = prefix + '.nic.' + interface
-                    if_info = stat['network'][interface]
-                    data[netprefix + '.speed'] = if_info['speed']
-                    data[netprefix + '.rx_bytes'] = if_info['rx']
-                    data[netprefix + '.rx_errors'] = if_info['rxErrors']
-                    data[netprefix + '.rx_dropped'] = if_info['rxDropped']
-
-                    data[netprefix + '.tx_bytes'] = if_info['tx']
-                    data[netprefix + '.tx_errors'] = if_info['txErrors']
-                    data[netprefix + '.tx_dropped'] = if_info['txDropped']
+                for interface, if_info in six.iteritems(stat['network']):
+                    _set(vm_metrics.nic(interface), if_info)
 
         # Guest cpu-count,apps list, status, mac addr, client IP,
         # display type, kvm enabled, username, vcpu info, vm jobs,
@@ -255,11 +366,68 @@ def send_metrics(vms_stats):
         #
         # are all meta-data that should be published separately
 
-        metrics.send(data)
+        # Forget vms which are not running any more.
+        for name in set(_vm_metrics) - names:
+            _vm_metrics.pop(name).remove()
+
+        metrics.flush()
     except KeyError:
         _log.exception('VM metrics collection failed')
 
 
+def _collect_nics(nics, vm, stats, first_sample, last_sample, interval):
+    """
+    Add the network stats of the vm nics, without the traffic stats. Append
+    the nics to `nics', to compute the traffic later using _nic_stats().
+    """
+    stats['network'] = {}
+
+    if first_sample is None or last_sample is None:
+        return None
+    if interval <= 0:
+        _log.warning(
+            'invalid interval %i when computing network stats for vm %s',
+            interval, vm.id)
+        return None
+
+    first_indexes = _find_bulk_stats_reverse_map(first_sample, 'net')
+    last_indexes = _find_bulk_stats_reverse_map(last_sample, 'net')
+
+    for nic in vm.getNicDevices():
+        if nic.is_hostdevice:
+            continue
+
+        # may happen if nic is a new hot-plugged one
+        if nic.name not in first_indexes or nic.name not in last_indexes:
+            continue
+
+        if_stats = nic_info(nic)
+        stats['network'][nic.name] = if_stats
+        nics.append((vm, if_stats, last_sample, last_indexes[nic.name]))
+
+    return stats
+
+
+def _nic_stats(item, sample_time):
+    """
+    Add the traffic stats of a nic collected by _collect_nics().
+    """
+    vm_obj, if_stats, end_sample, end_index = item
+    keys = _bulk_stats_keys('net', end_index)
+
+    with _skip_if_missing_stats(vm_obj):
+        if_stats['rxErrors'] = str(end_sample[keys['rx.errs']])
+        if_stats['rxDropped'] = str(end_sample[keys['rx.drop']])
+        if_stats['txErrors'] = str(end_sample[keys['tx.errs']])
+        if_stats['txDropped'] = str(end_sample[keys['tx.drop']])
+
+    with _skip_if_missing_stats(vm_obj):
+        if_stats['rx'] = str(end_sample[keys['rx.bytes']])
+        if_stats['tx'] = str(end_sample[keys['tx.bytes']])
+
+    if_stats['sampleTime'] = sample_time
+
+
 def _nic_traffic(vm_obj, nic,
                  start_sample, start_index,
                  end_sample, end_index):
@@ -288,48 +456,19 @@ def _nic_traffic(vm_obj, nic,
     """
 
     if_stats = nic_info(nic)
-
-    with _skip_if_missing_stats(vm_obj):
-        if_stats['rxErrors'] = str(end_sample['net.%d.rx.errs' % end_index])
-        if_stats['rxDropped'] = str(end_sample['net.%d.rx.drop' % end_index])
-        if_stats['txErrors'] = str(end_sample['net.%d.tx.errs' % end_index])
-        if_stats['txDropped'] = str(end_sample['net.%d.tx.drop' % end_index])
-
-    with _skip_if_missing_stats(vm_obj):
-        if_stats['rx'] = str(end_sample['net.%d.rx.bytes' % end_index])
-        if_stats['tx'] = str(end_sample['net.%d.tx.bytes' % end_index])
-
-    if_stats['sampleTime'] = monotonic_time()
-
+    _nic_stats((vm_obj, if_stats, end_sample, end_index), monotonic_time())
     return if_stats
 
 
 def networks(vm, stats, first_sample, last_sample, interval):
-    stats['network'] = {}
-
-    if first_sample is None or last_sample is None:
+    nics = []
+    if _collect_nics(nics, vm, stats, first_sample, last_sample,
+                     interval) is None:
         return None
-    if interval <= 0:
-        _log.warning(
-            'invalid interval %i when computing network stats for vm %s',
-            interval, vm.id)
-        return None
-
-    first_indexes = _find_bulk_stats_reverse_map(first_sample, 'net')
-    last_indexes = _find_bulk_stats_reverse_map(last_sample, 'net')
-
-    for nic in vm.getNicDevices():
-        if nic.is_hostdevice:
-            continue
 
-        # may happen if nic is a new hot-plugged one
-        if nic.name not in first_indexes or nic.name not in last_indexes:
-            continue
-
-        stats['network'][nic.name] = _nic_traffic(
-            vm, nic,
-            first_sample, first_indexes[nic.name],
-            last_sample, last_indexes[nic.name])
+    sample_time = monotonic_time()
+    for item in nics:
+        _nic_stats(item, sample_time)
 
     return stats
 
@@ -347,6 +486,22 @@ def nic_info(nic):
 
 
 def disks(vm, stats, first_sample, last_sample, interval):
+    drives = []
+    if _collect_drives(drives, vm, stats, first_sample, last_sample,
+                       interval) is None:
+        return None
+
+    for item in drives:
+        _drive_stats(item)
+
+    return stats
+
+
+def _collect_drives(drives, vm, stats, first_sample, last_sample, interval):
+    """
+    Add the disks stats of the vm drives, without the I/O stats. Append the
+    drives to `drives', to compute the I/O stats later using _drive_stats().
+    """
     if first_sample is None or last_sample is None:
         return None
 
@@ -362,33 +517,16 @@ def disks(vm, stats, first_sample, last_sample, interval):
         drive_stats = {}
         try:
             drive_stats = disk_info(vm_drive)
-
-            if (vm_drive.name in first_indexes and
-               vm_drive.name in last_indexes):
-                # will be None if sampled during recovery
-                if interval <= 0:
-                    _log.warning(
-                        'invalid interval %i when calculating '
-                        'stats for vm %s disk %s',
-                        interval, vm.id, vm_drive.name)
-                else:
-                    drive_stats.update(
-                        _disk_rate(
-                            first_sample, first_indexes[vm_drive.name],
-                            last_sample, last_indexes[vm_drive.name],
-                            interval))
-                drive_stats.update(
-                    _disk_latency(
-                        first_sample, first_indexes[vm_drive.name],
-                        last_sample, last_indexes[vm_drive.name]))
-                drive_stats.update(
-                    _disk_iops_bytes(
-                        first_sample, first_indexes[vm_drive.name],
-                        last_sample, last_indexes[vm_drive.name]))
-
         except AttributeError:
             _log.exception("Disk %s stats not available",
                            vm_drive.name)
+        else:
+            if (vm_drive.name in first_indexes and
+                    vm_drive.name in last_indexes):
+                drives.append((vm, vm_drive, drive_stats,
+                               first_sample, first_indexes[vm_drive.name],
+                               last_sample, last_indexes[vm_drive.name],
+                               interval))
 
         disk_stats[vm_drive.name] = drive_stats
 
@@ -398,6 +536,51 @@ def disks(vm, stats, first_sample, last_sample, interval):
     return stats
 
 
+def _drive_stats(item):
+    """
+    Add the I/O stats of a drive collected by _collect_drives().
+    """
+    (vm, vm_drive, drive_stats, first_sample, first_index,
+     last_sample, last_index, interval) = item
+    first_keys = _bulk_stats_keys('block', first_index)
+    last_keys = _bulk_stats_keys('block', last_index)
+
+    # will be None if sampled during recovery
+    if interval <= 0:
+        _log.warning(
+            'invalid interval %i when calculating '
+            'stats for vm %s disk %s',
+            interval, vm.id, vm_drive.name)
+    else:
+        for name, field in _DISK_RATE_FIELDS:
+            try:
+                first_value = first_sample[first_keys[field]]
+                last_value = last_sample[last_keys[field]]
+            except KeyError:
+                continue
+            drive_stats[name] = str((last_value - first_value) / interval)
+
+    for name, reqs, times in _DISK_LATENCY_FIELDS:
+        try:
+            operations = (last_sample[last_keys[reqs]] -
+                          first_sample[first_keys[reqs]])
+            elapsed_time = (last_sample[last_keys[times]] -
+                            first_sample[first_keys[times]])
+        except KeyError:
+            continue
+        if operations:
+            drive_stats[name] = str(elapsed_time / operations)
+        else:
+            drive_stats[name] = '0'
+
+    for name, field in _DISK_IOPS_BYTES_FIELDS:
+        try:
+            value = last_sample[last_keys[field]]
+        except KeyError:
+            continue
+        drive_stats[name] = str(value)
+
+
 def disk_info(vm_drive):
     drive_stats = {
         'truesize': str(vm_drive.truesize),
@@ -413,60 +596,50 @@ def disk_info(vm_drive):
     return drive_stats
 
 
-def _disk_rate(first_sample, first_index, last_sample, last_index, interval):
-    stats = {}
+_DISK_RATE_FIELDS = (
+    ('readRate', 'rd.bytes'),
+    ('writeRate', 'wr.bytes'),
+)
 
-    for name, mode in (("readRate", "rd"), ("writeRate", "wr")):
-        first_key = 'block.%d.%s.bytes' % (first_index, mode)
-        last_key = 'block.%d.%s.bytes' % (last_index, mode)
-        try:
-            first_value = first_sample[first_key]
-            last_value = last_sample[last_key]
-        except KeyError:
-            continue
-        stats[name] = str((last_value - first_value) / interval)
+_DISK_LATENCY_FIELDS = (
+    ('readLatency', 'rd.reqs', 'rd.times'),
+    ('writeLatency', 'wr.reqs', 'wr.times'),
+    ('flushLatency', 'fl.reqs', 'fl.times'),
+)
 
-    return stats
+_DISK_IOPS_BYTES_FIELDS = (
+    ('readOps', 'rd.reqs'),
+    ('writeOps', 'wr.reqs'),
+    ('readBytes', 'rd.bytes'),
+    ('writtenBytes', 'wr.bytes'),
+)
 
 
-def _disk_latency(first_sample, first_index, last_sample, last_index):
-    stats = {}
-
-    for name, mode in (('readLatency', 'rd'),
-                       ('writeLatency', 'wr'),
-                       ('flushLatency', 'fl')):
-        try:
-            last_key = "block.%d.%s" % (last_index, mode)
-            first_key = "block.%d.%s" % (first_index, mode)
-            operations = (last_sample[last_key + ".reqs"] -
-                          first_sample[first_key + ".reqs"])
-            elapsed_time = (last_sample[last_key + ".times"] -
-                            first_sample[first_key + ".times"])
-        except KeyError:
-            continue
-        if operations:
-            stats[name] = str(elapsed_time / operations)
-        else:
-            stats[name] = '0'
-
-    return stats
+_BULK_STATS_FIELDS = {
+    'block': ('name', 'rd.reqs', 'rd.bytes', 'rd.times', 'wr.reqs',
+              'wr.bytes', 'wr.times', 'fl.reqs', 'fl.times'),
+    'net': ('name', 'rx.bytes', 'rx.errs', 'rx.drop', 'tx.bytes', 'tx.errs',
+            'tx.drop'),
+}
 
+_bulk_stats_keys_cache = {}
 
-def _disk_iops_bytes(first_sample, first_index, last_sample, last_index):
-    stats = {}
 
-    for name, mode, field in (('readOps', 'rd', 'reqs'),
-                              ('writeOps', 'wr', 'reqs'),
-                              ('readBytes', 'rd', 'bytes'),
-                              ('writtenBytes', 'wr', 'bytes')):
-        key = 'block.%d.%s.%s' % (last_index, mode, field)
-        try:
-            value = last_sample[key]
-        except KeyError:
-            continue
-        stats[name] = str(value)
+def _bulk_stats_keys(group, index):
+    """
+    Return dict mapping bulk stats fields of device `index' in `group' to
+    bulk stats keys, e.g. 'rd.bytes' -> 'block.1.rd.bytes'.
 
-    return stats
+    Formatting the keys is a significant part of the stats computation,
+    so the keys are cached.
+    """
+    try:
+        return _bulk_stats_keys_cache[(group, index)]
+    except KeyError:
+        keys = {field: '%s.%d.%s' % (group, index, field)
+                for field in _BULK_STATS_FIELDS[group]}
+        _bulk_stats_keys_cache[(group, index)] = keys
+        return keys
 
 
 def _usage_percentage(val, interval):
@@ -477,7 +650,7 @@ def _find_bulk_stats_reverse_map(stats, group):
     name_to_idx = {}
     for idx in six.moves.xrange(stats.get('%s.count' % group, 0)):
         try:
-            name = stats['%s.%d.name' % (group, idx)]
+            name = stats[_bulk_stats_keys(group, idx)['name']]
         except KeyError:
             # Bulk stats accumulate what they can get, raising errors
             # only in the critical cases. This includes fundamental
@@ -540,9 +713,13 @@ def _skip_if_missing_stats(vm_obj):
     try:
         yield
     except KeyError as exc:
-        if not vm_obj.monitorable:
-            # If a VM is migration destination,
-            # libvirt doesn't give any disk stat.
-            pass
-        else:
-            _log.warning('Missing stat: %s for vm %s', str(exc), vm_obj.id)
+        _log_missing_stats(vm_obj, exc)
+
+
+def _log_missing_stats(vm_obj, exc):
+    if not vm_obj.monitorable:
+        # If a VM is migration destination,
+        # libvirt doesn't give any disk stat.
+        pass
+    else:
+        _log.warning('Missing stat: %s for vm %s', str(exc), vm_obj.id)
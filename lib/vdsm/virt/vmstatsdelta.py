@@ -0,0 +1,221 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+
+"""
+Delta encoding of the stats of all vms.
+
+Most fields returned by Host.getAllVmStats (vmName, vmType, kvmEnable,
+hash, displayInfo, ...) do not change between polls. The Tracker remembers
+the last value of every field of every vm, and the generation in which the
+value changed. A client sends the generation it got in the previous reply,
+and gets only the fields changed since that generation.
+
+Generations are derived from the wall clock in milliseconds, so a client
+sending a generation from a previous vdsm instance gets a full reply.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+import six
+
+
+# Number of removed vms remembered. Clients older than the oldest forgotten
+# removal get a full reply.
+MAX_REMOVED_VMS = 1000
+
+# Value of a removed field.
+_REMOVED = object()
+
+_log = logging.getLogger('virt.vmstatsdelta')
+
+
+class _VmRecord(object):
+
+    __slots__ = ('fields', 'live', 'changed', 'removed')
+
+    def __init__(self):
+        # name -> (generation, value)
+        self.fields = {}
+        # Number of fields which are not removed.
+        self.live = 0
+        # Last generation any field changed.
+        self.changed = 0
+        # Generation the vm was removed, None if the vm exists.
+        self.removed = None
+
+
+class Tracker(object):
+    """
+    Tracks changes in the stats of all vms.
+
+    update() must be called with fresh stats dicts, such as the stats
+    returned by Vm.getStats(). The tracker keeps references to the values,
+    and does not copy them.
+    """
+
+    def __init__(self, max_removed_vms=MAX_REMOVED_VMS, clock=time.time):
+        self._max_removed_vms = max_removed_vms
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._generation = self._now()
+        # Oldest generation we can compute a delta from.
+        self._horizon = self._generation
+        self._vms = {}
+        # vm_id -> generation, in removal order.
+        self._removed = collections.OrderedDict()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def update(self, stats_list, generation=0):
+        """
+        Record stats_list, a list of vm stats dicts, and return the changes
+        since generation as a dict:
+
+            generation      the generation of this reply, to be sent by the
+                            client in the next call
+            full            True if the reply contains all the fields of
+                            all the vms, and the client should drop the
+                            stats it has
+            changed         list of dicts with the vmId and the changed
+                            fields of every changed vm
+            removedFields   list of {'vmId': ..., 'fields': [...]} of the
+                            fields removed from the stats of a vm
+            removed         list of the ids of the removed vms
+
+        If generation is unknown, for example 0 or a generation of another
+        vdsm instance, a full reply is returned.
+        """
+        with self._lock:
+            self._record(stats_list)
+            return self._delta(generation)
+
+    def _now(self):
+        return int(self._clock() * 1000)
+
+    def _record(self, stats_list):
+        # Generation of the changes found in this update.
+        gen = max(self._generation + 1, self._now())
+        changed = False
+        seen = set()
+
+        for stats in stats_list:
+            vm_id = stats['vmId']
+            seen.add(vm_id)
+            rec = self._vms.get(vm_id)
+            if rec is None:
+                rec = self._vms[vm_id] = _VmRecord()
+            elif rec.removed is not None:
+                # Vm with the same id was started again. Clients which saw
+                # the removal need all the fields again.
+                rec.removed = None
+                del self._removed[vm_id]
+                for name, (_, value) in list(six.iteritems(rec.fields)):
+                    rec.fields[name] = (gen, value)
+                rec.changed = gen
+                changed = True
+
+            if self._record_vm(rec, stats, gen):
+                rec.changed = gen
+                changed = True
+
+        for vm_id, rec in six.iteritems(self._vms):
+            if rec.removed is None and vm_id not in seen:
+                rec.removed = gen
+                self._removed[vm_id] = gen
+                changed = True
+
+        while len(self._removed) > self._max_removed_vms:
+            vm_id, removed = self._removed.popitem(last=False)
+            del self._vms[vm_id]
+            self._horizon = removed
+
+        if changed:
+            self._generation = gen
+
+    def _record_vm(self, rec, stats, gen):
+        changed = False
+        fields = rec.fields
+
+        for name, value in six.iteritems(stats):
+            old = fields.get(name)
+            if old is None or old[1] is _REMOVED:
+                rec.live += 1
+            elif old[1] == value:
+                continue
+            fields[name] = (gen, value)
+            changed = True
+
+        if rec.live > len(stats):
+            for name, (_, value) in list(six.iteritems(fields)):
+                if value is not _REMOVED and name not in stats:
+                    fields[name] = (gen, _REMOVED)
+                    rec.live -= 1
+                    changed = True
+
+        return changed
+
+    def _delta(self, generation):
+        full = not (self._horizon <= generation <= self._generation)
+        if full:
+            _log.debug("Sending full stats for generation %s (horizon=%s, "
+                       "current=%s)", generation, self._horizon,
+                       self._generation)
+            generation = 0
+
+        changed = []
+        removed_fields = []
+        removed = []
+
+        for vm_id, rec in six.iteritems(self._vms):
+            if rec.removed is not None:
+                if not full and rec.removed > generation:
+                    removed.append(vm_id)
+                continue
+            if rec.changed <= generation:
+                continue
+            vm_changed = {}
+            vm_removed = []
+            for name, (gen, value) in six.iteritems(rec.fields):
+                if gen <= generation:
+                    continue
+                if value is _REMOVED:
+                    if not full:
+                        vm_removed.append(name)
+                else:
+                    vm_changed[name] = value
+            if vm_changed:
+                vm_changed['vmId'] = vm_id
+                changed.append(vm_changed)
+            if vm_removed:
+                removed_fields.append({'vmId': vm_id, 'fields': vm_removed})
+
+        return {
+            'generation': self._generation,
+            'full': full,
+            'changed': changed,
+            'removedFields': removed_fields,
+            'removed': removed,
+        }
@@ -14,19 +14,21 @@
 # License along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA
 from __future__ import absolute_import
+import functools
 import logging
+import six
 from six.moves import queue
 from threading import Lock, Event
 
 from vdsm.common import exception as vdsmexception
 
-from vdsm.common.compat import json
 from vdsm.common.logutils import Suppressed, traceback
 from vdsm.common.threadlocal import vars
 from vdsm.common.time import monotonic_time
 from vdsm.common.password import protect_passwords, unprotect_passwords
 
 from yajsonrpc import exception
+from yajsonrpc import jsoncodec
 
 __all__ = ["betterAsyncore", "stompreactor", "stomp"]
 
@@ -46,7 +48,7 @@ class JsonRpcRequest(object):
     @classmethod
     def decode(cls, msg):
         try:
-            obj = json.loads(msg, encoding='utf-8')
+            obj = jsoncodec.loads(msg)
         except:
             raise exception.JsonRpcParseError()
 
@@ -92,7 +94,7 @@ class JsonRpcRequest(object):
 
     def encode(self):
         res = self.toDict()
-        return json.dumps(res, 'utf-8')
+        return jsoncodec.dumps(res)
 
     def isNotification(self):
         return (self.id is None)
@@ -118,11 +120,11 @@ class JsonRpcResponse(object):
 
     def encode(self):
         res = self.toDict()
-        return json.dumps(res, 'utf-8')
+        return jsoncodec.dumps(res)
 
     @staticmethod
     def decode(msg):
-        obj = json.loads(msg, encoding='utf-8')
+        obj = jsoncodec.loads(msg)
         return JsonRpcResponse.fromRawObject(obj)
 
     @staticmethod
@@ -174,9 +176,10 @@ class Notification(object):
         """
         self._add_notify_time(params)
         self._event_schema.verify_event_params(self._event_id, params)
-        notification = json.dumps({'jsonrpc': '2.0',
-                                   'method': self._event_id,
-                                   'params': params})
+        notification = jsoncodec.dumps({'jsonrpc': '2.0',
+                                        'method': self._event_id,
+                                        'params': params},
+                                       skipkeys=False)
 
         self.log.debug("Sending event %s", notification)
         self._cb(notification)
@@ -214,9 +217,8 @@ class _JsonRpcClientRequestContext(object):
         return self._responses.keys()
 
     def encode(self):
-        return ("[" +
-                ", ".join(r.encode() for r in self._requests) +
-                "]")
+        return jsoncodec.dumps_array([r.encode() for r in self._requests],
+                                     separator=b", ")
 
 
 class _JsonRpcServeRequestContext(object):
@@ -266,9 +268,9 @@ class _JsonRpcServeRequestContext(object):
         if len(encodedObjects) == 1:
             data = encodedObjects[0]
         else:
-            data = '[' + ','.join(encodedObjects) + ']'
+            data = jsoncodec.dumps_array(encodedObjects)
 
-        self._client.send(data.encode('utf-8'))
+        self._client.send(data)
 
     def addResponse(self, response):
         self._responses.append(response)
@@ -457,7 +459,7 @@ class JsonRpcClient(object):
 
     def _handleMessage(self, message, event_queue=None):
         try:
-            mobj = json.loads(message)
+            mobj = jsoncodec.loads(message)
         except ValueError:
             self.log.warning(
                 "Received message is not a valid JSON: %r",
@@ -535,12 +537,20 @@ class JsonRpcServer(object):
     Creates new JsonrRpcServer by providing a bridge, timeout in seconds
     which defining how often we should log connections stats and thread
     factory.
+
+    If a fairqueue.FairQueue is provided, requests wait in the fair queue
+    until a worker is available, instead of being passed to the thread
+    factory in arrival order. report is called with the queue wait time
+    metrics every timeout seconds.
     """
-    def __init__(self, bridge, timeout, cif, threadFactory=None):
+    def __init__(self, bridge, timeout, cif, threadFactory=None,
+                 fairQueue=None, report=None):
         self._bridge = bridge
         self._cif = cif
         self._workQueue = queue.Queue()
         self._threadFactory = threadFactory
+        self._fairQueue = fairQueue
+        self._report = report
         self._timeout = timeout
         self._next_report = monotonic_time() + self._timeout
         self._counter = 0
@@ -560,6 +570,26 @@ class JsonRpcServer(object):
                           self._counter, self._timeout)
             self._next_report += self._timeout
             self._counter = 0
+            if self._fairQueue is not None:
+                self._report_wait_stats()
+
+    def _report_wait_stats(self):
+        stats = self._fairQueue.wait_stats()
+        if not stats:
+            return
+        method, (count, avg, max_wait) = max(
+            six.iteritems(stats), key=lambda item: item[1][2])
+        self.log.info('Longest queue wait for %s: %.2f seconds '
+                      '(%d requests, average %.2f seconds)',
+                      method, max_wait, count, avg)
+        if self._report is not None:
+            report = {}
+            for method, (count, avg, max_wait) in six.iteritems(stats):
+                prefix = 'hosts.vdsm.jsonrpc.' + method
+                report[prefix + '.queued'] = count
+                report[prefix + '.wait_avg'] = avg
+                report[prefix + '.wait_max'] = max_wait
+            self._report(report)
 
     def _serveRequest(self, ctx, req):
         start_time = monotonic_time()
@@ -635,7 +665,7 @@ class JsonRpcServer(object):
         ctx = _JsonRpcServeRequestContext(client, server_address, context)
 
         try:
-            rawRequests = json.loads(msg)
+            rawRequests = jsoncodec.loads(msg)
         except:
             ctx.addResponse(JsonRpcResponse(
                 None, exception.JsonRpcParseError(), None))
@@ -680,25 +710,67 @@ class JsonRpcServer(object):
     def _runRequest(self, ctx, request):
         if self._threadFactory is None:
             self._serveRequest(ctx, request)
+        elif self._fairQueue is None:
+            self._dispatch(self._serveRequest, ctx, request)
         else:
             try:
-                self._threadFactory(
-                    JsonRpcTask(self._serveRequest, ctx, request)
-                )
+                self._fairQueue.put(_connection(ctx), request.method,
+                                    (ctx, request))
             except vdsmexception.ContextException as e:
                 ctx.requestDone(JsonRpcResponse(None, e, request.id))
-            except Exception as e:
-                self.log.exception("could not serve request %s", request)
-                ctx.requestDone(
-                    JsonRpcResponse(
-                        None,
-                        exception.JsonRpcInternalError(
-                            str(e)
-                        ),
-                        request.id
-                    )
+                return
+            self._dispatchQueued()
+
+    def _dispatchQueued(self):
+        while True:
+            entry = self._fairQueue.get()
+            if entry is None:
+                break
+            ctx, request = entry.item
+            handler = functools.partial(self._serveQueuedRequest, entry)
+            if not self._dispatch(handler, ctx, request):
+                self._fairQueue.done(entry)
+
+    def _serveQueuedRequest(self, entry, ctx, request):
+        try:
+            self._serveRequest(ctx, request)
+        finally:
+            self._fairQueue.done(entry)
+            self._dispatchQueued()
+
+    def _dispatch(self, handler, ctx, request):
+        try:
+            self._threadFactory(
+                JsonRpcTask(handler, ctx, request)
+            )
+        except vdsmexception.ContextException as e:
+            ctx.requestDone(JsonRpcResponse(None, e, request.id))
+        except Exception as e:
+            self.log.exception("could not serve request %s", request)
+            ctx.requestDone(
+                JsonRpcResponse(
+                    None,
+                    exception.JsonRpcInternalError(
+                        str(e)
+                    ),
+                    request.id
                 )
+            )
+        else:
+            return True
+        return False
 
     def stop(self):
         self.log.info("Stopping JsonRPC Server")
         self._workQueue.put_nowait(None)
+
+
+def _connection(ctx):
+    """
+    Return the client connection of a request context, used for fair
+    queuing between clients.
+    """
+    context = ctx.context
+    if context is None:
+        return None
+    return context.client_host, context.client_port
@@ -0,0 +1,232 @@
+# Copyright (C) 2018 Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA
+"""
+Queue of jsonrpc requests waiting for a worker.
+
+Every method has a cost class, taken from the "cost" key of the method in
+the schema. Requests are queued in one lane per cost class, and inside a
+lane, in one queue per client connection.
+
+When a worker is available, the next request is taken from the lanes
+using weighted round robin, so cheap requests are served first, but
+expensive requests are not starved. Inside a lane, connections are served
+in round robin, so one client flooding the server cannot delay other
+clients.
+
+Expensive requests may not use all the workers. The reserved workers are
+always available for cheap and normal requests.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import threading
+
+import six
+
+from vdsm.common import exception
+from vdsm.common.time import monotonic_time
+
+CHEAP = "cheap"
+NORMAL = "normal"
+EXPENSIVE = "expensive"
+
+# Cost classes, in priority order.
+COSTS = (CHEAP, NORMAL, EXPENSIVE)
+
+DEFAULT_WEIGHTS = {CHEAP: 16, NORMAL: 4, EXPENSIVE: 1}
+
+
+class Entry(object):
+    """
+    A request waiting in the queue or running.
+    """
+
+    __slots__ = ("item", "method", "lane", "queued", "started")
+
+    def __init__(self, item, method, lane, queued):
+        self.item = item
+        self.method = method
+        self.lane = lane
+        self.queued = queued
+        self.started = None
+
+
+class _Lane(object):
+
+    def __init__(self, cost, weight, limit):
+        self.cost = cost
+        self.weight = weight
+        self.limit = limit
+        self.credit = weight
+        self.running = 0
+        self.size = 0
+        # connection -> deque of entries, in round robin order.
+        self.queues = collections.OrderedDict()
+
+    def runnable(self):
+        return self.size > 0 and self.running < self.limit
+
+    def put(self, connection, entry):
+        queue = self.queues.get(connection)
+        if queue is None:
+            queue = self.queues[connection] = collections.deque()
+        queue.append(entry)
+        self.size += 1
+
+    def pop(self):
+        connection, queue = next(six.iteritems(self.queues))
+        entry = queue.popleft()
+        # Move the connection to the end of the round.
+        del self.queues[connection]
+        if queue:
+            self.queues[connection] = queue
+        self.size -= 1
+        return entry
+
+
+class FairQueue(object):
+
+    def __init__(self, workers, costs=None, weights=None, reserved=0,
+                 timeout=None, max_requests=None, clock=monotonic_time):
+        """
+        Arguments:
+            workers (int): maximum number of running requests
+            costs (dict): method name -> cost class. Methods not in costs
+                are normal.
+            weights (dict): cost class -> weight of the lane. Lanes missing
+                in weights use the default weight.
+            reserved (int): number of workers that cannot run expensive
+                requests
+            timeout (float): requests running longer than timeout seconds
+                do not occupy a worker. The executor replaces the workers
+                of such requests.
+            max_requests (int): maximum number of requests waiting in the
+                queue. Use None for no limit.
+        """
+        if weights is None:
+            weights = {}
+        self._workers = workers
+        self._costs = dict(costs or {})
+        self._timeout = timeout
+        self._max_requests = max_requests
+        self._size = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        limits = {EXPENSIVE: max(1, workers - reserved)}
+        self._lanes = []
+        for cost in COSTS:
+            weight = weights.get(cost, DEFAULT_WEIGHTS[cost])
+            if weight < 1:
+                raise ValueError("Invalid weight for %s: %r" % (cost, weight))
+            self._lanes.append(_Lane(cost, weight, limits.get(cost, workers)))
+        self._lane_by_cost = {lane.cost: lane for lane in self._lanes}
+        self._running = set()
+        # method -> [count, total wait, max wait]
+        self._waits = {}
+
+    def __len__(self):
+        with self._lock:
+            return self._size
+
+    def cost(self, method):
+        return self._costs.get(method, NORMAL)
+
+    def put(self, connection, method, item):
+        """
+        Queue item, for running method for connection. connection can be
+        any hashable object identifying the client connection.
+
+        Do not block when full, raises ResourceExhausted instead.
+        """
+        lane = self._lane_by_cost[self.cost(method)]
+        entry = Entry(item, method, lane, self._clock())
+        with self._lock:
+            if (self._max_requests is not None and
+                    self._size >= self._max_requests):
+                raise exception.ResourceExhausted(
+                    "Too many requests",
+                    resource="fair queue",
+                    current_requests=self._max_requests)
+            lane.put(connection, entry)
+            self._size += 1
+
+    def get(self):
+        """
+        Return the next entry to run, or None if no entry can run now.
+        done() must be called with the entry when the request is finished.
+        """
+        with self._lock:
+            now = self._clock()
+            if self._timeout is not None:
+                self._release_stuck(now)
+            if len(self._running) >= self._workers:
+                return None
+            lane = self._next_lane()
+            if lane is None:
+                return None
+            entry = lane.pop()
+            self._size -= 1
+            lane.credit -= 1
+            lane.running += 1
+            entry.started = now
+            self._running.add(entry)
+            self._record_wait(entry.method, now - entry.queued)
+            return entry
+
+    def done(self, entry):
+        with self._lock:
+            if entry in self._running:
+                self._running.remove(entry)
+                entry.lane.running -= 1
+
+    def wait_stats(self):
+        """
+        Return the queue wait time per method since the last call, as dict
+        method -> (count, average wait, max wait), and start a new period.
+        """
+        with self._lock:
+            waits = self._waits
+            self._waits = {}
+        return {method: (count, total / count, max_wait)
+                for method, (count, total, max_wait) in six.iteritems(waits)}
+
+    def _next_lane(self):
+        for lane in self._lanes:
+            if lane.credit > 0 and lane.runnable():
+                return lane
+        # All runnable lanes used their credit, start a new round.
+        runnable = [lane for lane in self._lanes if lane.runnable()]
+        if not runnable:
+            return None
+        for lane in self._lanes:
+            lane.credit = lane.weight
+        return runnable[0]
+
+    def _release_stuck(self, now):
+        deadline = now - self._timeout
+        for entry in [e for e in self._running if e.started < deadline]:
+            self._running.remove(entry)
+            entry.lane.running -= 1
+
+    def _record_wait(self, method, wait):
+        stats = self._waits.get(method)
+        if stats is None:
+            self._waits[method] = [1, wait, wait]
+        else:
+            stats[0] += 1
+            stats[1] += wait
+            if wait > stats[2]:
+                stats[2] = wait
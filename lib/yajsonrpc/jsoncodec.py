@@ -0,0 +1,92 @@
+# Copyright (C) 2018 Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA
+"""
+JSON codec used for jsonrpc requests, responses and notifications.
+
+The codec is created once using the fastest json module available (see
+vdsm.common.compat), and encodes messages directly to the bytes sent on
+the wire.
+
+json.dumps() and json.loads() create a new encoder or decoder on every call
+when called with non-default arguments, so we keep the encoders and call
+them directly. The encoders use the same arguments used before, to keep
+the wire format: json.dumps(obj, 'utf-8') passes 'utf-8' as skipkeys, and
+ensure_ascii is enabled, so the output is always ascii.
+"""
+
+from __future__ import absolute_import
+
+import six
+
+from vdsm.common.compat import json
+
+
+class Codec(object):
+
+    def __init__(self, json_module=json):
+        self.name = json_module.__name__
+        # Requests and responses skip non-string keys.
+        self._encoder = json_module.JSONEncoder(skipkeys=True)
+        # Notifications fail on non-string keys.
+        self._strict_encoder = json_module.JSONEncoder()
+        self._decoder = json_module.JSONDecoder()
+
+    def dumps(self, obj, skipkeys=True):
+        """
+        Encode obj, returning bytes.
+        """
+        if skipkeys:
+            s = self._encoder.encode(obj)
+        else:
+            s = self._strict_encoder.encode(obj)
+        return _to_bytes(s)
+
+    def dumps_array(self, encoded, separator=b","):
+        """
+        Join a list of encoded objects into a json array, returning bytes.
+
+        Objects are encoded separately by the caller, so an object failing
+        to encode can be replaced by an error.
+        """
+        return b"[" + separator.join(encoded) + b"]"
+
+    def loads(self, data):
+        """
+        Decode json text or utf-8 encoded bytes.
+        """
+        if isinstance(data, bytearray):
+            data = bytes(data)
+        if six.PY3 and isinstance(data, bytes):
+            data = data.decode("utf-8")
+        return self._decoder.decode(data)
+
+
+if six.PY2:
+    def _to_bytes(s):
+        # With ensure_ascii the encoder returns str, unless it was given
+        # unicode it could not escape.
+        if isinstance(s, unicode):  # NOQA: F821 (undefined name)
+            s = s.encode("utf-8")
+        return s
+else:
+    def _to_bytes(s):
+        return s.encode("ascii")
+
+
+_codec = Codec()
+
+dumps = _codec.dumps
+dumps_array = _codec.dumps_array
+loads = _codec.loads
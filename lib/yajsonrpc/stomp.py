@@ -185,6 +185,17 @@ def encodeValue(s):
 
 
 class Parser(object):
+    """
+    Parse a stream of STOMP frames.
+
+    Received data is appended to a bytearray, and frames are parsed in place
+    by keeping the offset of the first unparsed byte, so a partially
+    received frame is not copied again when more data arrives. The body of
+    a frame is copied once out of the buffer when it was received
+    completely. When the frame has a content-length header, the body is
+    sliced without scanning it.
+    """
+
     _STATE_CMD = "Parsing command"
     _STATE_HEADER = "Parsing headers"
     _STATE_BODY = "Receiving body"
@@ -197,39 +208,45 @@ class Parser(object):
         self._frames = deque()
         self._change_state(self._STATE_CMD)
         self._contentLength = -1
-        self._flush()
+        self._buffer = bytearray()
+        # Offset of the first unparsed byte in the buffer.
+        self._pos = 0
+        # Offset where searching for the body terminator continues.
+        self._scan = 0
 
     def _change_state(self, new_state):
         self._state = new_state
         self._state_cb = self._states[new_state]
 
-    def _flush(self):
-        self._buffer = ""
-
-    def _write_buffer(self, buff):
-        self._buffer += buff
-
-    def _get_buffer(self):
-        return self._buffer
+    def _compact(self):
+        # Drop the parsed data only when it is at least half of the buffer,
+        # so a large frame received in small chunks is moved only a few
+        # times.
+        pos = self._pos
+        if pos and pos * 2 >= len(self._buffer):
+            del self._buffer[:pos]
+            self._pos = 0
+            self._scan = max(0, self._scan - pos)
 
     def _handle_terminator(self, term):
-        res, sep, rest = self._buffer.partition(term)
-        if not sep:
+        end = self._buffer.find(term, self._pos)
+        if end == -1:
             return None
 
-        self._buffer = rest
+        res = bytes(self._buffer[self._pos:end])
+        self._pos = end + 1
 
         return res
 
     def _parse_command(self):
-        cmd = self._handle_terminator('\n')
+        cmd = self._handle_terminator(b'\n')
         if cmd is None:
             return False
 
-        if len(cmd) > 0 and cmd[-1] == '\r':
+        if cmd.endswith(b'\r'):
             cmd = cmd[:-1]
 
-        if cmd == "":
+        if cmd == b"":
             return True
 
         cmd = decodeValue(cmd)
@@ -239,20 +256,21 @@ class Parser(object):
         return True
 
     def _parse_header(self):
-        header = self._handle_terminator('\n')
+        header = self._handle_terminator(b'\n')
         if header is None:
             return False
 
-        if len(header) > 0 and header[-1] == '\r':
+        if header.endswith(b'\r'):
             header = header[:-1]
 
         headers = self._tmpFrame.headers
-        if header == "":
+        if header == b"":
             self._contentLength = int(headers.get('content-length', -1))
+            self._scan = self._pos
             self._change_state(self._STATE_BODY)
             return True
 
-        key, value = header.split(":", 1)
+        key, value = header.split(b":", 1)
         key = decodeValue(key)
         value = decodeValue(value)
 
@@ -277,41 +295,46 @@ class Parser(object):
             return self._parse_body_terminator()
 
     def _parse_body_terminator(self):
-        body = self._handle_terminator('\0')
-        if body is None:
+        end = self._buffer.find(b'\0', self._scan)
+        if end == -1:
+            # Do not scan the received data again.
+            self._scan = len(self._buffer)
             return False
 
-        self._tmpFrame.body = body
+        self._tmpFrame.body = self._slice(self._pos, end)
+        self._pos = end + 1
         self._pushFrame()
         return True
 
     def _parse_body_length(self):
-        buf = self._get_buffer()
-        cl = self._contentLength
-        ndata = len(buf)
-        if ndata < (cl + 1):
+        start = self._pos
+        end = start + self._contentLength
+        if len(self._buffer) <= end:
             return False
 
-        if buf[cl] != "\0":
+        if self._buffer[end] != 0:
             raise RuntimeError("Frame end is missing \\0")
 
-        self._flush()
-        self._write_buffer(buf[cl + 1:])
-        body = buf[:cl]
-
-        self._tmpFrame.body = body
+        self._tmpFrame.body = self._slice(start, end)
+        self._pos = end + 1
         self._pushFrame()
 
         return True
 
+    def _slice(self, start, end):
+        # The temporary memoryview is released before the buffer is
+        # modified again.
+        return memoryview(self._buffer)[start:end].tobytes()
+
     @property
     def pending(self):
         return len(self._frames)
 
     def parse(self, data):
-        self._write_buffer(data)
+        self._buffer.extend(data)
         while self._state_cb():
             pass
+        self._compact()
 
     def popFrame(self):
         try:
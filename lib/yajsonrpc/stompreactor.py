@@ -24,9 +24,9 @@ from vdsm.config import config
 from vdsm.common import api
 from vdsm.common import concurrent
 from vdsm.common import pki
-from vdsm.common.compat import json
 from vdsm.sslutils import CLIENT_PROTOCOL, SSLSocket, SSLContext
 from . import JsonRpcClient, JsonRpcServer
+from . import jsoncodec
 from . import stomp
 from .betterAsyncore import Dispatcher, Reactor
 
@@ -243,7 +243,8 @@ class StompAdapterImpl(object):
         or for standard mode we use 'reply-to' header.
         """
         try:
-            self._handle_destination(dispatcher, req_dest, json.loads(request))
+            self._handle_destination(dispatcher, req_dest,
+                                     jsoncodec.loads(request))
         except Exception:
             # let json server process issue
             pass
@@ -381,7 +382,7 @@ class StompServer(object):
     Sends message to all subscribes that subscribed to destination.
     """
     def send(self, message, destination=stomp.SUBSCRIPTION_ID_RESPONSE):
-        resp = json.loads(message)
+        resp = jsoncodec.loads(message)
         if not isinstance(resp, dict):
             raise ValueError(
                 'Provided message %s failed parsing to dictionary' % message)
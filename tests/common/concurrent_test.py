@@ -202,6 +202,29 @@ class TMapTests(VdsmTestCase):
         self.assertGreater(elapsed, 0.5)
         self.assertLess(elapsed, 1.0)
 
+    def test_workers(self):
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+
+        def func(x):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return x
+
+        values = tuple(range(10))
+        results = concurrent.tmap(func, values, workers=3)
+        expected = [concurrent.Result(True, x) for x in values]
+        self.assertEqual(results, expected)
+        self.assertEqual(max_running[0], 3)
+
+    def test_empty(self):
+        self.assertEqual(concurrent.tmap(lambda x: x, [], workers=4), [])
+
     def test_error(self):
         error = RuntimeError("No result for you!")
 
@@ -112,3 +112,20 @@ class TestClock(VdsmTestCase):
         with self.assertRaises(RuntimeError):
             with c.run("stopped"):
                 pass
+
+
+class TestPreciseMonotonicTime(VdsmTestCase):
+
+    def test_monotonic(self):
+        start = time.precise_monotonic_time()
+        for i in range(1000):
+            now = time.precise_monotonic_time()
+            self.assertGreaterEqual(now, start)
+            start = now
+
+    def test_resolution(self):
+        # monotonic_time() would return the same value for 10 milliseconds.
+        start = time.precise_monotonic_time()
+        while time.precise_monotonic_time() == start:
+            pass
+        self.assertLess(time.precise_monotonic_time() - start, 0.001)
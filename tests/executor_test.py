@@ -18,6 +18,7 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import itertools
 import logging
 import threading
 import time
@@ -31,11 +32,14 @@ from vdsm.common import pthread
 
 from fakelib import FakeLogger
 from testValidation import slowtest
+from testValidation import stresstest
 from testlib import VdsmTestCase as TestCaseBase
 
 
 class ExecutorTests(TestCaseBase):
 
+    work_stealing = False
+
     def setUp(self):
         self.scheduler = schedule.Scheduler()
         self.scheduler.start()
@@ -45,7 +49,8 @@ class ExecutorTests(TestCaseBase):
                                           workers_count=10,
                                           max_tasks=self.max_tasks,
                                           scheduler=self.scheduler,
-                                          max_workers=self.max_workers)
+                                          max_workers=self.max_workers,
+                                          work_stealing=self.work_stealing)
         self.executor.start()
         time.sleep(0.1)  # Give time to start all threads
 
@@ -235,7 +240,8 @@ class ExecutorTests(TestCaseBase):
                                           max_tasks=self.max_tasks,
                                           scheduler=self.scheduler,
                                           max_workers=self.max_workers,
-                                          log=log)
+                                          log=log,
+                                          work_stealing=self.work_stealing)
         self.executor.start()
         time.sleep(0.1)  # Give time to start all threads
 
@@ -252,6 +258,27 @@ class ExecutorTests(TestCaseBase):
             text.startswith('Worker blocked')
             for (level, text, _) in log.messages))
 
+    def test_stats(self):
+        tasks = [Task() for n in range(5)]
+        for task in tasks:
+            self.executor.dispatch(task)
+        for task in tasks:
+            self.assertTrue(task.executed.wait(1))
+        self.executor.dispatch(Task(wait=0.01))
+        # Wait until the statistics of the last task are recorded.
+        self.retryAssert(self._check_stats, tries=20, sleep=0.05)
+
+    def _check_stats(self):
+        wait, run = self.executor.stats()['Task']
+        self.assertEqual(wait.count, 6)
+        self.assertEqual(run.count, 6)
+        self.assertGreaterEqual(run.total, 0.01)
+
+
+class StealingExecutorTests(ExecutorTests):
+
+    work_stealing = True
+
 
 class TestWorkerSystemNames(TestCaseBase):
 
@@ -317,6 +344,246 @@ class ExecutorTaskTests(TestCaseBase):
         self.assertTrue(msg.startswith('<Task discardable'))
 
 
+class StealingTaskQueueTests(TestCaseBase):
+
+    def test_local_queue(self):
+        q = executor.StealingTaskQueue('test', 10, 2)
+        for i in range(4):
+            q.put(i)
+        self.assertEqual([q.get(0), q.get(0)], [0, 2])
+        self.assertEqual([q.get(1), q.get(1)], [1, 3])
+
+    def test_steal(self):
+        q = executor.StealingTaskQueue('test', 10, 3)
+        for i in range(3):
+            q.put(i)
+        self.assertEqual([q.get(2) for i in range(3)], [2, 0, 1])
+        self.assertEqual(len(q), 0)
+
+    def test_full(self):
+        q = executor.StealingTaskQueue('test', 2, 2)
+        q.put(0)
+        q.put(1)
+        with self.assertRaises(exception.ResourceExhausted):
+            q.put(2)
+
+    def test_clear(self):
+        q = executor.StealingTaskQueue('test', 10, 2)
+        for i in range(4):
+            q.put(i)
+        q.clear()
+        self.assertEqual(len(q), 0)
+
+    def test_wakeup(self):
+        q = executor.StealingTaskQueue('test', 10, 4)
+        results = []
+
+        def worker(slot):
+            results.append(q.get(slot))
+
+        threads = [concurrent.thread(worker, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for i in range(4):
+            q.put(i)
+        for t in threads:
+            t.join(1)
+            self.assertFalse(t.is_alive())
+        self.assertEqual(sorted(results), [0, 1, 2, 3])
+
+
+class FakeScheduler(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def schedule(self, delay, callable):
+        call = FakeCall(delay, callable)
+        self.calls.append(call)
+        return call
+
+    def run(self):
+        calls, self.calls = self.calls, []
+        for call in calls:
+            if not call.cancelled:
+                call.callable()
+
+
+class FakeCall(object):
+
+    def __init__(self, delay, callable):
+        self.delay = delay
+        self.callable = callable
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TimingWheelTests(TestCaseBase):
+
+    def setUp(self):
+        self.scheduler = FakeScheduler()
+        self.clock = FakeClock()
+        self.wheel = executor.TimingWheel(self.scheduler, tick=1, size=4,
+                                          clock=self.clock)
+        self.wheel.start()
+        self.fired = []
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        self.scheduler.run()
+
+    def test_single_scheduler_call(self):
+        for i in range(10):
+            self.wheel.schedule(i + 1, lambda: None)
+        self.assertEqual(len(self.scheduler.calls), 1)
+
+    def test_expire(self):
+        self.wheel.schedule(2, lambda: self.fired.append(2))
+        self.wheel.schedule(3, lambda: self.fired.append(3))
+        self.advance(1)
+        self.assertEqual(self.fired, [])
+        self.advance(1)
+        self.assertEqual(self.fired, [2])
+        self.advance(1)
+        self.assertEqual(self.fired, [2, 3])
+
+    def test_round_up_to_tick(self):
+        self.wheel.schedule(0.5, lambda: self.fired.append(0.5))
+        self.advance(0.5)
+        self.assertEqual(self.fired, [])
+        self.advance(0.5)
+        self.assertEqual(self.fired, [0.5])
+
+    def test_cancel(self):
+        call = self.wheel.schedule(1, lambda: self.fired.append(1))
+        call.cancel()
+        self.advance(1)
+        self.assertEqual(self.fired, [])
+
+    def test_more_than_one_revolution(self):
+        self.wheel.schedule(6, lambda: self.fired.append(6))
+        for i in range(5):
+            self.advance(1)
+        self.assertEqual(self.fired, [])
+        self.advance(1)
+        self.assertEqual(self.fired, [6])
+
+    def test_late_advance(self):
+        self.wheel.schedule(1, lambda: self.fired.append(1))
+        self.wheel.schedule(3, lambda: self.fired.append(3))
+        self.advance(10)
+        self.assertEqual(sorted(self.fired), [1, 3])
+
+    def test_stop(self):
+        self.wheel.schedule(1, lambda: self.fired.append(1))
+        self.wheel.stop()
+        self.advance(1)
+        self.assertEqual(self.fired, [])
+        self.assertEqual(self.scheduler.calls, [])
+
+    def test_error_in_call(self):
+        def fail():
+            raise RuntimeError("fail")
+        self.wheel.schedule(1, fail)
+        self.wheel.schedule(1, lambda: self.fired.append(1))
+        self.advance(1)
+        self.assertEqual(self.fired, [1])
+        # The wheel is still advanced.
+        self.assertEqual(len(self.scheduler.calls), 1)
+
+
+class HistogramTests(TestCaseBase):
+
+    def test_empty(self):
+        h = executor.Histogram()
+        self.assertEqual(h.count, 0)
+        self.assertIsNone(h.percentile(50))
+
+    def test_percentile(self):
+        h = executor.Histogram()
+        for i in range(99):
+            h.add(0.00005)
+        h.add(0.1)
+        self.assertEqual(h.count, 100)
+        self.assertEqual(h.percentile(50), 0.0001)
+        self.assertEqual(h.percentile(99), 0.0001)
+        self.assertEqual(h.percentile(100), 0.0001 * 2 ** 10)
+
+    def test_overflow(self):
+        h = executor.Histogram()
+        h.add(1000)
+        self.assertEqual(h.percentile(50), float("inf"))
+
+    def test_merge(self):
+        a = executor.Histogram()
+        b = executor.Histogram()
+        a.add(0.001)
+        b.add(0.001)
+        b.add(1)
+        a.merge(b)
+        self.assertEqual(a.count, 3)
+        self.assertAlmostEqual(a.total, 1.002)
+
+
+class ExecutorBenchmark(TestCaseBase):
+
+    TASKS = 1000000
+    WORKERS = 4
+
+    @stresstest
+    def test_dispatch_queue(self):
+        self.dispatch(False)
+
+    @stresstest
+    def test_dispatch_stealing(self):
+        self.dispatch(True)
+
+    def dispatch(self, work_stealing):
+        scheduler = schedule.Scheduler()
+        scheduler.start()
+        e = executor.Executor('bench',
+                              workers_count=self.WORKERS,
+                              max_tasks=self.TASKS,
+                              scheduler=scheduler,
+                              work_stealing=work_stealing)
+        e.start()
+        done = threading.Event()
+        counter = itertools.count(1)
+
+        def task():
+            if next(counter) == self.TASKS:
+                done.set()
+
+        try:
+            start = time.time()
+            for i in range(self.TASKS):
+                e.dispatch(task, timeout=10)
+            dispatched = time.time()
+            self.assertTrue(done.wait(300))
+            end = time.time()
+        finally:
+            e.stop()
+            scheduler.stop()
+        wait, run = e.stats()['task']
+        print("\n%s: %d tasks dispatched in %.2f seconds, completed in %.2f "
+              "seconds (%d tasks/s), wait p50=%s run p99=%s" % (
+                  "work stealing" if work_stealing else "single queue",
+                  self.TASKS, dispatched - start, end - start,
+                  self.TASKS / (end - start), wait.percentile(50),
+                  run.percentile(99)))
+
+
 class Task(object):
 
     def __init__(self, wait=None, error=None, event=None, start_barrier=None):
@@ -0,0 +1,412 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import time
+
+from six.moves import queue
+
+from vdsm.common import api
+from vdsm.common import concurrent
+from vdsm.common import exception
+from vdsm.common.compat import json
+
+from yajsonrpc import JsonRpcServer
+from yajsonrpc import fairqueue
+
+from testlib import VdsmTestCase
+from testValidation import stresstest
+
+COSTS = {
+    'Host.ping2': fairqueue.CHEAP,
+    'Volume.getInfo': fairqueue.EXPENSIVE,
+}
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FairQueueTests(VdsmTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def queue(self, workers=1, **kw):
+        return fairqueue.FairQueue(workers, costs=COSTS, clock=self.clock,
+                                   **kw)
+
+    def drain(self, fq):
+        items = []
+        while True:
+            entry = fq.get()
+            if entry is None:
+                return items
+            items.append(entry.item)
+            fq.done(entry)
+
+    def test_empty(self):
+        fq = self.queue()
+        self.assertIsNone(fq.get())
+        self.assertEqual(len(fq), 0)
+
+    def test_cost(self):
+        fq = self.queue()
+        self.assertEqual(fq.cost('Host.ping2'), fairqueue.CHEAP)
+        self.assertEqual(fq.cost('Volume.getInfo'), fairqueue.EXPENSIVE)
+        self.assertEqual(fq.cost('Host.getCapabilities'), fairqueue.NORMAL)
+
+    def test_fifo(self):
+        fq = self.queue()
+        for i in range(5):
+            fq.put('conn', 'Host.getCapabilities', i)
+        self.assertEqual(len(fq), 5)
+        self.assertEqual(self.drain(fq), list(range(5)))
+
+    def test_priority(self):
+        fq = self.queue()
+        fq.put('conn', 'Volume.getInfo', 'expensive')
+        fq.put('conn', 'Host.getCapabilities', 'normal')
+        fq.put('conn', 'Host.ping2', 'cheap')
+        self.assertEqual(self.drain(fq), ['cheap', 'normal', 'expensive'])
+
+    def test_weights(self):
+        fq = self.queue(weights={fairqueue.CHEAP: 3})
+        for i in range(7):
+            fq.put('conn', 'Host.ping2', 'cheap')
+        for i in range(2):
+            fq.put('conn', 'Volume.getInfo', 'expensive')
+        self.assertEqual(self.drain(fq), (['cheap'] * 3 + ['expensive']) * 2 +
+                         ['cheap'])
+
+    def test_invalid_weight(self):
+        with self.assertRaises(ValueError):
+            self.queue(weights={fairqueue.NORMAL: 0})
+
+    def test_round_robin(self):
+        fq = self.queue()
+        for i in range(3):
+            fq.put('flood', 'Volume.getInfo', ('flood', i))
+        fq.put('other', 'Volume.getInfo', ('other', 0))
+        self.assertEqual(self.drain(fq), [
+            ('flood', 0), ('other', 0), ('flood', 1), ('flood', 2)])
+
+    def test_workers(self):
+        fq = self.queue(workers=2)
+        for i in range(3):
+            fq.put('conn', 'Host.getCapabilities', i)
+        first = fq.get()
+        second = fq.get()
+        self.assertEqual((first.item, second.item), (0, 1))
+        self.assertIsNone(fq.get())
+        fq.done(first)
+        self.assertEqual(fq.get().item, 2)
+
+    def test_max_requests(self):
+        fq = self.queue(max_requests=2)
+        fq.put('conn', 'Host.ping2', 0)
+        fq.put('conn', 'Volume.getInfo', 1)
+        with self.assertRaises(exception.ResourceExhausted):
+            fq.put('other', 'Host.ping2', 2)
+        self.assertEqual(len(fq), 2)
+        fq.done(fq.get())
+        fq.put('other', 'Host.ping2', 2)
+        self.assertEqual(sorted(self.drain(fq)), [1, 2])
+
+    def test_reserved_workers(self):
+        fq = self.queue(workers=3, reserved=2)
+        for i in range(2):
+            fq.put('conn', 'Volume.getInfo', 'expensive')
+        self.assertEqual(fq.get().item, 'expensive')
+        # Second expensive request must wait.
+        self.assertIsNone(fq.get())
+        fq.put('conn', 'Host.getCapabilities', 'normal')
+        fq.put('conn', 'Host.ping2', 'cheap')
+        self.assertEqual(fq.get().item, 'cheap')
+        self.assertEqual(fq.get().item, 'normal')
+
+    def test_reserved_all_workers(self):
+        fq = self.queue(workers=2, reserved=4)
+        fq.put('conn', 'Volume.getInfo', 'expensive')
+        self.assertEqual(fq.get().item, 'expensive')
+
+    def test_timeout(self):
+        fq = self.queue(workers=1, timeout=10)
+        fq.put('conn', 'Host.getCapabilities', 'stuck')
+        fq.put('conn', 'Host.getCapabilities', 'next')
+        stuck = fq.get()
+        self.assertEqual(stuck.item, 'stuck')
+        self.clock.now += 10
+        self.assertIsNone(fq.get())
+        self.clock.now += 1
+        self.assertEqual(fq.get().item, 'next')
+        # Finishing a released request does not free a worker twice.
+        fq.done(stuck)
+        fq.put('conn', 'Host.getCapabilities', 'last')
+        self.assertIsNone(fq.get())
+
+    def test_wait_stats(self):
+        fq = self.queue()
+        fq.put('conn', 'Host.getCapabilities', 0)
+        fq.put('conn', 'Host.getCapabilities', 1)
+        self.clock.now += 1
+        fq.done(fq.get())
+        self.clock.now += 2
+        fq.done(fq.get())
+        self.assertEqual(fq.wait_stats(),
+                         {'Host.getCapabilities': (2, 2.0, 3.0)})
+        self.assertEqual(fq.wait_stats(), {})
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.replies = {}
+
+    def send(self, data):
+        reply = json.loads(data)
+        with self.lock:
+            self.replies[reply['id']] = (time.time(), reply)
+
+
+class FakeBridge(object):
+
+    def __init__(self, slow_time=0):
+        self.slow_time = slow_time
+
+    def dispatch(self, method):
+        if method == 'Volume.getInfo':
+            return self.slow
+        return self.fast
+
+    def slow(self, *args):
+        time.sleep(self.slow_time)
+        return 'slow'
+
+    def fast(self, *args):
+        return 'fast'
+
+    def register_server_address(self, server_address):
+        pass
+
+    def unregister_server_address(self):
+        pass
+
+
+class FakeCif(object):
+    ready = True
+
+
+class CollectingThreadFactory(object):
+
+    def __init__(self):
+        self.tasks = []
+        self.dispatched = []
+
+    def __call__(self, task):
+        self.tasks.append(task)
+        self.dispatched.append(task._req.method)
+
+    def run(self, count=1):
+        for i in range(count):
+            self.tasks.pop(0)()
+
+
+class ThreadPool(object):
+
+    def __init__(self, workers):
+        self._tasks = queue.Queue()
+        self._threads = [concurrent.thread(self._run, name='test/%d' % i)
+                         for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def __call__(self, task):
+        self._tasks.put(task)
+
+    def stop(self):
+        for t in self._threads:
+            self._tasks.put(None)
+        for t in self._threads:
+            t.join()
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            task()
+
+
+def request(method, req_id):
+    return json.dumps({'jsonrpc': '2.0', 'method': method, 'params': {},
+                       'id': req_id})
+
+
+def message(client, port, msg):
+    return (client, '127.0.0.1', api.Context(None, '10.0.0.1', port), msg)
+
+
+class ServerTests(VdsmTestCase):
+
+    def test_cheap_request_not_delayed(self):
+        threads = CollectingThreadFactory()
+        fq = fairqueue.FairQueue(2, costs=COSTS)
+        server = JsonRpcServer(FakeBridge(), 0, FakeCif(), threads,
+                               fairQueue=fq)
+        flood = FakeClient()
+        for i in range(10):
+            server._parseMessage(
+                message(flood, 1000, request('Volume.getInfo', i)))
+        other = FakeClient()
+        server._parseMessage(message(other, 2000, request('Host.ping2', 0)))
+
+        # Both workers are busy serving the flood.
+        self.assertEqual(len(threads.tasks), 2)
+        while threads.tasks:
+            threads.run()
+        self.assertEqual(threads.dispatched[:3],
+                         ['Volume.getInfo', 'Volume.getInfo', 'Host.ping2'])
+        self.assertEqual(other.replies[0][1]['result'], 'fast')
+        self.assertEqual(len(flood.replies), 10)
+        self.assertEqual(len(fq), 0)
+
+    def test_dispatch_error(self):
+        def thread_factory(task):
+            raise RuntimeError("no threads")
+
+        fq = fairqueue.FairQueue(1, costs=COSTS)
+        server = JsonRpcServer(FakeBridge(), 0, FakeCif(), thread_factory,
+                               fairQueue=fq)
+        client = FakeClient()
+        for i in range(2):
+            server._parseMessage(
+                message(client, 1000, request('Host.ping2', i)))
+        for i in range(2):
+            self.assertIn('error', client.replies[i][1])
+        self.assertEqual(len(fq), 0)
+
+    def test_queue_full(self):
+        threads = CollectingThreadFactory()
+        fq = fairqueue.FairQueue(1, costs=COSTS, max_requests=2)
+        server = JsonRpcServer(FakeBridge(), 0, FakeCif(), threads,
+                               fairQueue=fq)
+        client = FakeClient()
+        # One request is running, two are waiting.
+        for i in range(4):
+            server._parseMessage(
+                message(client, 1000, request('Host.ping2', i)))
+        self.assertEqual(client.replies[3][1]['error']['code'],
+                         exception.ResourceExhausted.code)
+        while threads.tasks:
+            threads.run()
+        for i in range(3):
+            self.assertEqual(client.replies[i][1]['result'], 'fast')
+        self.assertEqual(len(fq), 0)
+
+    def test_report_wait_stats(self):
+        reports = []
+        threads = CollectingThreadFactory()
+        fq = fairqueue.FairQueue(1, costs=COSTS)
+        server = JsonRpcServer(FakeBridge(), 0, FakeCif(), threads,
+                               fairQueue=fq, report=reports.append)
+        server._parseMessage(
+            message(FakeClient(), 1000, request('Host.ping2', 0)))
+        threads.run()
+        server._report_wait_stats()
+        self.assertEqual(sorted(reports[0]), [
+            'hosts.vdsm.jsonrpc.Host.ping2.queued',
+            'hosts.vdsm.jsonrpc.Host.ping2.wait_avg',
+            'hosts.vdsm.jsonrpc.Host.ping2.wait_max',
+        ])
+
+
+class LoadTests(VdsmTestCase):
+    """
+    Clients flooding the server with slow requests, while another client
+    sends cheap requests.
+    """
+
+    WORKERS = 8
+    FLOOD_CLIENTS = 4
+    FLOOD_REQUESTS = 50
+    SLOW_TIME = 0.02
+    PINGS = 50
+    PING_INTERVAL = 0.01
+
+    @stresstest
+    def test_fifo(self):
+        self.run_load(None)
+
+    @stresstest
+    def test_fair_queue(self):
+        fq = fairqueue.FairQueue(self.WORKERS, costs=COSTS, reserved=2)
+        self.run_load(fq)
+
+    def run_load(self, fq):
+        threads = ThreadPool(self.WORKERS)
+        server = JsonRpcServer(FakeBridge(self.SLOW_TIME), 0, FakeCif(),
+                               threads, fairQueue=fq)
+        t = concurrent.thread(server.serve_requests, name='test/server')
+        t.start()
+        try:
+            flood = FakeClient()
+            for i in range(self.FLOOD_REQUESTS):
+                for port in range(self.FLOOD_CLIENTS):
+                    req_id = '%d-%d' % (port, i)
+                    server.queueRequest(
+                        message(flood, port,
+                                request('Volume.getInfo', req_id)))
+            ping = FakeClient()
+            sent = {}
+            for i in range(self.PINGS):
+                sent[i] = time.time()
+                server.queueRequest(
+                    message(ping, 9999, request('Host.ping2', i)))
+                time.sleep(self.PING_INTERVAL)
+
+            total = self.FLOOD_CLIENTS * self.FLOOD_REQUESTS
+            deadline = time.time() + total * self.SLOW_TIME + 10
+            while time.time() < deadline:
+                if (len(ping.replies) == self.PINGS and
+                        len(flood.replies) == total):
+                    break
+                time.sleep(0.1)
+            self.assertEqual(len(ping.replies), self.PINGS)
+            self.assertEqual(len(flood.replies), total)
+        finally:
+            server.stop()
+            t.join()
+            threads.stop()
+
+        latency = sorted(ping.replies[i][0] - sent[i]
+                         for i in range(self.PINGS))
+        print("\n%s: ping latency median %.3f seconds, max %.3f seconds" % (
+              "fifo" if fq is None else "fair queue",
+              latency[len(latency) // 2], latency[-1]))
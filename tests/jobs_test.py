@@ -77,6 +77,13 @@ class ProgressingJob(jobs.Job):
         self._progress = value
 
 
+class QueuedJob(TestingJob):
+
+    @property
+    def queued(self):
+        return self.status == jobs.STATUS.RUNNING
+
+
 class StuckJob(TestingJob):
 
     def __init__(self):
@@ -275,6 +282,12 @@ class JobsTests(VdsmTestCase):
             job.progress = i
             self.assertEqual(i, job.info()['progress'])
 
+    def test_job_queued(self):
+        job = QueuedJob()
+        self.assertNotIn('queued', job.info())
+        job._status = jobs.STATUS.RUNNING
+        self.assertTrue(job.info()['queued'])
+
     def test_job_get_error(self):
         job = TestingJob()
         self.assertIsNone(job.error)
@@ -0,0 +1,189 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+from __future__ import print_function
+
+import time
+
+import six
+
+from vdsm.common.compat import json
+
+from yajsonrpc import JsonRpcRequest
+from yajsonrpc import JsonRpcResponse
+from yajsonrpc import jsoncodec
+
+from testlib import VdsmTestCase
+from testlib import expandPermutations, permutations
+from testValidation import stresstest
+
+
+def vm_stats(i):
+    return {
+        'vmId': '%08d-1a2b-3c4d-5e6f-1234567890ab' % i,
+        'vmName': u'vm-\u05d0-%d' % i,
+        'status': 'Up',
+        'elapsedTime': '12345',
+        'cpuUser': '1.25',
+        'cpuSys': '0.50',
+        'memUsage': '42',
+        'balloonInfo': {'balloon_max': '1048576', 'balloon_cur': '1048576'},
+        'disks': {
+            'vda': {'readRate': '0.0', 'writeRate': '1024.5',
+                    'truesize': '1073741824', 'apparentsize': '1073741824',
+                    'readLatency': '0.000123', 'writeLatency': '0.000456',
+                    'flushLatency': '0.0'},
+        },
+        'network': {
+            'vnet0': {'rxErrors': '0', 'txErrors': '0', 'rxDropped': '0',
+                      'txDropped': '0', 'rx': '123456789', 'tx': '987654',
+                      'sampleTime': 4302.82, 'speed': '1000',
+                      'state': 'unknown', 'name': 'vnet0',
+                      'macAddr': '00:1a:4a:16:01:51'},
+        },
+        'displayInfo': [{'type': 'vnc', 'port': '5900', 'tlsPort': '-1',
+                         'ipAddress': '10.0.0.1'}],
+        'guestIPs': '10.0.0.%d' % (i % 255),
+        'vcpuCount': 2,
+        'monitorResponse': 0,
+        'kvmEnable': True,
+        'timeOffset': -2.5,
+    }
+
+
+def wire_format(obj):
+    # Format used before the codec: json.dumps(obj, 'utf-8'), encoded to
+    # utf-8 by the transport.
+    return json.dumps(obj, skipkeys=True).encode('utf-8')
+
+
+PAYLOADS = dict([
+    ('empty', {}),
+    ('unicode', {'name': u'\u05d0\u05d1 "quoted" \\ \n'}),
+    ('numbers', {'int': 1, 'float': 0.1, 'neg': -1, 'big': 2 ** 64,
+                 'true': True, 'none': None}),
+    ('nested', {'a': [1, {'b': [None, 'c']}]}),
+    ('vm_stats', [vm_stats(i) for i in range(10)]),
+])
+
+
+@expandPermutations
+class CodecTests(VdsmTestCase):
+
+    @permutations([[name] for name in sorted(PAYLOADS)])
+    def test_request_wire_format(self, name):
+        req = JsonRpcRequest('Host.getAllVmStats', PAYLOADS[name], reqId='1')
+        self.assertEqual(req.encode(), wire_format(req.toDict()))
+
+    @permutations([[name] for name in sorted(PAYLOADS)])
+    def test_response_wire_format(self, name):
+        res = JsonRpcResponse(PAYLOADS[name], reqId='1')
+        self.assertEqual(res.encode(), wire_format(res.toDict()))
+
+    @permutations([[name] for name in sorted(PAYLOADS)])
+    def test_round_trip(self, name):
+        obj = PAYLOADS[name]
+        self.assertEqual(jsoncodec.loads(jsoncodec.dumps(obj)), obj)
+
+    def test_dumps_returns_bytes(self):
+        self.assertIsInstance(jsoncodec.dumps({'a': u'\u05d0'}), bytes)
+
+    def test_dumps_skip_keys(self):
+        self.assertEqual(jsoncodec.dumps({1.5j: 'x', 'a': 1}), b'{"a": 1}')
+
+    def test_dumps_strict_keys(self):
+        with self.assertRaises(TypeError):
+            jsoncodec.dumps({1.5j: 'x'}, skipkeys=False)
+
+    @permutations([
+        # data
+        [b'{"a": "\\u05d0"}'],
+        [u'{"a": "\\u05d0"}'],
+        [b'{"a": "\xd7\x90"}'],
+        [bytearray(b'{"a": "\\u05d0"}')],
+    ])
+    def test_loads(self, data):
+        self.assertEqual(jsoncodec.loads(data), {'a': u'\u05d0'})
+
+    def test_loads_invalid(self):
+        with self.assertRaises(ValueError):
+            jsoncodec.loads(b'{"a": ')
+
+    def test_dumps_array(self):
+        encoded = [jsoncodec.dumps(i) for i in range(3)]
+        self.assertEqual(jsoncodec.dumps_array(encoded), b'[0,1,2]')
+        self.assertEqual(jsoncodec.dumps_array(encoded, separator=b', '),
+                         b'[0, 1, 2]')
+
+    def test_dumps_array_empty(self):
+        self.assertEqual(jsoncodec.dumps_array([]), b'[]')
+
+
+class CodecBenchmark(VdsmTestCase):
+
+    VMS = 300
+    RUNS = 20
+
+    def setUp(self):
+        stats = [vm_stats(i) for i in range(self.VMS)]
+        self.response = JsonRpcResponse(stats, reqId='1').toDict()
+        self.data = jsoncodec.dumps(self.response)
+
+    @stresstest
+    def test_encode(self):
+        def old():
+            json.dumps(self.response, skipkeys=True).encode('utf-8')
+
+        def new():
+            jsoncodec.dumps(self.response)
+
+        self.report("encode", old, new)
+
+    @stresstest
+    def test_decode(self):
+        data = self.data
+
+        def old():
+            if six.PY2:
+                json.loads(data, encoding='utf-8')
+            else:
+                json.loads(data.decode('utf-8'))
+
+        def new():
+            jsoncodec.loads(data)
+
+        self.report("decode", old, new)
+
+    def report(self, name, old, new):
+        old_time = self.measure(old)
+        new_time = self.measure(new)
+        print("\n%s %d vms (%d bytes, %s): old %.3f msec, new %.3f msec" % (
+              name, self.VMS, len(self.data), json.__name__,
+              old_time * 1000, new_time * 1000))
+
+    def measure(self, func):
+        best = None
+        for i in range(self.RUNS):
+            start = time.time()
+            func()
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
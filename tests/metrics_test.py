@@ -0,0 +1,252 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+
+import socket
+import threading
+
+from six.moves import urllib
+
+from vdsm import metrics
+from vdsm.metrics import prometheus
+from vdsm.metrics import registry
+from vdsm.metrics import statsd
+
+from testlib import VdsmTestCase
+
+
+class RegistryTests(VdsmTestCase):
+
+    def setUp(self):
+        self.registry = registry.Registry()
+
+    def test_gauge_cached(self):
+        g1 = self.registry.gauge("vms.{vm}.cpu.user", vm="vm-1")
+        g2 = self.registry.gauge("vms.{vm}.cpu.user", vm="vm-1")
+        g3 = self.registry.gauge("vms.{vm}.cpu.user", vm="vm-2")
+        self.assertIs(g1, g2)
+        self.assertIsNot(g1, g3)
+
+    def test_gauge_names(self):
+        g = self.registry.gauge("vms.{vm}.disk.{disk}.read-rate",
+                                vm="vm-1", disk="vda")
+        self.assertEqual(g.name, "vms.vm-1.disk.vda.read-rate")
+        self.assertEqual(g.family, "vms_disk_read_rate")
+        self.assertEqual(g.labels, (("disk", "vda"), ("vm", "vm-1")))
+
+    def test_gauge_no_labels(self):
+        g = self.registry.gauge("hosts.vdsm.jsonrpc.Host.ping2.queued")
+        self.assertEqual(g.name, "hosts.vdsm.jsonrpc.Host.ping2.queued")
+        self.assertEqual(g.family, "hosts_vdsm_jsonrpc_Host_ping2_queued")
+        self.assertEqual(g.labels, ())
+
+    def test_pending(self):
+        g1 = self.registry.gauge("a")
+        g2 = self.registry.gauge("b")
+        self.assertEqual(self.registry.pending(), [])
+        g1.set(1)
+        g1.set(2)
+        g2.set(3)
+        pending = self.registry.pending()
+        self.assertEqual(sorted(g.name for g in pending), ["a", "b"])
+        self.assertEqual(g1.value, 2)
+        self.assertEqual(self.registry.pending(), [])
+
+    def test_remove(self):
+        g = self.registry.gauge("a")
+        g.set(1)
+        g.remove()
+        self.assertEqual(self.registry.pending(), [g])
+        self.assertTrue(g.removed)
+        self.assertEqual(self.registry.gauges(), [])
+        self.assertIsNot(self.registry.gauge("a"), g)
+
+
+class UDPSink(object):
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(2)
+        self.port = self.sock.getsockname()[1]
+
+    def receive(self, lines):
+        """
+        Receive datagrams until lines were received, and return the
+        datagrams.
+        """
+        packets = []
+        received = 0
+        while received < lines:
+            packet = self.sock.recv(65536)
+            packets.append(packet)
+            received += len(packet.split(b"\n"))
+        return packets
+
+    def close(self):
+        self.sock.close()
+
+
+class StatsdTests(VdsmTestCase):
+
+    def setUp(self):
+        self.sink = UDPSink()
+        self.client = statsd._StatsClient("127.0.0.1", port=self.sink.port,
+                                          maxudpsize=100)
+
+    def tearDown(self):
+        self.client.close()
+        self.sink.close()
+
+    def test_pack(self):
+        items = [("vms.vm-%03d.cpu.user" % i, i) for i in range(100)]
+        self.client.send_gauges(items)
+        packets = self.sink.receive(len(items))
+        lines = []
+        for packet in packets:
+            self.assertLessEqual(len(packet), 100)
+            lines.extend(packet.split(b"\n"))
+        expected = [("%s:%s|g" % item).encode("utf-8") for item in items]
+        self.assertEqual(lines, expected)
+        # 100 lines of 24 bytes, 4 lines per datagram.
+        self.assertEqual(len(packets), 25)
+
+    def test_long_line(self):
+        name = "x" * 200
+        self.client.send_gauges([("a", 1), (name, 2), ("b", 3)])
+        packets = self.sink.receive(3)
+        self.assertEqual(packets, [
+            b"a:1|g",
+            ("%s:2|g" % name).encode("utf-8"),
+            b"b:3|g",
+        ])
+
+    def test_unicode(self):
+        self.client.send_gauges([(u"vms.\u05d0.cpu.user", 1)])
+        packets = self.sink.receive(1)
+        self.assertEqual(packets, [u"vms.\u05d0.cpu.user:1|g".encode("utf-8")])
+
+
+class PrometheusTests(VdsmTestCase):
+
+    def setUp(self):
+        self.registry = registry.Registry()
+        prometheus.start("127.0.0.1", port=0)
+        self.url = "http://127.0.0.1:%d" % prometheus._server.server_port
+
+    def tearDown(self):
+        prometheus.stop()
+
+    def publish(self):
+        prometheus.publish(self.registry.pending())
+
+    def get(self, path="/metrics"):
+        res = urllib.request.urlopen(self.url + path)
+        try:
+            self.assertEqual(res.info()["Content-Type"],
+                             prometheus.CONTENT_TYPE)
+            return res.read().decode("utf-8")
+        finally:
+            res.close()
+
+    def test_empty(self):
+        self.assertEqual(self.get(), "")
+
+    def test_gauges(self):
+        for vm in ("vm-2", "vm-1"):
+            self.registry.gauge("vms.{vm}.cpu.user", vm=vm).set(1.5)
+            self.registry.gauge("vms.{vm}.disk.{disk}.read_ops",
+                                vm=vm, disk="vda").set("42")
+        self.registry.gauge("hosts.vdsm.jsonrpc.Host.ping2.queued").set(3)
+        self.publish()
+        self.assertEqual(self.get(), (
+            '# TYPE vdsm_hosts_vdsm_jsonrpc_Host_ping2_queued gauge\n'
+            'vdsm_hosts_vdsm_jsonrpc_Host_ping2_queued 3.0\n'
+            '# TYPE vdsm_vms_cpu_user gauge\n'
+            'vdsm_vms_cpu_user{vm="vm-1"} 1.5\n'
+            'vdsm_vms_cpu_user{vm="vm-2"} 1.5\n'
+            '# TYPE vdsm_vms_disk_read_ops gauge\n'
+            'vdsm_vms_disk_read_ops{disk="vda",vm="vm-1"} 42.0\n'
+            'vdsm_vms_disk_read_ops{disk="vda",vm="vm-2"} 42.0\n'
+        ))
+
+    def test_latest_value(self):
+        g = self.registry.gauge("a")
+        g.set(1)
+        self.publish()
+        g.set(2)
+        self.publish()
+        self.assertEqual(self.get(), '# TYPE vdsm_a gauge\nvdsm_a 2.0\n')
+
+    def test_remove(self):
+        self.registry.gauge("a").set(1)
+        self.publish()
+        self.registry.gauge("a").remove()
+        self.publish()
+        self.assertEqual(self.get(), "")
+
+    def test_escape_labels(self):
+        self.registry.gauge("vms.{vm}.cpu.user",
+                            vm=u'\u05d0 "a\\b"\n').set(1)
+        self.publish()
+        self.assertEqual(self.get(), (
+            u'# TYPE vdsm_vms_cpu_user gauge\n'
+            u'vdsm_vms_cpu_user{vm="\u05d0 \\"a\\\\b\\"\\n"} 1.0\n'))
+
+    def test_skip_invalid_values(self):
+        self.registry.gauge("a").set("invalid")
+        self.registry.gauge("b").set(None)
+        self.publish()
+        self.assertEqual(self.get(), "")
+
+    def test_not_found(self):
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            self.get("/other")
+        self.assertEqual(e.exception.code, 404)
+
+
+class FakeReporter(object):
+
+    def __init__(self):
+        self.published = []
+        self.event = threading.Event()
+
+    def publish(self, gauges):
+        self.published.append(sorted(g.name for g in gauges))
+        self.event.set()
+
+
+class FlusherTests(VdsmTestCase):
+
+    def setUp(self):
+        self.registry = registry.Registry()
+        self.reporter = FakeReporter()
+        self.flusher = metrics._Flusher(self.registry, self.reporter)
+        self.flusher.start()
+
+    def tearDown(self):
+        self.flusher.stop()
+
+    def test_flush(self):
+        self.registry.gauge("a").set(1)
+        self.registry.gauge("b").set(2)
+        self.flusher.wakeup()
+        self.assertTrue(self.reporter.event.wait(2))
+        self.assertEqual(self.reporter.published, [["a", "b"]])
@@ -278,6 +278,15 @@ class ConvertTests(TestCaseBase):
             qemuimg.convert('src', 'dst', dstFormat='qcow2',
                             backing='bak', backingFormat='qcow2')
 
+    def test_rate_limit(self):
+        def convert(cmd, **kw):
+            expected = [QEMU_IMG, 'convert', '-p', '-t', 'none', '-T', 'none',
+                        '-r', '1048576', 'src', 'dst']
+            self.assertEqual(cmd, expected)
+
+        with MonkeyPatchScope([(qemuimg, 'ProgressCommand', convert)]):
+            qemuimg.convert('src', 'dst', rate_limit=1048576)
+
     def test_qcow2_compat_invalid(self):
         with self.assertRaises(ValueError):
             qemuimg.convert('image', 'dst', dstFormat='qcow2',
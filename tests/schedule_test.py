@@ -19,6 +19,9 @@
 #
 
 from __future__ import print_function
+import functools
+import math
+import random
 import threading
 import time
 
@@ -170,6 +173,21 @@ class SchedulerTests(VdsmTestCase):
             # avg latency 1 millisecond.
             self.assertTrue(max < 0.1)
 
+    def test_stats(self):
+        self.create_scheduler(vdsm.common.time.monotonic_time)
+        task = Task(self.clock)
+        self.scheduler.schedule(0, task)
+        call = self.scheduler.schedule(60, Task(self.clock))
+        self.scheduler.schedule(60, Task(self.clock))
+        call.cancel()
+        task.wait(self.GRACETIME)
+        stats = self.scheduler.stats()
+        self.assertEqual(stats["executed"], 1)
+        self.assertGreaterEqual(stats["lateness_avg"], 0)
+        self.assertGreaterEqual(stats["lateness_max"], 0)
+        self.assertEqual(self.scheduler.stats()["executed"], 0)
+        self.check_size(stats)
+
     # Helpers
 
     def create_scheduler(self, clock):
@@ -177,6 +195,230 @@ class SchedulerTests(VdsmTestCase):
         self.scheduler = schedule.Scheduler(clock=clock)
         self.scheduler.start()
 
+    def check_size(self, stats):
+        # Cancelled calls are kept until their deadline.
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["cancelled"], 1)
+
+
+class WheelSchedulerTests(SchedulerTests):
+
+    def create_scheduler(self, clock):
+        self.clock = clock
+        self.scheduler = schedule.WheelScheduler(clock=clock)
+        self.scheduler.start()
+
+    def check_size(self, stats):
+        # Cancelled calls are removed.
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["cancelled"], 0)
+
+
+class FakeClock(object):
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Recorder(object):
+
+    def __init__(self, clock, calls, name):
+        self.clock = clock
+        self.calls = calls
+        self.name = name
+
+    def __call__(self):
+        self.calls.append((self.name, self.clock()))
+
+
+@expandPermutations
+class WheelTests(VdsmTestCase):
+    """
+    Test the wheel without the scheduler thread, using small wheels to
+    exercise moving calls between wheels.
+    """
+
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        self.calls = []
+        self.scheduler = schedule.WheelScheduler(
+            clock=self.clock, tick=1.0, bits=2, levels=2)
+        # The test drives the wheel instead of the scheduler thread.
+        self.scheduler._running = True
+
+    def schedule(self, delay, name=None):
+        return self.scheduler.schedule(
+            delay, Recorder(self.clock, self.calls,
+                            delay if name is None else name))
+
+    def run_until(self, now):
+        # Run every tick until now.
+        while True:
+            for call in self.scheduler._pop_expired_calls():
+                call._execute()
+            if self.clock.now >= now:
+                break
+            self.clock.now = math.floor(self.clock.now) + 1
+
+    @permutations([
+        # start
+        [1000.0],
+        [1000.5],
+        [1003.0],
+        [1015.0],
+    ])
+    def test_deadline(self, start):
+        self.clock.now = start
+        # Beyond the range of the wheels (16 ticks).
+        delays = [0, 0.5, 1, 2.5, 3, 4, 5, 7, 11, 15, 16, 17, 31, 40, 100]
+        for delay in delays:
+            self.schedule(delay)
+        self.run_until(start + 101)
+        for delay, called in self.calls:
+            # Calls are executed in the first tick after the deadline.
+            self.assertEqual(called, math.ceil(start + delay))
+        self.assertEqual(sorted(d for d, _ in self.calls), delays)
+        self.assertEqual(self.scheduler.stats()["size"], 0)
+
+    def test_random(self):
+        expected = []
+        for i in range(200):
+            delay = random.uniform(0, 200)
+            call = self.schedule(delay, i)
+            if random.random() < 0.3:
+                call.cancel()
+            else:
+                expected.append((i, math.ceil(self.clock.now + delay)))
+        self.run_until(self.clock.now + 201)
+        self.assertEqual(sorted(self.calls), sorted(expected))
+
+    def test_coalesce(self):
+        self.schedule(1.2, "first")
+        self.schedule(1.7, "second")
+        self.schedule(2.1, "third")
+        self.clock.now += 2
+        expired = self.scheduler._pop_expired_calls()
+        self.assertEqual(len(expired), 2)
+
+    def test_cancel_removes_call(self):
+        calls = [self.schedule(delay) for delay in (1, 10, 100)]
+        self.assertEqual(self.scheduler.stats()["size"], 3)
+        for call in calls:
+            call.cancel()
+            self.assertFalse(call.valid())
+        self.assertEqual(self.scheduler.stats()["size"], 0)
+        self.run_until(self.clock.now + 101)
+        self.assertEqual(self.calls, [])
+
+    def test_cancel_twice(self):
+        call = self.schedule(1)
+        call.cancel()
+        call.cancel()
+        self.assertEqual(self.scheduler.stats()["size"], 0)
+
+    def test_late_call(self):
+        self.clock.now += 3.5
+        self.schedule(-10, "late")
+        self.run_until(self.clock.now + 1)
+        # The wheel was not advanced since 1000.
+        self.assertEqual(self.calls, [("late", 1003.5)])
+
+    def test_lateness(self):
+        self.schedule(0.25)
+        self.run_until(1001)
+        stats = self.scheduler.stats()
+        self.assertEqual(stats["executed"], 1)
+        self.assertEqual(stats["lateness_max"], 0.75)
+
+    def test_wakeup(self):
+        self.run_until(1000)
+        self.schedule(10)
+        # Wake up to move calls from the second wheel at 1004.
+        self.assertEqual(self.scheduler._time_until_deadline(), 4.0)
+        self.schedule(1.5)
+        self.assertEqual(self.scheduler._time_until_deadline(), 2.0)
+
+    def test_wakeup_cascade(self):
+        self.run_until(1000)
+        self.schedule(5)
+        self.run_until(1003)
+        # The call is moved to the first wheel at 1004.
+        self.assertEqual(self.scheduler._time_until_deadline(), 1.0)
+        self.run_until(1004)
+        self.assertEqual(self.scheduler._time_until_deadline(), 1.0)
+
+    def test_wakeup_empty(self):
+        self.assertEqual(self.scheduler._time_until_deadline(),
+                         schedule.Scheduler.DEFAULT_DELAY)
+
+    def test_cancel_calls(self):
+        calls = [self.schedule(delay) for delay in (1, 10, 100)]
+        self.scheduler._cancel_calls()
+        for call in calls:
+            self.assertFalse(call.valid())
+        self.assertEqual(self.scheduler.stats()["size"], 0)
+
+
+@expandPermutations
+class SchedulerBenchmark(VdsmTestCase):
+    """
+    Schedule many calls, cancel most of them like executor checks and
+    jsonrpc timeouts do, and report the lateness of the executed calls.
+    """
+
+    CALLS = 100000
+    DURATION = 10.0
+    CANCEL_RATIO = 0.9
+
+    @stresstest
+    @permutations([
+        # scheduler_class
+        [schedule.Scheduler],
+        [schedule.WheelScheduler],
+    ])
+    def test_lateness(self, scheduler_class):
+        clock = vdsm.common.time.monotonic_time
+        scheduler = scheduler_class(clock=clock)
+        scheduler.start()
+        try:
+            lateness = []
+
+            def record(deadline):
+                lateness.append(clock() - deadline)
+
+            start = time.time()
+            calls = []
+            for i in range(self.CALLS):
+                delay = random.uniform(0.1, self.DURATION)
+                deadline = clock() + delay
+                call = scheduler.schedule(
+                    delay, functools.partial(record, deadline))
+                calls.append(call)
+            random.shuffle(calls)
+            for call in calls[:int(self.CALLS * self.CANCEL_RATIO)]:
+                call.cancel()
+            elapsed = time.time() - start
+            before = scheduler.stats()
+
+            time.sleep(self.DURATION + 1)
+            after = scheduler.stats()
+        finally:
+            scheduler.stop(wait=True)
+
+        lateness.sort()
+        print("\n%s: schedule and cancel %.3f seconds, size %d, "
+              "executed %d, lateness p50 %.3f p99 %.3f max %.3f seconds"
+              % (scheduler_class.__name__, elapsed, before["size"],
+                 len(lateness),
+                 lateness[len(lateness) // 2],
+                 lateness[int(len(lateness) * 0.99)], lateness[-1]))
+        # Calls cancelled after the scheduler took them are counted.
+        self.assertGreaterEqual(before["executed"] + after["executed"],
+                                len(lateness))
+
 
 class Task(object):
 
@@ -69,6 +69,22 @@ class StatsdModuleTest(TestCaseBase):
     def test_send_multiple(self):
         data = {'hello': 7, 'goodbye': 11}
         statsd.send(data)
-        calls = [mock.call(b'hello:7|g', self._address),
-                 mock.call(b'goodbye:11|g', self._address)]
-        self.mock_socket.return_value.sendto.assert_has_calls(calls)
+        # Packed in one datagram.
+        sendto = self.mock_socket.return_value.sendto
+        self.assertEqual(sendto.call_count, 1)
+        packet, address = sendto.call_args[0]
+        self.assertEqual(sorted(packet.split(b'\n')),
+                         [b'goodbye:11|g', b'hello:7|g'])
+        self.assertEqual(address, self._address)
+
+    def test_send_many(self):
+        data = {'metric.%04d' % i: i for i in range(1000)}
+        statsd.send(data)
+        sendto = self.mock_socket.return_value.sendto
+        lines = []
+        for call in sendto.call_args_list:
+            packet, address = call[0]
+            self.assertLessEqual(len(packet), 1432)
+            lines.extend(packet.split(b'\n'))
+        self.assertEqual(len(lines), 1000)
+        self.assertLess(sendto.call_count, 20)
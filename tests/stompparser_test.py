@@ -0,0 +1,138 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+from testlib import VdsmTestCase as TestCaseBase
+from testlib import expandPermutations, permutations
+from testValidation import stresstest
+
+from yajsonrpc.stomp import Command, Parser
+
+
+def frame(body, command=b"SEND", headers=b"destination:queue\n"):
+    return (command + b"\n" + headers +
+            b"content-length:" + str(len(body)).encode("ascii") + b"\n\n" +
+            body + b"\0")
+
+
+def parse_chunks(data, size):
+    parser = Parser()
+    for i in range(0, len(data), size):
+        parser.parse(data[i:i + size])
+    frames = []
+    while parser.pending:
+        frames.append(parser.popFrame())
+    return frames
+
+
+@expandPermutations
+class ParserTests(TestCaseBase):
+
+    @permutations([[1], [2], [7], [4096]])
+    def test_content_length(self, size):
+        body = b'{"jsonrpc": "2.0", "method": "Host.ping", "id": "1"}'
+        frames = parse_chunks(frame(body) * 3, size)
+        self.assertEqual(len(frames), 3)
+        for f in frames:
+            self.assertEqual(f.command, Command.SEND)
+            self.assertEqual(f.headers, {'destination': 'queue',
+                                         'content-length': str(len(body))})
+            self.assertEqual(f.body, body)
+
+    @permutations([[1], [3], [4096]])
+    def test_no_content_length(self, size):
+        data = (b"SEND\r\ndestination:queue\r\n\r\nbody one\0"
+                b"SEND\ndestination:queue\n\nbody two\0")
+        frames = parse_chunks(data, size)
+        self.assertEqual([f.body for f in frames], [b"body one", b"body two"])
+        self.assertEqual([f.headers for f in frames],
+                         [{'destination': 'queue'}] * 2)
+
+    @permutations([[1], [2], [4096]])
+    def test_binary_body(self, size):
+        body = b"\0\n\r:\0"
+        frames = parse_chunks(frame(body), size)
+        self.assertEqual(frames[0].body, body)
+
+    def test_empty_body(self):
+        frames = parse_chunks(b"CONNECTED\nversion:1.2\n\n\0", 4096)
+        self.assertEqual(frames[0].command, Command.CONNECTED)
+        self.assertEqual(frames[0].body, b"")
+
+    def test_heartbeats(self):
+        frames = parse_chunks(b"\n\r\n" + frame(b"x") + b"\n", 1)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0].body, b"x")
+
+    def test_repeated_header(self):
+        frames = parse_chunks(b"SEND\nkey:first\nkey:second\n\n\0", 4096)
+        self.assertEqual(frames[0].headers, {'key': 'first'})
+
+    def test_escaped_header(self):
+        frames = parse_chunks(b"SEND\nkey:a\\cb\\nc\n\n\0", 4096)
+        self.assertEqual(frames[0].headers, {'key': 'a:b\nc'})
+
+    def test_missing_frame_end(self):
+        parser = Parser()
+        with self.assertRaises(RuntimeError):
+            parser.parse(b"SEND\ncontent-length:1\n\nxx")
+
+    def test_partial_frame(self):
+        parser = Parser()
+        parser.parse(b"SEND\ncontent-length:4\n\nbo")
+        self.assertEqual(parser.pending, 0)
+        self.assertIsNone(parser.popFrame())
+        parser.parse(b"dy\0SEND\n")
+        self.assertEqual(parser.pending, 1)
+        self.assertEqual(parser.popFrame().body, b"body")
+        parser.parse(b"\nbody\0")
+        self.assertEqual(parser.popFrame().body, b"body")
+
+
+@expandPermutations
+class ParserBenchmark(TestCaseBase):
+
+    @permutations([
+        # body size, frames
+        (512, 20000),
+        (256 * 1024, 200),
+        (8 * 1024 * 1024, 5),
+    ])
+    @stresstest
+    def test_throughput(self, body_size, count):
+        data = frame(b"x" * body_size, command=b"MESSAGE") * count
+        # AsyncDispatcher receives data in 4096 bytes chunks.
+        chunks = [data[i:i + 4096] for i in range(0, len(data), 4096)]
+        parser = Parser()
+
+        start = time.time()
+        for chunk in chunks:
+            parser.parse(chunk)
+            while parser.pending:
+                parser.popFrame()
+        elapsed = time.time() - start
+
+        print("\n%d frames of %d bytes: %d frames/s, %.2f MB/s" % (
+            count, body_size, count / elapsed,
+            len(data) / elapsed / 1024**2))
@@ -18,6 +18,7 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import time
 from contextlib import contextmanager
 
 import pytest
@@ -26,11 +27,17 @@ from vdsm import constants
 from vdsm.config import config
 from vdsm.constants import GIB
 from vdsm.constants import MEGAB
+from vdsm.storage import blockSD
 from vdsm.storage import blockVolume
 from vdsm.storage import constants as sc
+from vdsm.storage import directio
 from vdsm.storage import exception as se
+from vdsm.storage import image
+from vdsm.storage import misc
 from vdsm.storage import qemuimg
+from vdsm.storage import slotcache
 from vdsm.storage.blockVolume import BlockVolume
+from vdsm.storage.volumemetadata import VolumeMetadata
 
 from monkeypatch import MonkeyPatch
 from monkeypatch import MonkeyPatchScope
@@ -44,6 +51,7 @@ from storage.storagetestlib import (
 from testlib import make_config
 from testlib import make_uuid
 from testlib import permutations, expandPermutations
+from testlib import temporaryPath
 from testlib import VdsmTestCase
 
 CONFIG = make_config([('irs', 'volume_utilization_chunk_mb', '1024')])
@@ -169,3 +177,156 @@ class TestBlockVolumeManifest(VdsmTestCase):
             with MonkeyPatchScope([(qemuimg, 'check', fake_check)]):
                 env.chain = make_qemu_chain(env, actual_size, sc.COW_FORMAT, 3)
                 self.assertEqual(env.chain[1].optimal_size(), optimal_size)
+
+
+class TestSlotCache(VdsmTestCase):
+
+    def make_chain(self, env, length):
+        img_id = make_uuid()
+        parent_id = sc.BLANK_UUID
+        vol_ids = []
+        for i in range(length):
+            vol_id = make_uuid()
+            vol_type = sc.LEAF_VOL if i == length - 1 else sc.INTERNAL_VOL
+            env.make_volume(MEGAB, img_id, vol_id, parent_vol_id=parent_id,
+                            vol_type=vol_type, desc="volume %d" % i)
+            vol_ids.append(vol_id)
+            parent_id = vol_id
+        return img_id, vol_ids
+
+    def test_read_outside_snapshot(self):
+        with fake_env('block') as env:
+            img_id, vol_ids = self.make_chain(env, 3)
+            for i, vol_id in enumerate(vol_ids):
+                vol = env.sd_manifest.produceVolume(img_id, vol_id)
+                self.assertEqual(vol.getMetaParam(sc.DESCRIPTION),
+                                 "volume %d" % i)
+            stats = env.sd_manifest.getSlotCacheStats()
+            self.assertEqual(stats["loads"], 0)
+
+    def test_read_in_snapshot(self):
+        with fake_env('block') as env:
+            img_id, vol_ids = self.make_chain(env, 3)
+            with env.sd_manifest.volume_metadata_snapshot():
+                for i, vol_id in enumerate(vol_ids):
+                    vol = env.sd_manifest.produceVolume(img_id, vol_id)
+                    self.assertEqual(vol.getMetaParam(sc.DESCRIPTION),
+                                     "volume %d" % i)
+                    self.assertEqual(vol.getMetaParam(sc.PUUID),
+                                     vol.getParent())
+            stats = env.sd_manifest.getSlotCacheStats()
+            self.assertEqual(stats["loads"], 1)
+            self.assertEqual(stats["slots"], 3)
+            self.assertEqual(stats["hits"], 6)
+
+    def test_write_invalidates_slot(self):
+        with fake_env('block') as env:
+            img_id, vol_ids = self.make_chain(env, 2)
+            vol = env.sd_manifest.produceVolume(img_id, vol_ids[0])
+            with env.sd_manifest.volume_metadata_snapshot():
+                self.assertEqual(vol.getMetaParam(sc.DESCRIPTION), "volume 0")
+                vol.setMetaParam(sc.DESCRIPTION, "modified")
+                self.assertEqual(vol.getMetaParam(sc.DESCRIPTION), "modified")
+
+    def test_new_volume_in_snapshot(self):
+        with fake_env('block') as env:
+            img_id, vol_ids = self.make_chain(env, 2)
+            with env.sd_manifest.volume_metadata_snapshot():
+                vol = env.sd_manifest.produceVolume(img_id, vol_ids[0])
+                vol.getMetaParam(sc.DESCRIPTION)
+                new_img_id, new_vol_ids = self.make_chain(env, 1)
+                vol = env.sd_manifest.produceVolume(new_img_id, new_vol_ids[0])
+                self.assertEqual(vol.getMetaParam(sc.DESCRIPTION), "volume 0")
+            stats = env.sd_manifest.getSlotCacheStats()
+            self.assertEqual(stats["loads"], 2)
+            self.assertEqual(stats["slots"], 3)
+
+    @MonkeyPatch(blockSD, "SLOT_CACHE_MAX_AGE", 0)
+    def test_changed_by_other_host(self):
+        with fake_env('block') as env:
+            img_id, vol_ids = self.make_chain(env, 1)
+            vol = env.sd_manifest.produceVolume(img_id, vol_ids[0])
+            with env.sd_manifest.volume_metadata_snapshot():
+                self.assertEqual(vol.getMetaParam(sc.DESCRIPTION), "volume 0")
+                write_description(env, vol, "modified")
+                # The snapshot is not loaded again in the same scope.
+                self.assertEqual(vol.getMetaParam(sc.DESCRIPTION), "volume 0")
+            with env.sd_manifest.volume_metadata_snapshot():
+                self.assertEqual(vol.getMetaParam(sc.DESCRIPTION), "modified")
+
+    def test_slot_reused_by_other_host(self):
+        with fake_env('block') as env:
+            img_id, vol_ids = self.make_chain(env, 1)
+            vol = env.sd_manifest.produceVolume(img_id, vol_ids[0])
+            other = env.sd_manifest.produceVolume(make_uuid(), vol_ids[0])
+            with env.sd_manifest.volume_metadata_snapshot():
+                # The cached metadata belongs to another image.
+                self.assertEqual(other.getMetaParam(sc.IMAGE), img_id)
+                self.assertEqual(vol.getMetaParam(sc.IMAGE), img_id)
+            stats = env.sd_manifest.getSlotCacheStats()
+            self.assertEqual(stats["hits"], 2)
+
+    def test_get_chain(self):
+        with fake_env('block') as env:
+            img_id, vol_ids = self.make_chain(env, 5)
+            repo = image.Image(env.tmpdir)
+            with MonkeyPatchScope([(image, "sdCache", env.sdcache)]):
+                chain = repo.getChain(env.sd_manifest.sdUUID, img_id)
+            self.assertEqual([vol.volUUID for vol in chain], vol_ids)
+            stats = env.sd_manifest.getSlotCacheStats()
+            self.assertEqual(stats["loads"], 1)
+            self.assertEqual(stats["misses"], 0)
+
+
+def write_description(env, vol, description):
+    """
+    Modify the metadata of vol on storage without using the volume, like
+    another host would do.
+    """
+    _, slot = vol.getMetadataId()
+    meta = vol.getMetadata()
+    meta[sc.DESCRIPTION] = description
+    data = BlockVolume.formatMetadata(meta)
+    data += "\0" * (sc.METADATA_SIZE - len(data))
+    with directio.DirectFile(env.sd_manifest.metadata_volume_path(),
+                             "r+") as f:
+        f.seek(slot * sc.METADATA_SIZE)
+        f.write(data)
+
+
+@pytest.mark.stress
+class TestSlotCacheBenchmark(VdsmTestCase):
+
+    SLOTS = 2000
+    FIRST = 4
+
+    def test_read_all_slots(self):
+        img_id = make_uuid()
+        md = VolumeMetadata(make_uuid(), img_id, sc.BLANK_UUID, 2048,
+                            "RAW", "SPARSE", "LEAF", "DATA", "", "LEGAL")
+        data = md.storage_format()
+        data += "\0" * (sc.METADATA_SIZE - len(data))
+        end = self.FIRST + self.SLOTS
+        with temporaryPath(data=b"\0" * end * sc.METADATA_SIZE) as path:
+            with directio.DirectFile(path, "r+") as f:
+                f.seek(self.FIRST * sc.METADATA_SIZE)
+                f.write(data * self.SLOTS)
+
+            start = time.time()
+            for slot in range(self.FIRST, end):
+                lines = misc.readblock(path, slot * sc.METADATA_SIZE,
+                                       sc.METADATA_SIZE)
+                self.assertEqual(VolumeMetadata.from_lines(lines).image,
+                                 img_id)
+            readblock = time.time() - start
+
+            cache = slotcache.SlotCache(lambda: path,
+                                        lambda: (self.FIRST, end), 0)
+            start = time.time()
+            with cache.snapshot():
+                for slot in range(self.FIRST, end):
+                    self.assertEqual(cache.get(slot).image, img_id)
+            snapshot = time.time() - start
+
+        print("\nreading %d slots: readblock %.3f seconds, "
+              "snapshot %.3f seconds" % (self.SLOTS, readblock, snapshot))
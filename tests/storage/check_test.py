@@ -20,10 +20,12 @@
 
 from __future__ import print_function
 
+import errno
 import logging
 import os
 import pprint
 import re
+import resource
 import threading
 import time
 from contextlib import contextmanager
@@ -35,6 +37,7 @@ from monkeypatch import MonkeyPatch
 from monkeypatch import MonkeyPatchScope
 from testlib import VdsmTestCase
 from testlib import expandPermutations, permutations
+from testlib import make_config
 from testlib import start_thread
 from testlib import temporaryPath
 
@@ -369,7 +372,7 @@ class TestCheckResult(VdsmTestCase):
 class TestCheckService(VdsmTestCase):
 
     def setUp(self):
-        self.service = check.CheckService()
+        self.service = check_service("dd")
         self.service.start()
         self.result = None
         self.completed = threading.Event()
@@ -418,6 +421,281 @@ class TestCheckService(VdsmTestCase):
             self.assertFalse(self.service.is_checking("/path"))
 
 
+@expandPermutations
+class TestDirectioCheckerInProcess(VdsmTestCase):
+
+    def setUp(self):
+        self.loop = asyncevent.EventLoop()
+        self.pool = check.ReaderPool(4)
+        self.results = []
+        self.checks = 1
+
+    def tearDown(self):
+        self.pool.stop()
+        self.loop.close()
+
+    def complete(self, result):
+        self.results.append(result)
+        if len(self.results) == self.checks:
+            self.loop.stop()
+
+    def test_path_ok(self):
+        with temporaryPath(data=b"x" * check.READ_SIZE) as path:
+            checker = check.DirectioChecker(self.loop, path, self.complete,
+                                            pool=self.pool)
+            checker.start()
+            self.loop.run_forever()
+        result = self.results[0]
+        self.assertIsInstance(result, check.ReadResult)
+        delay = result.delay()
+        self.assertEqual(type(delay), float)
+        # The read is timed using a precise clock, but elapsed is using the
+        # event loop clock, with 10 milliseconds resolution.
+        self.assertGreater(delay, 0)
+        self.assertLessEqual(delay, result.elapsed + 0.01)
+
+    def test_path_missing(self):
+        checker = check.DirectioChecker(self.loop, "/no/such/path",
+                                        self.complete, pool=self.pool)
+        checker.start()
+        self.loop.run_forever()
+        result = self.results[0]
+        self.assertIsInstance(result, check.ReadResult)
+        self.assertRaises(exception.MiscFileReadException, result.delay)
+
+    def test_fallback_to_dd(self):
+        def read_direct(path):
+            raise OSError(errno.EINVAL, "Invalid argument")
+
+        self.checks = 2
+        with fake_dd(0.0), \
+                MonkeyPatchScope([(check, "read_direct", read_direct)]):
+            checker = check.DirectioChecker(self.loop, "/path", self.complete,
+                                            interval=0.1, pool=self.pool)
+            checker.start()
+            self.loop.run_forever()
+        for result in self.results:
+            self.assertIsInstance(result, check.CheckResult)
+            self.assertEqual(result.rc, 0)
+
+    @MonkeyPatch(check, "_log", FakeLogger(logging.WARNING))
+    def test_blocked_read(self):
+        unblock = threading.Event()
+
+        def read_direct(path):
+            if path == "/blocked":
+                unblock.wait(5)
+            return 0.0
+
+        self.checks = 3
+        with MonkeyPatchScope([(check, "read_direct", read_direct)]):
+            blocked = check.DirectioChecker(self.loop, "/blocked",
+                                            self.complete, interval=0.1,
+                                            pool=self.pool)
+            blocked.start()
+            ok = check.DirectioChecker(self.loop, "/ok", self.complete,
+                                       interval=0.1, pool=self.pool)
+            ok.start()
+            try:
+                self.loop.run_forever()
+            finally:
+                unblock.set()
+
+        # The blocked read did not delay the other checker.
+        self.assertEqual([r.path for r in self.results], ["/ok"] * 3)
+        msg = check._log.messages[0][1]
+        r = re.compile(r"Checker '/blocked' is blocked for .+ seconds")
+        self.assertRegexpMatches(msg, r)
+
+    def test_stop_during_read(self):
+        reading = threading.Event()
+        unblock = threading.Event()
+
+        def read_direct(path):
+            reading.set()
+            unblock.wait(5)
+            return 0.0
+
+        with MonkeyPatchScope([(check, "read_direct", read_direct)]):
+            checker = check.DirectioChecker(self.loop, "/path", self.complete,
+                                            pool=self.pool)
+            checker.start()
+            self.assertTrue(reading.wait(5))
+            checker.stop()
+            self.assertEqual(checker._state, check.STOPPING)
+            unblock.set()
+            start_thread(self.wait_for_checker, checker)
+            self.loop.run_forever()
+        self.assertFalse(checker.is_running())
+        self.assertEqual(self.results, [])
+
+    def wait_for_checker(self, checker):
+        checker.wait(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class TestReaderPool(VdsmTestCase):
+
+    def test_run(self):
+        pool = check.ReaderPool(2)
+        done = threading.Event()
+        try:
+            pool.submit(done.set)
+            self.assertTrue(done.wait(1))
+        finally:
+            pool.stop()
+
+    def test_start_thread_when_busy(self):
+        pool = check.ReaderPool(2)
+        unblock = threading.Event()
+        done = threading.Event()
+        try:
+            pool.submit(lambda: unblock.wait(5))
+            pool.submit(done.set)
+            self.assertTrue(done.wait(1))
+            self.assertEqual(pool.threads, 2)
+        finally:
+            unblock.set()
+            pool.stop()
+
+    def test_max_threads(self):
+        pool = check.ReaderPool(1)
+        unblock = threading.Event()
+        done = threading.Event()
+        try:
+            pool.submit(lambda: unblock.wait(5))
+            pool.submit(done.set)
+            self.assertFalse(done.wait(0.2))
+            self.assertEqual(pool.threads, 1)
+            unblock.set()
+            self.assertTrue(done.wait(1))
+        finally:
+            unblock.set()
+            pool.stop()
+
+    def test_no_max_threads(self):
+        pool = check.ReaderPool()
+        unblock = threading.Event()
+        done = threading.Event()
+        try:
+            # Hung reads do not delay other reads.
+            for i in range(10):
+                pool.submit(lambda: unblock.wait(5))
+            pool.submit(done.set)
+            self.assertTrue(done.wait(1))
+            self.assertEqual(pool.threads, 11)
+        finally:
+            unblock.set()
+            pool.stop()
+
+    def test_idle_timeout(self):
+        pool = check.ReaderPool(2, idle_timeout=0.1)
+        done = threading.Event()
+        try:
+            pool.submit(done.set)
+            self.assertTrue(done.wait(1))
+            deadline = time.time() + 1
+            while pool.threads and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(pool.threads, 0)
+        finally:
+            pool.stop()
+
+    def test_submit_after_stop(self):
+        pool = check.ReaderPool(2)
+        pool.stop()
+        with self.assertRaises(RuntimeError):
+            pool.submit(lambda: None)
+
+
+class TestCheckServiceInProcess(VdsmTestCase):
+
+    def setUp(self):
+        self.service = check_service("inprocess")
+        self.service.start()
+        self.result = None
+        self.completed = threading.Event()
+
+    def tearDown(self):
+        self.service.stop()
+
+    def complete(self, result):
+        self.result = result
+        self.completed.set()
+
+    def test_start_checking(self):
+        with temporaryPath(data=b"x" * check.READ_SIZE) as path:
+            self.service.start_checking(path, self.complete)
+            self.assertTrue(self.completed.wait(1.0))
+            self.assertIsInstance(self.result, check.ReadResult)
+            self.result.delay()
+            self.assertTrue(self.service.stop_checking(path, timeout=1.0))
+
+
+@pytest.mark.stress
+@expandPermutations
+class TestCheckerBenchmark(VdsmTestCase):
+
+    CHECKERS = 20
+    CHECKS = 1000
+
+    def setUp(self):
+        self.loop = asyncevent.EventLoop()
+        self.results = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def complete(self, result):
+        self.results.append(result)
+        if len(self.results) == self.CHECKS:
+            self.loop.stop()
+
+    # Debug logs would dominate the cpu time.
+    @MonkeyPatch(check, "_log", FakeLogger(logging.WARNING))
+    @permutations([["dd"], ["inprocess"]])
+    def test_cpu_usage(self, backend):
+        pool = check.ReaderPool(4) if backend == "inprocess" else None
+        with temporaryPath(data=b"x" * check.READ_SIZE) as path:
+            checkers = [check.DirectioChecker(self.loop, path, self.complete,
+                                              interval=0.05, pool=pool)
+                        for i in range(self.CHECKERS)]
+            start = time.time()
+            cpu_start = cpu_time()
+            for checker in checkers:
+                checker.start()
+            self.loop.run_forever()
+            cpu = cpu_time() - cpu_start
+            elapsed = time.time() - start
+            for checker in checkers:
+                checker.stop()
+            if pool is not None:
+                pool.stop()
+
+        for result in self.results:
+            result.delay()
+        print("\n%s: %d checks, %.3f seconds, cpu time per 1000 checks "
+              "%.3f seconds" % (backend, len(self.results), elapsed,
+                                cpu * 1000 / len(self.results)))
+
+
+def cpu_time():
+    """
+    Return user and system time used by this process and its children.
+    """
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def check_service(backend):
+    config = make_config([("irs", "path_checker", backend)])
+    with MonkeyPatchScope([(check, "config", config)]):
+        return check.CheckService()
+
+
 @contextmanager
 def fake_dd(delay):
     """
@@ -0,0 +1,316 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+import six
+
+from vdsm.common import exception
+from vdsm.storage import copyscheduler
+from vdsm.storage import qemuimg
+
+from testlib import start_thread
+
+FAKE_QEMU_IMG = os.path.join(os.path.dirname(__file__), "fake-qemu-img")
+
+MiB = 1024**2
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class Copy(object):
+    """
+    Run a copy in another thread, until finish() is called.
+    """
+
+    def __init__(self, scheduler, src, dst, size, admitted):
+        self.request = scheduler.request(src, dst, size)
+        self.name = "%s->%s:%d" % (src, dst, size)
+        self.error = None
+        self._admitted = admitted
+        self.running = threading.Event()
+        self._done = threading.Event()
+        self._thread = start_thread(self._run)
+
+    def _run(self):
+        try:
+            with self.request:
+                self._admitted.append(self.name)
+                self.running.set()
+                self._done.wait(5)
+        except Exception as e:
+            self.error = e
+
+    def finish(self):
+        self._done.set()
+        self._thread.join(5)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise RuntimeError("Timeout waiting for %s" % predicate)
+        time.sleep(0.005)
+
+
+def start(scheduler, src, dst, size, admitted):
+    copy = Copy(scheduler, src, dst, size, admitted)
+    wait_for(lambda: copy.running.is_set() or copy.request.waiting)
+    return copy
+
+
+def test_no_limit():
+    scheduler = copyscheduler.Scheduler(0)
+    admitted = []
+    copies = [start(scheduler, "sd1", "sd2", MiB, admitted) for i in range(5)]
+    assert len(admitted) == 5
+    assert scheduler.stats()["running"] == {"sd1": 5, "sd2": 5}
+    for copy in copies:
+        copy.finish()
+    assert scheduler.stats()["running"] == {}
+
+
+def test_limit_per_domain():
+    scheduler = copyscheduler.Scheduler(2)
+    admitted = []
+    c1 = start(scheduler, "sd1", "dst", MiB, admitted)
+    c2 = start(scheduler, "sd2", "dst", MiB, admitted)
+    c3 = start(scheduler, "sd3", "dst", MiB, admitted)
+    assert c3.request.waiting
+    # Other domains are not affected.
+    c4 = start(scheduler, "sd4", "sd5", MiB, admitted)
+    assert admitted == [c1.name, c2.name, c4.name]
+
+    c1.finish()
+    wait_for(lambda: len(admitted) == 4)
+    assert admitted[-1] == c3.name
+
+    for copy in (c2, c3, c4):
+        copy.finish()
+    assert scheduler.stats()["running"] == {}
+
+
+def test_same_source_and_destination():
+    scheduler = copyscheduler.Scheduler(1)
+    admitted = []
+    c1 = start(scheduler, "sd1", "sd1", MiB, admitted)
+    assert scheduler.stats()["running"] == {"sd1": 1}
+    c1.finish()
+
+
+def test_smaller_copies_first():
+    scheduler = copyscheduler.Scheduler(1)
+    admitted = []
+    running = start(scheduler, "src", "dst", MiB, admitted)
+    large = start(scheduler, "src", "dst", 100 * MiB, admitted)
+    small = start(scheduler, "src", "dst", 10 * MiB, admitted)
+
+    running.finish()
+    wait_for(lambda: len(admitted) == 2)
+    assert admitted[-1] == small.name
+    assert large.request.waiting
+
+    small.finish()
+    wait_for(lambda: len(admitted) == 3)
+    assert admitted[-1] == large.name
+    large.finish()
+
+
+def test_aging():
+    clock = FakeClock()
+    scheduler = copyscheduler.Scheduler(1, aging_rate=MiB, clock=clock)
+    admitted = []
+    running = start(scheduler, "src", "dst", MiB, admitted)
+    large = start(scheduler, "src", "dst", 100 * MiB, admitted)
+
+    # The large copy waited long enough.
+    clock.now = 91
+    small = start(scheduler, "src", "dst", 10 * MiB, admitted)
+
+    running.finish()
+    wait_for(lambda: len(admitted) == 2)
+    assert admitted[-1] == large.name
+
+    large.finish()
+    wait_for(lambda: len(admitted) == 3)
+    small.finish()
+
+
+def test_domains_reserved_for_waiting_copy():
+    clock = FakeClock()
+    scheduler = copyscheduler.Scheduler(1, aging_rate=MiB, clock=clock)
+    admitted = []
+    running = start(scheduler, "sd1", "sd2", MiB, admitted)
+    large = start(scheduler, "sd1", "sd3", 100 * MiB, admitted)
+    clock.now = 200
+
+    # sd3 is available, but the large copy waiting for it goes first.
+    small = start(scheduler, "sd4", "sd3", MiB, admitted)
+    assert small.request.waiting
+
+    running.finish()
+    wait_for(lambda: len(admitted) == 2)
+    assert admitted[-1] == large.name
+
+    large.finish()
+    wait_for(lambda: len(admitted) == 3)
+    small.finish()
+
+
+def test_cancel_waiting():
+    scheduler = copyscheduler.Scheduler(1)
+    admitted = []
+    running = start(scheduler, "src", "dst", MiB, admitted)
+    waiting = start(scheduler, "src", "dst", MiB, admitted)
+
+    waiting.request.cancel()
+    waiting.finish()
+    assert isinstance(waiting.error, exception.ActionStopped)
+    assert admitted == [running.name]
+
+    running.finish()
+    stats = scheduler.stats()
+    assert stats["running"] == {}
+    assert stats["waiting"] == 0
+    assert stats["canceled"] == 1
+
+
+def test_cancel_before_wait():
+    scheduler = copyscheduler.Scheduler(1)
+    request = scheduler.request("src", "dst", MiB)
+    request.cancel()
+    with pytest.raises(exception.ActionStopped):
+        with request:
+            pass
+    assert scheduler.stats()["running"] == {}
+
+
+def test_cancel_admitted():
+    scheduler = copyscheduler.Scheduler(1)
+    with scheduler.request("src", "dst", MiB) as request:
+        request.cancel()
+        assert request.state == copyscheduler.RUNNING
+    assert request.state == copyscheduler.DONE
+
+
+@pytest.mark.parametrize("max_per_domain,rate_limit", [
+    # Without a copies limit, copies cannot share the domain bandwidth.
+    (0, None),
+    (1, 10 * MiB),
+    (4, 2.5 * MiB),
+])
+def test_rate_limit(max_per_domain, rate_limit):
+    scheduler = copyscheduler.Scheduler(
+        max_per_domain, domain_rate_limit=10 * MiB)
+    with scheduler.request("src", "dst", MiB) as request:
+        assert request.rate_limit == rate_limit
+
+
+def test_no_rate_limit():
+    scheduler = copyscheduler.Scheduler(4)
+    with scheduler.request("src", "dst", MiB) as request:
+        assert request.rate_limit is None
+
+
+@pytest.fixture
+def fake_qemu_img(tmpdir, monkeypatch):
+    # Run the fake with the interpreter running the tests.
+    wrapper = tmpdir.join("qemu-img")
+    wrapper.write('#!/bin/sh\nexec %s %s "$@"\n' %
+                  (sys.executable, FAKE_QEMU_IMG))
+    wrapper.chmod(0o755)
+    monkeypatch.setattr(qemuimg._qemuimg, "_cmd", str(wrapper))
+    # Simulated storage throughput of a single copy.
+    monkeypatch.setenv("FAKE_QEMU_IMG_THROUGHPUT", str(8 * MiB))
+    log = tmpdir.join("log")
+    monkeypatch.setenv("FAKE_QEMU_IMG_LOG", str(log))
+    return log
+
+
+def run_copies(scheduler, tmpdir, count, size):
+    """
+    Copy count images of size bytes to the same domain, returning the
+    maximum number of concurrent qemu-img processes and the duration of
+    every copy.
+    """
+    src = tmpdir.join("src")
+    src.write(b"x" * size, mode="wb")
+
+    def copy(i):
+        request = scheduler.request("src-%d" % i, "dst", size)
+        with request:
+            operation = qemuimg.convert(str(src), str(tmpdir.join(str(i))),
+                                        rate_limit=request.rate_limit)
+            operation.run()
+            assert operation.progress == 100.0
+
+    threads = [start_thread(copy, i) for i in range(count)]
+    for t in threads:
+        t.join()
+
+    events = sorted((float(t), e, pid) for e, pid, t in
+                    (line.split() for line in tmpdir.join("log").readlines()))
+    running = 0
+    max_running = 0
+    started = {}
+    durations = []
+    for t, event, pid in events:
+        if event == "start":
+            running += 1
+            started[pid] = t
+        else:
+            running -= 1
+            durations.append(t - started[pid])
+        max_running = max(running, max_running)
+    return max_running, durations
+
+
+@pytest.mark.skipif(six.PY3, reason="ProgressCommand needs porting to "
+                    "python 3")
+def test_qemu_img_limit_per_domain(fake_qemu_img, tmpdir):
+    scheduler = copyscheduler.Scheduler(2)
+    max_running, durations = run_copies(scheduler, tmpdir, 4, MiB)
+    assert max_running == 2
+    assert len(durations) == 4
+
+
+@pytest.mark.skipif(six.PY3, reason="ProgressCommand needs porting to "
+                    "python 3")
+def test_qemu_img_rate_limit(fake_qemu_img, tmpdir):
+    # 2 MiB/s per copy, 4 times slower than the storage.
+    scheduler = copyscheduler.Scheduler(2, domain_rate_limit=4 * MiB)
+    max_running, durations = run_copies(scheduler, tmpdir, 2, MiB)
+    assert max_running == 2
+    assert min(durations) >= 0.45
@@ -94,3 +94,80 @@ class TestDirectFile(VdsmTestCase):
                 directio.DirectFile(srcPath, "r") as direct_file, \
                 io.open(srcPath, "rb") as buffered_file:
             self.assertEqual(direct_file.read(), buffered_file.read())
+
+
+class TestAlignedBuffer(VdsmTestCase):
+
+    def test_aligned(self):
+        with directio.AlignedBuffer(BLOCK_SIZE * 2) as buf:
+            self.assertEqual(buf.address() % BLOCK_SIZE, 0)
+            self.assertEqual(len(buf), BLOCK_SIZE * 2)
+
+    def test_zeroed(self):
+        with directio.AlignedBuffer(BLOCK_SIZE) as buf:
+            self.assertEqual(buf[:], b"\0" * BLOCK_SIZE)
+
+    def test_update(self):
+        with directio.AlignedBuffer(BLOCK_SIZE) as buf:
+            buf[10:15] = b"12345"
+            self.assertEqual(buf[9:16], b"\x0012345\x00")
+
+
+@expandPermutations
+class TestPositionalIO(VdsmTestCase):
+
+    DATA = TestDirectFile.DATA
+
+    @permutations([
+        # offset, start, size
+        (0, 0, None),
+        (BLOCK_SIZE, 0, BLOCK_SIZE),
+        (0, BLOCK_SIZE, BLOCK_SIZE),
+    ])
+    def test_pread(self, offset, start, size):
+        with temporaryPath(data=self.DATA) as srcPath, \
+                directio.DirectFile(srcPath, "r") as f, \
+                directio.AlignedBuffer(len(self.DATA)) as buf:
+            n = f.pread(buf, offset, start, size)
+            if size is None:
+                size = len(self.DATA) - start
+            self.assertEqual(n, size)
+            self.assertEqual(buf[start:start + size],
+                             self.DATA[offset:offset + size])
+            # The file position is not modified.
+            self.assertEqual(f.tell(), 0)
+
+    def test_pread_eof(self):
+        with temporaryPath(data=self.DATA) as srcPath, \
+                directio.DirectFile(srcPath, "r") as f, \
+                directio.AlignedBuffer(len(self.DATA)) as buf:
+            n = f.pread(buf, len(self.DATA) - BLOCK_SIZE)
+            self.assertEqual(n, BLOCK_SIZE)
+
+    def test_pwrite(self):
+        with temporaryPath(data=self.DATA) as srcPath, \
+                directio.DirectFile(srcPath, "r+") as f, \
+                directio.AlignedBuffer(2 * BLOCK_SIZE) as buf:
+            buf[:] = b"x" * 2 * BLOCK_SIZE
+            n = f.pwrite(buf, BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE)
+            self.assertEqual(n, BLOCK_SIZE)
+            with io.open(srcPath, "rb") as f:
+                data = f.read()
+            expected = (self.DATA[:BLOCK_SIZE] +
+                        b"x" * BLOCK_SIZE +
+                        self.DATA[2 * BLOCK_SIZE:])
+            self.assertEqual(data, expected)
+
+    @permutations([
+        # offset, start, size
+        (1, 0, BLOCK_SIZE),
+        (0, 1, BLOCK_SIZE),
+        (0, 0, BLOCK_SIZE - 1),
+        (0, BLOCK_SIZE, 2 * BLOCK_SIZE),
+    ])
+    def test_invalid_range(self, offset, start, size):
+        with temporaryPath(data=self.DATA) as srcPath, \
+                directio.DirectFile(srcPath, "r+") as f, \
+                directio.AlignedBuffer(2 * BLOCK_SIZE) as buf:
+            self.assertRaises(ValueError, f.pread, buf, offset, start, size)
+            self.assertRaises(ValueError, f.pwrite, buf, offset, start, size)
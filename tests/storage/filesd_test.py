@@ -59,25 +59,60 @@ class FileStorageDomain(fileSD.FileStorageDomain):
 
 
 class FakeGlob(object):
+    """
+    Directories are implied by the files, and like glob.glob(), "*" does
+    not match "/".
+    """
 
     def __init__(self, files):
         self.files = files
+        self.dirs = set()
+        for path in files:
+            path = os.path.dirname(path)
+            while path not in self.dirs and path != "/":
+                self.dirs.add(path)
+                path = os.path.dirname(path)
 
     def glob(self, pattern):
-        return fnmatch.filter(self.files, pattern)
+        depth = pattern.count("/")
+        paths = fnmatch.filter(list(self.dirs) + self.files, pattern)
+        return [path for path in paths if path.count("/") == depth]
+
+
+class FakeOS(object):
+
+    def __init__(self, glob):
+        self.path = FakePath(glob)
+
+    def stat(self, path):
+        return os.stat_result((0,) * 10)
+
+
+class FakePath(object):
+
+    def __init__(self, glob):
+        self._glob = glob
+
+    def isdir(self, path):
+        return path in self._glob.dirs
 
 
 class FakeOOP(object):
 
     def __init__(self, glob=None):
         self.glob = glob
+        self.os = FakeOS(glob)
 
 
 class TestGetAllVolumes(VdsmTestCase):
 
     MOUNTPOINT = "/rhev/data-center/%s" % uuid.uuid4()
-    SD_UUID = str(uuid.uuid4())
-    IMAGES_DIR = os.path.join(MOUNTPOINT, SD_UUID, sd.DOMAIN_IMAGES)
+
+    def setUp(self):
+        # The volume index is shared by all domains with the same UUID.
+        self.SD_UUID = str(uuid.uuid4())
+        self.IMAGES_DIR = os.path.join(self.MOUNTPOINT, self.SD_UUID,
+                                       sd.DOMAIN_IMAGES)
 
     def test_no_volumes(self):
         oop = FakeOOP(FakeGlob([]))
@@ -138,6 +173,49 @@ class TestGetAllVolumes(VdsmTestCase):
         self.assertEqual(res["volume-4"], (("image-2",), None))
         self.assertEqual(res["volume-5"], (("image-3",), None))
 
+    def test_refresh_image_volumes(self):
+        glob = FakeGlob([
+            os.path.join(self.IMAGES_DIR, "image-1", "volume-1.meta"),
+        ])
+        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, FakeOOP(glob))
+        dom.getAllVolumes()
+
+        # Another host added a volume; the images directory did not change.
+        glob.files.append(
+            os.path.join(self.IMAGES_DIR, "image-1", "volume-2.meta"))
+        self.assertNotIn("volume-2", dom.getAllVolumes())
+
+        dom.refreshImageVolumes("image-1")
+        self.assertEqual(dom.getAllVolumes()["volume-2"],
+                         (("image-1",), None))
+
+    def test_get_vols_of_image(self):
+        glob = FakeGlob([
+            os.path.join(self.IMAGES_DIR, "image-1", "volume-1.meta"),
+            os.path.join(self.IMAGES_DIR, "image-2", "volume-2.meta"),
+        ])
+        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, FakeOOP(glob))
+        dom.getAllVolumes()
+
+        # Another host added a volume; the images directory did not change.
+        glob.files.append(
+            os.path.join(self.IMAGES_DIR, "image-1", "volume-3.meta"))
+        self.assertEqual(sorted(dom.getVolsOfImage("image-1")),
+                         ["volume-1", "volume-3"])
+
+    def test_refresh_volumes(self):
+        glob = FakeGlob([
+            os.path.join(self.IMAGES_DIR, "image-1", "volume-1.meta"),
+        ])
+        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, FakeOOP(glob))
+        dom.getAllVolumes()
+
+        glob.files.append(
+            os.path.join(self.IMAGES_DIR, "image-2", "volume-2.meta"))
+        dom.refreshVolumes()
+        self.assertEqual(dom.getAllVolumes()["volume-2"],
+                         (("image-2",), None))
+
     def test_scale(self):
         # For this test we want real world strings
         images_count = 5000
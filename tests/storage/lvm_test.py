@@ -19,10 +19,25 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+import six
+
 from testlib import VdsmTestCase
 
+from vdsm.common import commands
+from vdsm.storage import lvmshell
 import vdsm.storage.lvm as lvm
 
+FAKE_LVM = os.path.join(os.path.dirname(__file__), "fake-lvm")
+
 
 class TestLvm(VdsmTestCase):
     def test_buildFilter(self):
@@ -37,3 +52,229 @@ class TestLvm(VdsmTestCase):
                           "\\\\x22\\\\x28|\', \'r|.*|\' ]"
                           )
         self.assertEqual(expectedFilter, filter)
+
+
+class FakeLVMCache(lvm.LVMCache):
+    """
+    LVMCache running a fake lvs command, reporting the LVs in self.lvs, a
+    dict mapping vg name to list of lv names.
+    """
+
+    def __init__(self, delay=0):
+        super(FakeLVMCache, self).__init__()
+        self.lvs = {}
+        self.delay = delay
+        self.calls = []
+
+    def cmd(self, cmd, devices=tuple()):
+        assert tuple(cmd[:len(lvm.LVS_CMD)]) == lvm.LVS_CMD
+        args = cmd[len(lvm.LVS_CMD):]
+        self.calls.append(args)
+        if self.delay:
+            time.sleep(self.delay)
+        out = []
+        rc = 0
+        if not args:
+            args = list(self.lvs)
+        for arg in args:
+            if "/" in arg:
+                vg, lv = arg.split("/")
+                if lv not in self.lvs.get(vg, ()):
+                    rc = 5
+                    continue
+                names = [lv]
+            else:
+                vg = arg
+                names = self.lvs.get(vg, ())
+            for name in names:
+                out.append("  %s|%s|%s|-wi-a-----|134217728|0|"
+                           "/dev/mapper/pv(0)|IU_image,PU_parent,MD_1" %
+                           ("uuid-" + name, name, vg))
+        return rc, out, "" if rc == 0 else "  Failed to find logical volume"
+
+
+class FakeListener(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def lvsChanged(self, vgName, lvNames):
+        self.calls.append(("changed", vgName, sorted(lvNames)
+                           if lvNames is not None else None))
+
+    def lvsRemoved(self, vgName, lvNames):
+        self.calls.append(("removed", vgName, sorted(lvNames)))
+
+
+class TestLVMCache(VdsmTestCase):
+
+    def setUp(self):
+        self.cache = FakeLVMCache()
+        self.cache.lvs["vg"] = ["lv1", "lv2", "lv3"]
+
+    def test_get_lv_loads_vg(self):
+        lv = self.cache.getLv("vg", "lv1")
+        self.assertEqual(lv.name, "lv1")
+        self.assertEqual(self.cache.calls, [["vg"]])
+        lvs = self.cache.getLv("vg")
+        self.assertEqual(sorted(lv.name for lv in lvs), ["lv1", "lv2", "lv3"])
+        self.assertEqual(len(self.cache.calls), 1)
+
+    def test_reload_invalidated_lvs_only(self):
+        self.cache.getLv("vg")
+        self.cache._invalidatelvs("vg", ["lv1", "lv2"])
+        self.cache.getLv("vg", "lv1")
+        self.assertEqual(self.cache.calls[1], ["vg/lv1", "vg/lv2"])
+        # lv2 was reloaded with lv1.
+        self.cache.getLv("vg", "lv2")
+        self.assertEqual(len(self.cache.calls), 2)
+
+    def test_reload_vg_after_vg_invalidation(self):
+        self.cache.getLv("vg")
+        self.cache.lvs["vg"].append("lv4")
+        self.cache._invalidatelvs("vg")
+        lvs = self.cache.getLv("vg")
+        self.assertEqual(self.cache.calls[1], ["vg"])
+        self.assertEqual(len(lvs), 4)
+
+    def test_lookup_new_lv(self):
+        self.cache.getLv("vg")
+        self.cache.lvs["vg"].append("lv4")
+        lv = self.cache.getLv("vg", "lv4")
+        self.assertEqual(lv.name, "lv4")
+        self.assertEqual(self.cache.calls[1], ["vg/lv4"])
+
+    def test_removed_lv(self):
+        self.cache.getLv("vg")
+        self.cache.lvs["vg"].remove("lv2")
+        self.cache._invalidatelvs("vg", ["lv1", "lv2"])
+        self.assertEqual(self.cache.getLv("vg", "lv1").name, "lv1")
+        # Looking up the removed lv failed, so the entire vg was reloaded.
+        self.assertEqual(self.cache.calls[1:], [["vg/lv1", "vg/lv2"], ["vg"]])
+        self.assertIsNone(self.cache.getLv("vg", "lv2"))
+        lvs = self.cache.getLv("vg")
+        self.assertEqual(sorted(lv.name for lv in lvs), ["lv1", "lv3"])
+
+    def test_reload_vg_notifies_listeners(self):
+        listener = FakeListener()
+        self.cache.addLvListener("vg", listener)
+        self.cache.getLv("vg")
+        # Nothing to report on the first load.
+        self.assertEqual(listener.calls, [])
+        # Simulate LVs created and removed by another host. Looking up the
+        # removed LV fails, so the entire VG is reloaded.
+        self.cache.lvs["vg"] = ["lv1", "lv3", "lv4"]
+        self.cache._invalidatelvs("vg", ["lv2"])
+        self.assertIsNone(self.cache.getLv("vg", "lv2"))
+        self.assertEqual(listener.calls, [("changed", "vg", ["lv2"]),
+                                          ("changed", "vg", ["lv4"]),
+                                          ("removed", "vg", ["lv2"])])
+
+    def test_missing_lv(self):
+        self.assertIsNone(self.cache.getLv("vg", "missing"))
+        self.assertNotIn(("vg", "missing"), self.cache._lvs)
+
+    def test_stats(self):
+        self.cache.getLv("vg", "lv1")
+        self.cache.getLv("vg", "lv2")
+        self.cache.getLv("vg")
+        stats = self.cache.stats()
+        self.assertEqual(stats["lv_misses"], 1)
+        self.assertEqual(stats["lv_hits"], 2)
+        self.assertEqual(stats["lv_reloads"], 1)
+        self.assertGreaterEqual(stats["lv_reload_time"], 0)
+        self.assertGreaterEqual(stats["lv_reload_max_time"], 0)
+
+    def test_concurrent_reloads(self):
+        self.cache.delay = 0.1
+        self.cache.getLv("vg")
+        self.cache._invalidatelvs("vg", ["lv1", "lv2", "lv3"])
+        results = {}
+
+        def worker(name):
+            results[name] = self.cache.getLv("vg", name)
+
+        threads = [threading.Thread(target=worker, args=(name,))
+                   for name in self.cache.lvs["vg"] * 5]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(
+            sorted((name, lv.name) for name, lv in results.items()),
+            [("lv1", "lv1"), ("lv2", "lv2"), ("lv3", "lv3")])
+        # Initial load, and at most 2 reloads for 15 threads.
+        self.assertLessEqual(len(self.cache.calls), 3)
+
+
+class FakeLVMCommandCache(lvm.LVMCache):
+    """
+    LVMCache running tests/storage/fake-lvm instead of lvm, without sudo
+    and without looking up multipath devices.
+    """
+
+    def __init__(self, shell=None):
+        super(FakeLVMCommandCache, self).__init__(shell)
+        self.commands = []
+
+    def _getCachedExtraCfg(self):
+        return lvm._buildConfig(["/dev/mapper/pv"])
+
+    def _run(self, cmd):
+        self.commands.append(cmd[1:])
+        if self._shell is not None:
+            return self._shell.run(cmd[1:])
+        return commands.execCmd([sys.executable, FAKE_LVM] + cmd[1:])
+
+
+@pytest.mark.stress
+@pytest.mark.skipif(six.PY3, reason="lvm output parsing not compatible "
+                                    "with python 3")
+@pytest.mark.parametrize("shells", [0, 1])
+def test_incremental_refresh_benchmark(monkeypatch, shells):
+    lvs = 5000
+    lookups = 500
+    invalidate_every = 10
+    monkeypatch.setenv("FAKE_LVM_LVS", str(lvs))
+    names = ["lv-%04d" % i for i in range(lvs)]
+
+    shell = None
+    if shells:
+        shell = lvmshell.Pool([sys.executable, FAKE_LVM], shells, sudo=False)
+    cache = FakeLVMCommandCache(shell)
+    try:
+        start = time.time()
+        assert len(cache.getLv("vg")) == lvs
+        load = time.time() - start
+
+        start = time.time()
+        for i in range(lookups):
+            name = names[i]
+            if i % invalidate_every == 0:
+                cache._invalidatelvs("vg", [name])
+            assert cache.getLv("vg", name).name == name
+        elapsed = time.time() - start
+
+        stats = cache.stats()
+        print("\n%d lvs, shells=%d, initial load %.3f seconds" %
+              (lvs, shells, load))
+        print("%d lookups in %.3f seconds, hits=%d misses=%d reloads=%d "
+              "reload_time=%.3f" % (
+                  lookups, elapsed, stats["lv_hits"], stats["lv_misses"],
+                  stats["lv_reloads"], stats["lv_reload_time"]))
+
+        # Every invalidation runs one command reloading a single lv.
+        reloads = 1 + lookups // invalidate_every
+        assert stats["lv_reloads"] == reloads
+        assert len(cache.commands) == reloads
+        for args in cache.commands[1:]:
+            assert args[-2] == lvm.LV_FIELDS
+            assert "/" in args[-1]
+        if shell is not None:
+            # All commands ran in the same lvm process.
+            assert shell.stats()["started"] == 1
+            assert shell.stats()["commands"] == reloads
+    finally:
+        if shell is not None:
+            shell.close()
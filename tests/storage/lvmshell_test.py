@@ -0,0 +1,210 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from vdsm.common import commands
+from vdsm.storage import lvm
+from vdsm.storage import lvmshell
+from vdsm.storage import misc
+
+FAKE_LVM = os.path.join(os.path.dirname(__file__), "fake-lvm")
+
+LVS_CMD = ["lvs", "--config", lvm._buildConfig(["/dev/mapper/pv"])]
+
+
+@pytest.fixture
+def pool():
+    p = lvmshell.Pool([sys.executable, FAKE_LVM], 2, sudo=False)
+    yield p
+    p.close()
+
+
+def test_report(pool):
+    rc, out, err = pool.run(LVS_CMD + ["vg"])
+    assert rc == 0
+    assert err == []
+    assert len(out) == 10
+    line = out[0].decode("utf-8")
+    lv = lvm.makeLV(*[f.strip() for f in line.split(lvm.SEPARATOR)])
+    assert lv.name == "lv-0000"
+    assert lv.vg_name == "vg"
+    assert lv.tags == ("IU_image", "PU_parent", "MD_0")
+
+
+def test_same_output_as_lvm(pool):
+    args = LVS_CMD + ["vg"]
+    rc, out, err = commands.execCmd([sys.executable, FAKE_LVM] + args)
+    assert (rc, err) == (0, [])
+    assert pool.run(args) == (rc, out, err)
+
+
+def test_failed_command(pool):
+    rc, out, err = pool.run(["fail"])
+    assert rc == 5
+    assert out == []
+    assert err == [b"  Command fail failed"]
+
+
+def test_shell_reused(pool):
+    for i in range(5):
+        assert pool.run(LVS_CMD + ["vg"])[0] == 0
+    stats = pool.stats()
+    assert stats["started"] == 1
+    assert stats["commands"] == 5
+    assert stats["idle"] == 1
+
+
+def test_concurrent_commands(pool):
+    results = []
+
+    def run():
+        for i in range(10):
+            results.append(pool.run(LVS_CMD + ["vg"])[0])
+
+    threads = [threading.Thread(target=run) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == [0] * 40
+    stats = pool.stats()
+    assert stats["started"] <= 2
+    assert stats["busy"] == 0
+
+
+def test_restart(pool):
+    pool.run(LVS_CMD + ["vg"])
+    pool.restart()
+    pool.run(LVS_CMD + ["vg"])
+    stats = pool.stats()
+    assert stats["started"] == 2
+    assert stats["idle"] == 1
+
+
+def test_start_failure():
+    pool = lvmshell.Pool(["/no/such/lvm"], 2, sudo=False)
+    with pytest.raises(lvmshell.Error):
+        pool.run(LVS_CMD + ["vg"])
+    # Starting shells is disabled for a while.
+    with pytest.raises(lvmshell.Error):
+        pool.run(LVS_CMD + ["vg"])
+    assert pool.stats()["failed"] == 1
+
+
+def test_report_shell_terminated(pool):
+    # Reports can be run again in a new lvm process.
+    with pytest.raises(lvmshell.Error) as e:
+        pool.run(LVS_CMD + ["crash"])
+    assert e.value.sent
+    assert pool.stats()["busy"] == 0
+
+
+def test_command_shell_terminated(pool):
+    # Other commands may have run, so they are reported as failed.
+    rc, out, err = pool.run(["lvchange", "crash"])
+    assert rc == 1
+    assert out == []
+    assert pool.stats()["busy"] == 0
+    # The next command starts a new shell.
+    assert pool.run(LVS_CMD + ["vg"])[0] == 0
+
+
+def test_invalid_argument(pool):
+    with pytest.raises(lvmshell.Error) as e:
+        pool.run(["lvs", "'invalid\"argument'"])
+    assert not e.value.sent
+
+
+class TestLVMCache:
+
+    def test_run_in_shell(self, pool, monkeypatch):
+        monkeypatch.setattr(misc, "execCmd", fail_exec)
+        cache = lvm.LVMCache(pool)
+        rc, out, err = cache.cmd(["lvs", "vg"], devices=["/dev/mapper/pv"])
+        assert rc == 0
+        assert len(out) == 10
+
+    def test_fallback_to_lvm(self, monkeypatch):
+        calls = []
+
+        def fake_exec(cmd, sudo=False):
+            calls.append(cmd)
+            return 0, [], []
+
+        monkeypatch.setattr(misc, "execCmd", fake_exec)
+        pool = lvmshell.Pool(["/no/such/lvm"], 1, sudo=False)
+        cache = lvm.LVMCache(pool)
+        assert cache.cmd(["lvs", "vg"], devices=["/dev/mapper/pv"])[0] == 0
+        assert len(calls) == 1
+        assert calls[0][1] == "lvs"
+
+    def test_restart_on_filter_change(self, pool, monkeypatch):
+        devices = [["/dev/mapper/pv1"]]
+        monkeypatch.setattr(lvm.multipath, "getMPDevNamesIter",
+                            lambda: iter(devices[0]))
+        monkeypatch.setattr(lvm, "_updateLvmConf", lambda conf: None)
+        monkeypatch.setattr(misc, "execCmd", fail_exec)
+        cache = lvm.LVMCache(pool)
+
+        cache.cmd(["lvs", "vg"])
+        cache.invalidateFilter()
+        cache.cmd(["lvs", "vg"])
+        assert pool.stats()["started"] == 1
+
+        devices[0] = ["/dev/mapper/pv1", "/dev/mapper/pv2"]
+        cache.invalidateFilter()
+        cache.cmd(["lvs", "vg"])
+        assert pool.stats()["started"] == 2
+
+
+def fail_exec(cmd, sudo=False):
+    raise AssertionError("Unexpected command %s" % cmd)
+
+
+@pytest.mark.stress
+@pytest.mark.parametrize("backend", ["exec", "shell"])
+def test_benchmark_lvs(pool, backend):
+    count = 500
+    args = LVS_CMD + ["vg"]
+    if backend == "shell":
+        def run():
+            return pool.run(args)
+    else:
+        def run():
+            return commands.execCmd([sys.executable, FAKE_LVM] + args)
+
+    start = time.time()
+    for i in range(count):
+        rc, out, err = run()
+        assert rc == 0
+    elapsed = time.time() - start
+
+    print("\n%s: %d lvs commands in %.3f seconds (%.2f msec per command)"
+          % (backend, count, elapsed, elapsed / count * 1000))
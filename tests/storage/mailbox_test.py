@@ -18,12 +18,17 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+from __future__ import print_function
+
 import collections
 import contextlib
 import io
 import os
 import threading
 import struct
+import time
+
+import pytest
 
 from testlib import VdsmTestCase
 from testlib import namedTemporaryDir
@@ -202,3 +207,205 @@ class TestValidation(VdsmTestCase):
         data = msg + padding * "\0"
         mailbox = data + "bad!"
         self.assertFalse(sm.SPM_MailMonitor.validateMailbox(mailbox, 7))
+
+
+class TestMailReader(VdsmTestCase):
+
+    def test_read(self):
+        with make_env() as env:
+            with io.open(env.inbox, "r+b") as f:
+                f.seek(sm.MAILBOX_SIZE)
+                f.write(b"x" * sm.MAILBOX_SIZE)
+            reader = sm._MailReader(env.inbox, sm.MAILBOX_SIZE,
+                                    2 * sm.MAILBOX_SIZE)
+            try:
+                reader.read()
+                self.assertEqual(reader[:sm.MAILBOX_SIZE],
+                                 b"x" * sm.MAILBOX_SIZE)
+                self.assertEqual(reader[sm.MAILBOX_SIZE:], sm.EMPTYMAILBOX)
+            finally:
+                reader.close()
+
+    def test_changed(self):
+        with make_env() as env:
+            reader = sm._MailReader(env.inbox, 0, sm.MAILBOX_SIZE)
+            try:
+                reader.read()
+                self.assertFalse(reader.changed(0, sm.MAILBOX_SIZE))
+                with io.open(env.inbox, "r+b") as f:
+                    f.seek(sm.MESSAGE_SIZE)
+                    f.write(b"x")
+                reader.read()
+                self.assertTrue(reader.changed(0, sm.MAILBOX_SIZE))
+                self.assertFalse(reader.changed(0, sm.MESSAGE_SIZE))
+                self.assertTrue(reader.changed(sm.MESSAGE_SIZE,
+                                               2 * sm.MESSAGE_SIZE))
+                reader.read()
+                self.assertFalse(reader.changed(0, sm.MAILBOX_SIZE))
+            finally:
+                reader.close()
+
+    def test_clear(self):
+        with make_env() as env:
+            with io.open(env.inbox, "r+b") as f:
+                f.write(b"x" * sm.MESSAGE_SIZE)
+            reader = sm._MailReader(env.inbox, 0, sm.MAILBOX_SIZE)
+            try:
+                reader.read()
+                reader.clear(0, sm.MAILBOX_SIZE)
+                self.assertEqual(reader[:], sm.EMPTYMAILBOX)
+                # Cleared content is compared with the next read.
+                reader.read()
+                self.assertTrue(reader.changed(0, sm.MESSAGE_SIZE))
+            finally:
+                reader.close()
+
+    def test_read_replaced_file(self):
+        with make_env() as env:
+            reader = sm._MailReader(env.inbox, 0, sm.MAILBOX_SIZE)
+            try:
+                reader.read()
+                # Like changing the master domain, replacing the mailbox.
+                replace_file(env.inbox, b"x" * sm.MAILBOX_SIZE)
+                reader.read()
+                self.assertEqual(reader[:], b"x" * sm.MAILBOX_SIZE)
+            finally:
+                reader.close()
+
+    def test_read_short_file(self):
+        with make_env() as env:
+            reader = sm._MailReader(env.inbox, 0,
+                                    (MAX_HOSTS + 1) * sm.MAILBOX_SIZE)
+            try:
+                self.assertRaises(IOError, reader.read)
+            finally:
+                reader.close()
+
+
+class TestMailWriter(VdsmTestCase):
+
+    def test_flush_modified_mailboxes(self):
+        with make_env() as env:
+            writer = sm._MailWriter(env.outbox, 0,
+                                    MAX_HOSTS * sm.MAILBOX_SIZE)
+            try:
+                writer.write(3 * sm.MAILBOX_SIZE, b"x" * sm.MESSAGE_SIZE)
+                # Modify other mailboxes behind the writer back; they must
+                # not be overwritten.
+                with io.open(env.outbox, "r+b") as f:
+                    f.write(b"y" * sm.MAILBOX_SIZE)
+                writer.flush()
+            finally:
+                writer.close()
+            with io.open(env.outbox, "rb") as f:
+                data = f.read()
+            self.assertEqual(data[:sm.MAILBOX_SIZE], b"y" * sm.MAILBOX_SIZE)
+            start = 3 * sm.MAILBOX_SIZE
+            self.assertEqual(data[start:start + sm.MESSAGE_SIZE],
+                             b"x" * sm.MESSAGE_SIZE)
+
+    def test_flush_nothing(self):
+        with make_env() as env:
+            writer = sm._MailWriter(env.outbox, 0,
+                                    MAX_HOSTS * sm.MAILBOX_SIZE)
+            try:
+                with io.open(env.outbox, "r+b") as f:
+                    f.write(b"y" * sm.MAILBOX_SIZE)
+                writer.flush()
+            finally:
+                writer.close()
+            with io.open(env.outbox, "rb") as f:
+                data = f.read()
+            self.assertEqual(data[:sm.MAILBOX_SIZE], b"y" * sm.MAILBOX_SIZE)
+
+    def test_clear(self):
+        with make_env() as env:
+            with io.open(env.outbox, "wb") as f:
+                f.write(b"x" * sm.MAILBOX_SIZE * MAX_HOSTS)
+            writer = sm._MailWriter(env.outbox, 0,
+                                    MAX_HOSTS * sm.MAILBOX_SIZE)
+            try:
+                writer.clear()
+                writer.flush()
+            finally:
+                writer.close()
+            with io.open(env.outbox, "rb") as f:
+                data = f.read()
+            self.assertEqual(data, sm.EMPTYMAILBOX * MAX_HOSTS)
+
+    def test_flush_replaced_file(self):
+        with make_env() as env:
+            writer = sm._MailWriter(env.outbox, 0,
+                                    MAX_HOSTS * sm.MAILBOX_SIZE)
+            try:
+                writer.write(0, b"x" * sm.MESSAGE_SIZE)
+                writer.flush()
+                replace_file(env.outbox, b"y" * sm.MAILBOX_SIZE * MAX_HOSTS)
+                writer.write(sm.MAILBOX_SIZE, b"z" * sm.MESSAGE_SIZE)
+                writer.flush()
+            finally:
+                writer.close()
+            # All mailboxes are written to the new file.
+            with io.open(env.outbox, "rb") as f:
+                data = f.read()
+            self.assertEqual(data[:sm.MESSAGE_SIZE], b"x" * sm.MESSAGE_SIZE)
+            start = sm.MAILBOX_SIZE
+            self.assertEqual(data[start:start + sm.MESSAGE_SIZE],
+                             b"z" * sm.MESSAGE_SIZE)
+            self.assertEqual(data[2 * sm.MAILBOX_SIZE:],
+                             sm.EMPTYMAILBOX * (MAX_HOSTS - 2))
+
+    def test_resize(self):
+        with make_env() as env:
+            writer = sm._MailWriter(env.outbox, 0, 2 * sm.MAILBOX_SIZE)
+            try:
+                writer.write(0, b"x" * sm.MESSAGE_SIZE)
+                writer.resize(3 * sm.MAILBOX_SIZE)
+                self.assertEqual(len(writer), 3 * sm.MAILBOX_SIZE)
+                self.assertEqual(writer[:sm.MESSAGE_SIZE],
+                                 b"x" * sm.MESSAGE_SIZE)
+            finally:
+                writer.close()
+
+
+def replace_file(path, data):
+    tmp = path + ".tmp"
+    with io.open(tmp, "wb") as f:
+        f.write(data)
+    os.rename(tmp, path)
+
+
+class TestRanges(VdsmTestCase):
+
+    def test_ranges(self):
+        self.assertEqual(list(sm._ranges([])), [])
+        self.assertEqual(list(sm._ranges([3])), [(3, 1)])
+        self.assertEqual(list(sm._ranges([0, 1, 2, 5, 7, 8])),
+                         [(0, 3), (5, 1), (7, 2)])
+
+
+class TestSPMMailMonitorBenchmark(VdsmTestCase):
+
+    @pytest.mark.stress
+    def test_check_for_mail(self):
+        hosts = 250
+        polls = 1000
+        with namedTemporaryDir() as tmpdir:
+            inbox = os.path.join(tmpdir, "inbox")
+            outbox = os.path.join(tmpdir, "outbox")
+            for path in (inbox, outbox):
+                with io.open(path, "wb") as f:
+                    f.write(sm.EMPTYMAILBOX * hosts)
+            mailbox = sm.SPM_MailMonitor(SPUUID, hosts, inbox=inbox,
+                                         outbox=outbox,
+                                         monitorInterval=MONITOR_INTERVAL)
+            try:
+                start = time.time()
+                for i in range(polls):
+                    mailbox._checkForMail()
+                elapsed = time.time() - start
+            finally:
+                mailbox.stop()
+                mailbox.wait(timeout=MAILER_TIMEOUT)
+        print()
+        print("%d hosts: %.2f polls/s" % (hosts, polls / elapsed))
@@ -18,6 +18,7 @@
 # Refer to the README and COPYING files for full details of the license
 #
 from __future__ import print_function
+import errno
 import os
 import random
 import tempfile
@@ -36,6 +37,7 @@ from testlib import VdsmTestCase
 from testlib import namedTemporaryDir
 from testlib import permutations, expandPermutations
 from testlib import TEMPDIR
+from testlib import temporaryPath
 
 from vdsm.common import cmdutils
 from vdsm.common import commands
@@ -45,6 +47,7 @@ from vdsm.storage import misc
 from vdsm.storage import outOfProcess as oop
 
 from monkeypatch import MonkeyPatch
+from monkeypatch import MonkeyPatchScope
 from testValidation import checkSudo
 
 EXT_DD = "/bin/dd"
@@ -671,6 +674,89 @@ class TestReadBlock(VdsmTestCase):
 
         os.unlink(path)
 
+    def testFallbackToDD(self):
+        """
+        Make sure we fall back to dd if direct I/O is not supported.
+        """
+        data = b"x" * 511 + b"\n"
+        path = self._createTempFile(1024, data)
+        try:
+            def unsupported(name, offset, size):
+                raise OSError(errno.EINVAL, "Invalid argument")
+
+            with MonkeyPatchScope([(misc, "_readblock_direct", unsupported)]):
+                block = misc.readblock(path, 512, 512)
+        finally:
+            os.unlink(path)
+
+        self.assertEqual(block, [b"x" * 511])
+
+    def testDirectReadError(self):
+        """
+        Direct I/O errors other than EINVAL are not retried with dd.
+        """
+        def failing(name, offset, size):
+            raise OSError(errno.EIO, "Input/output error")
+
+        with MonkeyPatchScope([(misc, "_readblock_direct", failing),
+                               (misc, "_readblock_dd", None)]):
+            self.assertRaises(misc.se.MiscBlockReadException, misc.readblock,
+                              "/no/such/path", 0, 512)
+
+
+@expandPermutations
+class TestReadBlockImplementations(VdsmTestCase):
+
+    # 2 MiB + 1 KiB, to exercise multiple chunks and partial chunks.
+    DATA = b"".join(os.urandom(512) for i in range(4098))
+
+    @permutations([
+        # offset, size
+        (0, 512),
+        (512, 1024),
+        (4096, misc.MEGA),
+        (512, 2 * misc.MEGA),
+    ])
+    def test_direct_matches_dd(self, offset, size):
+        with temporaryPath(data=self.DATA) as path:
+            direct = misc._readblock_direct(path, offset, size)
+            dd = misc._readblock_dd(path, offset, size)
+        self.assertEqual(direct, self.DATA[offset:offset + size])
+        self.assertEqual(direct, dd)
+
+    @permutations([["_readblock_direct"], ["_readblock_dd"]])
+    def test_read_past_end(self, reader):
+        with temporaryPath(data=self.DATA) as path:
+            self.assertRaises(misc.se.MiscBlockReadIncomplete,
+                              getattr(misc, reader),
+                              path, len(self.DATA) - 512, 1024)
+
+    @pytest.mark.stress
+    @permutations([
+        # reader, size
+        ("_readblock_direct", 512),
+        ("_readblock_dd", 512),
+        ("_readblock_direct", misc.MEGA),
+        ("_readblock_dd", misc.MEGA),
+    ])
+    def test_benchmark(self, reader, size):
+        read = getattr(misc, reader)
+        count = 500
+        latency = []
+        with temporaryPath(data=self.DATA) as path:
+            start = time.time()
+            for i in range(count):
+                t = time.time()
+                read(path, 0, size)
+                latency.append(time.time() - t)
+            elapsed = time.time() - start
+
+        latency.sort()
+        p99 = latency[int(len(latency) * 0.99)]
+        print()
+        print("%s size=%d: %.2f reads/s, p99 latency %.6f s"
+              % (reader, size, count / elapsed, p99))
+
 
 class TestCleanUpDir(VdsmTestCase):
 
@@ -26,6 +26,10 @@ from contextlib import contextmanager
 
 from six.moves import queue
 
+from vdsm import executor
+from vdsm import schedule
+from vdsm.common.time import monotonic_time
+from vdsm.storage import clusterlock
 from vdsm.storage import exception as se
 from vdsm.storage import monitor
 
@@ -70,6 +74,12 @@ class FakeCheckService(object):
     def __init__(self):
         self.checkers = {}
 
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
     def start_checking(self, path, complete, interval=10.0):
         log.info("Start checking %r", path)
         if path in self.checkers:
@@ -113,7 +123,7 @@ class FakeDomain(object):
         log.debug("Performing selftest")
 
     def getMonitoringPath(self):
-        return "/path/to/metadata"
+        return "/path/to/%s/metadata" % self.sdUUID
 
     @maybefail
     def getStats(self):
@@ -134,6 +144,11 @@ class FakeDomain(object):
         log.debug("Checking if host id is acquired")
         return self.acquired
 
+    def getHostStatus(self, hostId):
+        if self.acquired:
+            return clusterlock.HOST_STATUS_LIVE
+        return clusterlock.HOST_STATUS_FREE
+
     @maybefail
     def acquireHostId(self, hostId, async=True):
         log.debug("Acquiring host id (hostId=%s, async=%s)", hostId, async)
@@ -178,12 +193,12 @@ class FakeCheckResult(object):
 
 class MonitorEnv(object):
 
-    def __init__(self, thread, event, checker):
-        self.thread = thread
+    def __init__(self, monitor, event, checker):
+        self.monitor = monitor
         self.event = event
         self.checker = checker
         self.queue = queue.Queue()
-        self.thread.cycleCallback = self._callback
+        self.monitor.cycleCallback = self._callback
 
     def wait_for_cycle(self):
         try:
@@ -206,29 +221,36 @@ def monitor_env(shutdown=False, refresh=300):
     ]):
         event = FakeEvent()
         checker = FakeCheckService()
-        thread = monitor.MonitorThread('uuid', 'host_id', MONITOR_INTERVAL,
-                                       event, checker)
+        scheduler = schedule.Scheduler(name="test.Scheduler",
+                                       clock=monotonic_time)
+        scheduler.start()
+        tasks = executor.Executor(name="test.Executor", workers_count=2,
+                                  max_tasks=10, scheduler=scheduler,
+                                  max_workers=4)
+        tasks.start()
+        task = monitor.MonitorTask('uuid', 'host_id', MONITOR_INTERVAL,
+                                   event, checker, scheduler, tasks)
         try:
-            yield MonitorEnv(thread, event, checker)
+            yield MonitorEnv(task, event, checker)
         finally:
-            thread.stop(shutdown=shutdown)
-            try:
-                thread.join()
-            except RuntimeError as e:
-                log.error("Error joining thread: %s", e)
+            task.stop(shutdown=shutdown)
+            task.join()
+            tasks.stop(wait=False)
+            scheduler.stop()
 
 
-class TestMonitorThreadIdle(VdsmTestCase):
+class TestMonitorIdle(VdsmTestCase):
 
     def test_initial_status(self):
-        thread = monitor.MonitorThread('uuid', 'host_id', 0.2, None, None)
-        status = thread.getStatus()
+        task = monitor.MonitorTask('uuid', 'host_id', 0.2, None, None, None,
+                                   None)
+        status = task.getStatus()
         self.assertFalse(status.actual)
         self.assertTrue(status.valid)
 
 
 @expandPermutations
-class TestMonitorThreadSetup(VdsmTestCase):
+class TestMonitorSetup(VdsmTestCase):
 
     # in this state we do:
     # 1. If refresh timeout has expired, remove the domain from the cache
@@ -247,18 +269,18 @@ class TestMonitorThreadSetup(VdsmTestCase):
         with monitor_env() as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
             env.wait_for_cycle()
             _, interval = env.checker.checkers[domain.getMonitoringPath()]
             self.assertEqual(interval, MONITOR_INTERVAL)
 
     def test_produce_retry(self):
         with monitor_env() as env:
-            env.thread.start()
+            env.monitor.start()
 
             # First cycle will fail since domain does not exist
             env.wait_for_cycle()
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertTrue(status.actual)
             self.assertFalse(status.valid)
             self.assertIsInstance(status.error, se.StorageDomainDoesNotExist)
@@ -267,7 +289,7 @@ class TestMonitorThreadSetup(VdsmTestCase):
 
             # Second cycle will fail but no event should be emitted
             env.wait_for_cycle()
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertFalse(status.valid)
             self.assertIsInstance(status.error, se.StorageDomainDoesNotExist)
             self.assertEqual(env.event.received, [])
@@ -277,13 +299,13 @@ class TestMonitorThreadSetup(VdsmTestCase):
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
             env.wait_for_cycle()
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertTrue(status.valid)
             self.assertEqual(env.event.received, [])
 
             # When path status is available, emit event
             env.checker.complete(domain.getMonitoringPath(), FakeCheckResult())
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertTrue(status.valid)
             self.assertEqual(env.event.received, [(('uuid', True), {})])
 
@@ -294,11 +316,11 @@ class TestMonitorThreadSetup(VdsmTestCase):
             domain = FakeDomain("uuid", iso_dir="/path")
             domain.errors["isISO"] = exception
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # First cycle will fail in domain.isISO
             env.wait_for_cycle()
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertTrue(status.actual)
             self.assertIsNone(status.isoPrefix)
             self.assertFalse(status.valid)
@@ -308,7 +330,7 @@ class TestMonitorThreadSetup(VdsmTestCase):
 
             # Second cycle will fail but no event should be emitted
             env.wait_for_cycle()
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertFalse(status.valid)
             self.assertIsInstance(status.error, exception)
             self.assertEqual(env.event.received, [])
@@ -317,14 +339,14 @@ class TestMonitorThreadSetup(VdsmTestCase):
             # we don't have path status yet.
             del domain.errors["isISO"]
             env.wait_for_cycle()
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertEqual(status.isoPrefix, domain.iso_dir)
             self.assertTrue(status.valid)
             self.assertEqual(env.event.received, [])
 
             # When path status is available, emit event
             env.checker.complete(domain.getMonitoringPath(), FakeCheckResult())
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertTrue(status.valid)
             self.assertEqual(env.event.received, [(('uuid', True), {})])
 
@@ -334,7 +356,7 @@ class TestMonitorThreadSetup(VdsmTestCase):
             domain = FakeDomain("uuid", iso_dir="/path")
             domain.errors["isISO"] = OSError
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # Domain will be removed after the refresh timeout
             env.wait_for_cycle()
@@ -346,7 +368,7 @@ class TestMonitorThreadSetup(VdsmTestCase):
 
 
 @expandPermutations
-class TestMonitorThreadMonitoring(VdsmTestCase):
+class TestMonitorMonitoring(VdsmTestCase):
 
     # In this state we do:
     # 1. If refresh timeout has expired, remove the domain from the cache
@@ -370,17 +392,17 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
         with monitor_env() as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # First cycle suceeds, but path status is not avialale yet
             env.wait_for_cycle()
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertFalse(status.actual)
             self.assertEqual(env.event.received, [])
 
             # When path succeeds, emit VALID event
             env.checker.complete(domain.getMonitoringPath(), FakeCheckResult())
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertTrue(status.actual)
             self.assertTrue(status.valid)
             self.assertEqual(env.event.received, [(('uuid', True), {})])
@@ -401,11 +423,11 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
             domain = FakeDomain("uuid")
             domain.errors[method] = exception
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # First cycle fail, emit event without waiting for path status
             env.wait_for_cycle()
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertTrue(status.actual)
             self.assertFalse(status.valid)
             self.assertIsInstance(status.error, exception)
@@ -416,18 +438,18 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
         with monitor_env() as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # First cycle succeed, but path status is not available yet
             env.wait_for_cycle()
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertFalse(status.actual)
             self.assertEqual(env.event.received, [])
 
             # When path fail, emit INVALID event
             env.checker.complete(domain.getMonitoringPath(),
                                  FakeCheckResult(exception))
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertTrue(status.actual)
             self.assertFalse(status.valid)
             self.assertIsInstance(status.error, exception)
@@ -449,7 +471,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
             domain = FakeDomain("uuid")
             domain.errors[method] = exception
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # First cycle fail, and emit INVALID event
             env.wait_for_cycle()
@@ -459,7 +481,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
             # is emitted.
             env.wait_for_cycle()
             env.checker.complete(domain.getMonitoringPath(), FakeCheckResult())
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertTrue(status.actual)
             self.assertFalse(status.valid)
             self.assertEqual(env.event.received, [])
@@ -467,7 +489,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
             # When next cycle succeeds, emit VALID event
             del domain.errors[method]
             env.wait_for_cycle()
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertTrue(status.valid)
             self.assertEqual(env.event.received, [(('uuid', True), {})])
 
@@ -476,7 +498,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
         with monitor_env() as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # First cycle succeed, but path status fail, emit INVALID event
             env.wait_for_cycle()
@@ -487,7 +509,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
             # Both domain status and pass status succeed, emit VALID event
             env.wait_for_cycle()
             env.checker.complete(domain.getMonitoringPath(), FakeCheckResult())
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertTrue(status.valid)
             self.assertEqual(env.event.received, [(('uuid', True), {})])
 
@@ -495,7 +517,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
         with monitor_env() as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # Both domain status and path status succeed and emit VALID event
             env.wait_for_cycle()
@@ -506,7 +528,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
             # not change (valid -> valid)
             env.wait_for_cycle()
             env.checker.complete(domain.getMonitoringPath(), FakeCheckResult())
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertTrue(status.valid)
             self.assertEqual(env.event.received, [])
 
@@ -525,7 +547,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
         with monitor_env() as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # Both domain status and path status succeed and emit VALID event
             env.wait_for_cycle()
@@ -535,7 +557,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
             # Domain status fail, emit INVALID event
             domain.errors[method] = exception
             env.wait_for_cycle()
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertFalse(status.valid)
             self.assertIsInstance(status.error, exception)
             self.assertEqual(env.event.received, [(('uuid', False), {})])
@@ -545,7 +567,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
         with monitor_env() as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # Both domain status and path status succeed and emit VALID event
             env.wait_for_cycle()
@@ -555,7 +577,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
             env.wait_for_cycle()
             env.checker.complete(domain.getMonitoringPath(),
                                  FakeCheckResult(exception))
-            status = env.thread.getStatus()
+            status = env.monitor.getStatus()
             self.assertFalse(status.valid)
             self.assertIsInstance(status.error, exception)
             self.assertEqual(env.event.received, [(('uuid', False), {})])
@@ -564,7 +586,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
         with monitor_env() as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # Both domain status and path status succeed
             env.wait_for_cycle()
@@ -580,7 +602,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
             domain = FakeDomain("uuid")
             domain.errors["selftest"] = OSError
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # Domain status fail, emit INVALID event
             env.wait_for_cycle()
@@ -599,7 +621,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
         with monitor_env() as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # Both domain status and path status succeed
             env.wait_for_cycle()
@@ -619,7 +641,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
         with monitor_env() as env:
             domain = FakeDomain("uuid", iso_dir="/path")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
             env.wait_for_cycle()
             env.checker.complete(domain.getMonitoringPath(), FakeCheckResult())
             self.assertFalse(domain.acquired)
@@ -629,7 +651,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
             domain = FakeDomain("uuid")
             domain.errors["selftest"] = OSError
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
             env.wait_for_cycle()
             env.checker.complete(domain.getMonitoringPath(), FakeCheckResult())
             self.assertFalse(domain.acquired)
@@ -640,7 +662,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
             domain = FakeDomain("uuid")
             domain.errors['acquireHostId'] = exception
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
             env.wait_for_cycle()
             self.assertFalse(domain.acquired)
             del domain.errors["acquireHostId"]
@@ -655,7 +677,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
         with monitor_env(refresh=MONITOR_INTERVAL * 1.5) as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
 
             # Domain will be removed after the refresh timeout
             env.wait_for_cycle()
@@ -666,7 +688,7 @@ class TestMonitorThreadMonitoring(VdsmTestCase):
             self.assertNotIn(domain.sdUUID, monitor.sdCache.domains)
 
 
-class TestMonitorThreadStopping(VdsmTestCase):
+class TestMonitorStopping(VdsmTestCase):
 
     # Here we release the host id if we acquired it, and the monitor was
     # stopped with shutdown=False.
@@ -675,7 +697,7 @@ class TestMonitorThreadStopping(VdsmTestCase):
         with monitor_env(shutdown=False) as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
             env.wait_for_cycle()
             env.checker.complete(domain.getMonitoringPath(), FakeCheckResult())
         self.assertFalse(domain.acquired)
@@ -684,7 +706,7 @@ class TestMonitorThreadStopping(VdsmTestCase):
         with monitor_env(shutdown=True) as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
             env.wait_for_cycle()
             env.checker.complete(domain.getMonitoringPath(), FakeCheckResult())
             # Acquire on next cycle
@@ -702,11 +724,11 @@ class TestMonitorThreadStopping(VdsmTestCase):
 
             domain.selftest = block
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
             if not blocked.wait(CYCLE_TIMEOUT):
                 raise RuntimeError("Timeout waiting for calling getReadDelay")
 
-        status = env.thread.getStatus()
+        status = env.monitor.getStatus()
         self.assertFalse(status.actual)
         self.assertFalse(domain.acquired)
 
@@ -714,12 +736,92 @@ class TestMonitorThreadStopping(VdsmTestCase):
         with monitor_env() as env:
             domain = FakeDomain("uuid")
             monitor.sdCache.domains["uuid"] = domain
-            env.thread.start()
+            env.monitor.start()
             env.wait_for_cycle()
         self.assertFalse(domain.acquired)
         self.assertNotIn(domain.getMonitoringPath(), env.checker.checkers)
 
 
+class TestDomainMonitor(VdsmTestCase):
+
+    DOMAINS = 200
+
+    def test_many_domains(self):
+        with domain_monitor_env() as env:
+            # Threads started by the domain monitor.
+            threads = threading.active_count()
+
+            for i in range(self.DOMAINS):
+                sd_uuid = "uuid-%03d" % i
+                monitor.sdCache.domains[sd_uuid] = FakeDomain(sd_uuid)
+                env.monitor.startMonitoring(sd_uuid, 1)
+            self.assertEqual(len(env.monitor.domains), self.DOMAINS)
+
+            # Wait until all monitors are set up and start checking the
+            # monitoring path.
+            wait_for(lambda: all(m.ready for m in env.monitors()))
+            for m in env.monitors():
+                env.checker.complete(m.monitoringPath, FakeCheckResult())
+
+            # Host id is acquired on the next cycle, and reported in the
+            # status on the cycle after that.
+            wait_for(lambda: all(status.hasHostId for _, status in
+                                 env.monitor.getDomainsStatus()))
+
+            for sd_uuid, status in env.monitor.getDomainsStatus():
+                self.assertTrue(status.actual)
+                self.assertTrue(status.valid)
+
+            domains = {m.sdUUID: 1 for m in env.monitors()}
+            host_status = env.monitor.getHostStatus(domains)
+            self.assertEqual(set(host_status.values()),
+                             {clusterlock.HOST_STATUS_LIVE})
+
+            self.assertEqual(len(env.event.received), self.DOMAINS)
+            self.assertEqual(threading.active_count(), threads)
+
+            env.monitor.stopMonitoring(domains)
+            self.assertEqual(list(env.monitor.domains), [])
+            self.assertFalse(any(d.acquired
+                                 for d in monitor.sdCache.domains.values()))
+            self.assertEqual(threading.active_count(), threads)
+
+
+class DomainMonitorEnv(object):
+
+    def __init__(self, domain_monitor, event, checker):
+        self.monitor = domain_monitor
+        self.event = event
+        self.checker = checker
+
+    def monitors(self):
+        return list(self.monitor._monitors.values())
+
+
+@contextmanager
+def domain_monitor_env():
+    checker = FakeCheckService()
+    event = FakeEvent()
+    with MonkeyPatchScope([
+        (monitor, "sdCache", FakeStorageDomainCache()),
+        (monitor.check, "CheckService", lambda: checker),
+    ]):
+        domain_monitor = monitor.DomainMonitor(MONITOR_INTERVAL)
+        domain_monitor.onDomainStateChange = event
+        try:
+            yield DomainMonitorEnv(domain_monitor, event, checker)
+        finally:
+            domain_monitor.shutdown()
+
+
+def wait_for(predicate, timeout=CYCLE_TIMEOUT):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise RuntimeError("Timeout waiting for %s" % predicate)
+        time.sleep(0.05)
+
+
 @expandPermutations
 class TestStatus(VdsmTestCase):
 
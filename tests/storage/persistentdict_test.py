@@ -17,7 +17,19 @@
 #
 # Refer to the README and COPYING files for full details of the license
 #
+from __future__ import absolute_import
+from __future__ import print_function
+
+import threading
+import time
+
+import pytest
+
+from monkeypatch import MonkeyPatchScope
 from testlib import VdsmTestCase
+from testlib import expandPermutations, permutations
+from vdsm.common import concurrent
+from vdsm.storage import exception as se
 from vdsm.storage import persistent as persistentDict
 
 
@@ -75,3 +87,162 @@ class TestPersistentDict(VdsmTestCase):
             return
 
         self.fail("Exception was not thrown")
+
+
+class FakeBlockRW(object):
+    """
+    Fake LvMetadataRW, storing metadata lines in a zero padded block.
+    """
+
+    def __init__(self, size=2048):
+        self.size = size
+        self.data = "\0" * size
+
+    def readlines(self):
+        return [line for line in self.data.split("\n")
+                if len(line) > 0 and line[0] != "\0" and "=" in line]
+
+    def writelines(self, lines):
+        data = "".join(line + "\n" for line in lines)
+        self.data = data + "\0" * (self.size - len(data))
+
+
+class CountingEncoder(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, line):
+        self.calls += 1
+        return _preprocessLine(line)
+
+
+_preprocessLine = persistentDict._preprocessLine
+
+METADATA = {"KEY-%02d" % i: "value-%02d" % i for i in range(30)}
+
+
+@expandPermutations
+class TestPersistentDictCache(VdsmTestCase):
+
+    @permutations([[DummyWriter], [FakeBlockRW]])
+    def test_refresh_unchanged(self, backend):
+        pd = persistentDict.PersistentDict(backend())
+        pd.update(METADATA)
+        encoder = CountingEncoder()
+        with MonkeyPatchScope([(persistentDict, "_preprocessLine", encoder)]):
+            pd.invalidate()
+            self.assertEqual(pd.copy(), METADATA)
+        # Lines did not change, no need to verify the checksum.
+        self.assertEqual(encoder.calls, 0)
+
+    @permutations([[DummyWriter], [FakeBlockRW]])
+    def test_refresh_changed(self, backend):
+        rw = backend()
+        pd = persistentDict.PersistentDict(rw)
+        pd.update(METADATA)
+        # Another host modify the metadata.
+        other = persistentDict.PersistentDict(rw)
+        other["KEY-00"] = "modified"
+        pd.invalidate()
+        self.assertEqual(pd["KEY-00"], "modified")
+
+    def test_refresh_seal_broken(self):
+        rw = DummyWriter()
+        pd = persistentDict.PersistentDict(rw)
+        pd.update(METADATA)
+        rw.lines[0] = "KEY-00=modified"
+        pd.invalidate()
+        self.assertRaises(se.MetaDataSealIsBroken, pd.get, "KEY-00")
+
+    def test_refresh_unchanged_after_failed_rollback(self):
+        rw = DummyWriter()
+        pd = persistentDict.PersistentDict(rw)
+        pd.update(METADATA)
+        # Simulate changes in memory which were never flushed.
+        pd._metadata["KEY-00"] = "not flushed"
+        pd.invalidate()
+        self.assertEqual(pd["KEY-00"], METADATA["KEY-00"])
+
+    def test_flush_reuses_encoded_lines(self):
+        pd = persistentDict.PersistentDict(DummyWriter())
+        pd.update(METADATA)
+        encoder = CountingEncoder()
+        with MonkeyPatchScope([(persistentDict, "_preprocessLine", encoder)]):
+            pd["KEY-00"] = "modified"
+        self.assertEqual(encoder.calls, 1)
+
+    def test_read_mostly_lockless(self):
+        pd = persistentDict.PersistentDict(DummyWriter(), readMostly=True)
+        pd.update(METADATA)
+        done = threading.Event()
+
+        def get():
+            pd.get("KEY-00")
+            done.set()
+
+        with pd._syncRoot:
+            t = concurrent.thread(get)
+            t.start()
+            try:
+                self.assertTrue(done.wait(1))
+            finally:
+                t.join()
+
+    def test_read_mostly_invalidate(self):
+        rw = DummyWriter()
+        pd = persistentDict.PersistentDict(rw, readMostly=True)
+        pd.update(METADATA)
+        other = persistentDict.PersistentDict(rw)
+        other["KEY-00"] = "modified"
+        self.assertEqual(pd["KEY-00"], METADATA["KEY-00"])
+        pd.invalidate()
+        self.assertEqual(pd["KEY-00"], "modified")
+
+    def test_read_mostly_transaction(self):
+        pd = persistentDict.PersistentDict(DummyWriter(), readMostly=True)
+        pd.update(METADATA)
+        with pd.transaction():
+            pd["KEY-00"] = "modified"
+            self.assertEqual(pd["KEY-00"], "modified")
+            self.assertIn("KEY-00", pd)
+        self.assertEqual(pd.get("KEY-00"), "modified")
+
+    def test_read_mostly_rollback(self):
+        pd = persistentDict.PersistentDict(DummyWriter(), readMostly=True)
+        pd.update(METADATA)
+        try:
+            with pd.transaction():
+                pd["KEY-00"] = "modified"
+                raise SpecialError("rollback")
+        except SpecialError:
+            pass
+        self.assertEqual(pd.get("KEY-00"), METADATA["KEY-00"])
+
+
+@pytest.mark.stress
+@expandPermutations
+class TestPersistentDictBenchmark(VdsmTestCase):
+
+    REFRESHES = 1000
+
+    @permutations([
+        # backend, readMostly
+        [DummyWriter, False],
+        [DummyWriter, True],
+        [FakeBlockRW, False],
+        [FakeBlockRW, True],
+    ])
+    def test_refresh(self, backend, readMostly):
+        pd = persistentDict.PersistentDict(backend(), readMostly=readMostly)
+        pd.update(METADATA)
+        start = time.time()
+        for i in range(self.REFRESHES):
+            pd.invalidate()
+            for key in METADATA:
+                pd.get(key)
+        elapsed = time.time() - start
+        print("%d refreshes with %s (readMostly=%s) in %.6f seconds "
+              "(%.6f seconds per refresh)"
+              % (self.REFRESHES, backend.__name__, readMostly, elapsed,
+                 elapsed / self.REFRESHES))
@@ -654,6 +654,101 @@ class TestResourceManager(VdsmTestCase):
             t.join()
 
 
+class TestResourceManagerQueue(VdsmTestCase):
+
+    @MonkeyPatch(rm, "_manager", manager())
+    def test_fifo(self):
+        granted = []
+
+        def callback(req, res):
+            granted.append((req.name, req.lockType, res))
+
+        owner = rm.acquireResource("storage", "resource", rm.EXCLUSIVE)
+        for lockType in (rm.EXCLUSIVE, rm.SHARED, rm.SHARED, rm.EXCLUSIVE):
+            rm._registerResource("storage", "resource", lockType, callback)
+        self.assertEqual(granted, [])
+
+        owner.release()
+        self.assertEqual([g[1] for g in granted], [rm.EXCLUSIVE])
+
+        granted.pop()[2].release()
+        # Both shared requests are granted together.
+        self.assertEqual([g[1] for g in granted], [rm.SHARED, rm.SHARED])
+
+        granted.pop()[2].release()
+        self.assertEqual(len(granted), 1)
+        granted.pop()[2].release()
+        self.assertEqual([g[1] for g in granted], [rm.EXCLUSIVE])
+        granted.pop()[2].release()
+        self.assertEqual(rm._getResourceStatus("storage", "resource"),
+                         rm.LockState.free)
+
+    @MonkeyPatch(rm, "_manager", manager())
+    def test_shared_waits_for_exclusive_waiter(self):
+        granted = []
+
+        def callback(req, res):
+            granted.append((req.lockType, res))
+
+        shared = rm.acquireResource("storage", "resource", rm.SHARED)
+        rm._registerResource("storage", "resource", rm.EXCLUSIVE, callback)
+        # Not joining the current shared lock, since a request is waiting.
+        rm._registerResource("storage", "resource", rm.SHARED, callback)
+        self.assertEqual(granted, [])
+
+        shared.release()
+        self.assertEqual([g[0] for g in granted], [rm.EXCLUSIVE])
+        granted.pop()[1].release()
+        self.assertEqual([g[0] for g in granted], [rm.SHARED])
+        granted.pop()[1].release()
+
+    @MonkeyPatch(rm, "_manager", manager())
+    def test_unregister_namespace_with_resources(self):
+        refs = [rm.acquireResource("storage", "resource%d" % i, rm.SHARED)
+                for i in range(rm._STRIPES * 2)]
+        for ref in refs:
+            self.assertRaises(rm.ResourceManagerError,
+                              rm.unregisterNamespace, "storage")
+            ref.release()
+        rm.unregisterNamespace("storage")
+        self.assertRaises(ValueError, rm.acquireResource, "storage",
+                          "resource", rm.SHARED)
+
+
+@expandPermutations
+class TestResourceManagerBenchmark(VdsmTestCase):
+
+    THREADS = 8
+    ITERATIONS = 2000
+
+    @pytest.mark.stress
+    @permutations([
+        # resources, lockType
+        (100, rm.EXCLUSIVE),
+        (1, rm.SHARED),
+        (1, rm.EXCLUSIVE),
+    ])
+    @MonkeyPatch(rm, "_manager", manager())
+    def test_contention(self, resources, lockType):
+        def worker(n):
+            for i in range(self.ITERATIONS):
+                name = "resource%d" % ((i * self.THREADS + n) % resources)
+                rm.acquireResource("storage", name, lockType).release()
+
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(self.THREADS)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+
+        print("\n%d threads, %d resources, %s: %d operations per second" % (
+            self.THREADS, resources, lockType,
+            self.THREADS * self.ITERATIONS / elapsed))
+
+
 @expandPermutations
 class TestResourceManagerLock(VdsmTestCase):
 
@@ -49,6 +49,7 @@ from vdsm import jobs
 from vdsm.common import exception
 from vdsm.storage import blockVolume
 from vdsm.storage import constants as sc
+from vdsm.storage import copyscheduler
 from vdsm.storage import exception as se
 from vdsm.storage import guarded
 from vdsm.storage import qemuimg
@@ -310,6 +311,44 @@ class TestCopyDataDIV(VdsmTestCase):
                 self.assertEqual(sc.ILLEGAL_VOL, dst_vol.getLegality())
                 self.assertEqual(gen_id, dst_vol.getMetaParam(sc.GENERATION))
 
+    @permutations((('file',), ('block',)))
+    def test_abort_queued_copy(self, env_type):
+        fmt = sc.RAW_FORMAT
+        with self.make_env(env_type, fmt, fmt) as env:
+            src_vol = env.src_chain[0]
+            dst_vol = env.dst_chain[0]
+            gen_id = dst_vol.getMetaParam(sc.GENERATION)
+            source = dict(endpoint_type='div', sd_id=src_vol.sdUUID,
+                          img_id=src_vol.imgUUID, vol_id=src_vol.volUUID,
+                          generation=0)
+            dest = dict(endpoint_type='div', sd_id=dst_vol.sdUUID,
+                        img_id=dst_vol.imgUUID, vol_id=dst_vol.volUUID,
+                        generation=gen_id)
+            fake_convert = FakeQemuConvertChecker(src_vol, dst_vol)
+            scheduler = copyscheduler.Scheduler(1)
+            with MonkeyPatchScope([
+                (qemuimg, 'convert', fake_convert),
+                (copyscheduler, '_scheduler', scheduler),
+            ]):
+                job = copy_data.Job(make_uuid(), 0, source, dest)
+                # Another copy is using the destination domain.
+                with scheduler.request("other-sd", dst_vol.sdUUID, 0):
+                    t = start_thread(job.run)
+                    for i in range(100):
+                        if job.queued:
+                            break
+                        t.join(0.01)
+                    self.assertEqual(jobs.STATUS.RUNNING, job.status)
+                    self.assertTrue(job.info()['queued'])
+                    job.abort()
+                    t.join(1)
+                    if t.isAlive():
+                        raise RuntimeError("Timeout waiting for thread")
+                self.assertEqual(jobs.STATUS.ABORTED, job.status)
+                self.assertNotIn('queued', job.info())
+                self.assertFalse(fake_convert.ready_event.is_set())
+                self.assertEqual(gen_id, dst_vol.getMetaParam(sc.GENERATION))
+
     def test_wrong_generation(self):
         fmt = sc.RAW_FORMAT
         with self.make_env('block', fmt, fmt) as env:
@@ -117,6 +117,18 @@ class FakeDomainManifest(object):
     def getAllVolumes(self):
         pass
 
+    @recorded
+    def refreshImageVolumes(self, imgUUID):
+        pass
+
+    @recorded
+    def refreshVolumes(self):
+        pass
+
+    @recorded
+    def getVolsOfImage(self, imgUUID):
+        pass
+
     @recorded
     def getReservedId(self):
         pass
@@ -719,6 +731,9 @@ class DomainTestMixin(object):
         ['purgeImage', 4],
         ['getAllImages', 0],
         ['getAllVolumes', 0],
+        ['refreshImageVolumes', 1],
+        ['refreshVolumes', 0],
+        ['getVolsOfImage', 1],
         ['getReservedId', 0],
         ['acquireHostId', 2],
         ['releaseHostId', 3],
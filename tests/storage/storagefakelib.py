@@ -20,6 +20,8 @@
 import os
 import string
 import random
+import weakref
+from collections import defaultdict
 from contextlib import contextmanager
 from copy import deepcopy
 
@@ -51,6 +53,14 @@ class FakeLVM(object):
         self.pvmd = {}
         self.vgmd = {}
         self.lvmd = {}
+        self._lv_listeners = defaultdict(weakref.WeakSet)
+
+    def addLVListener(self, vgName, listener):
+        self._lv_listeners[vgName].add(listener)
+
+    def _lvs_changed(self, vgName, lvNames=None):
+        for listener in list(self._lv_listeners[vgName]):
+            listener.lvsChanged(vgName, lvNames)
 
     def createVG(self, vgName, devices, initialTag, metadataSize, force=False):
         # Convert params from MB to bytes to match other fields
@@ -92,7 +102,7 @@ class FakeLVM(object):
             self.pvmd[dev]['vg_uuid'] = vg_md['uuid']
 
     def invalidateVG(self, vgName):
-        pass
+        self._lvs_changed(vgName)
 
     def _size_param_to_bytes(self, size):
         # Size is received as a string in MB.  We need to convert it to bytes
@@ -152,6 +162,7 @@ class FakeLVM(object):
         self.vgmd[vgName]['lv_count'] = str(lv_count)
 
         self._create_lv_file(vgName, lvName, activate, size)
+        self._lvs_changed(vgName, [lvName])
 
     def activateLVs(self, vgName, lvNames):
         for lv in lvNames:
@@ -188,6 +199,7 @@ class FakeLVM(object):
         except KeyError:
             raise se.MissingTagOnLogicalVolume("%s/%s" % (vg, lv), tag)
         lv_md['tags'] += (tag,)
+        self._lvs_changed(vg, [lv])
 
     def changeLVTags(self, vg, lv, delTags=(), addTags=()):
         try:
@@ -201,6 +213,7 @@ class FakeLVM(object):
         tags |= set(addTags)
         tags -= set(delTags)
         lv_md['tags'] = tuple(tags)
+        self._lvs_changed(vg, [lv])
 
     def lvsByTag(self, vgName, tag):
         return [lv for lv in self.getLV(vgName) if tag in lv.tags]
@@ -45,6 +45,7 @@ from vdsm.storage import outOfProcess as oop
 from vdsm.storage import qemuimg
 from vdsm.storage import sd
 from vdsm.storage import volume
+from vdsm.storage import volumeindex
 from vdsm.storage.sdm import volume_artifacts
 
 
@@ -111,6 +112,7 @@ def fake_block_env(obj=None, sd_version=3):
             (blockVolume, 'lvm', lvm),
             (blockVolume, 'sdCache', fake_sdc),
             (volume_artifacts, 'lvm', lvm),
+            (volumeindex, 'lvm', lvm),
             (sd, 'storage_repository', tmpdir),
             (volume, 'sdCache', fake_sdc),
             (hsm, 'sdCache', fake_sdc),
@@ -171,6 +173,9 @@ class FakeSD(object):
     def getVersion(self):
         return self._manifest.getVersion()
 
+    def getVolumeClass(self):
+        return self._manifest.getVolumeClass()
+
     def extendVolume(self, volumeUUID, size, isShuttingDown=None):
         if self.lvm:
             self.lvm.extendLV(self._manifest.sdUUID, volumeUUID, size)
@@ -0,0 +1,582 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import glob
+import os
+import random
+import time
+import uuid
+
+import pytest
+import six
+
+from monkeypatch import MonkeyPatchScope
+from storage.storagefakelib import FakeLVM
+from testlib import VdsmTestCase
+from testlib import namedTemporaryDir
+from testlib import permutations, expandPermutations
+
+from vdsm.storage import constants as sc
+from vdsm.storage import volumeindex
+
+SD_UUID = "sd-uuid"
+SPECIAL_LVS = ("metadata", "ids", "leases", "inbox", "outbox", "master")
+FIRST_SLOT = 4
+
+
+def find_free_slot(occupied, first, size):
+    """
+    The original algorithm scanning all the occupied slots.
+    """
+    free = first
+    for offset, length in sorted(occupied):
+        if offset >= free + size:
+            break
+        free = max(free, offset + length)
+    return free
+
+
+@expandPermutations
+class TestSlotMap(VdsmTestCase):
+
+    def test_empty(self):
+        slots = volumeindex.SlotMap()
+        self.assertEqual(slots.find(FIRST_SLOT, 1), FIRST_SLOT)
+
+    def test_fill_gap(self):
+        slots = volumeindex.SlotMap()
+        for offset in (4, 5, 7, 8):
+            slots.add(offset, 1)
+        self.assertEqual(slots.find(FIRST_SLOT, 1), 6)
+        self.assertEqual(slots.find(FIRST_SLOT, 2), 9)
+        slots.add(6, 1)
+        self.assertEqual(slots.find(FIRST_SLOT, 1), 9)
+
+    def test_remove_merges_gaps(self):
+        slots = volumeindex.SlotMap()
+        for offset in range(4, 10):
+            slots.add(offset, 1)
+        slots.find(FIRST_SLOT, 1)
+        slots.remove(5, 1)
+        slots.remove(7, 1)
+        self.assertEqual(slots.find(FIRST_SLOT, 2), 10)
+        slots.remove(6, 1)
+        self.assertEqual(slots.find(FIRST_SLOT, 3), 5)
+        slots.remove(9, 1)
+        self.assertEqual(slots.occupied(), [(4, 1), (8, 1)])
+
+    def test_overlapping(self):
+        slots = volumeindex.SlotMap()
+        slots.add(4, 1)
+        slots.find(FIRST_SLOT, 1)
+        slots.add(4, 1)
+        slots.add(5, 3)
+        slots.add(6, 1)
+        self.assertEqual(slots.find(FIRST_SLOT, 1), 8)
+        slots.remove(4, 1)
+        self.assertEqual(slots.find(FIRST_SLOT, 1), 8)
+        slots.remove(5, 3)
+        self.assertEqual(slots.find(FIRST_SLOT, 1), 5)
+
+    def test_remove_missing(self):
+        slots = volumeindex.SlotMap()
+        slots.add(4, 1)
+        with self.assertRaises(KeyError):
+            slots.remove(5, 1)
+
+    @permutations([[1], [2], [3]])
+    def test_random(self, seed):
+        rnd = random.Random(seed)
+        slots = volumeindex.SlotMap()
+        occupied = []
+        for i in range(500):
+            if occupied and rnd.random() < 0.4:
+                interval = occupied.pop(rnd.randrange(len(occupied)))
+                slots.remove(*interval)
+            else:
+                size = rnd.choice((1, 1, 1, 2, 5))
+                offset = find_free_slot(occupied, FIRST_SLOT, size)
+                self.assertEqual(slots.find(FIRST_SLOT, size), offset)
+                interval = (offset, size)
+                occupied.append(interval)
+                slots.add(*interval)
+            self.assertEqual(slots.occupied(), sorted(occupied))
+
+
+class VolumeIndexEnv(object):
+
+    def __init__(self, lvm):
+        self.lvm = lvm
+        self.lvm.createVG(SD_UUID, ["pv"], "tag", 128)
+        for name in SPECIAL_LVS:
+            self.lvm.createLV(SD_UUID, name, 128)
+        self.index = volumeindex.BlockVolumeIndex(SD_UUID, SPECIAL_LVS)
+
+    def create_volume(self, name, image, parent=sc.BLANK_UUID, slot=None):
+        self.lvm.createLV(SD_UUID, name, 128)
+        if slot is None:
+            slot = self.index.free_slot(FIRST_SLOT, sc.VOLUME_MDNUMBLKS)
+        self.lvm.changeLVTags(
+            SD_UUID, name,
+            addTags=("%s%s" % (sc.TAG_PREFIX_MD, slot),
+                     "%s%s" % (sc.TAG_PREFIX_PARENT, parent),
+                     "%s%s" % (sc.TAG_PREFIX_IMAGE, image)))
+        return slot
+
+    def remove_volume(self, name):
+        del self.lvm.lvmd[(SD_UUID, name)]
+        self.index.lvsRemoved(SD_UUID, [name])
+
+
+class CountingLVM(FakeLVM):
+
+    def __init__(self, root):
+        super(CountingLVM, self).__init__(root)
+        self.lookups = 0
+
+    def getLV(self, vgName, lvName=None):
+        self.lookups += 1
+        return super(CountingLVM, self).getLV(vgName, lvName)
+
+
+def fake_index_env(tmpdir):
+    lvm = CountingLVM(tmpdir)
+    return lvm, MonkeyPatchScope([(volumeindex, "lvm", lvm)])
+
+
+@pytest.mark.skipif(six.PY3, reason="FakeLVM not compatible with python 3")
+class TestBlockVolumeIndex(VdsmTestCase):
+
+    def test_volumes(self):
+        with namedTemporaryDir() as tmpdir:
+            lvm, scope = fake_index_env(tmpdir)
+            with scope:
+                env = VolumeIndexEnv(lvm)
+                self.assertEqual(env.index.volumes(), {})
+                env.create_volume("vol1", "img1")
+                env.create_volume("vol2", "img1", parent="vol1")
+                vols = env.index.volumes()
+                self.assertEqual(
+                    vols,
+                    {"vol1": ("vol1", "img1", sc.BLANK_UUID),
+                     "vol2": ("vol2", "img1", "vol1")})
+                self.assertEqual(env.index.image_volumes("img1"),
+                                 ["vol1", "vol2"])
+
+    def test_temporary_volume(self):
+        with namedTemporaryDir() as tmpdir:
+            lvm, scope = fake_index_env(tmpdir)
+            with scope:
+                env = VolumeIndexEnv(lvm)
+                env.create_volume("vol1", "img1")
+                lvm.addtag(SD_UUID, "vol1", sc.TEMP_VOL_LVTAG)
+                self.assertEqual(env.index.volumes(), {})
+                self.assertEqual(env.index.image_volumes("img1"), ["vol1"])
+
+    def test_slots(self):
+        with namedTemporaryDir() as tmpdir:
+            lvm, scope = fake_index_env(tmpdir)
+            with scope:
+                env = VolumeIndexEnv(lvm)
+                slots = [env.create_volume("vol%d" % i, "img%d" % i)
+                         for i in range(3)]
+                self.assertEqual(slots, [4, 5, 6])
+                env.remove_volume("vol1")
+                self.assertEqual(env.index.occupied_slots(), [(4, 1), (6, 1)])
+                self.assertEqual(env.create_volume("vol3", "img3"), 5)
+                self.assertEqual(env.index.image_volumes("img1"), [])
+
+    def test_changed_tags(self):
+        with namedTemporaryDir() as tmpdir:
+            lvm, scope = fake_index_env(tmpdir)
+            with scope:
+                env = VolumeIndexEnv(lvm)
+                env.create_volume("vol1", "img1")
+                lvm.changeLVTags(
+                    SD_UUID, "vol1",
+                    delTags=(sc.TAG_PREFIX_IMAGE + "img1",),
+                    addTags=(sc.TAG_PREFIX_IMAGE + "img2",))
+                self.assertEqual(env.index.image_volumes("img1"), [])
+                self.assertEqual(env.index.image_volumes("img2"), ["vol1"])
+
+    def test_incremental_update(self):
+        with namedTemporaryDir() as tmpdir:
+            lvm, scope = fake_index_env(tmpdir)
+            with scope:
+                env = VolumeIndexEnv(lvm)
+                for i in range(10):
+                    env.create_volume("vol%d" % i, "img%d" % i)
+                env.index.volumes()
+                lvm.lookups = 0
+                env.create_volume("vol10", "img10", slot=14)
+                env.index.volumes()
+                # Only the new volume was looked up.
+                self.assertEqual(lvm.lookups, 1)
+                env.index.volumes()
+                self.assertEqual(lvm.lookups, 1)
+
+    def test_invalidate_vg(self):
+        with namedTemporaryDir() as tmpdir:
+            lvm, scope = fake_index_env(tmpdir)
+            with scope:
+                env = VolumeIndexEnv(lvm)
+                env.create_volume("vol1", "img1")
+                env.index.volumes()
+                # Simulate tags modified by another host.
+                lvm.lvmd[(SD_UUID, "vol1")]["tags"] += (
+                    sc.TAG_PREFIX_MDNUMBLKS + "2",)
+                self.assertEqual(env.index.occupied_slots(), [(4, 1)])
+                lvm.invalidateVG(SD_UUID)
+                self.assertEqual(env.index.occupied_slots(), [(4, 2)])
+
+    def test_warn_once(self):
+        with namedTemporaryDir() as tmpdir:
+            lvm, scope = fake_index_env(tmpdir)
+            log = FakeLogger()
+            with scope, MonkeyPatchScope([(volumeindex, "log", log)]):
+                env = VolumeIndexEnv(lvm)
+                lvm.createLV(SD_UUID, "untagged", 128)
+                for i in range(3):
+                    lvm.invalidateVG(SD_UUID)
+                    self.assertEqual(env.index.volumes(), {})
+                self.assertEqual(len(log.warnings), 2)
+
+
+class FakeLogger(object):
+
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, msg, *args):
+        self.warnings.append(msg % args)
+
+    def debug(self, msg, *args):
+        pass
+
+
+@pytest.mark.stress
+@pytest.mark.skipif(six.PY3, reason="FakeLVM not compatible with python 3")
+class TestBlockVolumeIndexBenchmark(VdsmTestCase):
+
+    VOLUMES = 3000
+    CREATE = 200
+
+    def test_create_volumes(self):
+        with namedTemporaryDir() as tmpdir:
+            lvm, scope = fake_index_env(tmpdir)
+            with scope:
+                env = VolumeIndexEnv(lvm)
+                for i in range(self.VOLUMES):
+                    env.create_volume("vol-%04d" % i, "img-%04d" % i,
+                                      slot=FIRST_SLOT + i)
+                env.index.volumes()
+
+                start = time.time()
+                for i in range(self.CREATE):
+                    env.create_volume("new-%04d" % i, "new-%04d" % i)
+                elapsed = time.time() - start
+
+                # The original code parsing the tags of all the lvs. Getting
+                # the lvs from the fake lvm is slow, so we do this once.
+                lvs = lvm.getLV(SD_UUID)
+                start = time.time()
+                for i in range(self.CREATE):
+                    occupied = [
+                        (e.offset, e.size) for e in
+                        (volumeindex.parse_tags(lv.tags) for lv in lvs)
+                        if e.offset is not None]
+                    find_free_slot(occupied, FIRST_SLOT, 1)
+                scan = time.time() - start
+
+        print("\n%d volumes, %d slot allocations: index %.3f seconds, "
+              "scan %.3f seconds" % (self.VOLUMES, self.CREATE, elapsed,
+                                     scan))
+
+
+class LocalOOP(object):
+    """
+    Run oop functions in the current process.
+    """
+    glob = glob
+    os = os
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FileIndexEnv(object):
+
+    def __init__(self, tmpdir, max_age=60, inotify=False):
+        self.images_dir = os.path.join(tmpdir, "images")
+        os.mkdir(self.images_dir)
+        self.oop = LocalOOP()
+        self.clock = FakeClock()
+        self.index = volumeindex.FileVolumeIndex(
+            SD_UUID, self.images_dir, max_age, inotify=inotify,
+            clock=self.clock)
+
+    def create_image(self, image, *volumes):
+        image_dir = os.path.join(self.images_dir, image)
+        if not os.path.isdir(image_dir):
+            os.mkdir(image_dir)
+        for vol in volumes:
+            for ext in ("", ".meta", ".lease"):
+                open(os.path.join(image_dir, vol + ext), "w").close()
+
+    def remove_image(self, image):
+        image_dir = os.path.join(self.images_dir, image)
+        for name in os.listdir(image_dir):
+            os.unlink(os.path.join(image_dir, name))
+        os.rmdir(image_dir)
+
+    def freeze_mtime(self, mtime=1000000000):
+        """
+        Set the images directory mtime, simulating changes keeping the
+        mtime.
+        """
+        os.utime(self.images_dir, (mtime, mtime))
+
+    def settle_mtime(self):
+        """
+        Access the index after the mtime granularity, so the index trusts
+        the images directory mtime.
+        """
+        self.clock.now += volumeindex._MTIME_GRANULARITY
+        self.images()
+
+    def images(self):
+        return self.index.images(self.oop)
+
+
+class TestFileVolumeIndex(VdsmTestCase):
+
+    def test_images(self):
+        with namedTemporaryDir() as tmpdir:
+            env = FileIndexEnv(tmpdir)
+            self.assertEqual(env.images(), {})
+            env.create_image("img1", "vol1", "vol2")
+            env.create_image("img2")
+            env.index.invalidate()
+            self.assertEqual(env.images(), {
+                "img1": frozenset(["vol1", "vol2"]),
+                "img2": frozenset(),
+            })
+
+    def test_cached(self):
+        with namedTemporaryDir() as tmpdir:
+            env = FileIndexEnv(tmpdir)
+            env.create_image("img1", "vol1")
+            env.freeze_mtime()
+            env.images()
+            # Changes in the image directory are not detected by checking
+            # the images directory.
+            env.create_image("img1", "vol2")
+            self.assertEqual(env.images(), {"img1": frozenset(["vol1"])})
+            stats = env.index.stats()
+            self.assertEqual(stats["hits"], 1)
+            self.assertEqual(stats["misses"], 1)
+            self.assertEqual(stats["rebuilds"], 1)
+            self.assertEqual(stats["hit_rate"], 0.5)
+            self.assertFalse(stats["inotify"])
+
+    def test_image_changed(self):
+        with namedTemporaryDir() as tmpdir:
+            env = FileIndexEnv(tmpdir)
+            env.create_image("img1", "vol1")
+            env.freeze_mtime()
+            env.images()
+            env.create_image("img1", "vol2")
+            env.index.image_changed("img1")
+            self.assertEqual(env.images(),
+                             {"img1": frozenset(["vol1", "vol2"])})
+            self.assertEqual(env.index.stats()["rebuilds"], 1)
+
+    def test_images_dir_changed(self):
+        with namedTemporaryDir() as tmpdir:
+            env = FileIndexEnv(tmpdir)
+            env.create_image("img1", "vol1")
+            env.create_image("img2", "vol2")
+            env.freeze_mtime()
+            env.images()
+            env.create_image("img3", "vol3")
+            env.remove_image("img2")
+            env.freeze_mtime(1000000001)
+            self.assertEqual(env.images(), {
+                "img1": frozenset(["vol1"]),
+                "img3": frozenset(["vol3"]),
+            })
+            self.assertEqual(env.index.stats()["rebuilds"], 1)
+
+    def test_recent_mtime(self):
+        with namedTemporaryDir() as tmpdir:
+            env = FileIndexEnv(tmpdir)
+            env.images()
+            # The images directory was just modified, so its mtime may not
+            # change when the next image is added.
+            env.create_image("img1", "vol1")
+            self.assertEqual(env.images(), {"img1": frozenset(["vol1"])})
+
+    def test_mtime_clock_skew(self):
+        with namedTemporaryDir() as tmpdir:
+            env = FileIndexEnv(tmpdir)
+            # The server clock is one hour behind our clock.
+            mtime = time.time() - 3600
+            env.freeze_mtime(mtime)
+            env.images()
+            # Another host adds an image in the same second.
+            env.create_image("img1", "vol1")
+            env.freeze_mtime(mtime)
+            self.assertEqual(env.images(), {"img1": frozenset(["vol1"])})
+            env.settle_mtime()
+            # The mtime can be trusted now, and is not modified.
+            os.mkdir(os.path.join(env.images_dir, "img2"))
+            env.freeze_mtime(mtime)
+            self.assertEqual(env.images(), {"img1": frozenset(["vol1"])})
+
+    def test_mtime_changed_before_settled(self):
+        with namedTemporaryDir() as tmpdir:
+            env = FileIndexEnv(tmpdir)
+            env.freeze_mtime()
+            env.images()
+            env.clock.now += 0.5
+            env.images()
+            # Another host adds an image in the same second.
+            env.create_image("img1", "vol1")
+            env.freeze_mtime()
+            env.clock.now += 0.5
+            self.assertEqual(env.images(), {"img1": frozenset(["vol1"])})
+
+    def test_max_age(self):
+        with namedTemporaryDir() as tmpdir:
+            env = FileIndexEnv(tmpdir, max_age=0)
+            env.create_image("img1", "vol1")
+            env.freeze_mtime()
+            env.images()
+            env.create_image("img1", "vol2")
+            self.assertEqual(env.images(),
+                             {"img1": frozenset(["vol1", "vol2"])})
+            self.assertEqual(env.index.stats()["rebuilds"], 2)
+
+    def test_inotify(self):
+        with namedTemporaryDir() as tmpdir:
+            env = FileIndexEnv(tmpdir, inotify=True)
+            try:
+                env.create_image("img1", "vol1")
+                env.create_image("img2", "vol2")
+                env.images()
+                env.create_image("img1", "vol3")
+                env.create_image("img3", "vol4")
+                env.remove_image("img2")
+                self.assertEqual(env.images(), {
+                    "img1": frozenset(["vol1", "vol3"]),
+                    "img3": frozenset(["vol4"]),
+                })
+                # Changes in the new image directory are watched.
+                env.create_image("img3", "vol5")
+                self.assertEqual(env.images()["img3"],
+                                 frozenset(["vol4", "vol5"]))
+                stats = env.index.stats()
+                self.assertTrue(stats["inotify"])
+                self.assertEqual(stats["rebuilds"], 1)
+            finally:
+                env.index.close()
+
+    def test_registry(self):
+        sd_uuid = str(uuid.uuid4())
+        with namedTemporaryDir() as tmpdir:
+            images_dir = os.path.join(tmpdir, "images")
+            os.mkdir(images_dir)
+            index = volumeindex.file_volume_index(sd_uuid, images_dir, 60)
+            self.assertIs(
+                volumeindex.file_volume_index(sd_uuid, images_dir, 60),
+                index)
+            image_dir = os.path.join(images_dir, "img1")
+            os.mkdir(image_dir)
+            self.assertEqual(index.images(LocalOOP()),
+                             {"img1": frozenset()})
+            open(os.path.join(image_dir, "vol1.meta"), "w").close()
+            self.assertEqual(index.images(LocalOOP()),
+                             {"img1": frozenset()})
+            volumeindex.image_changed(sd_uuid, "img1")
+            self.assertEqual(index.images(LocalOOP()),
+                             {"img1": frozenset(["vol1"])})
+
+
+@pytest.mark.stress
+@expandPermutations
+class TestFileVolumeIndexBenchmark(VdsmTestCase):
+
+    IMAGES = 20000
+    ACCESSES = 1000
+    CHANGES = 100
+
+    @permutations([[False], [True]])
+    def test_access(self, inotify):
+        with namedTemporaryDir() as tmpdir:
+            env = FileIndexEnv(tmpdir)
+            for i in range(self.IMAGES):
+                env.create_image("img-%05d" % i, "vol-%05d" % i)
+            env.freeze_mtime()
+
+            start = time.time()
+            env.index = volumeindex.FileVolumeIndex(
+                SD_UUID, env.images_dir, 60, inotify=inotify)
+            try:
+                env.images()
+                rebuild = time.time() - start
+
+                start = time.time()
+                for i in range(self.ACCESSES):
+                    env.images()
+                hit = (time.time() - start) / self.ACCESSES
+
+                start = time.time()
+                for i in range(self.CHANGES):
+                    # A volume created by this host in an existing image.
+                    env.create_image("img-%05d" % i, "new-%05d" % i)
+                    env.index.image_changed("img-%05d" % i)
+                    env.images()
+                change = (time.time() - start) / self.CHANGES
+
+                stats = env.index.stats()
+            finally:
+                env.index.close()
+
+            # The original code, scanning the entire domain.
+            pattern = os.path.join(env.images_dir, "*", "*.meta")
+            start = time.time()
+            for i in range(3):
+                env.oop.glob.glob(pattern)
+            scan = (time.time() - start) / 3
+
+        self.assertEqual(stats["rebuilds"], 1)
+        print("\n%d images, inotify=%s: rebuild %.3f seconds, hit %.6f "
+              "seconds, change %.6f seconds, scan %.3f seconds, hit rate "
+              "%.2f" % (self.IMAGES, stats["inotify"], rebuild, hit, change,
+                        scan, stats["hit_rate"]))
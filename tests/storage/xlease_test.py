@@ -309,6 +309,99 @@ class TestIndex(VdsmTestCase):
             self.assertEqual(leases[uuids[2]]["offset"],
                              xlease.USER_RESOURCE_BASE + xlease.SLOT_SIZE * 2)
 
+    def test_lookup_loaded_record(self):
+        lease_id = make_uuid()
+        recnum = xlease.MAX_RECORDS - 1
+        record = xlease.Record(lease_id, xlease.lease_offset(recnum))
+        with make_volume((recnum, record)) as vol:
+            lease = vol.lookup(lease_id)
+            self.assertEqual(lease.offset, xlease.lease_offset(recnum))
+
+    def test_lookup_duplicate_record(self):
+        lease_id = make_uuid()
+        records = [(recnum, xlease.Record(lease_id,
+                                          xlease.lease_offset(recnum)))
+                   for recnum in (7, 3)]
+        with make_volume(*records) as vol:
+            # Like a linear search, the first record is used.
+            lease = vol.lookup(lease_id)
+            self.assertEqual(lease.offset, xlease.lease_offset(3))
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_remove_duplicate_record(self):
+        lease_id = make_uuid()
+        records = [(recnum, xlease.Record(lease_id,
+                                          xlease.lease_offset(recnum)))
+                   for recnum in (3, 7)]
+        with make_volume(*records) as vol:
+            vol.remove(lease_id)
+            lease = vol.lookup(lease_id)
+            self.assertEqual(lease.offset, xlease.lease_offset(7))
+            vol.remove(lease_id)
+            with self.assertRaises(xlease.NoSuchLease):
+                vol.lookup(lease_id)
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_add_no_space(self):
+        records = [(recnum, xlease.Record(make_uuid(),
+                                          xlease.lease_offset(recnum)))
+                   for recnum in range(xlease.MAX_RECORDS)]
+        with make_volume(*records) as vol:
+            with self.assertRaises(xlease.NoSpace):
+                vol.add(make_uuid())
+            # Freeing any record makes it available again.
+            lease_id = records[42][1].resource
+            vol.remove(lease_id)
+            lease = vol.add(make_uuid())
+            self.assertEqual(lease.offset, xlease.lease_offset(42))
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_index_reloaded(self):
+        with make_volume() as vol:
+            uuids = [make_uuid() for i in range(3)]
+            for uuid in uuids:
+                vol.add(uuid)
+            vol.remove(uuids[0])
+            # A new volume must see the same state on storage.
+            file = xlease.DirectFile(vol.path)
+            with utils.closing(file):
+                vol2 = xlease.LeasesVolume(file)
+                with utils.closing(vol2):
+                    self.assertEqual(vol2.leases(), vol.leases())
+                    with self.assertRaises(xlease.NoSuchLease):
+                        vol2.lookup(uuids[0])
+                    lease = vol2.add(make_uuid())
+                    self.assertEqual(lease.offset, xlease.lease_offset(0))
+
+    @pytest.mark.slow
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_time_full_index(self):
+        # Populate all records but the last, so the last lookup and the free
+        # record are at the end of the index.
+        uuids = [make_uuid() for i in range(xlease.MAX_RECORDS - 1)]
+        records = [(recnum, xlease.Record(uuid, xlease.lease_offset(recnum)))
+                   for recnum, uuid in enumerate(uuids)]
+        with make_volume(*records) as vol:
+            count = 1000
+            start = time.time()
+            for i in range(count):
+                vol.lookup(uuids[-1])
+            elapsed = time.time() - start
+            print("%d lookups in %.6f seconds (%.6f seconds per lookup)"
+                  % (count, elapsed, elapsed / count))
+
+            count = 100
+            start = time.time()
+            for i in range(count):
+                lease_id = make_uuid()
+                vol.add(lease_id)
+                vol.remove(lease_id)
+            elapsed = time.time() - start
+            # Note: this does not include the time to create the real sanlock
+            # resource.
+            print("%d add/remove in %.6f seconds (%.6f seconds per "
+                  "add/remove)" % (count, elapsed, elapsed / count))
+
     @pytest.mark.slow
     def test_time_lookup(self):
         setup = """
@@ -491,3 +584,6 @@ def write_records(records, file):
             with utils.closing(block):
                 block.write_record(recnum, record)
                 block.dump(file)
+            # Keep the index updated, so following records in the same block
+            # are written on top of this record.
+            index.write_record(recnum, record)
@@ -18,13 +18,20 @@
 # Refer to the README and COPYING files for full details of the license
 #
 from __future__ import absolute_import
+from __future__ import print_function
 
 import json
+import time
 
 from vdsm.api import vdsmapi
+from yajsonrpc import fairqueue
 from yajsonrpc.exception import JsonRpcErrorBase
 
+from fakelib import FakeLogger
+from monkeypatch import MonkeyPatchScope
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import permutations, expandPermutations
+from testValidation import stresstest
 
 try:
     import vdsm.gluster.apiwrapper as gapi
@@ -34,6 +41,151 @@ except ImportError:
     _glusterEnabled = False
 
 
+VM_STATS = [{'vcpuCount': '1',
+             'displayInfo': [{'tlsPort': u'5900',
+                              'ipAddress': '0',
+                              'type': u'spice',
+                              'port': '-1'}],
+             'hash': '-3472228600028768455',
+             'acpiEnable': u'true',
+             'displayIp': '0',
+             'guestFQDN': '',
+             'vmId': u'f1eb5cc5-d793-46c6-b1e3-719345bfec0c',
+             'pid': '32632',
+             'cpuUsage': '2660000000',
+             'timeOffset': u'0',
+             'session': 'Unknown',
+             'displaySecurePort': u'5900',
+             'displayPort': '-1',
+             'memUsage': '0',
+             'guestIPs': '',
+             'pauseCode': 'NOERR',
+             'vcpuQuota': '-1',
+             'username': 'Unknown',
+             'kvmEnable': u'true',
+             'network': {u'vnet0': {'macAddr': u'00:1a:4a:16:01:51',
+                                    'rxDropped': '1572',
+                                    'tx': '0',
+                                    'rxErrors': '0',
+                                    'txDropped': '0',
+                                    'rx': '90',
+                                    'txErrors': '0',
+                                    'state': 'unknown',
+                                    'sampleTime': 4319358.22,
+                                    'speed': '1000',
+                                    'name': u'vnet0'}},
+             'displayType': 'qxl',
+             'cpuUser': '0.57',
+             'vmJobs': {},
+             'disks': {
+                 u'vdq': {'readLatency': '0',
+                          'writtenBytes': '0',
+                          'writeOps': '0',
+                          'apparentsize': '1073741824',
+                          'readOps': '0',
+                          'writeLatency': '0',
+                          'imageID': u'95c06337-8c23-4dfb-b0bf-a5f30bc9d33',
+                          'readBytes': '0',
+                          'flushLatency': '0',
+                          'readRate': '0.0',
+                          'truesize': '0',
+                          'writeRate': '0.0'},
+                 u'vdp': {'readLatency': '0',
+                          'writtenBytes': '0',
+                          'writeOps': '0',
+                          'apparentsize': '1073741824',
+                          'readOps': '0',
+                          'writeLatency': '0',
+                          'imageID': u'702df0bd-fff6-41eb-817b-103b23e5bd9',
+                          'readBytes': '0',
+                          'flushLatency': '0',
+                          'readRate': '0.0',
+                          'truesize': '0',
+                          'writeRate': '0.0'}},
+             'monitorResponse': '0',
+             'elapsedTime': '2560',
+             'vmType': u'kvm',
+             'cpuSys': '0.20',
+             'status': 'Up',
+             'guestCPUCount': -1,
+             'appsList': (),
+             'clientIp': '',
+             'statusTime': '4319358220',
+             'vmName': u'vm1',
+             'vcpuPeriod': 100000},
+            {'vcpuCount': '1',
+             'displayInfo': [{'tlsPort': u'5901',
+                              'ipAddress': '0',
+                              'type': u'spice',
+                              'port': '-1'}],
+             'hash': '8478318448907411309',
+             'acpiEnable': u'true',
+             'displayIp': '0',
+             'guestFQDN': '',
+             'vmId': u'7d3efc8f-405e-40cc-b512-1f8de3d6d587',
+             'pid': '32734',
+             'cpuUsage': '1220000000',
+             'timeOffset': u'0',
+             'session': 'Unknown',
+             'displaySecurePort': u'5901',
+             'displayPort': '-1',
+             'memUsage': '0',
+             'guestIPs': '',
+             'pauseCode': 'NOERR',
+             'vcpuQuota': '-1',
+             'username': 'Unknown',
+             'kvmEnable': u'true',
+             'network': {u'vnet1': {'macAddr': u'00:1a:4a:16:01:52',
+                                    'rxDropped': '0',
+                                    'tx': '7478',
+                                    'rxErrors': '0',
+                                    'txDropped': '0',
+                                    'rx': '331023',
+                                    'txErrors': '0',
+                                    'state': 'unknown',
+                                    'sampleTime': 4319358.22,
+                                    'speed': '1000',
+                                    'name': u'vnet1'}},
+             'displayType': 'qxl',
+             'cpuUser': '0.34',
+             'vmJobs': {},
+             'disks': {
+                 u'vda': {'readLatency': '0',
+                          'writtenBytes': '219136',
+                          'writeOps': '81',
+                          'apparentsize': '2621440',
+                          'readOps': '791',
+                          'writeLatency': '0',
+                          'imageID': u'e2461e60-ee91-4500-bebf-f50f2a2f644',
+                          'readBytes': '15910400',
+                          'flushLatency': '0',
+                          'readRate': '0.0',
+                          'truesize': '2564096',
+                          'writeRate': '0.0'},
+                 u'hdc': {'readLatency': '0',
+                          'writtenBytes': '0',
+                          'writeOps': '0',
+                          'apparentsize': '0',
+                          'readOps': '1',
+                          'writeLatency': '0',
+                          'readBytes': '30',
+                          'flushLatency': '0',
+                          'readRate': '0.0',
+                          'truesize': '0',
+                          'writeRate': '0.0'}},
+             'monitorResponse': '0',
+             'elapsedTime': '2541',
+             'vmType': u'kvm',
+             'cpuSys': '0.07',
+             'status': 'Up',
+             'guestCPUCount': -1,
+             'appsList': (),
+             'clientIp': '',
+             'statusTime': '4319358220',
+             'vmName': u'vm2',
+             'vcpuPeriod': 100000}]
+
+
 class SchemaWrapper(object):
 
     def __init__(self):
@@ -258,154 +410,38 @@ class DataVerificationTests(TestCaseBase):
         _schema.schema().verify_retval(
             vdsmapi.MethodRep('Host', 'getStats'), ret)
 
+    def test_host_jobs_queued(self):
+        ret = {u"0ffd3c9c-8a7e-44b2-8e34-7ab79f4d0ec3": {
+            u"id": u"0ffd3c9c-8a7e-44b2-8e34-7ab79f4d0ec3",
+            u"status": u"running",
+            u"description": u"copy_data",
+            u"job_type": u"storage",
+            u"queued": True}}
+
+        _schema.schema().verify_retval(
+            vdsmapi.MethodRep('Host', 'getJobs'), ret)
+
     def test_allvmstats(self):
-        ret = [{'vcpuCount': '1',
-                'displayInfo': [{'tlsPort': u'5900',
-                                 'ipAddress': '0',
-                                 'type': u'spice',
-                                 'port': '-1'}],
-                'hash': '-3472228600028768455',
-                'acpiEnable': u'true',
-                'displayIp': '0',
-                'guestFQDN': '',
-                'vmId': u'f1eb5cc5-d793-46c6-b1e3-719345bfec0c',
-                'pid': '32632',
-                'cpuUsage': '2660000000',
-                'timeOffset': u'0',
-                'session': 'Unknown',
-                'displaySecurePort': u'5900',
-                'displayPort': '-1',
-                'memUsage': '0',
-                'guestIPs': '',
-                'pauseCode': 'NOERR',
-                'vcpuQuota': '-1',
-                'username': 'Unknown',
-                'kvmEnable': u'true',
-                'network': {u'vnet0': {'macAddr': u'00:1a:4a:16:01:51',
-                                       'rxDropped': '1572',
-                                       'tx': '0',
-                                       'rxErrors': '0',
-                                       'txDropped': '0',
-                                       'rx': '90',
-                                       'txErrors': '0',
-                                       'state': 'unknown',
-                                       'sampleTime': 4319358.22,
-                                       'speed': '1000',
-                                       'name': u'vnet0'}},
-                'displayType': 'qxl',
-                'cpuUser': '0.57',
-                'vmJobs': {},
-                'disks': {
-                    u'vdq': {'readLatency': '0',
-                             'writtenBytes': '0',
-                             'writeOps': '0',
-                             'apparentsize': '1073741824',
-                             'readOps': '0',
-                             'writeLatency': '0',
-                             'imageID': u'95c06337-8c23-4dfb-b0bf-a5f30bc9d33',
-                             'readBytes': '0',
-                             'flushLatency': '0',
-                             'readRate': '0.0',
-                             'truesize': '0',
-                             'writeRate': '0.0'},
-                    u'vdp': {'readLatency': '0',
-                             'writtenBytes': '0',
-                             'writeOps': '0',
-                             'apparentsize': '1073741824',
-                             'readOps': '0',
-                             'writeLatency': '0',
-                             'imageID': u'702df0bd-fff6-41eb-817b-103b23e5bd9',
-                             'readBytes': '0',
-                             'flushLatency': '0',
-                             'readRate': '0.0',
-                             'truesize': '0',
-                             'writeRate': '0.0'}},
-                'monitorResponse': '0',
-                'elapsedTime': '2560',
-                'vmType': u'kvm',
-                'cpuSys': '0.20',
-                'status': 'Up',
-                'guestCPUCount': -1,
-                'appsList': (),
-                'clientIp': '',
-                'statusTime': '4319358220',
-                'vmName': u'vm1',
-                'vcpuPeriod': 100000},
-               {'vcpuCount': '1',
-                'displayInfo': [{'tlsPort': u'5901',
-                                 'ipAddress': '0',
-                                 'type': u'spice',
-                                 'port': '-1'}],
-                'hash': '8478318448907411309',
-                'acpiEnable': u'true',
-                'displayIp': '0',
-                'guestFQDN': '',
-                'vmId': u'7d3efc8f-405e-40cc-b512-1f8de3d6d587',
-                'pid': '32734',
-                'cpuUsage': '1220000000',
-                'timeOffset': u'0',
-                'session': 'Unknown',
-                'displaySecurePort': u'5901',
-                'displayPort': '-1',
-                'memUsage': '0',
-                'guestIPs': '',
-                'pauseCode': 'NOERR',
-                'vcpuQuota': '-1',
-                'username': 'Unknown',
-                'kvmEnable': u'true',
-                'network': {u'vnet1': {'macAddr': u'00:1a:4a:16:01:52',
-                                       'rxDropped': '0',
-                                       'tx': '7478',
-                                       'rxErrors': '0',
-                                       'txDropped': '0',
-                                       'rx': '331023',
-                                       'txErrors': '0',
-                                       'state': 'unknown',
-                                       'sampleTime': 4319358.22,
-                                       'speed': '1000',
-                                       'name': u'vnet1'}},
-                'displayType': 'qxl',
-                'cpuUser': '0.34',
-                'vmJobs': {},
-                'disks': {
-                    u'vda': {'readLatency': '0',
-                             'writtenBytes': '219136',
-                             'writeOps': '81',
-                             'apparentsize': '2621440',
-                             'readOps': '791',
-                             'writeLatency': '0',
-                             'imageID': u'e2461e60-ee91-4500-bebf-f50f2a2f644',
-                             'readBytes': '15910400',
-                             'flushLatency': '0',
-                             'readRate': '0.0',
-                             'truesize': '2564096',
-                             'writeRate': '0.0'},
-                    u'hdc': {'readLatency': '0',
-                             'writtenBytes': '0',
-                             'writeOps': '0',
-                             'apparentsize': '0',
-                             'readOps': '1',
-                             'writeLatency': '0',
-                             'readBytes': '30',
-                             'flushLatency': '0',
-                             'readRate': '0.0',
-                             'truesize': '0',
-                             'writeRate': '0.0'}},
-                'monitorResponse': '0',
-                'elapsedTime': '2541',
-                'vmType': u'kvm',
-                'cpuSys': '0.07',
-                'status': 'Up',
-                'guestCPUCount': -1,
-                'appsList': (),
-                'clientIp': '',
-                'statusTime': '4319358220',
-                'vmName': u'vm2',
-                'vcpuPeriod': 100000}]
+        ret = VM_STATS
 
         _schema.schema().verify_retval(
             vdsmapi.MethodRep('Host', 'getAllVmStats'), ret)
 
+    def test_allvmstats_delta(self):
+        ret = {'generation': 1525267645123,
+               'full': False,
+               'changed': [{'vmId': u'f1eb5cc5-d793-46c6-b1e3-719345bfec0c',
+                            'cpuUser': '0.57',
+                            'elapsedTime': '106',
+                            'statusTime': '4319358220'}],
+               'removedFields': [
+                   {'vmId': u'f1eb5cc5-d793-46c6-b1e3-719345bfec0c',
+                    'fields': ['guestFQDN']}],
+               'removed': [u'c8e5d2b4-91b6-4a62-9a4d-5cfa8ae2b1f3']}
+
+        _schema.schema().verify_retval(
+            vdsmapi.MethodRep('Host', 'getAllVmStatsDelta'), ret)
+
     def test_missing_method(self):
         with self.assertRaises(vdsmapi.MethodNotFound):
             _schema.schema().get_method(
@@ -415,6 +451,14 @@ class DataVerificationTests(TestCaseBase):
         with self.assertRaises(vdsmapi.TypeNotFound):
             _schema.schema().get_type('Missing_type')
 
+    def test_method_costs(self):
+        costs = _schema.schema().get_method_costs()
+        self.assertEqual(costs['Host.ping2'], fairqueue.CHEAP)
+        self.assertEqual(costs['Volume.getInfo'], fairqueue.EXPENSIVE)
+        self.assertNotIn('Host.getCapabilities', costs)
+        for cost in costs.values():
+            self.assertIn(cost, fairqueue.COSTS)
+
     def test_events_params(self):
         params = {u"notify_time": 4303947020,
                   u"426aef82-ea1d-4442-91d3-fd876540e0f0":
@@ -635,3 +679,98 @@ class DataVerificationTests(TestCaseBase):
         complex_type = {'vmID': {'UUID': 'UUID'}}
         self.assertEqual(_schema.schema().get_args_dict(
             'VM', 'getStats'), json.dumps(complex_type, indent=4))
+
+
+@expandPermutations
+class VerifyRatioTests(TestCaseBase):
+
+    # Missing required parameter vmID.
+    REP = vdsmapi.MethodRep('VM', 'getStats')
+    ARGS = {}
+
+    @permutations([
+        # verify_ratio, calls, verified
+        (1, 6, 6),
+        (3, 6, 2),
+        (0, 6, 0),
+    ])
+    def test_args(self, verify_ratio, calls, verified):
+        log = FakeLogger()
+        schema = vdsmapi.Schema([vdsmapi.find_schema()], False,
+                                verify_ratio=verify_ratio)
+        with MonkeyPatchScope([(vdsmapi, '_log_devel', log)]):
+            for i in range(calls):
+                schema.verify_args(self.REP, self.ARGS)
+        self.assertEqual(len(log.messages), verified)
+
+    def test_args_and_retval(self):
+        log = FakeLogger()
+        schema = vdsmapi.Schema([vdsmapi.find_schema()], False,
+                                verify_ratio=2)
+        with MonkeyPatchScope([(vdsmapi, '_log_devel', log)]):
+            for i in range(4):
+                schema.verify_args(self.REP, self.ARGS)
+                schema.verify_retval(self.REP, [{'bogus': 1}])
+        messages = [m for _, m, _ in log.messages]
+        self.assertEqual(len([m for m in messages if 'vmID' in m]), 2)
+        self.assertEqual(len([m for m in messages if 'bogus' in m]), 2)
+
+    def test_strict_mode_verifies_all_calls(self):
+        schema = vdsmapi.Schema([vdsmapi.find_schema()], True,
+                                verify_ratio=0)
+        with self.assertRaises(JsonRpcErrorBase):
+            schema.verify_args(self.REP, self.ARGS)
+
+    def test_cached_arg_names(self):
+        schema = _schema.schema()
+        rep = vdsmapi.MethodRep('VM', 'create')
+        self.assertEqual(schema.get_arg_names(rep), ('vmID', 'vmParams'))
+        self.assertIs(schema.get_arg_names(rep), schema.get_arg_names(rep))
+
+
+class VerificationBenchmark(TestCaseBase):
+
+    CALLS = 1000
+    VMS = 300
+    VMS_CALLS = 20
+
+    @stresstest
+    def test_small_call(self):
+        schema = _schema.schema()
+        rep = vdsmapi.MethodRep('VM', 'getStats')
+        args = {'vmID': u'f1eb5cc5-d793-46c6-b1e3-719345bfec0c'}
+        ret = VM_STATS[:1]
+        start = time.time()
+        for i in range(self.CALLS):
+            schema.verify_args(rep, args)
+            schema.verify_retval(rep, ret)
+        elapsed = time.time() - start
+        print("\nVM.getStats: %.3f msec per call" %
+              (elapsed / self.CALLS * 1000))
+
+    @stresstest
+    def test_allvmstats(self):
+        schema = _schema.schema()
+        rep = vdsmapi.MethodRep('Host', 'getAllVmStats')
+        ret = VM_STATS * (self.VMS // len(VM_STATS))
+        start = time.time()
+        for i in range(self.VMS_CALLS):
+            schema.verify_args(rep, {})
+            schema.verify_retval(rep, ret)
+        elapsed = time.time() - start
+        print("\nHost.getAllVmStats (%d vms): %.3f msec per call" %
+              (self.VMS, elapsed / self.VMS_CALLS * 1000))
+
+    @stresstest
+    def test_allvmstats_sampling(self):
+        schema = vdsmapi.Schema([vdsmapi.find_schema()], False,
+                                verify_ratio=10)
+        rep = vdsmapi.MethodRep('Host', 'getAllVmStats')
+        ret = VM_STATS * (self.VMS // len(VM_STATS))
+        start = time.time()
+        for i in range(self.VMS_CALLS):
+            schema.verify_args(rep, {})
+            schema.verify_retval(rep, ret)
+        elapsed = time.time() - start
+        print("\nHost.getAllVmStats (%d vms, verify_ratio=10): %.3f msec "
+              "per call" % (self.VMS, elapsed / self.VMS_CALLS * 1000))
@@ -22,6 +22,7 @@ from contextlib import contextmanager
 import itertools
 import random
 import threading
+import time
 
 import six
 
@@ -29,12 +30,15 @@ from vdsm.network import ipwrapper
 from vdsm.virt import sampling
 from vdsm import numa
 
+from monkeypatch import MonkeyPatch
 from monkeypatch import MonkeyPatchScope
 
 from testValidation import ValidateRunningAsRoot
+from testValidation import stresstest
 from testlib import permutations, expandPermutations
 from testlib import VdsmTestCase as TestCaseBase
 from network.nettestlib import dummy_device
+from network.nettestlib import dummy_devices
 
 
 @expandPermutations
@@ -344,6 +348,125 @@ class InterfaceSampleTests(TestCaseBase):
                 self.assertNotIn(self.NEW_VLAN, interfaces_and_samples)
 
 
+class FakeLink(object):
+
+    def __init__(self, name, bond=False, vlan=False):
+        self.name = name
+        self._bond = bond
+        self._vlan = vlan
+
+    def isBOND(self):
+        return self._bond
+
+    def isVLAN(self):
+        return self._vlan
+
+
+class LinkSamplerTests(TestCaseBase):
+
+    def setUp(self):
+        self.speed_calls = []
+
+    def fake_speed(self, link):
+        self.speed_calls.append(link.name)
+        return 1000
+
+    def sample(self, sampler):
+        with MonkeyPatchScope([(sampling, '_getLinkSpeed', self.fake_speed)]):
+            return sampler.sample()
+
+    @MonkeyPatch(ipwrapper, 'getDpdkLinks', lambda: iter([]))
+    def test_same_as_sysfs(self):
+        sampler = sampling.LinkSampler()
+        nl_sample = sampler.sample()['lo']
+        sysfs_sample = sampling.InterfaceSample(ipwrapper.getLink('lo'))
+        self.assertEqual(nl_sample.operstate, sysfs_sample.operstate)
+        self.assertEqual(nl_sample.speed, sysfs_sample.speed)
+        self.assertEqual(nl_sample.duplex, sysfs_sample.duplex)
+        # Counters can only grow between the samples.
+        for name in ('rx', 'tx', 'rxDropped', 'txDropped', 'rxErrors',
+                     'txErrors'):
+            self.assertLessEqual(getattr(nl_sample, name),
+                                 getattr(sysfs_sample, name))
+
+    @MonkeyPatch(ipwrapper, 'getDpdkLinks', lambda: iter([]))
+    def test_same_links(self):
+        sampler = sampling.LinkSampler()
+        self.assertEqual(set(sampler.sample()),
+                         set(sampling._get_interfaces_and_samples()))
+
+    @MonkeyPatch(ipwrapper, 'getDpdkLinks', lambda: iter([]))
+    def test_not_monitoring(self):
+        sampler = sampling.LinkSampler()
+        self.sample(sampler)
+        self.sample(sampler)
+        self.assertEqual(self.speed_calls.count('lo'), 2)
+
+    @MonkeyPatch(ipwrapper, 'getDpdkLinks', lambda: iter([]))
+    def test_cached(self):
+        sampler = sampling.LinkSampler()
+        sampler._monitoring = True
+        first = self.sample(sampler)
+        second = self.sample(sampler)
+        self.assertEqual(self.speed_calls.count('lo'), 1)
+        self.assertEqual(second['lo'].speed, first['lo'].speed)
+
+    @MonkeyPatch(ipwrapper, 'getDpdkLinks', lambda: iter([]))
+    def test_invalidate(self):
+        sampler = sampling.LinkSampler()
+        sampler._monitoring = True
+        self.sample(sampler)
+        sampler.invalidate('lo')
+        self.sample(sampler)
+        self.assertEqual(self.speed_calls.count('lo'), 2)
+
+    def test_invalidate_bonds_and_vlans(self):
+        sampler = sampling.LinkSampler()
+        for link in (FakeLink('eth0'), FakeLink('eth1'),
+                     FakeLink('bond0', bond=True),
+                     FakeLink('eth1.1', vlan=True)):
+            sampler._cache[link.name] = sampling._LinkEntry(
+                1, link, 1000, 'full')
+        sampler.invalidate('eth0')
+        self.assertEqual(list(sampler._cache), ['eth1'])
+
+    def test_monitor(self):
+        sampler = sampling.LinkSampler()
+        sampler.start()
+        try:
+            self.assertTrue(sampler._monitoring)
+        finally:
+            sampler.stop()
+
+        def assert_stopped():
+            self.assertFalse(sampler._monitoring)
+
+        self.retryAssert(assert_stopped, timeout=5)
+
+    @stresstest
+    @ValidateRunningAsRoot
+    def test_benchmark(self):
+        sampler = sampling.LinkSampler()
+        sampler.start()
+        try:
+            with dummy_devices(1000):
+                # Fill the cache.
+                self.assertGreaterEqual(len(sampler.sample()), 1000)
+
+                start = time.time()
+                sampling._get_interfaces_and_samples()
+                sysfs_time = time.time() - start
+
+                start = time.time()
+                sampler.sample()
+                netlink_time = time.time() - start
+        finally:
+            sampler.stop()
+
+        print("\n1000 links: sysfs %.3f seconds, netlink %.3f seconds" % (
+              sysfs_time, netlink_time))
+
+
 @contextmanager
 def vlan(name, link, vlan_id):
     ipwrapper.linkAdd(name, 'vlan', link=link, args=['id', str(vlan_id)])
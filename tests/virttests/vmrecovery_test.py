@@ -21,13 +21,17 @@ from __future__ import absolute_import
 
 import contextlib
 import os
+import tempfile
 import threading
+import time
+import uuid
 
 from vdsm.common import cpuarch
 from vdsm.common import libvirtconnection
 from vdsm.common import response
 from vdsm.common.compat import pickle
 from vdsm.virt import recovery
+from vdsm.virt.domain_descriptor import DomainDescriptor
 from vdsm.virt import vmstatus
 from vdsm import constants
 from vdsm import containersconnection
@@ -37,6 +41,7 @@ from monkeypatch import MonkeyPatchScope
 from testlib import VdsmTestCase as TestCaseBase
 from testlib import namedTemporaryDir
 from testlib import permutations, expandPermutations
+from testValidation import stresstest
 from vmTestsData import CONF_TO_DOMXML_X86_64
 from vmTestsData import CONF_TO_DOMXML_PPC64
 from vmTestsData import CONF_TO_DOMXML_NO_VDSM
@@ -61,7 +66,8 @@ class RecoveryFileTests(TestCaseBase):
             rec.save(testvm)
 
             with open(os.path.join(tmpdir, rec.name), 'rb') as f:
-                self.assertTrue(pickle.load(f))
+                self.assertTrue(f.read().startswith(recovery.File.MAGIC))
+            self.assertTrue(rec._read())
 
     def test_save_after_cleanup(self):
 
@@ -105,6 +111,19 @@ class RecoveryFileTests(TestCaseBase):
             self.assertEqual(fakecif.vmContainer, {})
             self.assertEqual(fakecif.vmRequests, {})
 
+    def test_load_legacy_pickle(self):
+
+        with self.setup_env() as (testvm, tmpdir):
+            path = os.path.join(tmpdir, recovery.File(testvm.id).name)
+            with open(path, 'wb') as f:
+                pickle.dump(testvm.status(), f)
+
+            loaded = recovery.File(testvm.id)
+            fakecif = fake.ClientIF()
+            self.assertTrue(loaded.load(fakecif))
+
+            self.assertVmStatus(testvm, fakecif.vmRequests[testvm.id][0])
+
     def test_cleanup(self):
 
         with self.setup_env() as (testvm, tmpdir):
@@ -147,6 +166,148 @@ class RecoveryFileTests(TestCaseBase):
                 yield testvm, tmpdir
 
 
+def _vm_state(vm_id, xml_size=10 * 1024):
+    return {
+        'vmId': vm_id,
+        'status': 'Up',
+        'statusTime': '4296118930',
+        'xml': '<domain>%s</domain>' % ('x' * xml_size),
+        'devices': [{'type': 'disk', 'device': 'disk', 'index': i,
+                     'path': '/rhev/data-center/mnt/sd/images/%d/vol' % i}
+                    for i in range(4)],
+        '_blockJobs': {},
+        'username': 'user',
+        'guestIPs': '10.0.0.1',
+        'guestFQDN': 'vm.example.com',
+    }
+
+
+class RecoveryStoreTests(TestCaseBase):
+
+    def setUp(self):
+        self.vm_id = str(uuid.uuid4())
+
+    def test_roundtrip(self):
+        with self.setup_env():
+            state = _vm_state(self.vm_id)
+            recovery.File(self.vm_id)._write(state)
+            self.assertEqual(recovery.File(self.vm_id)._read(), state)
+
+    def test_write_changed_sections(self):
+        with self.setup_env() as tmpdir:
+            rec = recovery.File(self.vm_id)
+            path = os.path.join(tmpdir, rec.name)
+            state = _vm_state(self.vm_id)
+            rec._write(state)
+            size = os.path.getsize(path)
+
+            # Nothing changed.
+            rec._write(_vm_state(self.vm_id))
+            self.assertEqual(os.path.getsize(path), size)
+
+            # Only the guest section is appended, not the xml.
+            state['guestIPs'] = '10.0.0.2'
+            rec._write(state)
+            self.assertLess(os.path.getsize(path) - size, 1024)
+            self.assertEqual(recovery.File(self.vm_id)._read(), state)
+
+    def test_compact(self):
+        with self.setup_env() as tmpdir:
+            rec = recovery.File(self.vm_id)
+            rec.COMPACT_RECORDS = 10
+            path = os.path.join(tmpdir, rec.name)
+            state = _vm_state(self.vm_id)
+            rec._write(state)
+            size = os.path.getsize(path)
+            for i in range(50):
+                state['statusTime'] = str(i)
+                rec._write(state)
+                self.assertLessEqual(rec._records, rec.COMPACT_RECORDS)
+            self.assertLess(os.path.getsize(path), size + 1024)
+            self.assertEqual(recovery.File(self.vm_id)._read(), state)
+
+    def test_rewrite_legacy_file(self):
+        with self.setup_env() as tmpdir:
+            rec = recovery.File(self.vm_id)
+            path = os.path.join(tmpdir, rec.name)
+            with open(path, 'wb') as f:
+                pickle.dump({'vmId': self.vm_id}, f)
+            state = _vm_state(self.vm_id)
+            rec._write(state)
+            with open(path, 'rb') as f:
+                self.assertTrue(f.read().startswith(recovery.File.MAGIC))
+            self.assertEqual(recovery.File(self.vm_id)._read(), state)
+
+    def test_truncated_record(self):
+        with self.setup_env() as tmpdir:
+            rec = recovery.File(self.vm_id)
+            path = os.path.join(tmpdir, rec.name)
+            state = _vm_state(self.vm_id)
+            rec._write(state)
+            size = os.path.getsize(path)
+            state['xml'] = '<domain>modified</domain>'
+            rec._write(state)
+            with open(path, 'r+b') as f:
+                f.truncate(size + 10)
+            state['xml'] = _vm_state(self.vm_id)['xml']
+            self.assertEqual(recovery.File(self.vm_id)._read(), state)
+
+    def test_read_libvirt_xml(self):
+        with self.setup_env():
+            state = _vm_state(self.vm_id)
+            recovery.File(self.vm_id)._write(state)
+            params = recovery.File(self.vm_id)._read('<domain/>')
+            self.assertEqual(params['xml'], '<domain/>')
+
+    def test_read_libvirt_xml_no_xml_section(self):
+        with self.setup_env():
+            state = _vm_state(self.vm_id)
+            del state['xml']
+            recovery.File(self.vm_id)._write(state)
+            params = recovery.File(self.vm_id)._read('<domain/>')
+            self.assertNotIn('xml', params)
+
+    @stresstest
+    def test_benchmark(self):
+        count = 500
+        vm_ids = [str(uuid.uuid4()) for i in range(count)]
+        states = [_vm_state(vm_id) for vm_id in vm_ids]
+        with self.setup_env() as tmpdir:
+            files = [recovery.File(vm_id) for vm_id in vm_ids]
+            for rec, state in zip(files, states):
+                rec._write(state)
+
+            start = time.time()
+            for rec, state in zip(files, states):
+                state['statusTime'] = str(int(state['statusTime']) + 1)
+                rec._write(state)
+            save_time = time.time() - start
+
+            start = time.time()
+            for vm_id in vm_ids:
+                recovery.File(vm_id)._read('<domain/>')
+            load_time = time.time() - start
+
+            # Previous format: pickle of the entire state.
+            start = time.time()
+            for state in states:
+                with tempfile.NamedTemporaryFile(dir=tmpdir,
+                                                 delete=False) as f:
+                    pickle.dump(state, f)
+                os.rename(f.name, os.path.join(tmpdir, 'legacy'))
+            legacy_save_time = time.time() - start
+
+        print("\n%d vms: save %.3f seconds (legacy %.3f seconds), "
+              "load %.3f seconds" % (count, save_time, legacy_save_time,
+                                     load_time))
+
+    @contextlib.contextmanager
+    def setup_env(self):
+        with namedTemporaryDir() as tmpdir:
+            with MonkeyPatchScope([(constants, 'P_VDSM_RUN', tmpdir)]):
+                yield tmpdir
+
+
 class FakeConnection(object):
 
     CONFS = {
@@ -219,6 +380,179 @@ class RecoveryAllVmsTests(TestCaseBase):
                 self.assertEqual(fakecif.vmContainer, {})
 
 
+class ManyDomainsConnection(object):
+
+    def __init__(self, count):
+        conf, raw_xml = CONF_TO_DOMXML_X86_64[0]
+        self.domains = []
+        for i in range(count):
+            conf = dict(conf, vmId=str(uuid.uuid4()))
+            self.domains.append(fake.Domain(raw_xml % conf,
+                                            vmId=conf['vmId']))
+
+    def listAllDomains(self):
+        return iter(self.domains)
+
+
+class RecordingClientIF(fake.ClientIF):
+
+    def __init__(self):
+        super(RecordingClientIF, self).__init__()
+        self.created = []
+        self.running = 0
+        self.max_running = 0
+
+    def createVm(self, vmParams, vmRecover=False):
+        with self.vmContainerLock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            vm_id = DomainDescriptor(vmParams['xml']).id
+            self.created.append((vm_id, vmRecover))
+        finally:
+            with self.vmContainerLock:
+                self.running -= 1
+        return response.success(vmList={})
+
+
+class RecoveryPipelineTests(TestCaseBase):
+
+    def test_all_domains(self):
+        conn = ManyDomainsConnection(50)
+        cif = RecordingClientIF()
+        timings = recovery.Timings()
+        with MonkeyPatchScope([
+            (libvirtconnection, 'get', lambda: conn),
+            (containersconnection, 'recovery', lambda: []),
+        ]):
+            recovery.all_domains(cif, timings)
+
+        # Created in libvirt order, one at a time.
+        expected = [(dom.UUIDString(), True) for dom in conn.domains]
+        self.assertEqual(cif.created, expected)
+        self.assertEqual(cif.max_running, 1)
+        self.assertEqual([name for name, _ in timings._phases],
+                         ['list', 'parse', 'create'])
+
+    def test_parse_error(self):
+        conn = ManyDomainsConnection(3)
+        bad_id = conn.domains[1].UUIDString()
+        recovery_params = recovery._recovery_params
+
+        def fail_parse(vm_id, dom_xml, external):
+            if vm_id == bad_id:
+                raise RuntimeError("fake error")
+            return recovery_params(vm_id, dom_xml, external)
+
+        cif = RecordingClientIF()
+        with MonkeyPatchScope([
+            (libvirtconnection, 'get', lambda: conn),
+            (containersconnection, 'recovery', lambda: []),
+            (recovery, '_recovery_params', fail_parse),
+        ]):
+            recovery.all_domains(cif)
+
+        # The domain that could not be parsed is not recovered.
+        expected = [(dom.UUIDString(), True) for dom in conn.domains
+                    if dom.UUIDString() != bad_id]
+        self.assertEqual(cif.created, expected)
+
+    def test_timings(self):
+        clock = FakeClock()
+        timings = recovery.Timings(clock=clock)
+        with timings.phase('list'):
+            clock.now += 1.5
+        with timings.phase('create'):
+            clock.now += 0.25
+        self.assertEqual(str(timings), "list: 1.50s, create: 0.25s")
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDrive(object):
+
+    def __init__(self, domainID=None):
+        if domainID is not None:
+            self.domainID = domainID
+            self.imageID = self.poolID = self.volumeID = 'id'
+
+    def __contains__(self, attr):
+        return hasattr(self, attr)
+
+
+class FakePreparingVm(object):
+
+    def __init__(self, vm_id, sd_id, prepared):
+        self.id = vm_id
+        self.sd_id = sd_id
+        self._prepared = prepared
+
+    def getDiskDevices(self):
+        return [FakeDrive(), FakeDrive(self.sd_id)]
+
+    def preparePaths(self):
+        self._prepared.start(self)
+        time.sleep(0.05)
+        self._prepared.done(self)
+
+
+class PrepareRecorder(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prepared = []
+        self.running = {}
+        self.max_running = 0
+
+    def start(self, vm):
+        with self.lock:
+            self.running.setdefault(vm.sd_id, []).append(vm.id)
+            self.max_running = max(self.max_running,
+                                   sum(len(v) for v in self.running.values()))
+            if len(self.running[vm.sd_id]) > 1:
+                raise AssertionError("concurrent prepare on %s" % vm.sd_id)
+
+    def done(self, vm):
+        with self.lock:
+            self.running[vm.sd_id].remove(vm.id)
+            self.prepared.append(vm.id)
+
+
+class PreparePathsTests(TestCaseBase):
+
+    def test_group_by_storage_domain(self):
+        recorder = PrepareRecorder()
+        vms = [FakePreparingVm(i, 'sd-%d' % (i % 2), recorder)
+               for i in range(4)]
+        vms.append(FakePreparingVm(4, None, recorder))
+        groups = recovery.group_by_storage_domain(vms)
+        self.assertEqual(sorted([vm.id for vm in group] for group in groups),
+                         [[0, 2], [1, 3], [4]])
+
+    def test_prepare_paths(self):
+        recorder = PrepareRecorder()
+        vms = [FakePreparingVm(i, 'sd-%d' % (i % 4), recorder)
+               for i in range(12)]
+        cif = fake.ClientIF()
+        recovery.prepare_paths(cif, vms)
+        self.assertEqual(sorted(recorder.prepared), list(range(12)))
+        # Different storage domains were prepared concurrently.
+        self.assertGreater(recorder.max_running, 1)
+
+    def test_prepare_paths_disabled(self):
+        recorder = PrepareRecorder()
+        vms = [FakePreparingVm(i, 'sd', recorder) for i in range(3)]
+        recovery.prepare_paths(fake.ClientIF(), vms, enabled=lambda: False)
+        self.assertEqual(recorder.prepared, [])
+
+
 class VmRecoveryTests(TestCaseBase):
 
     def test_exception(self):
@@ -18,18 +18,24 @@
 # Refer to the README and COPYING files for full details of the license
 #
 from __future__ import absolute_import
+from __future__ import print_function
 
 import copy
 import logging
+import time
 import uuid
 
 import six
 
+from vdsm import metrics
+from vdsm.metrics import registry
 from vdsm.virt import vmstats
+from vdsm.virt.sampling import StatsSample
 
 from fakelib import FakeLogger
 from testlib import VdsmTestCase as TestCaseBase
 from testlib import permutations, expandPermutations
+from testValidation import stresstest
 from monkeypatch import MonkeyPatchScope
 
 
@@ -594,8 +600,187 @@ class BalloonStatsTests(VmStatsTestCase):
         self.assertIn('balloon.current', log.messages[0][1])
 
 
+@expandPermutations
+class ProduceBatchTests(VmStatsTestCase):
+
+    def setUp(self):
+        super(ProduceBatchTests, self).setUp()
+        self.first, self.last = self.samples
+        self.vm = FakeVM(
+            nics=(FakeNic(name='vnet0', model='virtio',
+                          mac_addr='00:1a:4a:16:01:51',
+                          is_hostdevice=False),
+                  FakeNic(name='vnet1', model='e1000',
+                          mac_addr='00:1a:4a:16:01:52',
+                          is_hostdevice=False)),
+            drives=(FakeDrive(name='hdc', size=700 * 1024 * 1024),
+                    FakeDrive(name='vda', size=1024 * 1024 * 1024)))
+
+    @permutations([[10], [0]])
+    def test_same_as_produce(self, interval):
+        expected = vmstats.produce(self.vm, self.first, self.last, interval)
+        batch = vmstats.produce_batch(
+            {self.vm.id: self.vm},
+            {self.vm.id: StatsSample(self.first, self.last, interval, 0)})
+        self.assertEqual(_drop_sample_time(batch[self.vm.id]),
+                         _drop_sample_time(expected))
+
+    def test_same_as_produce_missing_samples(self):
+        expected = vmstats.produce(self.vm, None, None, None)
+        batch = vmstats.produce_batch(
+            {self.vm.id: self.vm},
+            {self.vm.id: StatsSample(None, None, None, 0)})
+        self.assertEqual(batch[self.vm.id], expected)
+
+    def test_unknown_vm(self):
+        batch = vmstats.produce_batch(
+            {},
+            {self.vm.id: StatsSample(self.first, self.last, 10, 0)})
+        self.assertEqual(batch, {})
+
+    def test_many_vms(self):
+        vms = {}
+        samples = {}
+        for i in range(10):
+            vm = FakeVM(nics=self.vm.nics, drives=self.vm.drives)
+            vms[vm.id] = vm
+            samples[vm.id] = StatsSample(self.first, self.last, 10, 0)
+        batch = vmstats.produce_batch(vms, samples)
+        expected = _drop_sample_time(
+            vmstats.produce(self.vm, self.first, self.last, 10))
+        self.assertEqual(sorted(batch), sorted(vms))
+        for vm_id, stats in six.iteritems(batch):
+            self.assertEqual(_drop_sample_time(stats), expected)
+
+
+class SendMetricsTests(VmStatsTestCase):
+
+    def setUp(self):
+        super(SendMetricsTests, self).setUp()
+        self.first, self.last = self.samples
+        self.vm = FakeVM(
+            nics=(FakeNic(name='vnet0', model='virtio',
+                          mac_addr='00:1a:4a:16:01:51',
+                          is_hostdevice=False),),
+            drives=(FakeDrive(name='vda', size=1024 * 1024 * 1024),))
+        self.registry = registry.Registry()
+
+    def send_metrics(self, names):
+        vms_stats = {}
+        for name in names:
+            stats = vmstats.produce(self.vm, self.first, self.last, 10)
+            stats['vmName'] = name
+            vms_stats[name] = stats
+        with MonkeyPatchScope([(metrics, '_registry', self.registry),
+                               (vmstats, '_vm_metrics', self.vm_metrics)]):
+            vmstats.send_metrics(vms_stats)
+
+    def test_send(self):
+        self.vm_metrics = {}
+        self.send_metrics(['vm-1'])
+        names = sorted(g.name for g in self.registry.pending())
+        self.assertIn('vms.vm-1.cpu.user', names)
+        self.assertIn('vms.vm-1.disk.vda.read_ops', names)
+        self.assertIn('vms.vm-1.nic.vnet0.rx_bytes', names)
+        self.assertEqual(len(names), 3 + 4 + 11 + 7)
+
+    def test_reuse_handles(self):
+        self.vm_metrics = {}
+        self.send_metrics(['vm-1'])
+        gauges = self.registry.gauges()
+        self.send_metrics(['vm-1'])
+        self.assertEqual(sorted(self.registry.gauges(), key=id),
+                         sorted(gauges, key=id))
+
+    def test_remove_stopped_vm(self):
+        self.vm_metrics = {}
+        self.send_metrics(['vm-1', 'vm-2'])
+        self.registry.pending()
+        self.send_metrics(['vm-2'])
+        removed = [g.name for g in self.registry.pending() if g.removed]
+        self.assertEqual(len(removed), 3 + 4 + 11 + 7)
+        self.assertTrue(all(name.startswith('vms.vm-1.')
+                            for name in removed))
+        self.assertEqual(list(self.vm_metrics), ['vm-2'])
+
+
+class ProduceBatchBenchmark(TestCaseBase):
+
+    VMS = 500
+    DISKS = 8
+    NICS = 4
+
+    @stresstest
+    def test_benchmark(self):
+        vms = {}
+        samples = {}
+        for i in range(self.VMS):
+            vm = FakeVM(
+                nics=[FakeNic(name='vnet%d' % (i * self.NICS + n),
+                              model='virtio',
+                              mac_addr='00:1a:4a:16:01:%02x' % n,
+                              is_hostdevice=False)
+                      for n in range(self.NICS)],
+                drives=[FakeDrive(name='vd%s' % chr(ord('a') + d),
+                                  size=1024 * 1024 * 1024)
+                        for d in range(self.DISKS)])
+            vms[vm.id] = vm
+            samples[vm.id] = StatsSample(
+                _fake_sample(vm, 0), _fake_sample(vm, 1), 15, 0)
+
+        start = time.time()
+        for vm_id, sample in six.iteritems(samples):
+            vmstats.produce(vms[vm_id], sample.first_value,
+                            sample.last_value, sample.interval)
+        produce_time = time.time() - start
+
+        start = time.time()
+        vmstats.produce_batch(vms, samples)
+        batch_time = time.time() - start
+
+        print("\n%d vms, %d disks, %d nics: produce %.3f seconds, "
+              "produce_batch %.3f seconds" % (
+                  self.VMS, self.DISKS, self.NICS, produce_time,
+                  batch_time))
+
+
 # helpers
 
+def _drop_sample_time(stats):
+    stats = copy.deepcopy(stats)
+    for if_stats in six.itervalues(stats.get('network', {})):
+        del if_stats['sampleTime']
+    return stats
+
+
+def _fake_sample(vm, n):
+    """
+    Return bulk stats sample for vm, `n' is the sample number.
+    """
+    sample = {
+        'cpu.time': 13755069120 + n * 10 ** 9,
+        'cpu.user': 3370000000 + n * 10 ** 8,
+        'cpu.system': 6320000000 + n * 10 ** 8,
+        'balloon.current': 4194304,
+        'balloon.available': 4194304,
+        'balloon.unused': 1048576,
+        'vcpu.current': 2,
+        'net.count': len(vm.nics),
+        'block.count': len(vm.drives),
+    }
+    for i, nic in enumerate(vm.nics):
+        sample['net.%d.name' % i] = nic.name
+        for field in ('rx.bytes', 'rx.pkts', 'rx.errs', 'rx.drop',
+                      'tx.bytes', 'tx.pkts', 'tx.errs', 'tx.drop'):
+            sample['net.%d.%s' % (i, field)] = n * 1024
+    for i, drive in enumerate(vm.drives):
+        sample['block.%d.name' % i] = drive.name
+        for field in ('rd.reqs', 'rd.bytes', 'rd.times', 'wr.reqs',
+                      'wr.bytes', 'wr.times', 'fl.reqs', 'fl.times'):
+            sample['block.%d.%s' % (i, field)] = n * 4096
+    return sample
+
+
 def _ensure_delta(stats_before, stats_after, key, delta):
     """
     Set stats_before[key] and stats_after[key] so that
@@ -625,6 +810,7 @@ class FakeDrive(object):
         self.domainID = str(uuid.uuid4())
         self.poolID = str(uuid.uuid4())
         self.volumeID = str(uuid.uuid4())
+        self.iotune = {}
 
     def __contains__(self, item):
         # isVdsmImage support
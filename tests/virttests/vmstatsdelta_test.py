@@ -0,0 +1,265 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+from __future__ import print_function
+
+import copy
+import json
+import time
+
+from vdsm.virt import vmstatsdelta
+
+from testlib import VdsmTestCase
+from testValidation import stresstest
+
+
+class FakeClock(object):
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Client(object):
+    """
+    Client applying the deltas to its copy of the stats.
+    """
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.generation = 0
+        self.stats = {}
+
+    def poll(self, stats_list):
+        delta = self.tracker.update(stats_list, self.generation)
+        if delta['full']:
+            self.stats = {}
+        for changes in delta['changed']:
+            self.stats.setdefault(changes['vmId'], {}).update(changes)
+        for removed in delta['removedFields']:
+            vm_stats = self.stats[removed['vmId']]
+            for name in removed['fields']:
+                vm_stats.pop(name, None)
+        for vm_id in delta['removed']:
+            del self.stats[vm_id]
+        self.generation = delta['generation']
+        return delta
+
+
+def vm_stats(vm_id, **kw):
+    stats = {
+        'vmId': vm_id,
+        'vmName': 'vm-' + vm_id,
+        'vmType': 'kvm',
+        'kvmEnable': 'true',
+        'status': 'Up',
+        'hash': '1234',
+        'cpuUser': '0.00',
+        'disks': {'vda': {'readRate': '0.0', 'truesize': '1024'}},
+    }
+    stats.update(kw)
+    return stats
+
+
+def by_id(stats_list):
+    return {stats['vmId']: stats for stats in stats_list}
+
+
+class TrackerTests(VdsmTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tracker = vmstatsdelta.Tracker(clock=self.clock)
+
+    def test_first_call_full(self):
+        stats = [vm_stats('1'), vm_stats('2')]
+        delta = self.tracker.update(copy.deepcopy(stats), 0)
+        self.assertTrue(delta['full'])
+        self.assertEqual(by_id(delta['changed']), by_id(stats))
+        self.assertEqual(delta['removed'], [])
+        self.assertEqual(delta['removedFields'], [])
+
+    def test_no_changes(self):
+        stats = [vm_stats('1')]
+        first = self.tracker.update(copy.deepcopy(stats), 0)
+        self.clock.now += 1
+        delta = self.tracker.update(copy.deepcopy(stats),
+                                    first['generation'])
+        self.assertFalse(delta['full'])
+        self.assertEqual(delta['generation'], first['generation'])
+        self.assertEqual(delta['changed'], [])
+
+    def test_changed_fields(self):
+        first = self.tracker.update([vm_stats('1'), vm_stats('2')], 0)
+        self.clock.now += 1
+        stats = [vm_stats('1', cpuUser='1.50'), vm_stats('2')]
+        delta = self.tracker.update(stats, first['generation'])
+        self.assertFalse(delta['full'])
+        self.assertGreater(delta['generation'], first['generation'])
+        self.assertEqual(delta['changed'], [{'vmId': '1', 'cpuUser': '1.50'}])
+
+    def test_changed_nested_value(self):
+        first = self.tracker.update([vm_stats('1')], 0)
+        disks = {'vda': {'readRate': '10.0', 'truesize': '1024'}}
+        delta = self.tracker.update([vm_stats('1', disks=disks)],
+                                    first['generation'])
+        self.assertEqual(delta['changed'], [{'vmId': '1', 'disks': disks}])
+
+    def test_removed_field(self):
+        first = self.tracker.update([vm_stats('1', guestFQDN='vm1')], 0)
+        delta = self.tracker.update([vm_stats('1')], first['generation'])
+        self.assertEqual(delta['changed'], [])
+        self.assertEqual(delta['removedFields'],
+                         [{'vmId': '1', 'fields': ['guestFQDN']}])
+
+    def test_removed_field_full(self):
+        self.tracker.update([vm_stats('1', guestFQDN='vm1')], 0)
+        delta = self.tracker.update([vm_stats('1')], 0)
+        self.assertTrue(delta['full'])
+        self.assertEqual(delta['removedFields'], [])
+        self.assertEqual(delta['changed'], [vm_stats('1')])
+
+    def test_new_vm(self):
+        first = self.tracker.update([vm_stats('1')], 0)
+        delta = self.tracker.update([vm_stats('1'), vm_stats('2')],
+                                    first['generation'])
+        self.assertEqual(delta['changed'], [vm_stats('2')])
+
+    def test_removed_vm(self):
+        first = self.tracker.update([vm_stats('1'), vm_stats('2')], 0)
+        delta = self.tracker.update([vm_stats('1')], first['generation'])
+        self.assertEqual(delta['changed'], [])
+        self.assertEqual(delta['removed'], ['2'])
+        # Not reported again.
+        delta = self.tracker.update([vm_stats('1')], delta['generation'])
+        self.assertEqual(delta['removed'], [])
+
+    def test_restarted_vm(self):
+        client = Client(self.tracker)
+        client.poll([vm_stats('1'), vm_stats('2')])
+        client.poll([vm_stats('1')])
+        self.assertNotIn('2', client.stats)
+        # Same vm started again - the client needs all the fields.
+        delta = client.poll([vm_stats('1'), vm_stats('2')])
+        self.assertEqual(by_id(delta['changed'])['2'], vm_stats('2'))
+        self.assertEqual(client.stats['2'], vm_stats('2'))
+
+    def test_forgotten_removed_vms(self):
+        tracker = vmstatsdelta.Tracker(max_removed_vms=1, clock=self.clock)
+        old = tracker.update([vm_stats('1'), vm_stats('2'), vm_stats('3')],
+                             0)
+        current = tracker.update([vm_stats('1'), vm_stats('2')],
+                                 old['generation'])
+        self.assertEqual(current['removed'], ['3'])
+        # Removal of vm 3 is forgotten.
+        delta = tracker.update([vm_stats('1')], current['generation'])
+        self.assertFalse(delta['full'])
+        self.assertEqual(delta['removed'], ['2'])
+        # A client which did not see the removal of vm 3 gets all the stats.
+        delta = tracker.update([vm_stats('1')], old['generation'])
+        self.assertTrue(delta['full'])
+        self.assertEqual(delta['changed'], [vm_stats('1')])
+
+    def test_unknown_generation(self):
+        first = self.tracker.update([vm_stats('1')], 0)
+        delta = self.tracker.update([vm_stats('1')],
+                                    first['generation'] + 1)
+        self.assertTrue(delta['full'])
+        self.assertEqual(delta['changed'], [vm_stats('1')])
+
+    def test_generation_of_previous_instance(self):
+        first = self.tracker.update([vm_stats('1')], 0)
+        # vdsm restarted.
+        self.clock.now += 10
+        tracker = vmstatsdelta.Tracker(clock=self.clock)
+        delta = tracker.update([vm_stats('1')], first['generation'])
+        self.assertTrue(delta['full'])
+
+    def test_clock_going_backwards(self):
+        first = self.tracker.update([vm_stats('1')], 0)
+        self.clock.now -= 10
+        delta = self.tracker.update([vm_stats('1', cpuUser='1.0')],
+                                    first['generation'])
+        self.assertGreater(delta['generation'], first['generation'])
+        self.assertEqual(delta['changed'], [{'vmId': '1', 'cpuUser': '1.0'}])
+
+    def test_multiple_clients(self):
+        fast = Client(self.tracker)
+        slow = Client(self.tracker)
+        history = [
+            [vm_stats('1'), vm_stats('2')],
+            [vm_stats('1', cpuUser='1.0'), vm_stats('2')],
+            [vm_stats('1', cpuUser='1.0'), vm_stats('3')],
+            [vm_stats('1', cpuUser='2.0', guestFQDN='vm1'), vm_stats('3')],
+            [vm_stats('1'), vm_stats('2'), vm_stats('3', status='Paused')],
+        ]
+        slow.poll(history[0])
+        for i, stats_list in enumerate(history):
+            self.clock.now += 1
+            fast.poll(copy.deepcopy(stats_list))
+            self.assertEqual(fast.stats, by_id(stats_list))
+            if i % 2:
+                slow.poll(copy.deepcopy(stats_list))
+                self.assertEqual(slow.stats, by_id(stats_list))
+
+
+class TrackerBenchmark(VdsmTestCase):
+
+    VMS = 300
+    POLLS = 10
+
+    @stresstest
+    def test_poll(self):
+        def stats_list(poll):
+            return [vm_stats('%04d' % i,
+                             cpuUser='%.2f' % (poll + i % 3),
+                             elapsedTime=str(poll * 15),
+                             statusTime=str(poll * 15000),
+                             displayInfo=[{'type': 'vnc', 'port': '5900',
+                                           'tlsPort': '-1',
+                                           'ipAddress': '10.0.0.1'}],
+                             guestIPs='10.0.0.%d' % (i % 255))
+                    for i in range(self.VMS)]
+
+        full_bytes = 0
+        full_time = 0
+        for poll in range(self.POLLS):
+            stats = stats_list(poll)
+            start = time.time()
+            full_bytes += len(json.dumps(stats))
+            full_time += time.time() - start
+
+        client = Client(vmstatsdelta.Tracker())
+        delta_bytes = 0
+        delta_time = 0
+        for poll in range(self.POLLS):
+            stats = stats_list(poll)
+            start = time.time()
+            delta = client.tracker.update(stats, client.generation)
+            delta_bytes += len(json.dumps(delta))
+            delta_time += time.time() - start
+            client.generation = delta['generation']
+
+        print("\n%d vms, %d polls: full %d bytes %.3f seconds, "
+              "delta %d bytes %.3f seconds" % (
+                  self.VMS, self.POLLS, full_bytes, full_time, delta_bytes,
+                  delta_time))